@@ -4,7 +4,7 @@ import os
 import sys
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from dotenv import load_dotenv
 from groq import Groq
@@ -89,7 +89,7 @@ class LeafDiseaseDetector:
     DEFAULT_TEMPERATURE = 0.3
     DEFAULT_MAX_TOKENS = 1024
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, client: Optional[Any] = None):
         """
         Initialize the Leaf Disease Detector with API credentials.
 
@@ -100,6 +100,9 @@ class LeafDiseaseDetector:
         Args:
             api_key (Optional[str]): Groq API key. If None, will attempt to
                                    load from GROQ_API_KEY environment variable.
+            client (Optional[Any]): Pre-built Groq-compatible client (for example
+                                  the fake inference backend). When given, no
+                                  API key is required.
 
         Raises:
             ValueError: If no valid API key is found in parameters or environment.
@@ -109,9 +112,12 @@ class LeafDiseaseDetector:
         """
         load_dotenv()
         self.api_key = api_key or os.environ.get("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
-        self.client = Groq(api_key=self.api_key)
+        if client is not None:
+            self.client = client
+        else:
+            if not self.api_key:
+                raise ValueError("GROQ_API_KEY not found in environment variables")
+            self.client = Groq(api_key=self.api_key)
         logger.info("Leaf Disease Detector initialized")
 
     def create_analysis_prompt(self) -> str:
@@ -204,9 +210,11 @@ class LeafDiseaseDetector:
             if not base64_image:
                 raise ValueError("base64_image cannot be empty")
 
-            # Clean base64 string (remove data URL prefix if present)
+            # Use a ready data URL as-is; otherwise wrap the raw base64 once
             if base64_image.startswith("data:"):
-                base64_image = base64_image.split(",", 1)[1]
+                image_url = base64_image
+            else:
+                image_url = f"data:image/jpeg;base64,{base64_image}"
 
             # Prepare request parameters
             temperature = temperature or self.DEFAULT_TEMPERATURE
@@ -222,9 +230,7 @@ class LeafDiseaseDetector:
                             {"type": "text", "text": self.create_analysis_prompt()},
                             {
                                 "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                },
+                                "image_url": {"url": image_url},
                             },
                         ],
                     }
@@ -239,8 +245,17 @@ class LeafDiseaseDetector:
             logger.info("API request completed successfully")
             result = self._parse_response(completion.choices[0].message.content)
 
+            # Add token usage information from API response
+            result_dict = result.__dict__
+            if hasattr(completion, "usage") and completion.usage:
+                result_dict["token_usage"] = {
+                    "prompt_tokens": completion.usage.prompt_tokens,
+                    "completion_tokens": completion.usage.completion_tokens,
+                    "total_tokens": completion.usage.total_tokens,
+                }
+
             # Return as dictionary for JSON serialization
-            return result.__dict__
+            return result_dict
 
         except Exception as e:
             logger.error(f"Analysis failed for base64 image data: {str(e)}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+API Batch Speedup Benchmark
+===========================
+
+Times ``/api/v1/batch-analyze`` at several batch sizes, once with the images
+run one after another and record by record (the old behaviour, forced with
+``API_BATCH_MAX_CONCURRENCY=1`` and single inserts) and once at the
+concurrency of the enterprise plan with chunked inserts, and reports the
+wall-clock speedup.
+
+The model is the fake inference backend with a fixed latency per call.
+
+Usage:
+    python -m benchmarks.batch_speedup_benchmark --sizes 1 10 50 100 --model-latency-ms 200
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.core.inference_backend import FakeGroqClient, set_inference_client
+from src.routes import programmatic_api
+
+
+async def time_batch(
+    client, images: List[bytes], concurrency: int, insert_size: int
+) -> Dict[str, Any]:
+    programmatic_api.API_BATCH_MAX_CONCURRENCY = concurrency
+    programmatic_api.API_BATCH_INSERT_SIZE = insert_size
+    request = {"images": [{"image_base64": base64.b64encode(image).decode()} for image in images]}
+    start = time.perf_counter()
+    response = await client.post("/api/v1/batch-analyze", json=request)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "status": response.status_code,
+        "successful": response.json().get("successful_analyses"),
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Sequential vs parallel /api/v1/batch-analyze")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--model-latency-ms", type=float, default=200)
+    parser.add_argument("--json-out", help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    images = make_test_images(max(args.sizes), width=320, height=240)
+    default_concurrency = programmatic_api.API_BATCH_MAX_CONCURRENCY
+    default_insert_size = programmatic_api.API_BATCH_INSERT_SIZE
+    results: Dict[str, Any] = {"model_latency_ms": args.model_latency_ms, "sizes": {}}
+
+    async with benchmark_environment() as (client, user):
+        set_inference_client(FakeGroqClient(latency_seconds=args.model_latency_ms / 1000))
+        concurrency = await programmatic_api.batch_concurrency(str(user.id))
+        results["concurrency"] = concurrency
+        try:
+            await time_batch(
+                client, images[:2], default_concurrency, default_insert_size
+            )  # warm up
+
+            print(
+                f"Model latency {args.model_latency_ms:g} ms, enterprise plan concurrency {concurrency}"
+            )
+            print(f"  {'images':>6} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}")
+            for size in args.sizes:
+                sequential = await time_batch(client, images[:size], 1, 1)
+                parallel = await time_batch(
+                    client, images[:size], default_concurrency, default_insert_size
+                )
+                speedup = sequential["seconds"] / parallel["seconds"]
+                results["sizes"][str(size)] = {
+                    "sequential": sequential,
+                    "parallel": parallel,
+                    "speedup": speedup,
+                }
+                print(
+                    f"  {size:>6} {sequential['seconds']:>13.2f} {parallel['seconds']:>11.2f} {speedup:>7.1f}x"
+                )
+        finally:
+            programmatic_api.API_BATCH_MAX_CONCURRENCY = default_concurrency
+            programmatic_api.API_BATCH_INSERT_SIZE = default_insert_size
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Bulk Analysis Responsiveness Benchmark
+======================================
+
+Sends one large ``/api/enterprise/bulk-analysis`` request and, on the same
+event loop, keeps probing a light endpoint (``GET /api``) for as long as the
+batch runs. The probe latency while the batch is in flight is compared with
+the same probe on an idle app: if the batch blocked the event loop, probes
+would stall for the length of the batch.
+
+The model is the fake inference backend with a fixed latency per call, the
+way a remote vision model spends most of an analysis waiting.
+
+Usage:
+    python -m benchmarks.bulk_responsiveness_benchmark --images 100 --model-latency-ms 200
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.core.inference_backend import FakeGroqClient, set_inference_client
+from src.utils.metrics import _percentile
+
+PROBE_PATH = "/api"
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": _percentile(ordered, 50) * 1000,
+        "p95_ms": _percentile(ordered, 95) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+async def probe(client, latencies: List[float], stop: asyncio.Event, interval: float) -> None:
+    """Time the probe endpoint until ``stop`` is set"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(PROBE_PATH)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Probe endpoint latency while a bulk analysis runs"
+    )
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--model-latency-ms", type=float, default=200)
+    parser.add_argument("--probe-interval-ms", type=float, default=20)
+    parser.add_argument("--json-out", help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    images = make_test_images(args.images, width=320, height=240)
+    files = [("files", (f"leaf_{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images)]
+    interval = args.probe_interval_ms / 1000
+    results: Dict[str, Any] = {"images": args.images, "model_latency_ms": args.model_latency_ms}
+
+    async with benchmark_environment() as (client, _user):
+        set_inference_client(FakeGroqClient(latency_seconds=args.model_latency_ms / 1000))
+
+        # Warm up imports, the CPU pool and the probe route
+        await client.post("/api/enterprise/bulk-analysis", files=files[:1])
+        idle: List[float] = []
+        for _ in range(50):
+            start = time.perf_counter()
+            await client.get(PROBE_PATH)
+            idle.append(time.perf_counter() - start)
+
+        busy: List[float] = []
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe(client, busy, stop, interval))
+        start = time.perf_counter()
+        response = await client.post("/api/enterprise/bulk-analysis", files=files)
+        batch_seconds = time.perf_counter() - start
+        stop.set()
+        await prober
+
+    body = response.json()
+    results.update(
+        {
+            "status": response.status_code,
+            "processed_images": body.get("processed_images"),
+            "batch_seconds": batch_seconds,
+            "idle_probe": summarize(idle),
+            "busy_probe": summarize(busy),
+        }
+    )
+    print(
+        f"{args.images}-image bulk analysis: status {response.status_code}, "
+        f"{body.get('processed_images')} processed in {batch_seconds:.2f}s"
+    )
+    print(f"  {'probe':<14} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name in ("idle_probe", "busy_probe"):
+        stats = results[name]
+        print(
+            f"  {name:<14} {stats['count']:>6} {stats['p50_ms']:>8.1f} "
+            f"{stats['p95_ms']:>8.1f} {stats['max_ms']:>8.1f}"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if response.status_code == 200 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,121 @@
+"""
+Recorded Provider Responses
+===========================
+
+Cassettes are JSON files holding one recorded provider response each. The
+replay clients below are drop-in replacements for the Groq and Perplexity
+SDK clients, so the detection routes run end-to-end without network access
+while still parsing real-world response shapes (code fences, preambles).
+"""
+
+import hashlib
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+CASSETTE_DIR = Path(__file__).parent / "cassettes"
+
+
+def load_cassettes(provider: str, cassette_dir: Path = CASSETTE_DIR) -> List[Dict[str, Any]]:
+    """Load all cassettes for a provider, sorted by file name"""
+    paths = sorted((cassette_dir / provider).glob("*.json"))
+    if not paths:
+        raise FileNotFoundError(f"No {provider} cassettes found in {cassette_dir / provider}")
+    return [json.loads(path.read_text(encoding="utf-8")) for path in paths]
+
+
+def _completion(content: str, usage: Optional[Dict[str, int]] = None) -> SimpleNamespace:
+    """Build an SDK-shaped completion object"""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(**usage) if usage else None,
+    )
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class CassetteGroqClient:
+    """Replays recorded Groq vision completions, chosen deterministically per image"""
+
+    def __init__(self, cassettes: Optional[List[Dict[str, Any]]] = None):
+        self.cassettes = cassettes or load_cassettes("groq")
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        image_url = ""
+        for part in messages[-1]["content"]:
+            if part.get("type") == "image_url":
+                image_url = part["image_url"]["url"]
+        digest = hashlib.sha256(image_url.encode("utf-8")).digest()
+        cassette = self.cassettes[digest[0] % len(self.cassettes)]
+        response = cassette["response"]
+        return _completion(response["content"], response.get("usage"))
+
+
+class CassettePerplexityClient:
+    """Replays recorded Perplexity responses for treatment and plant-care queries"""
+
+    def __init__(self, cassettes: Optional[List[Dict[str, Any]]] = None):
+        cassettes = cassettes or load_cassettes("perplexity")
+        self.by_kind = {cassette["kind"]: cassette for cassette in cassettes}
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        query = messages[-1]["content"]
+        kind = "treatment" if "treating" in query else "plant_care"
+        return _completion(self.by_kind[kind]["response"]["content"])
+
+
+class RecordingClient:
+    """
+    Wraps a real SDK client and writes every completion as a cassette.
+
+    Use it once against the live provider to refresh the recorded responses:
+        RecordingClient(Groq(), "groq", name_prefix="field_photo")
+    """
+
+    def __init__(
+        self,
+        inner: Any,
+        provider: str,
+        name_prefix: str = "recorded",
+        cassette_dir: Path = CASSETTE_DIR,
+    ):
+        self.inner = inner
+        self.provider = provider
+        self.name_prefix = name_prefix
+        self.out_dir = cassette_dir / provider
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> Any:
+        completion = self.inner.chat.completions.create(model=model, messages=messages, **kwargs)
+        usage = getattr(completion, "usage", None)
+        cassette = {
+            "provider": self.provider,
+            "model": model,
+            "recorded_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "response": {
+                "content": completion.choices[0].message.content,
+                "usage": {
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens,
+                    "total_tokens": usage.total_tokens,
+                }
+                if usage
+                else None,
+            },
+        }
+        path = self.out_dir / f"{self.name_prefix}_{int(time.time() * 1000)}.json"
+        path.write_text(json.dumps(cassette, indent=2) + "\n", encoding="utf-8")
+        return completion
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+CPU Preprocessing Scaling Benchmark
+===================================
+
+Preprocesses a batch of images (SHA-256, similarity embedding, base64) the way
+the bulk and batch endpoints do, first with the previous approach (the same
+work on a 5-thread pool, serialised by the GIL) and then on the process pool
+with 1, 2, 4, ... workers up to the available cores. Reports throughput and
+speedup relative to one worker.
+
+Usage:
+    python -m benchmarks.cpu_pool_benchmark --images 100
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.harness import make_test_images
+from src.utils.cpu_pool import CPUPool, _available_cpus, _preprocess
+
+
+def worker_counts(max_workers: int) -> List[int]:
+    """1, 2, 4, ... up to and including max_workers"""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def run_threads(images: List[bytes], threads: int = 5) -> float:
+    """Seconds to preprocess all images on a thread pool"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda image: _preprocess(memoryview(image), True, True), images))
+    return time.perf_counter() - start
+
+
+async def run_pool(images: List[bytes], workers: int) -> float:
+    """Seconds to preprocess all images on a process pool (after warm-up)"""
+    pool = CPUPool(workers=workers)
+    try:
+        # Start every worker and import the feature code before timing
+        await asyncio.gather(*(pool.preprocess(images[0]) for _ in range(workers * 2)))
+        start = time.perf_counter()
+        await asyncio.gather(*(pool.preprocess(image) for image in images))
+        return time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark CPU preprocessing scaling")
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--max-workers", type=int, default=_available_cpus())
+    parser.add_argument("--json-out", help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    images = make_test_images(args.images, args.width, args.height)
+    avg_kib = sum(len(i) for i in images) / len(images) / 1024
+    print(
+        f"{len(images)} images, {args.width}x{args.height}, {avg_kib:.0f} KiB avg, "
+        f"{_available_cpus()} CPUs available"
+    )
+
+    results: Dict[str, Any] = {"images": len(images), "cpus": _available_cpus(), "runs": []}
+
+    seconds = run_threads(images)
+    results["thread_pool_5"] = seconds
+    print(f"  thread pool (5)   {seconds:7.2f}s  {len(images) / seconds:7.1f} img/s")
+
+    base = None
+    for workers in worker_counts(args.max_workers):
+        seconds = await run_pool(images, workers)
+        base = base or seconds
+        speedup = base / seconds
+        results["runs"].append({"workers": workers, "seconds": seconds, "speedup": speedup})
+        print(
+            f"  process pool ({workers:>2}) {seconds:7.2f}s  {len(images) / seconds:7.1f} img/s  "
+            f"x{speedup:.2f} (efficiency {speedup / workers:.0%})"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Fair Scheduling Benchmark
+=========================
+
+Measures single-image (interactive) analysis latency on an idle app and
+while ``/api/enterprise/bulk-analysis`` batches are running, twice:
+
+- ``shared``: every model call waits in one FIFO queue, which is how the
+  model stage behaved before the scheduler (interactive requests sent to the
+  batch lane, no reserved slots)
+- ``fair``: the default scheduler, with interactive requests in their own
+  lane and ``SCHEDULER_INTERACTIVE_RESERVED`` slots kept free of batch work
+
+and reports end-to-end latency and the ``scheduler.wait.<class>`` metrics.
+The model is the fake inference backend with a fixed latency per call.
+
+Usage:
+    python -m benchmarks.fair_scheduling_benchmark --batches 3 --images 50 --model-latency-ms 200
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import sys
+import time
+from dataclasses import replace
+from typing import Any, Dict, List
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.core.inference_backend import FakeGroqClient, set_inference_client
+from src.routes import programmatic_api
+from src.services import model_scheduler
+from src.services.analysis_pipeline import get_analysis_pipeline
+from src.utils.metrics import _percentile, metrics
+
+INTERACTIVE_PATH = "/api/v1/analyze-base64"
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": _percentile(ordered, 50) * 1000,
+        "p95_ms": _percentile(ordered, 95) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+async def interactive_call(client, body: dict) -> float:
+    start = time.perf_counter()
+    response = await client.post(INTERACTIVE_PATH, json=body)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run_mode(
+    client, mode: str, files: list, batches: int, body: dict, probes: int, interval: float
+) -> Dict[str, Any]:
+    default_options = programmatic_api.API_OPTIONS
+    default_reserved = model_scheduler.INTERACTIVE_RESERVED
+    if mode == "shared":
+        programmatic_api.API_OPTIONS = replace(default_options, traffic_class=model_scheduler.BATCH)
+        model_scheduler.INTERACTIVE_RESERVED = 0
+    pipeline = get_analysis_pipeline()
+    pipeline._scheduler = None
+    try:
+        idle = [await interactive_call(client, body) for _ in range(probes)]
+
+        metrics.reset()
+        batch = asyncio.gather(
+            *[client.post("/api/enterprise/bulk-analysis", files=files) for _ in range(batches)]
+        )
+        await asyncio.sleep(interval)
+        busy: List[float] = []
+        while not batch.done():
+            busy.append(await interactive_call(client, body))
+            await asyncio.sleep(interval)
+        responses = await batch
+        waits = metrics.snapshot(prefix="scheduler.wait.")
+    finally:
+        programmatic_api.API_OPTIONS = default_options
+        model_scheduler.INTERACTIVE_RESERVED = default_reserved
+        pipeline._scheduler = None
+
+    return {
+        "batch_status": [response.status_code for response in responses],
+        "idle": summarize(idle),
+        "busy": summarize(busy),
+        "queue_wait": waits,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Interactive latency under batch load, shared vs fair scheduling"
+    )
+    parser.add_argument("--batches", type=int, default=3, help="Concurrent bulk requests")
+    parser.add_argument("--images", type=int, default=50, help="Images per bulk request")
+    parser.add_argument("--model-latency-ms", type=float, default=200)
+    parser.add_argument("--probes", type=int, default=10, help="Idle interactive calls per mode")
+    parser.add_argument("--probe-interval-ms", type=float, default=50)
+    parser.add_argument("--json-out", help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    images = make_test_images(args.images + 1, width=320, height=240)
+    files = [
+        ("files", (f"leaf_{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images[1:])
+    ]
+    body = {"image_base64": base64.b64encode(images[0]).decode(), "filename": "live.jpg"}
+    results: Dict[str, Any] = {
+        "batches": args.batches,
+        "images": args.images,
+        "model_latency_ms": args.model_latency_ms,
+        "modes": {},
+    }
+
+    async with benchmark_environment() as (client, _user):
+        set_inference_client(FakeGroqClient(latency_seconds=args.model_latency_ms / 1000))
+        await interactive_call(client, body)  # warm up
+        for mode in ("shared", "fair"):
+            results["modes"][mode] = await run_mode(
+                client, mode, files, args.batches, body, args.probes, args.probe_interval_ms / 1000
+            )
+
+    # In shared mode interactive calls queue in the batch lane, so only the
+    # end-to-end latency tells them apart
+    print(
+        f"{args.batches} x {args.images}-image bulk analyses, model latency {args.model_latency_ms:g} ms"
+    )
+    print(
+        f"  {'mode':<8} {'idle p95':>9} {'busy p50':>9} {'busy p95':>9} {'queue wait p95 (interactive / batch)':>38}"
+    )
+    for mode, stats in results["modes"].items():
+        waits = stats["queue_wait"]
+        interactive_wait = waits.get("scheduler.wait.interactive", {}).get("p95_ms")
+        batch_wait = waits.get("scheduler.wait.batch", {}).get("p95_ms", 0.0)
+        interactive_text = f"{interactive_wait:.0f}ms" if interactive_wait is not None else "-"
+        print(
+            f"  {mode:<8} {stats['idle']['p95_ms']:>7.0f}ms {stats['busy']['p50_ms']:>7.0f}ms "
+            f"{stats['busy']['p95_ms']:>7.0f}ms {interactive_text:>26} / {batch_wait:.0f}ms"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
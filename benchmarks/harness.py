@@ -0,0 +1,133 @@
+"""
+Benchmark Environment
+=====================
+
+Sets up the FastAPI app for offline benchmarking: in-memory MongoDB, a
+temporary upload directory, replayed Groq/Perplexity responses, a seeded
+enterprise user and auth dependency overrides. Benchmarks drive the app
+through ``httpx.AsyncClient`` on the ASGI transport, so every request runs
+the real routes on the benchmark's own event loop.
+"""
+
+import io
+import os
+import random
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Tuple
+
+import httpx
+
+from benchmarks.cassette import CassetteGroqClient, CassettePerplexityClient
+from benchmarks.memory_mongo import install_memory_mongo
+from src.app import app
+from src.auth.api_key_auth import get_enterprise_api_user
+from src.auth.security import create_access_token, get_current_active_user
+from src.core.inference_backend import set_inference_client
+from src.database.connection import USERS_COLLECTION, MongoDB
+from src.database.models import UserInDB
+from src.database.subscription_models import BillingCycle, PlanType
+from src.services import perplexity_service
+from src.services.perplexity_service import PerplexityService
+from src.services.subscription_service import SubscriptionService
+from src.storage import derivatives, image_storage
+
+try:
+    from PIL import Image
+
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+def make_test_images(
+    count: int, width: int = 1024, height: int = 768, seed: int = 7
+) -> List[bytes]:
+    """Generate distinct JPEG images (noise, so they do not compress away)"""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        if PIL_AVAILABLE:
+            pixels = bytes(rng.getrandbits(8) for _ in range(width * height * 3 // 16))
+            image = Image.frombytes("RGB", (width // 4, height // 4), pixels).resize(
+                (width, height)
+            )
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=90)
+            images.append(buffer.getvalue())
+        else:
+            # Not decodable, but carries JPEG markers and a realistic size
+            body = bytes(rng.getrandbits(8) for _ in range(width * height // 4))
+            images.append(b"\xff\xd8\xff\xe0" + body + b"\xff\xd9")
+    return images
+
+
+def _install_replayed_perplexity() -> None:
+    """Swap the Perplexity singleton for one backed by recorded responses"""
+    service = PerplexityService.__new__(PerplexityService)
+    service.enabled = True
+    service.api_key = "cassette"
+    service.client = CassettePerplexityClient()
+    perplexity_service._perplexity_service = service
+
+
+async def _seed_enterprise_user() -> UserInDB:
+    """Create the benchmark user with an enterprise subscription"""
+    await SubscriptionService.initialize_default_plans()
+    plan = await SubscriptionService.get_plan_by_type(PlanType.ENTERPRISE)
+
+    user = UserInDB(username="bench_user", email="bench@example.com", hashed_password="not-used")
+    await MongoDB.get_collection(USERS_COLLECTION).insert_one(user.dict(by_alias=True))
+    await SubscriptionService.create_subscription(
+        user_id=str(user.id),
+        username=user.username,
+        plan_id=str(plan.id),
+        billing_cycle=BillingCycle.YEARLY,
+        payment_method="benchmark",
+        transaction_id="benchmark",
+    )
+    return user
+
+
+@asynccontextmanager
+async def benchmark_environment() -> AsyncIterator[Tuple[httpx.AsyncClient, UserInDB]]:
+    """Yield an HTTP client bound to the app plus the seeded enterprise user"""
+    original_upload_dir = image_storage.UPLOAD_DIR
+    original_blob_dir = image_storage.BLOB_DIR
+    original_segment_dir = image_storage.SEGMENT_DIR
+    original_mongo_client = MongoDB.client
+    with tempfile.TemporaryDirectory(prefix="leaf-bench-") as tmp:
+        image_storage.UPLOAD_DIR = Path(tmp) / "uploads"
+        image_storage.BLOB_DIR = Path(tmp) / "blobs"
+        image_storage.SEGMENT_DIR = Path(tmp) / "segments"
+        derivatives._cache = derivatives.DerivativeCache(directory=Path(tmp) / "derivatives")
+        install_memory_mongo()
+        set_inference_client(CassetteGroqClient())
+        _install_replayed_perplexity()
+        os.environ.setdefault("GROQ_API_KEY", "cassette")
+
+        user = await _seed_enterprise_user()
+        app.dependency_overrides[get_current_active_user] = lambda: user
+        app.dependency_overrides[get_enterprise_api_user] = lambda: user
+
+        transport = httpx.ASGITransport(app=app)
+        try:
+            # The token lets middleware (rate and upload limits) identify the user
+            token = create_access_token({"sub": user.username})
+            async with httpx.AsyncClient(
+                transport=transport,
+                base_url="http://benchmark",
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=None,
+            ) as client:
+                yield client, user
+        finally:
+            app.dependency_overrides.clear()
+            set_inference_client(None)
+            perplexity_service._perplexity_service = None
+            image_storage.UPLOAD_DIR = original_upload_dir
+            image_storage.BLOB_DIR = original_blob_dir
+            image_storage.SEGMENT_DIR = original_segment_dir
+            derivatives._cache = None
+            MongoDB.client = original_mongo_client
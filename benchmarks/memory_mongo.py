@@ -0,0 +1,18 @@
+"""
+In-Memory MongoDB Stand-In
+==========================
+
+Points ``MongoDB.client`` at a ``mongomock_motor`` client so routes and
+services run their real queries without a database server.
+"""
+
+from mongomock_motor import AsyncMongoMockClient
+
+from src.database.connection import MongoDB
+
+
+def install_memory_mongo() -> AsyncMongoMockClient:
+    """Replace the application's MongoDB client with an in-memory one"""
+    client = AsyncMongoMockClient()
+    MongoDB.client = client
+    return client
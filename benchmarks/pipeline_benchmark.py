@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Detection Pipeline Benchmark
+============================
+
+Drives ``/api/disease-detection`` and ``/api/v1/analyze`` end-to-end with the
+model and Perplexity replayed from cassettes and MongoDB held in memory, then
+reports per-request and per-stage time and allocations. Results are written
+per commit so regressions in our own overhead can be caught in review.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --iterations 30
+    python -m benchmarks.pipeline_benchmark --baseline benchmarks/results/<sha>.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.utils.metrics import _percentile, metrics
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+SCENARIOS = {
+    "detect_disease": "/api/disease-detection",
+    "api_v1_analyze": "/api/v1/analyze",
+}
+
+# Stage changes smaller than this are treated as noise
+NOISE_FLOOR_MS = 0.5
+
+
+def git_commit() -> str:
+    """Short SHA of the checked-out commit (or 'unknown')"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run_scenario(
+    client, path: str, images: List[bytes], iterations: int, warmup: int, trace_alloc: bool
+) -> Dict[str, Any]:
+    """Run one endpoint repeatedly and collect request and stage statistics"""
+    for i in range(warmup):
+        await client.post(path, files={"file": ("leaf.jpg", images[i % len(images)], "image/jpeg")})
+
+    metrics.reset()
+    if trace_alloc:
+        tracemalloc.start()
+    latencies = []
+    failures = 0
+    for i in range(iterations):
+        image = images[i % len(images)]
+        start = time.perf_counter()
+        response = await client.post(path, files={"file": ("leaf.jpg", image, "image/jpeg")})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            failures += 1
+    peak_alloc = 0
+    if trace_alloc:
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    ordered = sorted(latencies)
+    return {
+        "iterations": iterations,
+        "failures": failures,
+        "request_ms": {
+            "p50": round(_percentile(ordered, 50) * 1000, 3),
+            "p95": round(_percentile(ordered, 95) * 1000, 3),
+            "p99": round(_percentile(ordered, 99) * 1000, 3),
+        },
+        "peak_alloc_bytes": peak_alloc,
+        "stages": {
+            name.split(".", 1)[1]: summary
+            for name, summary in metrics.snapshot(prefix="stage.").items()
+        },
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """List stages whose average time or allocations regressed beyond the threshold"""
+    regressions = []
+    for scenario, result in current["scenarios"].items():
+        base_stages = baseline.get("scenarios", {}).get(scenario, {}).get("stages", {})
+        for stage_name, summary in result["stages"].items():
+            base = base_stages.get(stage_name)
+            if not base:
+                continue
+            if (
+                summary["avg_ms"] > base["avg_ms"] * (1 + threshold)
+                and summary["avg_ms"] - base["avg_ms"] > NOISE_FLOOR_MS
+            ):
+                regressions.append(
+                    f"{scenario}.{stage_name}: {base['avg_ms']:.2f}ms -> {summary['avg_ms']:.2f}ms"
+                )
+            base_alloc = base.get("alloc_bytes_avg", 0)
+            alloc = summary.get("alloc_bytes_avg", 0)
+            if base_alloc and alloc > base_alloc * (1 + threshold):
+                regressions.append(
+                    f"{scenario}.{stage_name}: {base_alloc} -> {alloc} bytes allocated per call"
+                )
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    """Print a per-stage table for every scenario"""
+    for scenario, result in results["scenarios"].items():
+        request = result["request_ms"]
+        print(
+            f"\n{scenario}: p50 {request['p50']}ms  p95 {request['p95']}ms  "
+            f"p99 {request['p99']}ms  failures {result['failures']}/{result['iterations']}  "
+            f"peak alloc {result['peak_alloc_bytes'] / 1024:.0f} KiB"
+        )
+        print(f"  {'stage':<18} {'avg ms':>9} {'p95 ms':>9} {'alloc/call':>12}")
+        for stage_name, summary in result["stages"].items():
+            alloc = summary.get("alloc_bytes_avg", 0)
+            print(
+                f"  {stage_name:<18} {summary['avg_ms']:>9.3f} {summary['p95_ms']:>9.3f} "
+                f"{alloc / 1024:>10.1f}Ki"
+            )
+
+
+async def main() -> int:
+    """Run all scenarios and write/compare results"""
+    parser = argparse.ArgumentParser(description="Benchmark server-side detection overhead")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--images", type=int, default=8, help="Distinct test images")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--no-alloc", action="store_true", help="Skip tracemalloc (faster)")
+    parser.add_argument("--baseline", type=Path, help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown ratio")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    images = make_test_images(args.images, args.width, args.height)
+
+    results: Dict[str, Any] = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "image_bytes_avg": sum(len(i) for i in images) // len(images),
+        "scenarios": {},
+    }
+    async with benchmark_environment() as (client, _user):
+        for scenario, path in SCENARIOS.items():
+            results["scenarios"][scenario] = await run_scenario(
+                client, path, images, args.iterations, args.warmup, not args.no_alloc
+            )
+
+    print_results(results)
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    out_path = RESULTS_DIR / f"{results['commit']}.json"
+    out_path.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    print(f"\n[+] Results written to {out_path}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n[-] Regressions against {baseline.get('commit', args.baseline)}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"[+] No regressions against {baseline.get('commit', args.baseline)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
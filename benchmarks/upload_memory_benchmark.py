@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Upload Memory Benchmark
+=======================
+
+Sends concurrent large uploads to ``/api/v1/analyze`` and samples the
+process's resident set size while they are handled. Reports the peak RSS
+growth and what that is per upload, as a multiple of the upload size, plus
+how an upload over the plan limit is answered.
+
+The concurrent uploads are sent twice: without the upload memory budget, and
+with a budget of ``--budget-mb`` (src/utils/memory_budget.py), where images
+wait for room and uploads arriving while it is full get 503.
+
+The payload is a small real JPEG padded to the requested size (decoders stop
+at the end-of-image marker), so the model replay and the similarity
+embedding behave as for a normal image.
+
+Usage:
+    python -m benchmarks.upload_memory_benchmark --uploads 8 --size-mb 20 --budget-mb 100
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.utils import memory_budget
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux)"""
+    with open("/proc/self/statm", "rb") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+async def sample_peak(samples: List[int], stop: asyncio.Event, interval: float = 0.005) -> None:
+    while not stop.is_set():
+        samples.append(rss_bytes())
+        await asyncio.sleep(interval)
+
+
+async def measure(upload, payload: bytes, uploads: int, late: int = 0) -> Dict[str, Any]:
+    """Peak RSS growth while ``uploads`` uploads run, plus ``late`` more sent once they are under way"""
+    gc.collect()
+    samples: List[int] = []
+    stop = asyncio.Event()
+    baseline = rss_bytes()
+    sampler = asyncio.create_task(sample_peak(samples, stop))
+    start = time.perf_counter()
+    first = [asyncio.create_task(upload(payload)) for _ in range(uploads)]
+    await asyncio.sleep(0.2)
+    statuses = await asyncio.gather(*first, *(upload(payload) for _ in range(late)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+
+    peak_growth = max(samples + [rss_bytes()]) - baseline
+    per_upload = peak_growth / uploads
+    return {
+        "statuses": statuses,
+        "seconds": elapsed,
+        "baseline_rss": baseline,
+        "peak_rss_growth": peak_growth,
+        "per_upload_multiple": per_upload / len(payload),
+    }
+
+
+def report(label: str, stats: Dict[str, Any], uploads: int, size_mb: float) -> None:
+    counts = {code: stats["statuses"].count(code) for code in sorted(set(stats["statuses"]))}
+    print(
+        f"{label}: {uploads} concurrent uploads of {size_mb:g} MB (statuses {counts}) in {stats['seconds']:.2f}s"
+    )
+    print(
+        f"  peak RSS growth  {stats['peak_rss_growth'] / 2**20:8.1f} MB  "
+        f"({stats['peak_rss_growth'] / uploads / 2**20:.1f} MB per upload, "
+        f"{stats['per_upload_multiple']:.2f}x the upload size)"
+    )
+
+
+def make_payload(size_mb: float) -> bytes:
+    image = make_test_images(1, 640, 480)[0]
+    return image + b"\0" * max(0, int(size_mb * 1024 * 1024) - len(image))
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure peak RSS under concurrent large uploads")
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument(
+        "--budget-mb", type=int, default=100, help="Upload memory budget for the second run"
+    )
+    parser.add_argument(
+        "--late", type=int, default=2, help="Uploads sent to the budgeted run once it is full"
+    )
+    parser.add_argument("--json-out", help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if not os.path.exists("/proc/self/statm"):
+        print("RSS sampling needs /proc (Linux)")
+        return 1
+
+    payload = make_payload(args.size_mb)
+    results: Dict[str, Any] = {"uploads": args.uploads, "size_mb": args.size_mb}
+
+    async with benchmark_environment() as (client, _user):
+
+        async def upload(data: bytes) -> int:
+            response = await client.post(
+                "/api/v1/analyze", files={"file": ("leaf.jpg", data, "image/jpeg")}
+            )
+            return response.status_code
+
+        # Warm up imports, caches and the pool outside the measurement
+        await upload(make_payload(0.1))
+
+        try:
+            memory_budget._budget = memory_budget.MemoryBudget(0)
+            results["unbudgeted"] = await measure(upload, payload, args.uploads)
+            memory_budget._budget = memory_budget.MemoryBudget(args.budget_mb * 2**20)
+            results["budgeted"] = await measure(upload, payload, args.uploads, late=args.late)
+        finally:
+            memory_budget._budget = None
+        report("no budget", results["unbudgeted"], args.uploads, args.size_mb)
+        report(
+            f"{args.budget_mb} MB budget (+{args.late} late)",
+            results["budgeted"],
+            args.uploads,
+            args.size_mb,
+        )
+
+        # An upload over the 50 MB enterprise limit is refused before it is read
+        oversized = make_payload(60)
+        start = time.perf_counter()
+        status = await upload(oversized)
+        results["oversized"] = {"status": status, "seconds": time.perf_counter() - start}
+        print(
+            f"  60 MB upload     status {status} after {results['oversized']['seconds'] * 1000:.0f} ms"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -882,7 +882,7 @@ function displayFeedback(feedbackList) {
                         <h5 class="font-bold text-sm mb-3">Original Analysis:</h5>
                         <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
                             <div>
-                                <img src="/images/${feedback.analysis.username}/${feedback.analysis.image_filename}" 
+                                <img src="/images/${feedback.analysis.username}/${feedback.analysis.image_filename}?size=thumb" 
                                      alt="Analysis Image" 
                                      class="w-full h-32 object-cover rounded-lg border border-gray-300"
                                      onerror="this.src='data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEyOCIgdmlld0JveD0iMCAwIDIwMCAxMjgiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxyZWN0IHdpZHRoPSIyMDAiIGhlaWdodD0iMTI4IiBmaWxsPSIjRjNGNEY2Ii8+CjxwYXRoIGQ9Ik04NSA2NEw5NSA1NEwxMDUgNjRMOTUgNzRMODUgNjRaIiBmaWxsPSIjOUI5QjlCIi8+Cjx0ZXh0IHg9IjEwMCIgeT0iODQiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZpbGw9IiM5QjlCOUIiIGZvbnQtc2l6ZT0iMTIiPkltYWdlIG5vdCBmb3VuZDwvdGV4dD4KPC9zdmc+'">
@@ -974,7 +974,7 @@ function editFeedback(feedbackId) {
                         <h4 class="font-semibold text-blue-800 mb-3">Current Full Analysis</h4>
                         <div class="grid grid-cols-1 lg:grid-cols-3 gap-4">
                             <div class="lg:col-span-1">
-                                <img src="/images/${feedbackData.analysis.username}/${feedbackData.analysis.image_filename}" 
+                                <img src="/images/${feedbackData.analysis.username}/${feedbackData.analysis.image_filename}?size=medium" 
                                      alt="Analysis Image" 
                                      class="w-full h-48 object-cover rounded-lg border border-blue-300"
                                      onerror="this.src='data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMjAwIiBoZWlnaHQ9IjEyOCIgdmlld0JveD0iMCAwIDIwMCAxMjgiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxyZWN0IHdpZHRoPSIyMDAiIGhlaWdodD0iMTI4IiBmaWxsPSIjRjNGNEY2Ii8+CjxwYXRoIGQ9Ik04NSA2NEw5NSA1NEwxMDUgNjRMOTUgNzRMODUgNjRaIiBmaWxsPSIjOUI5QjlCIi8+Cjx0ZXh0IHg9IjEwMCIgeT0iODQiIHRleHQtYW5jaG9yPSJtaWRkbGUiIGZpbGw9IiM5QjlCOUIiIGZvbnQtc2l6ZT0iMTIiPkltYWdlIG5vdCBmb3VuZDwvdGV4dD4KPC9zdmc+'">
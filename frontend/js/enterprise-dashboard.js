@@ -2,6 +2,11 @@
 
 let usageTrendsChart = null;
 let accessTypeChart = null;
+const batchWatch = {
+    batchId: null,
+    controller: null,
+    retryTimer: null
+};
 const historyState = {
     limit: 20,
     offset: 0,
@@ -74,7 +79,8 @@ async function loadDashboardData() {
             loadEnterpriseStatus(),
             loadApiKeys(),
             loadUsageAnalytics(),
-            loadRecentActivity()
+            loadRecentActivity(),
+            loadActiveBatches()
         ]);
         initQuickStartGuide();
     } catch (error) {
@@ -496,6 +502,16 @@ function setupEventListeners() {
     if (historyNextBtn) {
         historyNextBtn.addEventListener('click', () => loadHistoryPage(historyState.offset + historyState.limit));
     }
+
+    // Live batch progress
+    document.getElementById('watchBatchForm').addEventListener('submit', (event) => {
+        event.preventDefault();
+        const batchId = document.getElementById('watchBatchId').value.trim();
+        if (batchId) {
+            watchBatch(batchId);
+        }
+    });
+    document.getElementById('stopWatchingBtn').addEventListener('click', stopWatchingBatch);
 }
 
 // Close create API key modal
@@ -816,3 +832,165 @@ async function copyQuickStartCurl() {
         showError('Failed to copy quickstart cURL');
     }
 }
+
+// Live batch progress (Server-Sent Events read with fetch, so the auth header is sent)
+async function loadActiveBatches() {
+    try {
+        const response = await authenticatedFetch(`${API_URL}/api/enterprise/batches/active`);
+        const data = await response.json();
+        renderActiveBatches(data.batches || []);
+    } catch (error) {
+        console.error('Error loading active batches:', error);
+    }
+}
+
+function renderActiveBatches(batches) {
+    const container = document.getElementById('activeBatches');
+    container.innerHTML = '';
+    if (batches.length === 0) {
+        container.innerHTML = '<p class="text-sm text-gray-500 dark:text-gray-400">No batches running right now.</p>';
+        return;
+    }
+    batches.forEach(batch => {
+        const row = document.createElement('div');
+        row.className = 'flex items-center justify-between p-3 bg-gray-50 dark:bg-gray-700 rounded-lg text-sm';
+        const label = document.createElement('span');
+        label.className = 'text-gray-900 dark:text-white';
+        label.textContent = `${batch.batch_name || batch.batch_id} • ${batch.status} • ${formatBatchCounts(batch)}`;
+        const button = document.createElement('button');
+        button.className = 'text-green-600 hover:text-green-700 dark:text-green-400';
+        button.innerHTML = '<i class="fas fa-eye mr-1"></i>Watch';
+        button.addEventListener('click', () => watchBatch(batch.batch_id));
+        row.append(label, button);
+        container.appendChild(row);
+    });
+}
+
+function formatBatchCounts(progress) {
+    const finished = progress.processed_images + progress.failed_images;
+    return progress.total_images != null ? `${finished}/${progress.total_images} images` : `${finished} images`;
+}
+
+function stopWatchingBatch() {
+    if (batchWatch.controller) {
+        batchWatch.controller.abort();
+    }
+    clearTimeout(batchWatch.retryTimer);
+    batchWatch.batchId = null;
+    batchWatch.controller = null;
+    document.getElementById('batchProgressPanel').classList.add('hidden');
+}
+
+async function watchBatch(batchId) {
+    stopWatchingBatch();
+    batchWatch.batchId = batchId;
+    batchWatch.controller = new AbortController();
+    document.getElementById('batchImageEvents').innerHTML = '';
+    document.getElementById('batchProgressPanel').classList.remove('hidden');
+    document.getElementById('batchProgressTitle').textContent = batchId;
+    document.getElementById('batchProgressStatus').textContent = 'Connecting...';
+
+    let finished = false;
+    try {
+        const response = await authenticatedFetch(`${API_URL}/api/enterprise/batch/${encodeURIComponent(batchId)}/events`, {
+            headers: { 'Accept': 'text/event-stream' },
+            signal: batchWatch.controller.signal
+        });
+        if (response.status === 404) {
+            showError('Batch not found');
+            stopWatchingBatch();
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const parsed = parseServerSentEvent(block);
+                if (parsed) {
+                    finished = handleBatchEvent(parsed.event, parsed.data) || finished;
+                }
+            }
+        }
+    } catch (error) {
+        if (error.name === 'AbortError') return;
+        console.error('Batch progress stream error:', error);
+    }
+
+    // The connection dropped before the batch finished: reconnect, a new snapshot catches up
+    if (!finished && batchWatch.batchId === batchId) {
+        document.getElementById('batchProgressStatus').textContent = 'Reconnecting...';
+        batchWatch.retryTimer = setTimeout(() => watchBatch(batchId), 3000);
+    }
+}
+
+function parseServerSentEvent(block) {
+    let event = 'message';
+    const data = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data.push(line.slice(6));
+    });
+    if (data.length === 0) return null; // keep-alive comment
+    return { event, data: JSON.parse(data.join('\n')) };
+}
+
+// Returns true once the batch has finished
+function handleBatchEvent(event, data) {
+    if (event === 'image') {
+        renderBatchProgress(data.progress);
+        appendBatchImageEvent(data.image);
+        return false;
+    }
+    if (event === 'error') {
+        showError(`Batch progress failed: ${data.detail}`);
+        return true;
+    }
+    renderBatchProgress(data);
+    if (data.status === 'completed' || data.status === 'cancelled') {
+        loadActiveBatches();
+        loadRecentActivity();
+        return true;
+    }
+    return false;
+}
+
+function renderBatchProgress(progress) {
+    const percent = progress.progress != null ? Math.round(progress.progress * 100) : 0;
+    document.getElementById('batchProgressTitle').textContent = progress.batch_name || progress.batch_id;
+    document.getElementById('batchProgressStatus').textContent = `${progress.status} • ${formatBatchCounts(progress)}`;
+    document.getElementById('batchProgressBar').style.width = `${percent}%`;
+    document.getElementById('batchProcessed').textContent = progress.processed_images;
+    document.getElementById('batchFailed').textContent = progress.failed_images;
+    const rate = progress.recent_images_per_second || progress.images_per_second;
+    document.getElementById('batchThroughput').textContent = `${rate.toFixed(2)} img/s`;
+    document.getElementById('batchEta').textContent = progress.eta_seconds != null
+        ? `${Math.ceil(progress.eta_seconds)}s`
+        : '-';
+}
+
+function appendBatchImageEvent(image) {
+    const container = document.getElementById('batchImageEvents');
+    const row = document.createElement('div');
+    row.className = image.success
+        ? 'text-gray-700 dark:text-gray-300'
+        : 'text-red-600 dark:text-red-400';
+    row.textContent = image.success
+        ? `#${image.index} ${image.filename} analysed`
+        : `#${image.index} ${image.filename} failed: ${image.error}`;
+    container.prepend(row);
+    // Keep the list short on large batches
+    while (container.children.length > 50) {
+        container.lastChild.remove();
+    }
+}
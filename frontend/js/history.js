@@ -163,7 +163,7 @@ function displayHistory(records) {
                     <div class="flex items-center space-x-4 flex-1">
                         <div class="flex-shrink-0">
                             ${record.username ? `
-                                <img src="/images/${record.username}/${record.image_filename}" 
+                                <img src="${record.thumbnail_url || `/images/${record.username}/${record.image_filename}?size=thumb`}" 
                                      alt="Analysis Image" 
                                      class="w-20 h-20 object-cover rounded-lg border border-gray-300"
                                      onerror="this.style.display='none'; this.nextElementSibling.style.display='block'">
@@ -257,7 +257,7 @@ function showDetailModal(record) {
             <div class="bg-gray-50 p-6 rounded-lg">
                 <div class="mb-4">
                     ${record.username ? `
-                        <img src="/images/${record.username}/${record.image_filename}" 
+                        <img src="${record.preview_url || `/images/${record.username}/${record.image_filename}?size=medium`}" 
                              alt="Analysis Image" 
                              class="w-full max-w-md mx-auto h-64 object-cover rounded-lg border border-gray-300"
                              onerror="this.style.display='none'; this.nextElementSibling.style.display='block'">
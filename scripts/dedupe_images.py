@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Fold Duplicate Images
+=====================
+
+Moves images saved before content addressing
+(``storage/uploads/<username>/<filename>``) into the deduplicated blob store.
+Every file keeps working under its old name as a reference; files with the
+same content are stored once and the duplicates are removed.
+
+Usage:
+    # See how much would be reclaimed
+    python scripts/dedupe_images.py --dry-run
+
+    # Migrate
+    python scripts/dedupe_images.py
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.connection import MongoDB
+from src.storage.image_storage import fold_legacy_images
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Fold duplicate uploaded images into the blob store"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be reclaimed"
+    )
+    return parser.parse_args()
+
+
+async def main() -> int:
+    """Run the migration"""
+    args = parse_args()
+    try:
+        print("[*] Connecting to database...")
+        await MongoDB.connect_db()
+
+        print("[*] Folding legacy images" + (" (dry run)" if args.dry_run else "") + "...")
+        stats = await fold_legacy_images(dry_run=args.dry_run)
+
+        print(f"  Files:      {stats['files']}")
+        print(f"  Blobs:      {stats['blobs']}")
+        print(f"  Duplicates: {stats['duplicates']}")
+        print(
+            f"[+] Bytes reclaimed: {stats['bytes_reclaimed']:,} "
+            f"({stats['bytes_reclaimed'] / (1024 * 1024):.1f} MB)"
+        )
+        return 0
+
+    except Exception as e:
+        print(f"[-] Error: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return 1
+    finally:
+        await MongoDB.close_db()
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
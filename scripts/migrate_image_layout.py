@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Migrate Image Storage Layout
+============================
+
+Brings stored images into the sharded layout (``storage/blobs/ab/cd/<sha256>``)
+with the per-user index in ``image_refs``:
+
+1. Blobs saved flat as ``storage/blobs/<sha256>`` are renamed into their shard.
+2. Files still in ``storage/uploads/<username>/`` are hashed, moved into the
+   blob store (duplicates removed) and indexed under their old name.
+
+Files are moved in place, so the storage directory needs no extra space.
+Safe to re-run; an interrupted run continues where it stopped.
+
+Usage:
+    python scripts/migrate_image_layout.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.connection import MongoDB
+from src.storage.image_storage import ensure_indexes, fold_legacy_images, reshard_blobs
+
+
+class ProgressPrinter:
+    """Prints done/total, rate and ETA at most once a second"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.start = time.monotonic()
+        self.last = 0.0
+
+    def __call__(self, done: int, total: int) -> None:
+        now = time.monotonic()
+        if now - self.last < 1 and done < total:
+            return
+        self.last = now
+        rate = done / max(now - self.start, 1e-6)
+        eta = (total - done) / rate if rate else 0
+        print(
+            f"  [{self.label}] {done}/{total} ({done / total:.0%}) "
+            f"{rate:.0f} files/s, ETA {eta:.0f}s",
+            flush=True,
+        )
+
+
+async def main() -> int:
+    """Run the migration"""
+    try:
+        print("[*] Connecting to database...")
+        await MongoDB.connect_db()
+        await ensure_indexes()
+
+        print("[*] Moving flat blobs into shards...")
+        resharded = await reshard_blobs(progress=ProgressPrinter("reshard"))
+        print(f"[+] Resharded {resharded['blobs']} blobs")
+
+        print("[*] Moving per-user uploads into the blob store...")
+        folded = await fold_legacy_images(progress=ProgressPrinter("uploads"))
+        print(
+            f"[+] Indexed {folded['files']} files as {folded['blobs']} blobs, "
+            f"{folded['duplicates']} duplicates removed "
+            f"({folded['bytes_reclaimed'] / (1024 * 1024):.1f} MB reclaimed)"
+        )
+        return 0
+
+    except Exception as e:
+        print(f"[-] Error: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return 1
+    finally:
+        await MongoDB.close_db()
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
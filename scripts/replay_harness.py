@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Prompt/Model Replay Harness
+===========================
+
+Replays a sample of stored images against candidate prompt/model
+configurations and reports agreement with the stored results, token usage,
+p50/p95/p99 latency and parse failure rate.
+
+Usage:
+    # CI: fake inference backend, samples from a manifest file
+    python scripts/replay_harness.py --manifest samples.json --backend fake
+
+    # On demand: real provider, 50 random records from MongoDB
+    python scripts/replay_harness.py --sample 50 --candidates candidates.json --backend groq
+
+Candidates file (JSON list):
+    [
+        {"name": "baseline"},
+        {"name": "new-prompt", "prompt_file": "prompts/v2.txt"},
+        {"name": "maverick", "model": "meta-llama/llama-4-maverick-17b-128e-instruct"}
+    ]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.inference_backend import BACKEND_FAKE, BACKEND_GROQ
+from src.database.connection import MongoDB
+from src.services.replay_service import (
+    ReplayCandidate,
+    load_samples_from_db,
+    load_samples_from_manifest,
+    run_replay,
+)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Replay stored images against candidate prompts/models"
+    )
+    parser.add_argument("--sample", type=int, default=50, help="Number of stored records to sample")
+    parser.add_argument("--user-id", help="Only sample records from this user")
+    parser.add_argument("--manifest", type=Path, help="JSON manifest of samples (skips MongoDB)")
+    parser.add_argument("--candidates", type=Path, help="JSON file with candidate configurations")
+    parser.add_argument(
+        "--backend",
+        choices=[BACKEND_FAKE, BACKEND_GROQ],
+        default=BACKEND_FAKE,
+        help="Inference backend (default: fake)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent model calls")
+    parser.add_argument("--json-out", type=Path, help="Write the full report as JSON")
+    return parser.parse_args()
+
+
+def load_candidates(path: Path) -> list[ReplayCandidate]:
+    """Load candidates from file, defaulting to the current production config"""
+    if not path:
+        return [ReplayCandidate(name="baseline")]
+    entries = json.loads(path.read_text(encoding="utf-8"))
+    return [ReplayCandidate.from_dict(entry, base_dir=path.parent) for entry in entries]
+
+
+def print_report(reports) -> None:
+    """Print a compact comparison table"""
+    print(f"\n{'='*100}")
+    print(
+        f"{'Candidate':<20} {'Done':>6} {'Type agr':>9} {'Name agr':>9} {'Parse fail':>11} "
+        f"{'In tok':>8} {'Out tok':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    print(f"{'-'*100}")
+    for r in reports:
+        print(
+            f"{r.candidate:<20} {r.completed:>3}/{r.samples:<2} {r.type_agreement:>9.1%} "
+            f"{r.name_agreement:>9.1%} {r.parse_failure_rate:>11.1%} {r.prompt_tokens_avg:>8.0f} "
+            f"{r.completion_tokens_avg:>8.0f} {r.latency_ms['p50']:>8.1f} "
+            f"{r.latency_ms['p95']:>8.1f} {r.latency_ms['p99']:>8.1f}"
+        )
+    print(f"{'='*100}")
+
+
+async def main() -> int:
+    """Run the replay harness"""
+    args = parse_args()
+    candidates = load_candidates(args.candidates)
+
+    connected = False
+    try:
+        if args.manifest:
+            samples = load_samples_from_manifest(args.manifest)
+        else:
+            print("[*] Connecting to database...")
+            await MongoDB.connect_db()
+            connected = True
+            samples = await load_samples_from_db(args.sample, user_id=args.user_id)
+
+        if not samples:
+            print("[-] No samples with images available")
+            return 1
+
+        print(
+            f"[*] Replaying {len(samples)} samples against {len(candidates)} candidate(s) "
+            f"on the '{args.backend}' backend (concurrency {args.concurrency})"
+        )
+        reports = await run_replay(candidates, samples, args.backend, args.concurrency)
+        print_report(reports)
+
+        if args.json_out:
+            args.json_out.write_text(
+                json.dumps([r.to_dict() for r in reports], indent=2), encoding="utf-8"
+            )
+            print(f"[+] Report written to {args.json_out}")
+        return 0
+
+    except Exception as e:
+        print(f"[-] Error: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return 1
+    finally:
+        if connected:
+            await MongoDB.close_db()
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Image Storage Maintenance
+=========================
+
+Runs one pass of the storage maintenance job by hand: re-encodes old images
+into a compact format, deletes images no analysis record points at and packs
+cold images into segment files. The
+app runs the same job periodically (``STORAGE_MAINTENANCE_INTERVAL_HOURS``).
+
+Usage:
+    # See how much would be reclaimed
+    python scripts/storage_maintenance.py --dry-run
+
+    # Only collect orphans, at full speed (e.g. during a maintenance window)
+    python scripts/storage_maintenance.py --skip-compaction --images-per-second 0 --mb-per-second 0
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.connection import MongoDB
+from src.services import storage_maintenance
+from src.services.storage_maintenance import Throttle, run_maintenance
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Compact old images and delete orphaned ones")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be reclaimed"
+    )
+    parser.add_argument(
+        "--skip-compaction", action="store_true", help="Do not re-encode old images"
+    )
+    parser.add_argument("--skip-orphans", action="store_true", help="Do not delete orphaned images")
+    parser.add_argument(
+        "--skip-packing", action="store_true", help="Do not pack cold images into segments"
+    )
+    parser.add_argument(
+        "--images-per-second",
+        type=float,
+        default=storage_maintenance.IMAGES_PER_SECOND,
+        help="Pace limit (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--mb-per-second",
+        type=float,
+        default=storage_maintenance.BYTES_PER_SECOND / (1024 * 1024),
+        help="Pace limit on bytes read (0 = unlimited)",
+    )
+    return parser.parse_args()
+
+
+def _mb(value: int) -> str:
+    return f"{value:,} bytes ({value / (1024 * 1024):.1f} MB)"
+
+
+async def main() -> int:
+    """Run the maintenance pass"""
+    args = parse_args()
+    try:
+        print("[*] Connecting to database...")
+        await MongoDB.connect_db()
+
+        print("[*] Running storage maintenance" + (" (dry run)" if args.dry_run else "") + "...")
+        report = await run_maintenance(
+            dry_run=args.dry_run,
+            compact=not args.skip_compaction,
+            orphans=not args.skip_orphans,
+            pack=not args.skip_packing,
+            throttle=Throttle(args.images_per_second, args.mb_per_second * 1024 * 1024),
+        )
+        if report is None:
+            print("[-] Maintenance is already running on another node")
+            return 1
+
+        compaction, orphans, segments = report["compaction"], report["orphans"], report["segments"]
+        print(
+            f"  Compacted:        {compaction['compacted']} of {compaction['examined']} old images "
+            f"({_mb(compaction['bytes_reclaimed'])})"
+        )
+        print(
+            f"  Orphaned images:  {orphans['references']} references, {orphans['blobs']} blobs, "
+            f"{orphans['legacy_files']} legacy files ({_mb(orphans['bytes_reclaimed'])})"
+        )
+        print(
+            f"  Packed:           {segments['packed']} cold images into {segments['segments_written']} segments"
+        )
+        print(
+            f"  Segments:         {segments['segments_rewritten']} rewritten ({_mb(segments['bytes_reclaimed'])})"
+        )
+        print(f"  Errors:           {report['errors']}")
+        print(f"[+] Bytes reclaimed: {_mb(report['bytes_reclaimed'])}")
+        return 0
+
+    except Exception as e:
+        print(f"[-] Error: {e}")
+        import traceback
+
+        traceback.print_exc()
+        return 1
+    finally:
+        await MongoDB.close_db()
+
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Local Webhook Receiver
+======================
+
+A small HTTP server for trying out webhooks locally: it prints every event
+it receives and checks its ``X-Webhook-Signature`` against the secret that
+was returned when the webhook was registered. Register
+``http://localhost:<port>/`` as the webhook URL (plain http is accepted for
+localhost) on an app started with ``WEBHOOK_ALLOW_PRIVATE=true``.
+
+Usage:
+    python scripts/webhook_receiver.py --port 8787 --secret whsec_...
+
+    # Answer the first 2 requests with 500 to watch the retries
+    python scripts/webhook_receiver.py --secret whsec_... --fail-first 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.webhooks import verify_signature
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """HTTP server that records the webhook requests it receives"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        secret: Optional[str] = None,
+        fail_first: int = 0,
+        verbose: bool = False,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.secret = secret
+        self.fail_first = fail_first
+        self.verbose = verbose
+        self.received: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def start(self) -> "WebhookReceiver":
+        """Serve in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def record(self, headers, body: bytes) -> int:
+        """Store a request and pick the status code to answer with"""
+        signature = headers.get("X-Webhook-Signature", "")
+        request = {
+            "event_id": headers.get("X-Webhook-Id"),
+            "event_type": headers.get("X-Webhook-Event"),
+            "attempt": int(headers.get("X-Webhook-Attempt", "0")),
+            "signature_valid": verify_signature(self.secret, signature, body)
+            if self.secret
+            else None,
+            "payload": json.loads(body or b"null"),
+        }
+        with self._lock:
+            self.received.append(request)
+            failing = len(self.received) <= self.fail_first
+        if self.verbose:
+            print(json.dumps(request, indent=2))
+        if request["signature_valid"] is False:
+            return 401
+        return 500 if failing else 204
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        self.send_response(self.server.record(self.headers, body))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Print and verify webhook deliveries")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--secret", help="Webhook secret (whsec_...) to verify signatures with")
+    parser.add_argument(
+        "--fail-first", type=int, default=0, help="Answer this many requests with 500"
+    )
+    args = parser.parse_args()
+
+    receiver = WebhookReceiver(args.port, args.secret, args.fail_first, verbose=True)
+    print(f"Listening on {receiver.url}")
+    try:
+        receiver.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
+import asyncio
 import logging
+import time
 from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from src.auth.routes import router as auth_router
 from src.database.connection import MongoDB
@@ -17,6 +21,15 @@ from src.routes.prescription_routes import router as prescription_router
 from src.routes.programmatic_api import router as programmatic_router
 from src.routes.subscription_routes import router as subscription_router
 from src.routes.system_status import router as system_status_router
+from src.services.analysis_pipeline import get_analysis_pipeline
+from src.services.batch_jobs import ensure_indexes as ensure_batch_indexes, start_batch_workers, stop_batch_workers
+from src.services.similarity_service import ensure_indexes as ensure_similarity_indexes
+from src.services.storage_maintenance import start_background_maintenance, stop_background_maintenance
+from src.services.webhooks import ensure_indexes as ensure_webhook_indexes, start_webhook_workers, stop_webhook_workers
+from src.storage.image_storage import ensure_indexes as ensure_image_indexes, shutdown_io_pool
+from src.utils.cpu_pool import shutdown_cpu_pool
+from src.utils.memory_budget import get_memory_budget
+from src.utils.uploads import DEFAULT_MAX_IMAGE_SIZE_MB, base64_length, read_upload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,9 +42,21 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up application...")
     await MongoDB.connect_db()
+    await ensure_image_indexes()
+    await ensure_batch_indexes()
+    await ensure_similarity_indexes()
+    await ensure_webhook_indexes()
+    maintenance_task = start_background_maintenance()
+    batch_workers = start_batch_workers()
+    webhook_workers = start_webhook_workers()
     yield
     # Shutdown
     logger.info("Shutting down application...")
+    await stop_batch_workers(batch_workers)
+    await stop_webhook_workers(webhook_workers)
+    await stop_background_maintenance(maintenance_task)
+    shutdown_cpu_pool()
+    shutdown_io_pool()
     await MongoDB.close_db()
 
 
@@ -55,6 +80,10 @@ app.add_middleware(
 from src.middleware.rate_limiting import RateLimitMiddleware
 app.add_middleware(RateLimitMiddleware)
 
+# Upload size limit middleware (outermost: cuts off oversized bodies early)
+from src.middleware.upload_limit import UploadSizeLimitMiddleware
+app.add_middleware(UploadSizeLimitMiddleware)
+
 import os
 
 from fastapi.responses import FileResponse
@@ -166,11 +195,16 @@ async def disease_detection_file(file: UploadFile = File(...)):
     try:
         logger.info("Received image file for disease detection (public endpoint)")
 
-        # Read uploaded file into memory
-        contents = await file.read()
+        # Read uploaded file into memory (the image and its base64 count against the upload memory budget)
+        limit_bytes = DEFAULT_MAX_IMAGE_SIZE_MB * 1024 * 1024
+        size = file.size if file.size is not None else limit_bytes
+        with await get_memory_budget().reserve(size + base64_length(size)):
+            contents = await read_upload(file, limit_bytes)
 
-        # Process file directly from memory
-        result = convert_image_to_base64_and_test(contents)
+            # Process file directly from memory, in the interactive lane of the model scheduler
+            async with get_analysis_pipeline().model_slot("public"):
+                result = await asyncio.to_thread(convert_image_to_base64_and_test, contents)
+            del contents
 
         if result is None:
             raise HTTPException(status_code=500, detail="Failed to process image file")
@@ -183,22 +217,126 @@ async def disease_detection_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+# Stored images never change under their name
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
 @app.get("/images/{username}/{filename}")
-async def serve_image(username: str, filename: str):
-    """Serve analysis images"""
-    import os
+async def serve_image(
+    request: Request,
+    username: str,
+    filename: str,
+    size: Optional[str] = None,
+    expires: Optional[int] = None,
+    sig: Optional[str] = None,
+):
+    """
+    Serve analysis images
+
+    ``?size=thumb|medium`` returns a downscaled JPEG. Responses carry a strong
+    ETag and immutable caching headers, answer If-None-Match with 304 and
+    support Range requests. Signed URLs (``expires`` and ``sig``, see
+    ``src.utils.image_urls``) may be cached publicly until they expire.
+    Originals in a remote storage backend are served by redirecting to a
+    presigned URL.
+    """
+    import hashlib
+    import mimetypes
+
     from fastapi import HTTPException
-    
-    image_path = f"storage/uploads/{username}/{filename}"
-    logger.info(f"Looking for image at: {image_path}")
-    
-    if os.path.exists(image_path):
-        return FileResponse(image_path)
+
+    from fastapi.responses import RedirectResponse, StreamingResponse
+
+    from src.services.image_export import parse_range
+    from src.storage.backends import get_storage_backend
+    from src.storage.derivatives import SIZE_PRESETS, get_derivative_cache
+    from src.storage.image_storage import read_image, resolve_image
+    from src.utils.image_urls import REQUIRE_SIGNED_IMAGE_URLS, verify_image_signature
+
+    if size is not None and size not in SIZE_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown size '{size}'. Use one of: {', '.join(SIZE_PRESETS)}",
+        )
+
+    signed = expires is not None or sig is not None
+    if signed:
+        if expires is None or sig is None or not verify_image_signature(
+            username, filename, size, expires, sig
+        ):
+            raise HTTPException(status_code=403, detail="Invalid or expired image URL")
+        max_age = max(0, min(expires - int(time.time()), IMMUTABLE_MAX_AGE_SECONDS))
+        cache_control = f"public, max-age={max_age}, immutable"
+    elif REQUIRE_SIGNED_IMAGE_URLS:
+        raise HTTPException(status_code=403, detail="Signed image URL required")
     else:
-        logger.warning(f"Image not found: {image_path}")
+        cache_control = f"private, max-age={IMMUTABLE_MAX_AGE_SECONDS}, immutable"
+
+    image = await resolve_image(username, filename)
+    if image is None:
+        logger.warning(f"Image not found: {username}/{filename}")
         # Return a placeholder image or 404
         raise HTTPException(status_code=404, detail=f"Image not found: {filename}")
 
+    # Blobs are named by hash, so take the type from the requested name unless re-encoded
+    media_type = image.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    served_path, identity = image.path, image.location
+    if image.content_type:
+        # Compaction rewrites the blob under the same key
+        identity = f"{image.location}|{image.content_type}"
+    if size is not None:
+        derivative = await get_derivative_cache().get(
+            image.path or image.location, size, loader=lambda: read_image(image)
+        )
+        if isinstance(derivative, Path) and derivative != image.path:
+            served_path, identity, media_type = derivative, str(derivative), "image/jpeg"
+
+    # Blob and derivative locations are derived from their content, legacy names are unique
+    etag = f'"{hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if served_path is not None:
+        return FileResponse(served_path, media_type=media_type, headers=headers)
+
+    backend = get_storage_backend()
+    presigned_url = backend.presigned_url(image.key, content_type=media_type)
+    if presigned_url:
+        # The redirect itself must not outlive the presigned URL
+        return RedirectResponse(presigned_url, status_code=307, headers={"Cache-Control": "no-store"})
+
+    # Packed blobs have no file to hand to FileResponse: stream them with their length and ranges
+    length = await backend.size(image.key)
+    if length is None:
+        raise HTTPException(status_code=404, detail=f"Image not found: {filename}")
+    byte_range = None
+    if request.headers.get("if-range") in (None, etag):
+        try:
+            byte_range = parse_range(request.headers.get("range"), length)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{length}"}
+            )
+    start, end = byte_range or (0, length - 1)
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return StreamingResponse(
+        backend.stream(image.key, start=start, end=end),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=headers,
+    )
+
 
 @app.get("/api")
 async def api_info():
@@ -226,17 +364,25 @@ async def api_info():
             },
             "enterprise": {
                 "status": "/api/enterprise/status (GET, enterprise only)",
-                "bulk_analysis": "/api/enterprise/bulk-analysis (POST, enterprise only)",
+                "bulk_analysis": "/api/enterprise/bulk-analysis (POST, enterprise only, ?async=true queues)",
+                "archive_analysis": "/api/enterprise/bulk-analysis/archive (POST, ZIP or tar, enterprise only)",
+                "batch_results": "/api/enterprise/batch/{batch_id} (GET, enterprise only, live progress)",
+                "batch_events": "/api/enterprise/batch/{batch_id}/events (GET, enterprise only, Server-Sent Events)",
+                "active_batches": "/api/enterprise/batches/active (GET, enterprise only)",
                 "analytics": "/api/enterprise/analytics (GET, enterprise only)",
                 "api_keys": "/api/enterprise/api-keys (GET/POST/DELETE, enterprise only)",
                 "export_csv": "/api/enterprise/export/csv (GET, enterprise only)",
+                "export_images": "/api/enterprise/export/images (GET, enterprise only, ZIP/tar, Range)",
                 "dashboard": "/enterprise-dashboard (GET, web interface)",
             },
             "programmatic": {
                 "health": "/api/v1/health (GET, API key required)",
                 "analyze": "/api/v1/analyze (POST, API key required)",
                 "analyze_base64": "/api/v1/analyze-base64 (POST, API key required)",
-                "batch_analyze": "/api/v1/batch-analyze (POST, API key required)",
+                "batch_analyze": "/api/v1/batch-analyze (POST, API key required, ?async=true queues)",
+                "webhooks": "/api/v1/webhooks (GET/POST/DELETE, API key required, signed event delivery)",
+                "batch_progress": "/api/v1/batch/{batch_id} (GET, API key required)",
+                "batch_events": "/api/v1/batch/{batch_id}/events (GET, API key required, Server-Sent Events)",
                 "get_analyses": "/api/v1/analyses (GET, API key required)",
             },
             "admin": {
@@ -97,6 +97,23 @@ class APIKeyAuth:
 get_api_key_user = APIKeyAuth.verify_api_key
 
 
+async def get_api_key_id(credentials: HTTPAuthorizationCredentials = Depends(api_key_scheme)) -> str:
+    """Id of the API key the request was made with (use alongside get_enterprise_api_user)"""
+    import hashlib
+
+    api_keys_collection = MongoDB.get_collection("enterprise_api_keys")
+    api_key_doc = await api_keys_collection.find_one(
+        {"api_key_hash": hashlib.sha256(credentials.credentials.encode("utf-8")).hexdigest()},
+        {"_id": 1},
+    )
+    if not api_key_doc:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired API key"
+        )
+    return str(api_key_doc["_id"])
+
+
 async def get_enterprise_api_user(user: UserInDB = Depends(get_api_key_user)) -> UserInDB:
     """Verify user has enterprise subscription for API access"""
     from src.services.subscription_service import SubscriptionService
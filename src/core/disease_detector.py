@@ -5,7 +5,7 @@ import sys
 import uuid
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from dotenv import load_dotenv
 from groq import Groq
@@ -88,7 +88,7 @@ class LeafDiseaseDetector:
     DEFAULT_TEMPERATURE = 0.3
     DEFAULT_MAX_TOKENS = 1024
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, client: Optional[Any] = None):
         """
         Initialize the Leaf Disease Detector with API credentials.
 
@@ -99,6 +99,9 @@ class LeafDiseaseDetector:
         Args:
             api_key (Optional[str]): Groq API key. If None, will attempt to
                                    load from GROQ_API_KEY environment variable.
+            client (Optional[Any]): Pre-built Groq-compatible client (for example
+                                  the fake inference backend). When given, no
+                                  API key is required.
 
         Raises:
             ValueError: If no valid API key is found in parameters or environment.
@@ -108,9 +111,12 @@ class LeafDiseaseDetector:
         """
         load_dotenv()
         self.api_key = api_key or os.environ.get("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
-        self.client = Groq(api_key=self.api_key)
+        if client is not None:
+            self.client = client
+        else:
+            if not self.api_key:
+                raise ValueError("GROQ_API_KEY not found in environment variables")
+            self.client = Groq(api_key=self.api_key)
         logger.info("Leaf Disease Detector initialized")
 
     def create_analysis_prompt(self) -> str:
@@ -0,0 +1,163 @@
+"""
+Inference Backend Selection
+===========================
+
+Chooses the client used by the leaf disease detector. The default ``groq``
+backend lets the detector build its own Groq client; the ``fake`` backend
+returns canned, deterministic responses so CI and offline tooling (replay
+harness, benchmarks) never touch the real provider.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND_GROQ = "groq"
+BACKEND_FAKE = "fake"
+
+# Client installed programmatically (benchmarks, recorded-response replays)
+_client_override: Optional[Any] = None
+
+# Canned diagnoses returned by the fake backend, picked by image hash
+FAKE_DIAGNOSES: List[Dict[str, Any]] = [
+    {
+        "disease_detected": True,
+        "disease_name": "Brown Spot",
+        "disease_type": "fungal",
+        "severity": "moderate",
+        "confidence": 88,
+        "symptoms": ["Circular brown lesions", "Yellow halos around spots"],
+        "possible_causes": ["Fungal infection", "High humidity"],
+        "treatment": ["Apply copper-based fungicide", "Remove infected leaves"],
+        "description": "Brown spot is a fungal disease that reduces photosynthesis.",
+    },
+    {
+        "disease_detected": True,
+        "disease_name": "Bacterial Leaf Blight",
+        "disease_type": "bacterial",
+        "severity": "severe",
+        "confidence": 82,
+        "symptoms": ["Water-soaked streaks", "Leaf tips drying"],
+        "possible_causes": ["Xanthomonas bacteria", "Wounds from wind or insects"],
+        "treatment": ["Use streptomycin spray", "Avoid overhead irrigation"],
+        "description": "Bacterial leaf blight spreads quickly in warm, wet weather.",
+    },
+    {
+        "disease_detected": False,
+        "disease_name": None,
+        "disease_type": "healthy",
+        "severity": "none",
+        "confidence": 93,
+        "symptoms": [],
+        "possible_causes": [],
+        "treatment": ["Continue regular care"],
+        "description": "The leaf appears healthy with uniform colour and texture.",
+    },
+]
+
+
+class _FakeCompletions:
+    """Groq-compatible ``chat.completions`` namespace for the fake backend"""
+
+    def __init__(self, backend: "FakeGroqClient"):
+        self._backend = backend
+
+    def create(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        """Return a canned completion shaped like the Groq SDK response"""
+        return self._backend.complete(model, messages, **kwargs)
+
+
+class FakeGroqClient:
+    """
+    Deterministic stand-in for the Groq client.
+
+    The same image always yields the same diagnosis, token counts scale with
+    the prompt and image payload size, and an optional malformed-response rate
+    exercises the detector's parse-failure path.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, malformed_rate: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self))
+
+    @staticmethod
+    def _split_message(messages: List[Dict[str, Any]]) -> tuple[str, str]:
+        """Extract the prompt text and image URL from a vision chat message"""
+        prompt, image_url = "", ""
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                prompt += content
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    prompt += part.get("text", "")
+                elif part.get("type") == "image_url":
+                    image_url = part.get("image_url", {}).get("url", "")
+        return prompt, image_url
+
+    def complete(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> SimpleNamespace:
+        """Build a fake completion for the given chat messages"""
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        prompt, image_url = self._split_message(messages)
+        digest = hashlib.sha256(image_url.encode("utf-8")).digest()
+
+        # The first hash byte drives malformed output so it is stable per image
+        if self.malformed_rate and digest[0] / 255 < self.malformed_rate:
+            content = "I could not produce a structured answer for this image."
+        else:
+            diagnosis = FAKE_DIAGNOSES[digest[1] % len(FAKE_DIAGNOSES)]
+            content = json.dumps(diagnosis)
+
+        prompt_tokens = len(prompt) // 4 + len(image_url) // 1000 + 1
+        completion_tokens = len(content) // 4 + 1
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+
+def set_inference_client(client: Optional[Any]) -> None:
+    """Install a client used for every detector until reset with None"""
+    global _client_override
+    _client_override = client
+
+
+def get_backend_name() -> str:
+    """Get the configured inference backend name"""
+    return os.getenv("INFERENCE_BACKEND", BACKEND_GROQ).strip().lower()
+
+
+def create_inference_client(backend: Optional[str] = None) -> Optional[Any]:
+    """
+    Create the client for the requested backend
+
+    Returns None for the Groq backend so the detector builds its own client
+    from GROQ_API_KEY. A client installed with ``set_inference_client`` wins
+    when no backend is requested explicitly.
+    """
+    if backend is None and _client_override is not None:
+        return _client_override
+    backend = (backend or get_backend_name()).lower()
+    if backend == BACKEND_FAKE:
+        latency_ms = float(os.getenv("FAKE_INFERENCE_LATENCY_MS", "0"))
+        return FakeGroqClient(latency_seconds=latency_ms / 1000)
+    if backend != BACKEND_GROQ:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return None
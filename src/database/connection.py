@@ -60,3 +60,11 @@ SUBSCRIPTION_PLANS_COLLECTION = "subscription_plans"
 USER_SUBSCRIPTIONS_COLLECTION = "user_subscriptions"
 PAYMENT_RECORDS_COLLECTION = "payment_records"
 USAGE_QUOTAS_COLLECTION = "usage_quotas"
+IMAGE_BLOBS_COLLECTION = "image_blobs"
+IMAGE_REFS_COLLECTION = "image_refs"
+STORAGE_MAINTENANCE_COLLECTION = "storage_maintenance"
+EXPORT_SESSIONS_COLLECTION = "export_sessions"
+BATCH_JOBS_COLLECTION = "batch_jobs"
+BATCH_ITEMS_COLLECTION = "batch_items"
+WEBHOOKS_COLLECTION = "webhooks"
+WEBHOOK_DELIVERIES_COLLECTION = "webhook_deliveries"
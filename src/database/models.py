@@ -127,6 +127,7 @@ class AnalysisRecord(BaseModel):
     username: str
     image_filename: str
     image_path: str
+    image_sha256: Optional[str] = None
     disease_detected: bool
     disease_name: Optional[str] = None
     original_disease_name: Optional[str] = None
@@ -148,6 +149,9 @@ class AnalysisRecord(BaseModel):
     api_access: bool = False
     metadata: Optional[dict] = None
 
+    # Colour/texture embedding for similar-case retrieval
+    feature_vector: Optional[List[float]] = None
+
     class Config:
         populate_by_name = True
         arbitrary_types_allowed = True
@@ -187,6 +191,28 @@ class AnalysisResponse(BaseModel):
     updated_at: Optional[datetime] = None
 
 
+class SimilarCase(BaseModel):
+    """Past analysis that looks like the queried image"""
+
+    analysis_id: str
+    similarity: float
+    image_filename: Optional[str] = None
+    disease_detected: bool
+    disease_name: Optional[str] = None
+    disease_type: str
+    severity: str
+    confidence: float
+    analysis_timestamp: Optional[datetime] = None
+
+
+class SimilarCasesResponse(BaseModel):
+    """Similar past analyses, with a provisional answer for near-identical matches"""
+
+    similar_cases: List[SimilarCase] = []
+    provisional_answer: Optional[SimilarCase] = None
+    search_time_ms: float
+
+
 class FeedbackCreate(BaseModel):
     """Feedback creation model"""
     
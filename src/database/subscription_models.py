@@ -7,7 +7,7 @@ MongoDB models for subscription plans, user subscriptions, and billing in Indian
 
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Annotated, List, Optional
+from typing import Annotated, Dict, List, Optional
 
 from bson import ObjectId
 from pydantic import BaseModel, BeforeValidator, Field
@@ -23,6 +23,16 @@ class PlanType(str, Enum):
     ENTERPRISE = "enterprise"
 
 
+# Share of model capacity a tenant gets per scheduling round, by plan type
+# (src/services/model_scheduler.py)
+SCHEDULING_WEIGHTS: Dict[PlanType, int] = {
+    PlanType.FREE: 1,
+    PlanType.BASIC: 2,
+    PlanType.PREMIUM: 4,
+    PlanType.ENTERPRISE: 8,
+}
+
+
 class BillingCycle(str, Enum):
     """Billing cycle options"""
     MONTHLY = "monthly"
@@ -63,6 +73,10 @@ class SubscriptionPlan(BaseModel):
     max_analyses_per_month: int = Field(..., ge=0)  # 0 = unlimited
     max_image_size_mb: int = Field(default=10, ge=1)
     api_rate_limit_per_minute: int = Field(default=60, ge=1)
+
+    # Model cost budgets in USD (0 = unlimited)
+    daily_cost_budget_usd: float = Field(default=0.0, ge=0)
+    monthly_cost_budget_usd: float = Field(default=0.0, ge=0)
     
     # Features
     features: List[str] = []
@@ -105,6 +119,10 @@ class UserSubscription(BaseModel):
     # Usage tracking
     analyses_used_this_month: int = Field(default=0, ge=0)
     last_reset_date: datetime = Field(default_factory=datetime.utcnow)
+
+    # Per-user cost budget overrides in USD (None = use plan budget)
+    daily_cost_budget_usd: Optional[float] = Field(default=None, ge=0)
+    monthly_cost_budget_usd: Optional[float] = Field(default=None, ge=0)
     
     # Payment info
     payment_method: Optional[str] = None  # "razorpay", "paytm", "upi", etc.
@@ -210,6 +228,8 @@ DEFAULT_SUBSCRIPTION_PLANS = [
         "max_analyses_per_month": 10,
         "max_image_size_mb": 5,
         "api_rate_limit_per_minute": 30,  # Increased from 10
+        "daily_cost_budget_usd": 0.01,
+        "monthly_cost_budget_usd": 0.05,
         "features": [
             "10 disease analyses per month",
             "Basic disease identification",
@@ -232,6 +252,8 @@ DEFAULT_SUBSCRIPTION_PLANS = [
         "max_analyses_per_month": 100,
         "max_image_size_mb": 10,
         "api_rate_limit_per_minute": 60,  # Increased from 30
+        "daily_cost_budget_usd": 0.05,
+        "monthly_cost_budget_usd": 0.5,
         "features": [
             "100 disease analyses per month",
             "Advanced disease identification",
@@ -256,6 +278,8 @@ DEFAULT_SUBSCRIPTION_PLANS = [
         "max_analyses_per_month": 500,
         "max_image_size_mb": 20,
         "api_rate_limit_per_minute": 120,  # Increased from 60
+        "daily_cost_budget_usd": 0.25,
+        "monthly_cost_budget_usd": 2.5,
         "features": [
             "500 disease analyses per month",
             "AI-powered severity assessment",
@@ -282,6 +306,8 @@ DEFAULT_SUBSCRIPTION_PLANS = [
         "max_analyses_per_month": 0,  # Unlimited
         "max_image_size_mb": 50,
         "api_rate_limit_per_minute": 300,  # Increased from 120
+        "daily_cost_budget_usd": 5.0,
+        "monthly_cost_budget_usd": 50.0,
         "features": [
             "Unlimited disease analyses",
             "Custom AI model training",
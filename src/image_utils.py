@@ -16,6 +16,8 @@ from pathlib import Path
 leaf_disease_path = Path(__file__).parent.parent / "Leaf Disease"
 sys.path.insert(0, str(leaf_disease_path))
 
+from src.core.inference_backend import create_inference_client
+
 try:
     from main import LeafDiseaseDetector
 except ImportError as e:
@@ -31,7 +33,7 @@ def test_with_base64_data(base64_image_string: str):
         base64_image_string (str): Base64 encoded image data
     """
     try:
-        detector = LeafDiseaseDetector()
+        detector = LeafDiseaseDetector(client=create_inference_client())
         result = detector.analyze_leaf_image_base64(base64_image_string)
         return result
     except Exception as e:
@@ -5,6 +5,7 @@ Rate Limiting Middleware
 Rate limiting for Enterprise API endpoints based on subscription plans.
 """
 
+import hashlib
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Optional
@@ -17,6 +18,43 @@ from src.database.connection import MongoDB
 logger = logging.getLogger(__name__)
 
 
+async def get_request_user_id(request: Request) -> Optional[str]:
+    """Extract user ID from request"""
+    try:
+        # Check for API key in Authorization header
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer ent_"):
+            # API key authentication
+            api_key = auth_header.split(" ")[1]
+            api_keys_collection = MongoDB.get_collection("enterprise_api_keys")
+            api_key_doc = await api_keys_collection.find_one({
+                "api_key_hash": hashlib.sha256(api_key.encode("utf-8")).hexdigest(),
+                "is_active": True,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+            return api_key_doc["user_id"] if api_key_doc else None
+        
+        # Check for JWT token (regular authentication)
+        if auth_header and auth_header.startswith("Bearer "):
+            from jose import jwt
+            from src.auth.security import SECRET_KEY, ALGORITHM
+            
+            token = auth_header.split(" ")[1]
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            
+            if username:
+                users_collection = MongoDB.get_collection("users")
+                user_doc = await users_collection.find_one({"username": username})
+                return str(user_doc["_id"]) if user_doc else None
+        
+        return None
+        
+    except Exception as e:
+        logger.error(f"Error extracting user ID: {str(e)}")
+        return None
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Rate limiting middleware for API endpoints"""
     
@@ -88,37 +126,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     
     async def _get_user_id(self, request: Request) -> Optional[str]:
         """Extract user ID from request"""
-        try:
-            # Check for API key in Authorization header
-            auth_header = request.headers.get("Authorization")
-            if auth_header and auth_header.startswith("Bearer ent_"):
-                # API key authentication
-                api_keys_collection = MongoDB.get_collection("enterprise_api_keys")
-                api_key_doc = await api_keys_collection.find_one({
-                    "is_active": True,
-                    "expires_at": {"$gt": datetime.utcnow()}
-                })
-                return api_key_doc["user_id"] if api_key_doc else None
-            
-            # Check for JWT token (regular authentication)
-            if auth_header and auth_header.startswith("Bearer "):
-                from jose import jwt
-                from src.auth.security import SECRET_KEY, ALGORITHM
-                
-                token = auth_header.split(" ")[1]
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                username = payload.get("sub")
-                
-                if username:
-                    users_collection = MongoDB.get_collection("users")
-                    user_doc = await users_collection.find_one({"username": username})
-                    return str(user_doc["_id"]) if user_doc else None
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting user ID: {str(e)}")
-            return None
+        return await get_request_user_id(request)
     
     async def _get_user_rate_limit(self, user_id: str) -> Optional[int]:
         """Get rate limit for user based on subscription"""
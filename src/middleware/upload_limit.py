@@ -0,0 +1,206 @@
+"""
+Upload Size Limit Middleware
+============================
+
+Rejects oversized upload bodies while they arrive instead of after they have
+been received and parsed.
+
+For the image upload routes the request body may not exceed the user's plan
+``max_image_size_mb`` times the number of images the route accepts (4/3 of
+that for JSON routes carrying base64). A declared ``Content-Length`` over the
+cap is refused before anything is read; otherwise bytes are counted as they
+are received and the request is cut off with 413 as soon as the cap is
+crossed. The per-image limit itself is enforced by the routes.
+
+Archive uploads are not bounded by the image limit but by the archive's
+uncompressed size cap (a compressed archive is never much larger).
+
+Every upload route is also admitted against the process-wide upload memory
+budget (src/utils/memory_budget.py): while it is tight the request gets 503
+with ``Retry-After`` before its body is read. JSON bodies, which are held in
+memory while the request runs, reserve twice their size (the raw body and
+the strings parsed from it) until the response is sent. The reservation is
+put in ``request.state.upload_memory`` so the images decoded from the body
+are counted within it.
+"""
+
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.middleware.rate_limiting import get_request_user_id
+from src.utils.memory_budget import RETRY_AFTER_SECONDS, busy_error, get_memory_budget
+from src.utils.metrics import metrics
+from src.utils.uploads import ARCHIVE_MAX_TOTAL_MB, DEFAULT_MAX_IMAGE_SIZE_MB, get_upload_limit_mb
+
+logger = logging.getLogger(__name__)
+
+# path -> (max images per request, body is JSON with base64 images)
+UPLOAD_ROUTES: Dict[str, Tuple[int, bool]] = {
+    "/disease-detection-file": (1, False),
+    "/api/disease-detection": (1, False),
+    "/api/similar-cases": (1, False),
+    "/api/v1/analyze": (1, False),
+    "/api/v1/analyze-base64": (1, True),
+    "/api/v1/batch-analyze": (100, True),
+    "/api/enterprise/bulk-analysis": (100, False),
+}
+
+# path -> fixed body cap in MB, whatever the plan
+FIXED_UPLOAD_ROUTES: Dict[str, int] = {
+    "/api/enterprise/bulk-analysis/archive": ARCHIVE_MAX_TOTAL_MB,
+}
+
+# Multipart boundaries, part headers, JSON metadata and the like
+BODY_OVERHEAD_BYTES = 64 * 1024
+
+# Memory held per byte of a JSON body: the body and the strings parsed from it
+JSON_BODY_MEMORY_FACTOR = 2
+
+
+def body_limit(limit_mb: int, images: int, encoded: bool) -> int:
+    """Largest acceptable request body in bytes (0 = unlimited)"""
+    if not limit_mb:
+        return 0
+    limit = images * limit_mb * 1024 * 1024
+    if encoded:
+        limit = limit * 4 // 3
+    return limit + images * BODY_OVERHEAD_BYTES
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """Cut off upload request bodies that exceed the user's plan limit"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def _get_limit_mb(self, scope: Scope) -> int:
+        user_id = await get_request_user_id(Request(scope))
+        if not user_id:
+            # Unauthenticated requests are refused by the route; keep them small
+            return DEFAULT_MAX_IMAGE_SIZE_MB
+        try:
+            return await get_upload_limit_mb(user_id)
+        except Exception as e:
+            logger.error(f"Could not load upload limit for {user_id}: {str(e)}")
+            return 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"].rstrip("/")
+        route = UPLOAD_ROUTES.get(path)
+        encoded = False
+        if path in FIXED_UPLOAD_ROUTES:
+            limit_mb = FIXED_UPLOAD_ROUTES[path]
+            limit = body_limit(limit_mb, 1, False)
+        elif route is not None:
+            limit_mb = await self._get_limit_mb(scope)
+            limit = body_limit(limit_mb, *route)
+            encoded = route[1]
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = _content_length(scope)
+        if limit and content_length is not None and content_length > limit:
+            await _send_too_large(send, limit_mb)
+            return
+
+        budget = get_memory_budget()
+        reservation = None
+        if not budget.is_tight():
+            body_bytes = JSON_BODY_MEMORY_FACTOR * (content_length or 0) if encoded else 0
+            reservation = budget.try_reserve(body_bytes)
+        if reservation is None:
+            metrics.observe("memory_budget.rejected", 0.0)
+            logger.warning(f"Upload to {path} refused, memory budget is tight: {budget.stats()}")
+            await _send_busy(send)
+            return
+        scope.setdefault("state", {})["upload_memory"] = reservation
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = len(message.get("body", b""))
+                received += chunk
+                if encoded and content_length is None:
+                    reservation.grow(JSON_BODY_MEMORY_FACTOR * chunk)
+                if limit and received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            # Drop whatever error response the app made of the aborted body
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        finally:
+            reservation.release()
+        if exceeded and not response_started:
+            await _send_too_large(send, limit_mb)
+
+
+def _content_length(scope: Scope) -> Optional[int]:
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _send_too_large(send: Send, limit_mb: int) -> None:
+    body = json.dumps({"detail": f"File size exceeds {limit_mb}MB limit"}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_busy(send: Send) -> None:
+    body = json.dumps({"detail": busy_error().detail}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"retry-after", str(RETRY_AFTER_SECONDS).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -3,6 +3,7 @@ Admin Routes for System Management
 ==================================
 """
 
+import asyncio
 import hashlib
 import json
 import logging
@@ -19,6 +20,7 @@ from src.database.admin_models import APIConfig, APIUsageRecord, UsageStats, Use
 from src.database.connection import ANALYSIS_COLLECTION, USERS_COLLECTION, MongoDB
 from src.database.models import UserInDB
 from src.services.analytics_service import AnalyticsService
+from src.utils.metrics import metrics
 
 load_dotenv()
 
@@ -905,3 +907,52 @@ async def get_prescription_analytics(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to fetch prescription analytics: {str(e)}",
         )
+
+
+@router.get("/metrics")
+async def get_metrics(prefix: str = "", current_admin: UserInDB = Depends(get_current_admin_user)):
+    """
+    Get in-process latency metrics
+
+    Args:
+        prefix: Only include metrics whose name starts with this
+            (e.g. ``storage.`` for image storage, ``stage.`` for analysis stages)
+    """
+    return {"pid": os.getpid(), "metrics": metrics.snapshot(prefix=prefix)}
+
+
+_maintenance_run: Optional[asyncio.Task] = None
+
+
+@router.get("/storage/maintenance")
+async def get_storage_maintenance(
+    limit: int = 10, current_admin: UserInDB = Depends(get_current_admin_user)
+):
+    """Recent image storage maintenance runs (compaction and orphan collection)"""
+    from src.services.storage_maintenance import get_recent_reports
+
+    return {
+        "running": _maintenance_run is not None and not _maintenance_run.done(),
+        "reports": await get_recent_reports(limit=min(limit, 100)),
+    }
+
+
+@router.post("/storage/maintenance", status_code=status.HTTP_202_ACCEPTED)
+async def start_storage_maintenance(
+    dry_run: bool = False, current_admin: UserInDB = Depends(get_current_admin_user)
+):
+    """
+    Start an image storage maintenance run in the background
+
+    Args:
+        dry_run: Only report what would be reclaimed
+    """
+    from src.services.storage_maintenance import run_maintenance
+
+    global _maintenance_run
+    if _maintenance_run is not None and not _maintenance_run.done():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Storage maintenance is already running")
+
+    _maintenance_run = asyncio.create_task(run_maintenance(dry_run=dry_run))
+    logger.info(f"Storage maintenance started by {current_admin.username} (dry_run={dry_run})")
+    return {"success": True, "dry_run": dry_run, "message": "Storage maintenance started"}
@@ -5,26 +5,42 @@ Disease Detection Routes with Authentication
 Protected API endpoints for disease detection with user authentication.
 """
 
-import base64
+import asyncio
 import logging
+import time
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
 from fastapi.responses import JSONResponse
 
 from src.auth.security import get_current_active_user
 from src.database.connection import ANALYSIS_COLLECTION, MongoDB
-from src.database.models import AnalysisRecord, AnalysisResponse, UserInDB, YouTubeVideo
-from src.image_utils import test_with_base64_data
-from src.services.perplexity_service import get_perplexity_service
-from src.services.prescription_service import PrescriptionService
-from src.storage.image_storage import save_image
-from src.utils.usage_tracker import track_groq_usage, track_perplexity_usage
+from src.database.models import AnalysisResponse, SimilarCasesResponse, UserInDB
+from src.services.analysis_pipeline import AnalysisInput, PipelineOptions, get_analysis_pipeline
+from src.services.similarity_service import (
+    SIMILARITY_AVAILABLE,
+    compute_feature_vector,
+    find_similar_cases,
+    get_similarity_index,
+    provisional_answer,
+)
+from src.utils.image_urls import signed_image_url
+from src.utils.memory_budget import get_memory_budget
 from src.utils.system_settings import ensure_analysis_allowed
+from src.utils.uploads import get_upload_limit_mb, read_upload
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["Disease Detection"])
 
+# Web uploads count against the monthly quota and get videos and a prescription
+WEB_UPLOAD_OPTIONS = PipelineOptions(
+    endpoint="disease-detection",
+    check_quota=True,
+    increment_usage=True,
+    enrich=True,
+    generate_prescription=True,
+)
+
 
 @router.post("/test-upload")
 async def test_upload(
@@ -56,189 +72,18 @@ async def detect_disease(
         logger.info(f"User {current_user.username} uploaded image for disease detection")
         logger.info(f"File details - filename: {file.filename}, content_type: {file.content_type}")
 
-        # Check subscription limits first
-        from src.services.subscription_service import SubscriptionService
-        
-        # Check if user can analyze
-        can_analyze = await SubscriptionService.check_usage_limit(str(current_user.id))
-        
-        logger.info(f"Can analyze check for {current_user.username}: {can_analyze}")
-        
-        if not can_analyze:
-            # Get details for error message
-            usage_quota = await SubscriptionService.get_user_usage_quota(str(current_user.id))
-            logger.info(f"Usage quota: {usage_quota}")
-            
-            if usage_quota:
-                logger.info(f"Quota limit: {usage_quota.analyses_limit}, used: {usage_quota.analyses_used}")
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail=f"Monthly analysis limit reached ({usage_quota.analyses_used}/{usage_quota.analyses_limit}). Please upgrade your plan."
-                )
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Monthly analysis limit reached. Please upgrade your plan."
-                )
-
         # Validate file
         if not file.filename:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No file provided")
 
-        # Read uploaded file
-        contents = await file.read()
-
-        if not contents:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file provided"
-            )
-
-        logger.info(f"File size: {len(contents)} bytes")
-
-        # Save image locally
-        filename, file_path = save_image(contents, file.filename, current_user.username)
-        logger.info(f"Image saved: {file_path}")
-
-        # Convert to base64 and analyze
-        base64_string = base64.b64encode(contents).decode("utf-8")
-        result = test_with_base64_data(base64_string)
-
-        logger.info(f"Analysis result keys: {result.keys() if result else 'None'}")
-        logger.info(
-            f"Description in result: {result.get('description', 'NOT FOUND') if result else 'None'}"
+        ctx = await get_analysis_pipeline().run(
+            current_user, AnalysisInput(filename=file.filename, upload=file), WEB_UPLOAD_OPTIONS
         )
-
-        # Track Groq API usage with actual token counts
-        token_usage = result.get("token_usage", {}) if result else {}
-        input_tokens = token_usage.get("prompt_tokens")
-        output_tokens = token_usage.get("completion_tokens")
-        total_tokens = token_usage.get("total_tokens", len(base64_string) // 4 + 500)
-
-        await track_groq_usage(
-            user_id=str(current_user.id),
-            username=current_user.username,
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            tokens_used=total_tokens,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            success=result is not None and not result.get("error"),
-        )
-
-        if result is None or (isinstance(result, dict) and result.get("error")):
-            error_detail = (
-                result.get("error", "Failed to process image")
-                if isinstance(result, dict)
-                else "Failed to process image"
-            )
-            logger.error(f"Disease detection failed: {error_detail}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error_detail
-            )
-
-        # Fetch YouTube video recommendations
-        youtube_videos = []
-        try:
-            perplexity = get_perplexity_service()
-            logger.info(f"Perplexity service enabled: {perplexity.enabled}")
-
-            if result.get("disease_detected") and result.get("disease_name"):
-                # Get treatment videos for detected disease
-                logger.info(f"Fetching treatment videos for: {result.get('disease_name')}")
-                youtube_videos = perplexity.get_treatment_videos(
-                    disease_name=result.get("disease_name"),
-                    disease_type=result.get("disease_type", "unknown"),
-                    max_videos=3,
-                )
-                logger.info(f"Fetched {len(youtube_videos)} treatment videos")
-                if youtube_videos:
-                    logger.info(f"First video: {youtube_videos[0]}")
-
-                # Track Perplexity usage
-                await track_perplexity_usage(
-                    user_id=str(current_user.id),
-                    username=current_user.username,
-                    model="sonar",
-                    tokens_used=1000,  # Estimate
-                    success=len(youtube_videos) > 0,
-                )
-            elif (
-                not result.get("disease_detected") and result.get("disease_type") != "invalid_image"
-            ):
-                # Get general plant care videos for healthy leaves
-                logger.info("Plant is healthy - fetching plant care videos")
-                youtube_videos = perplexity.get_general_plant_care_videos(max_videos=3)
-                logger.info(f"Fetched {len(youtube_videos)} plant care videos")
-
-                # Track Perplexity usage
-                await track_perplexity_usage(
-                    user_id=str(current_user.id),
-                    username=current_user.username,
-                    model="sonar",
-                    tokens_used=800,  # Estimate
-                    success=len(youtube_videos) > 0,
-                )
-            else:
-                logger.info(
-                    f"No videos fetched. Disease detected: {result.get('disease_detected')}, Type: {result.get('disease_type')}"
-                )
-        except Exception as e:
-            logger.error(f"Failed to fetch YouTube videos: {str(e)}", exc_info=True)
-            # Continue without videos - not critical
-
-        # Store analysis record in database
-        analysis_record = AnalysisRecord(
-            user_id=str(current_user.id),
-            username=current_user.username,
-            image_filename=filename,
-            image_path=file_path,
-            disease_detected=result.get("disease_detected", False),
-            disease_name=result.get("disease_name"),
-            original_disease_name=result.get("original_disease_name"),
-            disease_type=result.get("disease_type", "unknown"),
-            severity=result.get("severity", "unknown"),
-            confidence=result.get("confidence", 0.0),
-            symptoms=result.get("symptoms", []),
-            possible_causes=result.get("possible_causes", []),
-            treatment=result.get("treatment", []),
-            description=result.get("description", ""),
-            youtube_videos=youtube_videos,
-        )
-
-        analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
-        insert_result = await analysis_collection.insert_one(analysis_record.dict(by_alias=True))
-
-        logger.info(f"Analysis record saved with ID: {insert_result.inserted_id}")
-
-        # Increment usage count after successful analysis
-        try:
-            await SubscriptionService.increment_usage(str(current_user.id))
-            logger.info(f"Incremented usage count for user {current_user.username}")
-        except Exception as e:
-            logger.error(f"Failed to increment usage count: {str(e)}")
-            # Continue - don't fail the analysis for usage tracking issues
-
-        # Generate prescription if disease detected
-        prescription_id = None
-        if analysis_record.disease_detected and analysis_record.disease_name:
-            try:
-                prescription = await PrescriptionService.generate_prescription(
-                    user_id=str(current_user.id),
-                    username=current_user.username,
-                    analysis_id=str(insert_result.inserted_id),
-                    disease_name=analysis_record.disease_name,
-                    disease_type=analysis_record.disease_type,
-                    severity=analysis_record.severity,
-                    confidence=analysis_record.confidence,
-                )
-                prescription_id = prescription.prescription_id
-                logger.info(f"Generated prescription: {prescription_id}")
-            except Exception as e:
-                logger.error(f"Failed to generate prescription: {str(e)}")
-                # Continue without prescription - not critical
+        analysis_record = ctx.record
 
         # Return response
         return AnalysisResponse(
-            id=str(insert_result.inserted_id),
+            id=ctx.analysis_id,
             disease_detected=analysis_record.disease_detected,
             disease_name=analysis_record.disease_name,
             original_disease_name=analysis_record.original_disease_name,
@@ -287,6 +132,11 @@ async def get_my_analyses(
             {
                 "id": str(record["_id"]),
                 "image_filename": record["image_filename"],
+                "username": record["username"],
+                "image_url": signed_image_url(record["username"], record["image_filename"]),
+                "thumbnail_url": signed_image_url(
+                    record["username"], record["image_filename"], size="thumb"
+                ),
                 "disease_detected": record["disease_detected"],
                 "disease_name": record.get("disease_name"),
                 "original_disease_name": record.get("original_disease_name"),
@@ -330,9 +180,110 @@ async def get_analysis_detail(
         )
 
     record["id"] = str(record.pop("_id"))
+    record.pop("feature_vector", None)
+    record["image_url"] = signed_image_url(record["username"], record["image_filename"])
+    record["preview_url"] = signed_image_url(
+        record["username"], record["image_filename"], size="medium"
+    )
     return record
 
 
+def _require_similarity_search() -> None:
+    if not SIMILARITY_AVAILABLE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Similar-case search is not available (NumPy/Pillow not installed)",
+        )
+
+
+@router.post("/similar-cases", response_model=SimilarCasesResponse)
+async def find_similar_to_image(
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=50),
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    """
+    Find past analyses that look like an uploaded image
+
+    Meant to be called alongside /disease-detection: a near-identical match
+    with high past confidence is returned as a provisional answer while the
+    model call is still running. Searches the user's own analyses (all
+    analyses for admins). Does not count against the analysis quota.
+    """
+    _require_similarity_search()
+    limit_mb = await get_upload_limit_mb(str(current_user.id))
+    limit_bytes = limit_mb * 1024 * 1024
+    with await get_memory_budget().reserve(file.size if file.size is not None else limit_bytes):
+        contents = await read_upload(file, limit_bytes)
+        if not contents:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file provided")
+
+        start = time.perf_counter()
+        vector = await asyncio.to_thread(compute_feature_vector, contents)
+        del contents
+    if vector is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not decode image")
+
+    cases = await find_similar_cases(
+        vector, k=k, user_id=None if current_user.is_admin else str(current_user.id)
+    )
+    return SimilarCasesResponse(
+        similar_cases=cases,
+        provisional_answer=provisional_answer(cases),
+        search_time_ms=round((time.perf_counter() - start) * 1000, 3),
+    )
+
+
+@router.get("/analyses/{analysis_id}/similar", response_model=SimilarCasesResponse)
+async def get_similar_analyses(
+    analysis_id: str,
+    k: int = Query(5, ge=1, le=50),
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    """Find past analyses similar to an existing one"""
+    from bson import ObjectId
+
+    _require_similarity_search()
+    analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+
+    try:
+        record = await analysis_collection.find_one(
+            {"_id": ObjectId(analysis_id)}, {"user_id": 1, "feature_vector": 1}
+        )
+    except:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid analysis ID")
+
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Analysis record not found"
+        )
+
+    if record["user_id"] != str(current_user.id) and not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this record",
+        )
+
+    if not record.get("feature_vector"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No image features stored for this analysis",
+        )
+
+    start = time.perf_counter()
+    cases = await find_similar_cases(
+        record["feature_vector"],
+        k=k,
+        user_id=None if current_user.is_admin else str(current_user.id),
+        exclude_id=analysis_id,
+    )
+    return SimilarCasesResponse(
+        similar_cases=cases,
+        provisional_answer=provisional_answer(cases),
+        search_time_ms=round((time.perf_counter() - start) * 1000, 3),
+    )
+
+
 @router.delete("/analyses/{analysis_id}")
 async def delete_analysis(
     analysis_id: str, current_user: UserInDB = Depends(get_current_active_user)
@@ -362,9 +313,13 @@ async def delete_analysis(
         )
 
     # Delete image file
-    delete_image(record["username"], record["image_filename"])
+    await delete_image(record["username"], record["image_filename"])
 
     # Delete database record
     await analysis_collection.delete_one({"_id": ObjectId(analysis_id)})
 
+    similarity_index = get_similarity_index()
+    if similarity_index is not None:
+        similarity_index.remove(analysis_id)
+
     return {"message": "Analysis record deleted successfully"}
@@ -7,23 +7,48 @@ higher rate limits, and specialized functionality.
 """
 
 import logging
+import os
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, UploadFile, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from src.auth.security import get_current_active_user
 from src.database.connection import ANALYSIS_COLLECTION, MongoDB
-from src.database.models import AnalysisRecord, UserInDB
+from src.database.models import UserInDB
+from src.services.analysis_pipeline import (
+    AnalysisContext,
+    AnalysisInput,
+    PipelineOptions,
+    get_analysis_pipeline,
+)
+from src.services.budget_service import CostBudgetService
+from src.services.model_scheduler import BATCH
 from src.services.subscription_service import SubscriptionService
+from src.services.webhooks import emit_batch_completed
+from src.storage.image_storage import get_user_storage_usage
+from src.utils.ndjson import ndjson_response, wants_ndjson
 from src.utils.system_settings import ensure_analysis_allowed
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/enterprise", tags=["Enterprise API"])
 
+BULK_OPTIONS = PipelineOptions(
+    endpoint="enterprise-bulk", cpu_offload=True, webhooks=True, traffic_class=BATCH
+)
+ARCHIVE_OPTIONS = PipelineOptions(
+    endpoint="enterprise-archive", cpu_offload=True, webhooks=True, traffic_class=BATCH
+)
+
+# Images of one bulk request analysed at the same time
+BULK_CONCURRENCY = int(os.getenv("BULK_ANALYSIS_CONCURRENCY", "8"))
+# Analysis records of a bulk request written per insert_many
+BULK_INSERT_BATCH_SIZE = 20
+
 
 class EnterpriseUser:
     """Dependency to verify enterprise user access"""
@@ -78,6 +103,22 @@ class BulkAnalysisResponse(BaseModel):
     metadata: Optional[dict]
 
 
+class ArchiveAnalysisResponse(BaseModel):
+    """Response model for archive bulk analysis"""
+    batch_id: str
+    batch_name: Optional[str]
+    total_entries: int
+    processed_images: int
+    failed_images: int
+    skipped_entries: int
+    uncompressed_bytes: int
+    truncated: bool
+    error: Optional[str]
+    results: List[dict]
+    processing_time_seconds: float
+    metadata: Optional[dict]
+
+
 class AnalyticsRequest(BaseModel):
     """Request model for analytics"""
     start_date: Optional[datetime] = None
@@ -147,7 +188,9 @@ async def enterprise_status(
                 "analyses_used": usage_quota.analyses_used if usage_quota else 0,
                 "analyses_limit": plan.max_analyses_per_month,
                 "is_unlimited": plan.max_analyses_per_month == 0
-            }
+            },
+            "budget": await CostBudgetService.get_budget_status(str(enterprise_user.id)),
+            "storage": await get_user_storage_usage(enterprise_user.username)
         }
         
     except HTTPException:
@@ -160,21 +203,71 @@ async def enterprise_status(
         )
 
 
+def _bulk_result(ctx: AnalysisContext) -> dict:
+    """One image's entry in a bulk analysis response"""
+    analysis = None
+    if ctx.success:
+        analysis = ctx.record.dict(exclude={"id", "feature_vector"})
+        analysis["id"] = ctx.analysis_id
+    return {
+        "index": ctx.input.index,
+        "filename": ctx.input.filename,
+        "success": ctx.success,
+        "analysis": analysis,
+        "error": ctx.error
+    }
+
+
+async def _stream_bulk_results(
+    contexts: AsyncIterator[AnalysisContext],
+    batch_id: str,
+    request: BulkAnalysisRequest,
+    total_images: int,
+    start_time: float,
+    user_id: str,
+) -> AsyncIterator[dict]:
+    """NDJSON lines of a bulk analysis: one per image as it finishes, then a summary"""
+    from time import time
+
+    processed_count = 0
+    async for ctx in contexts:
+        processed_count += 1 if ctx.success else 0
+        yield {"type": "result", **_bulk_result(ctx)}
+    logger.info(f"Bulk analysis streamed: {processed_count} processed, {total_images - processed_count} failed")
+    await emit_batch_completed(
+        user_id, batch_id, request.batch_name, total_images, processed_count, total_images - processed_count
+    )
+    yield {
+        "type": "summary",
+        "batch_id": batch_id,
+        "batch_name": request.batch_name,
+        "total_images": total_images,
+        "processed_images": processed_count,
+        "failed_images": total_images - processed_count,
+        "processing_time_seconds": time() - start_time,
+        "metadata": request.metadata,
+    }
+
+
 @router.post("/bulk-analysis", response_model=BulkAnalysisResponse)
 async def bulk_disease_analysis(
     files: List[UploadFile] = File(...),
     request: BulkAnalysisRequest = Depends(),
+    queue: bool = Query(False, alias="async", description="Queue the batch and return its id at once"),
+    accept: Optional[str] = Header(None),
     enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
 ):
-    """Bulk disease analysis for multiple images"""
-    import base64
+    """
+    Bulk disease analysis for multiple images
+
+    With ``?async=true`` the images are stored and queued (202); poll
+    ``GET /api/enterprise/batch/{batch_id}`` for progress and results.
+    With ``Accept: application/x-ndjson`` each image's result is streamed
+    as one line as soon as it finishes, followed by a summary line.
+    """
     import uuid
-    from concurrent.futures import ThreadPoolExecutor
     from time import time
     
-    from src.image_utils import test_with_base64_data
-    from src.storage.image_storage import save_image
-    
     try:
         await ensure_analysis_allowed()
         start_time = time()
@@ -189,100 +282,50 @@ async def bulk_disease_analysis(
                 detail="Maximum 100 files allowed per batch"
             )
         
-        results = []
-        processed_count = 0
-        failed_count = 0
-        
-        # Process files in parallel (enterprise feature)
-        def process_single_image(file_data):
-            try:
-                file, index = file_data
-                contents = file["contents"]
-                filename = file["filename"]
-                
-                # Save image
-                saved_filename, file_path = save_image(contents, filename, enterprise_user.username)
-                
-                # Convert to base64 and analyze
-                base64_string = base64.b64encode(contents).decode("utf-8")
-                analysis_result = test_with_base64_data(base64_string)
-                
-                if analysis_result and not analysis_result.get("error"):
-                    # Store analysis record
-                    analysis_record = AnalysisRecord(
-                        user_id=str(enterprise_user.id),
-                        username=enterprise_user.username,
-                        image_filename=saved_filename,
-                        image_path=file_path,
-                        disease_detected=analysis_result.get("disease_detected", False),
-                        disease_name=analysis_result.get("disease_name"),
-                        disease_type=analysis_result.get("disease_type", "unknown"),
-                        severity=analysis_result.get("severity", "unknown"),
-                        confidence=analysis_result.get("confidence", 0.0),
-                        symptoms=analysis_result.get("symptoms", []),
-                        possible_causes=analysis_result.get("possible_causes", []),
-                        treatment=analysis_result.get("treatment", []),
-                        description=analysis_result.get("description", ""),
-                        batch_id=batch_id,
-                        batch_name=request.batch_name
-                    )
-                    
-                    return {
-                        "index": index,
-                        "filename": filename,
-                        "success": True,
-                        "analysis": analysis_record.dict(),
-                        "error": None
-                    }
-                else:
-                    return {
-                        "index": index,
-                        "filename": filename,
-                        "success": False,
-                        "analysis": None,
-                        "error": analysis_result.get("error", "Analysis failed") if analysis_result else "Analysis failed"
-                    }
-                    
-            except Exception as e:
-                return {
-                    "index": index,
-                    "filename": filename,
-                    "success": False,
-                    "analysis": None,
-                    "error": str(e)
-                }
-        
-        # Read all files first
-        file_data = []
-        for i, file in enumerate(files):
-            contents = await file.read()
-            file_data.append({
-                "contents": contents,
-                "filename": file.filename
-            })
-        
-        # Process in parallel with ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(process_single_image, (file_data[i], i)) for i in range(len(file_data))]
-            
-            for future in futures:
-                result = future.result()
-                results.append(result)
-                
-                if result["success"]:
-                    processed_count += 1
-                    # Store in database
-                    analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
-                    await analysis_collection.insert_one(result["analysis"])
-                else:
-                    failed_count += 1
-        
-        # Sort results by index
-        results.sort(key=lambda x: x["index"])
+        inputs = [
+            AnalysisInput(
+                filename=file.filename,
+                upload=file,
+                batch_id=batch_id,
+                batch_name=request.batch_name,
+                index=i,
+            )
+            for i, file in enumerate(files)
+        ]
+        if queue:
+            from src.services.batch_jobs import submit_batch
+
+            progress = await submit_batch(
+                enterprise_user, inputs, BULK_OPTIONS, batch_id, request.batch_name, request.metadata
+            )
+            progress["status_url"] = f"/api/enterprise/batch/{batch_id}"
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(progress))
+
+        contexts = get_analysis_pipeline().iter_completed(
+            enterprise_user,
+            inputs,
+            BULK_OPTIONS,
+            concurrency=BULK_CONCURRENCY,
+            insert_batch_size=BULK_INSERT_BATCH_SIZE,
+        )
+        if wants_ndjson(accept):
+            return ndjson_response(
+                _stream_bulk_results(contexts, batch_id, request, len(files), start_time, str(enterprise_user.id)),
+                headers={"X-Batch-Id": batch_id},
+            )
+
+        results = [_bulk_result(ctx) async for ctx in contexts]
+        # Returned all at once, so listed in request order (NDJSON gives completion order)
+        results.sort(key=lambda result: result["index"])
+        processed_count = sum(1 for result in results if result["success"])
+        failed_count = len(results) - processed_count
         
         processing_time = time() - start_time
         
         logger.info(f"Bulk analysis completed: {processed_count} processed, {failed_count} failed")
+        await emit_batch_completed(
+            str(enterprise_user.id), batch_id, request.batch_name, len(files), processed_count, failed_count
+        )
         
         return BulkAnalysisResponse(
             batch_id=batch_id,
@@ -305,6 +348,119 @@ async def bulk_disease_analysis(
         )
 
 
+def _archive_result(ctx: Optional[AnalysisContext], result: dict) -> dict:
+    """One archive entry's result, with its analysis if it was analysed"""
+    if ctx is not None:
+        result["analysis"] = _bulk_result(ctx)["analysis"]
+    return result
+
+
+async def _archive_summary(
+    user_id: str, batch_id: str, request: BulkAnalysisRequest, report, counts: dict, start_time: float
+) -> dict:
+    """Totals of an archive analysis (``report`` is the ingestion's ArchiveReport), announced to webhooks"""
+    from time import time
+
+    await emit_batch_completed(
+        user_id, batch_id, request.batch_name, report.entries, counts["processed"], counts["failed"]
+    )
+    return {
+        "batch_id": batch_id,
+        "batch_name": request.batch_name,
+        "total_entries": report.entries,
+        "processed_images": counts["processed"],
+        "failed_images": counts["failed"],
+        "skipped_entries": report.skipped,
+        "uncompressed_bytes": report.uncompressed_bytes,
+        "truncated": report.truncated,
+        "error": report.error,
+        "processing_time_seconds": time() - start_time,
+        "metadata": request.metadata,
+    }
+
+
+async def _archive_results(results, counts: dict) -> AsyncIterator[dict]:
+    """Entry results of ``analyse_archive``, counting successes and failures"""
+    async for ctx, result in results:
+        result = _archive_result(ctx, result)
+        if result["success"]:
+            counts["processed"] += 1
+        elif not result.get("skipped"):
+            counts["failed"] += 1
+        yield result
+
+
+@router.post("/bulk-analysis/archive", response_model=ArchiveAnalysisResponse)
+async def archive_disease_analysis(
+    file: UploadFile = File(...),
+    request: BulkAnalysisRequest = Depends(),
+    accept: Optional[str] = Header(None),
+    enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
+):
+    """
+    Bulk disease analysis of the images in one ZIP or tar archive
+
+    Entries are read and analysed one by one; each gets a result (analysis,
+    rejection or duplicate). With ``Accept: application/x-ndjson`` results
+    are streamed as they are known, followed by a summary line.
+    """
+    import uuid
+    from time import time
+
+    from src.services.archive_ingest import ArchiveReport, analyse_archive, check_archive
+
+    try:
+        await ensure_analysis_allowed()
+        start_time = time()
+        batch_id = str(uuid.uuid4())
+        await check_archive(file.file)
+
+        logger.info(f"Starting archive analysis of {file.filename}, batch: {batch_id}")
+
+        report = ArchiveReport()
+        counts = {"processed": 0, "failed": 0}
+        results = _archive_results(
+            analyse_archive(
+                enterprise_user,
+                file.file,
+                ARCHIVE_OPTIONS,
+                batch_id,
+                request.batch_name,
+                {**(request.metadata or {}), "archive": file.filename},
+                concurrency=BULK_CONCURRENCY,
+                insert_batch_size=BULK_INSERT_BATCH_SIZE,
+                report=report,
+            ),
+            counts,
+        )
+
+        if wants_ndjson(accept):
+            async def lines() -> AsyncIterator[dict]:
+                async for result in results:
+                    yield {"type": "result", **result}
+                summary = await _archive_summary(str(enterprise_user.id), batch_id, request, report, counts, start_time)
+                yield {"type": "summary", **summary}
+
+            return ndjson_response(lines(), headers={"X-Batch-Id": batch_id})
+
+        collected = [result async for result in results]
+        summary = await _archive_summary(str(enterprise_user.id), batch_id, request, report, counts, start_time)
+        logger.info(
+            f"Archive analysis completed: {summary['processed_images']} processed, "
+            f"{summary['failed_images']} failed, {summary['skipped_entries']} skipped"
+        )
+        return ArchiveAnalysisResponse(results=collected, **summary)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in archive analysis: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Archive analysis failed: {str(e)}"
+        )
+
+
 @router.get("/analytics", response_model=AnalyticsResponse)
 async def get_advanced_analytics(
     start_date: Optional[datetime] = Query(None),
@@ -446,8 +602,14 @@ async def get_batch_results(
     batch_id: str,
     enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
 ):
-    """Get results for a specific batch analysis"""
+    """Get results for a specific batch analysis (live progress for queued batches)"""
+    from src.services.batch_jobs import get_batch_progress
+
     try:
+        progress = await get_batch_progress(batch_id, str(enterprise_user.id))
+        if progress is not None:
+            return progress
+
         analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
         
         # Get all analyses for this batch
@@ -495,6 +657,54 @@ async def get_batch_results(
         )
 
 
+@router.get("/batches/active")
+async def list_active_batches(
+    enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
+):
+    """Batches still running: queued ones, and bulk requests in progress on this server"""
+    from src.services.batch_progress import progress_hub
+
+    try:
+        return {"batches": await progress_hub.active_batches(str(enterprise_user.id))}
+    except Exception as e:
+        logger.error(f"Error listing active batches: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to list active batches"
+        )
+
+
+@router.get("/batch/{batch_id}/events")
+async def stream_batch_events(
+    batch_id: str,
+    enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
+):
+    """
+    Live progress of a running batch as Server-Sent Events
+
+    Starts with a ``snapshot`` event, then sends an ``image`` event per
+    finished image (with the batch's counters and throughput) and ends with
+    ``completed``. Any number of clients may watch the same batch.
+    """
+    from src.services.batch_progress import progress_hub
+    from src.utils.sse import sse_response
+
+    try:
+        events = await progress_hub.open_stream(batch_id, str(enterprise_user.id))
+    except Exception as e:
+        logger.error(f"Error opening batch event stream: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to open batch event stream"
+        )
+    if events is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found"
+        )
+    return sse_response(events, headers={"X-Batch-Id": batch_id})
+
+
 @router.get("/export/csv")
 async def export_analyses_csv(
     start_date: Optional[datetime] = Query(None),
@@ -564,6 +774,93 @@ async def export_analyses_csv(
         )
 
 
+@router.get("/export/images")
+async def export_images(
+    request: Request,
+    format: str = Query("zip", pattern="^(zip|tar)$"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    batch_id: Optional[str] = Query(None),
+    enterprise_user: UserInDB = Depends(EnterpriseUser.verify_enterprise_access)
+):
+    """
+    Export analysed images as a ZIP or tar archive
+
+    Streams the images of a date range and/or batch with a ``manifest.json``
+    mapping files to analysis ids. Supports ``Range`` (with ``If-Range``) to
+    resume interrupted downloads. Limited to ``EXPORT_MAX_CONCURRENT``
+    downloads per tenant at a time.
+    """
+    from fastapi.responses import StreamingResponse
+
+    from src.services.image_export import (
+        EXPORT_MAX_CONCURRENT,
+        acquire_export_slot,
+        parse_range,
+        plan_export,
+        release_export_slot,
+        stream_with_slot,
+    )
+
+    user_id = str(enterprise_user.id)
+    slot_id = await acquire_export_slot(user_id)
+    if slot_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"At most {EXPORT_MAX_CONCURRENT} image exports may run at once",
+            headers={"Retry-After": "30"},
+        )
+
+    try:
+        plan = await plan_export(
+            user_id, enterprise_user.username, format, start_date, end_date, batch_id
+        )
+    except ValueError as e:
+        await release_export_slot(slot_id)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        await release_export_slot(slot_id)
+        logger.error(f"Error planning image export: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to export images"
+        )
+
+    # A resumed download only gets a range if the archive has not changed since
+    byte_range = None
+    if request.headers.get("if-range") in (None, plan.etag):
+        try:
+            byte_range = parse_range(request.headers.get("range"), plan.size)
+        except ValueError as e:
+            await release_export_slot(slot_id)
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail=str(e),
+                headers={"Content-Range": f"bytes */{plan.size}"},
+            )
+
+    start, end = byte_range or (0, plan.size - 1)
+    version = plan.etag.strip('"')[:8]
+    archive_name = f"images_{enterprise_user.username}_{version}.{format}"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": plan.etag,
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f"attachment; filename={archive_name}",
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{plan.size}"
+    logger.info(
+        f"Exporting {len(plan.entries) - 1} images ({plan.size} bytes, {format}) for {enterprise_user.username}"
+    )
+    return StreamingResponse(
+        stream_with_slot(plan.stream(start, end), slot_id),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="application/zip" if format == "zip" else "application/x-tar",
+        headers=headers,
+    )
+
+
 @router.post("/api-keys", response_model=APIKeyResponse)
 async def generate_api_key(
     request: APIKeyRequest,
@@ -6,25 +6,76 @@ API endpoints for programmatic access using API keys.
 Designed for enterprise users to integrate with their systems.
 """
 
-import base64
 import logging
+import os
 from datetime import datetime
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
-from src.auth.api_key_auth import get_enterprise_api_user
+from src.auth.api_key_auth import get_api_key_id, get_enterprise_api_user
 from src.database.connection import ANALYSIS_COLLECTION, MongoDB
-from src.database.models import AnalysisRecord, UserInDB
-from src.image_utils import test_with_base64_data
-from src.storage.image_storage import save_image
+from src.database.models import UserInDB
+from src.services.analysis_pipeline import (
+    AnalysisContext,
+    AnalysisInput,
+    PipelineOptions,
+    get_analysis_pipeline,
+)
+from src.services.model_scheduler import BATCH
+from src.services.webhooks import emit_batch_completed
+from src.utils.memory_budget import request_reservation
+from src.utils.ndjson import ndjson_response, wants_ndjson
 from src.utils.system_settings import ensure_analysis_allowed
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1", tags=["Programmatic API"])
 
+# API calls are flagged as such and capped at the enterprise upload limit
+API_OPTIONS = PipelineOptions(endpoint="api-v1", api_access=True, max_image_size_mb=50, webhooks=True)
+API_BATCH_OPTIONS = PipelineOptions(
+    endpoint="api-v1-batch",
+    api_access=True,
+    max_image_size_mb=50,
+    cpu_offload=True,
+    webhooks=True,
+    traffic_class=BATCH,
+)
+
+# One image of a batch in flight per this many requests/minute of the plan:
+# with a ~2 s model call a batch then runs at about the plan's rate
+API_BATCH_RATE_PER_SLOT = 30
+API_BATCH_MAX_CONCURRENCY = int(os.getenv("API_BATCH_MAX_CONCURRENCY", "16"))
+# Analysis records of a batch written per insert_many
+API_BATCH_INSERT_SIZE = 20
+
+
+async def batch_concurrency(user_id: str) -> int:
+    """Images of one batch analysed at the same time, sized from the plan's API rate limit"""
+    from src.services.subscription_service import SubscriptionService
+
+    rate_limit = 60
+    subscription = await SubscriptionService.get_user_subscription(user_id)
+    if subscription:
+        plan = await SubscriptionService.get_plan_by_id(subscription.plan_id)
+        if plan:
+            rate_limit = plan.api_rate_limit_per_minute
+    return max(1, min(API_BATCH_MAX_CONCURRENCY, rate_limit // API_BATCH_RATE_PER_SLOT))
+
 
 # Request/Response Models
 class ImageAnalysisRequest(BaseModel):
@@ -65,10 +116,19 @@ class BatchAnalysisResponse(BaseModel):
     successful_analyses: int
     failed_analyses: int
     results: List[ImageAnalysisResponse]
+    # Images that failed, in request order: index, filename and error
+    errors: List[dict] = []
     processing_time_seconds: float
     metadata: Optional[dict]
 
 
+class WebhookRequest(BaseModel):
+    """Request model for webhook registration"""
+    url: str
+    events: List[str] = ["analysis.completed", "batch.completed"]
+    description: Optional[str] = None
+
+
 class HealthCheckResponse(BaseModel):
     """Response model for health check"""
     status: str
@@ -94,6 +154,25 @@ async def health_check(
     )
 
 
+def _analysis_response(ctx: AnalysisContext) -> ImageAnalysisResponse:
+    """Shape a pipeline result as an API response"""
+    analysis_record = ctx.record
+    return ImageAnalysisResponse(
+        analysis_id=ctx.analysis_id,
+        disease_detected=analysis_record.disease_detected,
+        disease_name=analysis_record.disease_name,
+        disease_type=analysis_record.disease_type,
+        severity=analysis_record.severity,
+        confidence=analysis_record.confidence,
+        symptoms=analysis_record.symptoms,
+        possible_causes=analysis_record.possible_causes,
+        treatment=analysis_record.treatment,
+        description=analysis_record.description,
+        analysis_timestamp=analysis_record.analysis_timestamp,
+        metadata=analysis_record.metadata
+    )
+
+
 @router.post("/analyze", response_model=ImageAnalysisResponse)
 async def analyze_image(
     file: UploadFile = File(...),
@@ -111,73 +190,13 @@ async def analyze_image(
                 detail="No file provided"
             )
         
-        # Read file contents
-        contents = await file.read()
-        if not contents:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Empty file provided"
-            )
-        
-        # Check file size (enterprise limit: 50MB)
-        if len(contents) > 50 * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="File size exceeds 50MB limit"
-            )
-        
-        # Save image
-        filename, file_path = save_image(contents, file.filename, api_user.username)
-        
-        # Convert to base64 and analyze
-        base64_string = base64.b64encode(contents).decode("utf-8")
-        result = test_with_base64_data(base64_string)
-        
-        if result is None or result.get("error"):
-            error_detail = result.get("error", "Analysis failed") if result else "Analysis failed"
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=error_detail
-            )
-        
-        # Create analysis record
-        analysis_record = AnalysisRecord(
-            user_id=str(api_user.id),
-            username=api_user.username,
-            image_filename=filename,
-            image_path=file_path,
-            disease_detected=result.get("disease_detected", False),
-            disease_name=result.get("disease_name"),
-            disease_type=result.get("disease_type", "unknown"),
-            severity=result.get("severity", "unknown"),
-            confidence=result.get("confidence", 0.0),
-            symptoms=result.get("symptoms", []),
-            possible_causes=result.get("possible_causes", []),
-            treatment=result.get("treatment", []),
-            description=result.get("description", ""),
-            api_access=True  # Mark as API access
+        ctx = await get_analysis_pipeline().run(
+            api_user, AnalysisInput(filename=file.filename, upload=file), API_OPTIONS
         )
         
-        # Store in database
-        analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
-        insert_result = await analysis_collection.insert_one(analysis_record.dict(by_alias=True))
+        logger.info(f"API analysis completed: {ctx.analysis_id}")
         
-        logger.info(f"API analysis completed: {insert_result.inserted_id}")
-        
-        return ImageAnalysisResponse(
-            analysis_id=str(insert_result.inserted_id),
-            disease_detected=analysis_record.disease_detected,
-            disease_name=analysis_record.disease_name,
-            disease_type=analysis_record.disease_type,
-            severity=analysis_record.severity,
-            confidence=analysis_record.confidence,
-            symptoms=analysis_record.symptoms,
-            possible_causes=analysis_record.possible_causes,
-            treatment=analysis_record.treatment,
-            description=analysis_record.description,
-            analysis_timestamp=analysis_record.analysis_timestamp,
-            metadata=None
-        )
+        return _analysis_response(ctx)
         
     except HTTPException:
         raise
@@ -192,6 +211,7 @@ async def analyze_image(
 @router.post("/analyze-base64", response_model=ImageAnalysisResponse)
 async def analyze_base64_image(
     request: ImageAnalysisRequest,
+    http_request: Request,
     api_user: UserInDB = Depends(get_enterprise_api_user)
 ):
     """Analyze image provided as base64 string"""
@@ -199,75 +219,21 @@ async def analyze_base64_image(
         await ensure_analysis_allowed()
         logger.info(f"API base64 analysis request from user: {api_user.username}")
         
-        # Validate base64 data
-        try:
-            image_data = base64.b64decode(request.image_base64)
-        except Exception:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid base64 image data"
-            )
-        
-        # Check file size
-        if len(image_data) > 50 * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="Image size exceeds 50MB limit"
-            )
-        
-        # Save image
         filename = request.filename or f"api_image_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.jpg"
-        saved_filename, file_path = save_image(image_data, filename, api_user.username)
-        
-        # Analyze image
-        result = test_with_base64_data(request.image_base64)
-        
-        if result is None or result.get("error"):
-            error_detail = result.get("error", "Analysis failed") if result else "Analysis failed"
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=error_detail
-            )
-        
-        # Create analysis record
-        analysis_record = AnalysisRecord(
-            user_id=str(api_user.id),
-            username=api_user.username,
-            image_filename=saved_filename,
-            image_path=file_path,
-            disease_detected=result.get("disease_detected", False),
-            disease_name=result.get("disease_name"),
-            disease_type=result.get("disease_type", "unknown"),
-            severity=result.get("severity", "unknown"),
-            confidence=result.get("confidence", 0.0),
-            symptoms=result.get("symptoms", []),
-            possible_causes=result.get("possible_causes", []),
-            treatment=result.get("treatment", []),
-            description=result.get("description", ""),
-            api_access=True,
-            metadata=request.metadata
+        ctx = await get_analysis_pipeline().run(
+            api_user,
+            AnalysisInput(
+                filename=filename,
+                base64_data=request.image_base64,
+                metadata=request.metadata,
+                body_memory=request_reservation(http_request),
+            ),
+            API_OPTIONS,
         )
         
-        # Store in database
-        analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
-        insert_result = await analysis_collection.insert_one(analysis_record.dict(by_alias=True))
+        logger.info(f"API base64 analysis completed: {ctx.analysis_id}")
         
-        logger.info(f"API base64 analysis completed: {insert_result.inserted_id}")
-        
-        return ImageAnalysisResponse(
-            analysis_id=str(insert_result.inserted_id),
-            disease_detected=analysis_record.disease_detected,
-            disease_name=analysis_record.disease_name,
-            disease_type=analysis_record.disease_type,
-            severity=analysis_record.severity,
-            confidence=analysis_record.confidence,
-            symptoms=analysis_record.symptoms,
-            possible_causes=analysis_record.possible_causes,
-            treatment=analysis_record.treatment,
-            description=analysis_record.description,
-            analysis_timestamp=analysis_record.analysis_timestamp,
-            metadata=request.metadata
-        )
+        return _analysis_response(ctx)
         
     except HTTPException:
         raise
@@ -279,12 +245,61 @@ async def analyze_base64_image(
         )
 
 
+async def _stream_batch_results(
+    contexts: AsyncIterator[AnalysisContext],
+    batch_id: str,
+    request: BatchAnalysisRequest,
+    start_time: float,
+    user_id: str,
+) -> AsyncIterator[dict]:
+    """NDJSON lines of a batch: one per image as it finishes, then a summary"""
+    from time import time
+
+    successful_count = 0
+    async for ctx in contexts:
+        line = {
+            "type": "result",
+            "index": ctx.input.index,
+            "filename": ctx.input.filename,
+            "success": ctx.success,
+            "analysis": _analysis_response(ctx) if ctx.success else None,
+            "error": ctx.error,
+        }
+        successful_count += 1 if ctx.success else 0
+        yield line
+    total_images = len(request.images)
+    logger.info(f"API batch analysis streamed: {successful_count} successful, {total_images - successful_count} failed")
+    await emit_batch_completed(
+        user_id, batch_id, request.batch_name, total_images, successful_count, total_images - successful_count
+    )
+    yield {
+        "type": "summary",
+        "batch_id": batch_id,
+        "batch_name": request.batch_name,
+        "total_images": total_images,
+        "successful_analyses": successful_count,
+        "failed_analyses": total_images - successful_count,
+        "processing_time_seconds": time() - start_time,
+        "metadata": request.metadata,
+    }
+
+
 @router.post("/batch-analyze", response_model=BatchAnalysisResponse)
 async def batch_analyze_images(
     request: BatchAnalysisRequest,
+    http_request: Request,
+    queue: bool = Query(False, alias="async", description="Queue the batch and return its id at once"),
+    accept: Optional[str] = Header(None),
     api_user: UserInDB = Depends(get_enterprise_api_user)
 ):
-    """Analyze multiple images in a batch"""
+    """
+    Analyze multiple images in a batch
+
+    With ``?async=true`` the images are stored and queued (202); poll
+    ``GET /api/v1/batch/{batch_id}`` for progress and results.
+    With ``Accept: application/x-ndjson`` each image's result is streamed
+    as one line as soon as it finishes, followed by a summary line.
+    """
     import uuid
     from time import time
     
@@ -302,75 +317,61 @@ async def batch_analyze_images(
                 detail="Maximum 100 images allowed per batch"
             )
         
-        results = []
-        successful_count = 0
-        failed_count = 0
+        body_memory = request_reservation(http_request)
+        inputs = [
+            AnalysisInput(
+                filename=image_request.filename or f"batch_{batch_id}_{i}.jpg",
+                base64_data=image_request.image_base64,
+                metadata=image_request.metadata,
+                batch_id=batch_id,
+                batch_name=request.batch_name,
+                index=i,
+                body_memory=body_memory,
+            )
+            for i, image_request in enumerate(request.images)
+        ]
+        if queue:
+            from src.services.batch_jobs import submit_batch
+
+            progress = await submit_batch(
+                api_user, inputs, API_BATCH_OPTIONS, batch_id, request.batch_name, request.metadata
+            )
+            progress["status_url"] = f"/api/v1/batch/{batch_id}"
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(progress))
+
+        concurrency = await batch_concurrency(str(api_user.id))
+        if wants_ndjson(accept):
+            contexts = get_analysis_pipeline().iter_completed(
+                api_user, inputs, API_BATCH_OPTIONS, concurrency, API_BATCH_INSERT_SIZE
+            )
+            return ndjson_response(
+                _stream_batch_results(contexts, batch_id, request, start_time, str(api_user.id)),
+                headers={"X-Batch-Id": batch_id},
+            )
+
+        contexts = await get_analysis_pipeline().run_many(
+            api_user,
+            inputs,
+            API_BATCH_OPTIONS,
+            concurrency=concurrency,
+            insert_batch_size=API_BATCH_INSERT_SIZE,
+        )
         
-        for i, image_request in enumerate(request.images):
-            try:
-                # Validate base64 data
-                image_data = base64.b64decode(image_request.image_base64)
-                
-                # Save image
-                filename = image_request.filename or f"batch_{batch_id}_{i}.jpg"
-                saved_filename, file_path = save_image(image_data, filename, api_user.username)
-                
-                # Analyze image
-                result = test_with_base64_data(image_request.image_base64)
-                
-                if result and not result.get("error"):
-                    # Create analysis record
-                    analysis_record = AnalysisRecord(
-                        user_id=str(api_user.id),
-                        username=api_user.username,
-                        image_filename=saved_filename,
-                        image_path=file_path,
-                        disease_detected=result.get("disease_detected", False),
-                        disease_name=result.get("disease_name"),
-                        disease_type=result.get("disease_type", "unknown"),
-                        severity=result.get("severity", "unknown"),
-                        confidence=result.get("confidence", 0.0),
-                        symptoms=result.get("symptoms", []),
-                        possible_causes=result.get("possible_causes", []),
-                        treatment=result.get("treatment", []),
-                        description=result.get("description", ""),
-                        batch_id=batch_id,
-                        batch_name=request.batch_name,
-                        api_access=True,
-                        metadata=image_request.metadata
-                    )
-                    
-                    # Store in database
-                    analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
-                    insert_result = await analysis_collection.insert_one(analysis_record.dict(by_alias=True))
-                    
-                    results.append(ImageAnalysisResponse(
-                        analysis_id=str(insert_result.inserted_id),
-                        disease_detected=analysis_record.disease_detected,
-                        disease_name=analysis_record.disease_name,
-                        disease_type=analysis_record.disease_type,
-                        severity=analysis_record.severity,
-                        confidence=analysis_record.confidence,
-                        symptoms=analysis_record.symptoms,
-                        possible_causes=analysis_record.possible_causes,
-                        treatment=analysis_record.treatment,
-                        description=analysis_record.description,
-                        analysis_timestamp=analysis_record.analysis_timestamp,
-                        metadata=image_request.metadata
-                    ))
-                    
-                    successful_count += 1
-                else:
-                    failed_count += 1
-                    logger.warning(f"Analysis failed for image {i}: {result.get('error') if result else 'Unknown error'}")
-                    
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"Error processing image {i}: {str(e)}")
+        results = [_analysis_response(ctx) for ctx in contexts if ctx.success]
+        errors = []
+        for ctx in contexts:
+            if not ctx.success:
+                logger.warning(f"Analysis failed for image {ctx.input.index}: {ctx.error}")
+                errors.append({"index": ctx.input.index, "filename": ctx.input.filename, "error": ctx.error})
+        successful_count = len(results)
+        failed_count = len(errors)
         
         processing_time = time() - start_time
         
         logger.info(f"API batch analysis completed: {successful_count} successful, {failed_count} failed")
+        await emit_batch_completed(
+            str(api_user.id), batch_id, request.batch_name, len(request.images), successful_count, failed_count
+        )
         
         return BatchAnalysisResponse(
             batch_id=batch_id,
@@ -379,6 +380,7 @@ async def batch_analyze_images(
             successful_analyses=successful_count,
             failed_analyses=failed_count,
             results=results,
+            errors=errors,
             processing_time_seconds=processing_time,
             metadata=request.metadata
         )
@@ -393,6 +395,174 @@ async def batch_analyze_images(
         )
 
 
+@router.get("/batch/{batch_id}")
+async def get_batch_progress(
+    batch_id: str,
+    api_user: UserInDB = Depends(get_enterprise_api_user)
+):
+    """Progress and results so far of a batch queued with ``?async=true``"""
+    from src.services import batch_jobs
+
+    try:
+        progress = await batch_jobs.get_batch_progress(batch_id, str(api_user.id))
+    except Exception as e:
+        logger.error(f"Error getting batch progress: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get batch progress"
+        )
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found"
+        )
+    return progress
+
+
+@router.get("/batch/{batch_id}/events")
+async def stream_batch_events(
+    batch_id: str,
+    api_user: UserInDB = Depends(get_enterprise_api_user)
+):
+    """
+    Live progress of a batch as Server-Sent Events
+
+    Works for queued batches and for ones running in a ``/batch-analyze``
+    request. Starts with a ``snapshot`` event, then sends an ``image`` event
+    per finished image and ends with ``completed``.
+    """
+    from src.services.batch_progress import progress_hub
+    from src.utils.sse import sse_response
+
+    try:
+        events = await progress_hub.open_stream(batch_id, str(api_user.id))
+    except Exception as e:
+        logger.error(f"Error opening batch event stream: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to open batch event stream"
+        )
+    if events is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found"
+        )
+    return sse_response(events, headers={"X-Batch-Id": batch_id})
+
+
+@router.post("/webhooks")
+async def create_webhook(
+    request: WebhookRequest,
+    api_user: UserInDB = Depends(get_enterprise_api_user),
+    api_key_id: str = Depends(get_api_key_id)
+):
+    """
+    Register a webhook on the calling API key
+
+    The response carries the signing ``secret``; it is not shown again.
+    """
+    from src.services import webhooks
+
+    try:
+        return await webhooks.register_webhook(
+            str(api_user.id), api_key_id, request.url, request.events, request.description
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error registering webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to register webhook"
+        )
+
+
+@router.get("/webhooks")
+async def list_webhooks(
+    api_user: UserInDB = Depends(get_enterprise_api_user),
+    api_key_id: str = Depends(get_api_key_id)
+):
+    """List the calling API key's webhooks"""
+    from src.services import webhooks
+
+    try:
+        return {"webhooks": await webhooks.list_webhooks(api_key_id)}
+    except Exception as e:
+        logger.error(f"Error listing webhooks: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to list webhooks"
+        )
+
+
+@router.delete("/webhooks/{webhook_id}")
+async def delete_webhook(
+    webhook_id: str,
+    api_user: UserInDB = Depends(get_enterprise_api_user),
+    api_key_id: str = Depends(get_api_key_id)
+):
+    """Remove a webhook; deliveries still queued for it are failed"""
+    from src.services import webhooks
+
+    try:
+        await webhooks.delete_webhook(api_key_id, webhook_id)
+        return {"message": "Webhook deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete webhook"
+        )
+
+
+@router.post("/webhooks/{webhook_id}/test")
+async def test_webhook(
+    webhook_id: str,
+    api_user: UserInDB = Depends(get_enterprise_api_user),
+    api_key_id: str = Depends(get_api_key_id)
+):
+    """Queue a signed ``ping`` event for a webhook"""
+    from src.services import webhooks
+
+    try:
+        webhook = await webhooks.get_webhook(api_key_id, webhook_id)
+        return {"delivery_id": await webhooks.send_ping(webhook)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error testing webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to test webhook"
+        )
+
+
+@router.get("/webhooks/{webhook_id}/deliveries")
+async def list_webhook_deliveries(
+    webhook_id: str,
+    delivery_status: Optional[str] = Query(None, alias="status", description="pending, delivering, delivered or failed"),
+    limit: int = Query(50, ge=1, le=200),
+    api_user: UserInDB = Depends(get_enterprise_api_user),
+    api_key_id: str = Depends(get_api_key_id)
+):
+    """Recent deliveries of a webhook with each attempt's status code, latency and error"""
+    from src.services import webhooks
+
+    try:
+        await webhooks.get_webhook(api_key_id, webhook_id)
+        return {"deliveries": await webhooks.list_deliveries(webhook_id, delivery_status, limit)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing webhook deliveries: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to list webhook deliveries"
+        )
+
+
 @router.get("/analyses")
 async def get_analyses(
     limit: int = 50,
@@ -0,0 +1,874 @@
+"""
+Analysis Pipeline
+=================
+
+The disease-analysis flow shared by every detection entry point (web upload,
+programmatic API, enterprise bulk analysis):
+
+    quota_check -> read -> pre-processors -> budget_check -> save -> base64 ->
+    model (+ features) -> usage_tracking -> enrichment -> post-processors ->
+    insert -> increment_usage -> prescription
+
+With ``cpu_offload`` the base64 and features work runs as one ``preprocess``
+stage in the CPU process pool (src/utils/cpu_pool.py) before the model call.
+
+Routes build an ``AnalysisInput``, choose ``PipelineOptions`` and shape the
+response; timing, per-stage concurrency limits, cost budgets and similar-case
+indexing are handled here once.
+
+Model calls are admitted by the fair scheduler (src/services/model_scheduler.py):
+per-tenant queues weighted by plan, with single-image requests in a separate
+``interactive`` lane ahead of ``batch`` work.
+
+Batch routes use ``iter_completed`` (or ``run_many``): a bounded number of
+images are analysed at once, each is handed back as soon as it finishes, and
+their records can be written with ``insert_many`` in chunks. While an image's
+bytes are in memory it holds a share of the process-wide upload memory
+budget (src/utils/memory_budget.py).
+
+Extension points:
+    - pre-processors run after the image is read and may reject it (raise
+      HTTPException) or short-circuit the model call by setting ``ctx.result``
+    - post-processors run after the model and enrichment, before the record
+      is stored, and may adjust ``ctx.result``
+    - stage hooks are called with (stage name, context, seconds) after every
+      stage, in addition to the ``stage.<name>`` metrics timers
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sized,
+    TypeVar,
+    Union,
+)
+
+from fastapi import HTTPException, UploadFile, status
+
+from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+from src.database.models import AnalysisRecord, UserInDB, YouTubeVideo
+from src.image_utils import test_with_base64_data
+from src.services.batch_progress import progress_hub
+from src.services.budget_service import BudgetReservation, CostBudgetService
+from src.services.model_scheduler import INTERACTIVE, ModelScheduler
+from src.services.similarity_service import compute_feature_vector, get_similarity_index
+from src.storage.image_storage import StoredImage, read_image, resolve_image, save_image
+from src.utils.cpu_pool import get_cpu_pool
+from src.utils.memory_budget import MemoryReservation, get_memory_budget
+from src.utils.metrics import stage
+from src.utils.token_estimator import (
+    DEFAULT_MODEL,
+    TokenEstimate,
+    estimate_analysis_tokens,
+    usage_cost,
+)
+from src.utils.uploads import (
+    base64_length,
+    check_size,
+    encode_data_url,
+    get_upload_limit_mb,
+    read_upload,
+)
+from src.utils.usage_tracker import track_groq_usage, track_perplexity_usage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Default concurrency limits per stage (stages not listed are unbounded); the
+# model stage's slots are shared out by the fair scheduler
+DEFAULT_STAGE_CONCURRENCY = {
+    "model": int(os.getenv("PIPELINE_MODEL_CONCURRENCY", "8")),
+}
+
+# Longest a stored record waits for the rest of its insert_many chunk
+INSERT_MAX_WAIT_SECONDS = float(os.getenv("PIPELINE_INSERT_MAX_WAIT_MS", "250")) / 1000
+
+
+@dataclass
+class PipelineOptions:
+    """Per-entry-point behaviour of the pipeline"""
+
+    endpoint: str = "disease-detection"
+    check_quota: bool = False
+    increment_usage: bool = False
+    enrich: bool = False
+    generate_prescription: bool = False
+    api_access: bool = False
+    max_image_size_mb: Optional[int] = None
+    track_usage: bool = True
+    compute_features: bool = True
+    # Run hashing/embedding/base64 in the CPU process pool (batch endpoints)
+    cpu_offload: bool = False
+    # Raise analysis.completed webhook events (enterprise and API entry points)
+    webhooks: bool = False
+    # Scheduler lane for the model call: "interactive" or "batch"
+    traffic_class: str = INTERACTIVE
+
+
+@dataclass
+class AnalysisInput:
+    """One image to analyse, as bytes, an upload, a base64 string or a stored image"""
+
+    filename: str
+    contents: Optional[bytes] = None
+    upload: Optional[UploadFile] = None
+    base64_data: Optional[str] = None
+    # Already in image storage (queued batches): read from there, not saved again
+    stored: Optional[StoredImage] = None
+    # Content hash of ``contents``, if the caller already computed it
+    sha256: Optional[str] = None
+    metadata: Optional[dict] = None
+    batch_id: Optional[str] = None
+    batch_name: Optional[str] = None
+    index: int = 0
+    # Reservation of the request body ``base64_data`` came in; the image's
+    # memory is taken out of it instead of being reserved again
+    body_memory: Optional[MemoryReservation] = field(default=None, repr=False)
+
+
+@dataclass
+class AnalysisContext:
+    """State of one image as it moves through the pipeline"""
+
+    user: UserInDB
+    input: AnalysisInput
+    options: PipelineOptions
+    contents: Optional[bytes] = None
+    # Upload memory budget held while the image's bytes are in memory
+    memory: Optional[MemoryReservation] = field(default=None, repr=False)
+    filename: Optional[str] = None
+    file_path: Optional[str] = None
+    # Model input: data URL, or raw base64 as supplied by the client
+    image_url: Optional[str] = None
+    sha256: Optional[str] = None
+    token_estimate: Optional[TokenEstimate] = None
+    reservation: Optional[BudgetReservation] = None
+    model_called: bool = False
+    result: Optional[Dict[str, Any]] = None
+    feature_vector: Optional[List[float]] = None
+    youtube_videos: List[YouTubeVideo] = field(default_factory=list)
+    record: Optional[AnalysisRecord] = None
+    # Handed to a RecordBatcher (which then stops expecting it once written)
+    record_queued: bool = False
+    analysis_id: Optional[str] = None
+    prescription_id: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+    status_code: int = 200
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and self.analysis_id is not None
+
+
+StageHook = Callable[[str, AnalysisContext, float], None]
+Processor = Callable[[AnalysisContext], Awaitable[None]]
+
+
+class AnalysisPipeline:
+    """Staged disease-analysis pipeline with hooks and per-stage limits"""
+
+    def __init__(
+        self,
+        stage_concurrency: Optional[Dict[str, int]] = None,
+        pre_processors: Optional[List[Processor]] = None,
+        post_processors: Optional[List[Processor]] = None,
+        stage_hooks: Optional[List[StageHook]] = None,
+    ):
+        self.stage_concurrency = {**DEFAULT_STAGE_CONCURRENCY, **(stage_concurrency or {})}
+        self.pre_processors: List[Processor] = list(pre_processors or [])
+        self.post_processors: List[Processor] = list(post_processors or [])
+        self.stage_hooks: List[StageHook] = list(stage_hooks or [])
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._scheduler: Optional[ModelScheduler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add_pre_processor(self, processor: Processor) -> None:
+        self.pre_processors.append(processor)
+
+    def add_post_processor(self, processor: Processor) -> None:
+        self.post_processors.append(processor)
+
+    def add_stage_hook(self, hook: StageHook) -> None:
+        self.stage_hooks.append(hook)
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Semaphores and the scheduler belong to one event loop
+            self._loop = loop
+            self._semaphores = {}
+            self._scheduler = None
+
+    def _semaphore(self, name: str) -> Optional[asyncio.Semaphore]:
+        limit = self.stage_concurrency.get(name)
+        if not limit:
+            return None
+        self._bind_loop()
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(limit)
+        return self._semaphores[name]
+
+    @property
+    def scheduler(self) -> Optional[ModelScheduler]:
+        """Scheduler of the model stage's slots (None when the stage is unbounded)"""
+        limit = self.stage_concurrency.get("model")
+        if not limit:
+            return None
+        self._bind_loop()
+        if self._scheduler is None:
+            self._scheduler = ModelScheduler(limit)
+        return self._scheduler
+
+    def model_slot(self, tenant: str, traffic_class: str = INTERACTIVE):
+        """Hold one model call slot, fairly scheduled (for model calls outside the pipeline)"""
+        scheduler = self.scheduler
+        return scheduler.slot(tenant, traffic_class) if scheduler is not None else nullcontext()
+
+    def _gate(self, name: str, ctx: AnalysisContext):
+        if name == "model":
+            return self.model_slot(str(ctx.user.id), ctx.options.traffic_class)
+        semaphore = self._semaphore(name)
+        return semaphore if semaphore is not None else nullcontext()
+
+    @asynccontextmanager
+    async def _stage(self, name: str, ctx: AnalysisContext):
+        """Run a stage under its concurrency limit, timing it once admitted"""
+        start = None
+        try:
+            async with self._gate(name, ctx):
+                start = time.perf_counter()
+                with stage(name):
+                    yield
+        finally:
+            if start is not None:
+                elapsed = time.perf_counter() - start
+                ctx.timings[name] = elapsed
+                for hook in self.stage_hooks:
+                    try:
+                        hook(name, ctx, elapsed)
+                    except Exception as e:
+                        logger.error(f"Stage hook failed for {name}: {str(e)}")
+
+    async def run(
+        self, user: UserInDB, analysis_input: AnalysisInput, options: PipelineOptions
+    ) -> AnalysisContext:
+        """
+        Analyse one image
+
+        Raises:
+            HTTPException: on quota/budget rejection, invalid input or model failure
+        """
+        ctx = AnalysisContext(user=user, input=analysis_input, options=options)
+        await self._execute(ctx)
+        return ctx
+
+    async def load(
+        self, user: UserInDB, analysis_input: AnalysisInput, options: PipelineOptions
+    ) -> bytes:
+        """
+        Read an input's bytes under the plan's size limit, without analysing it
+
+        Raises:
+            HTTPException: if the image is too large, empty or invalid base64
+        """
+        ctx = AnalysisContext(user=user, input=analysis_input, options=options)
+        try:
+            async with self._stage("read", ctx):
+                await self._read(ctx)
+        finally:
+            # The caller only keeps the bytes briefly (to store them)
+            if ctx.memory is not None:
+                ctx.memory.release()
+        return ctx.contents
+
+    async def run_many(
+        self,
+        user: UserInDB,
+        inputs: List[AnalysisInput],
+        options: PipelineOptions,
+        concurrency: int = 1,
+        insert_batch_size: int = 1,
+    ) -> List[AnalysisContext]:
+        """
+        Analyse several images with bounded concurrency
+
+        Failures are isolated per image (recorded on ``ctx.error``); results
+        keep the order of ``inputs``.
+        """
+        position = {id(item): i for i, item in enumerate(inputs)}
+        contexts = [
+            ctx
+            async for ctx in self.iter_completed(
+                user, inputs, options, concurrency, insert_batch_size
+            )
+        ]
+        return sorted(contexts, key=lambda ctx: position[id(ctx.input)])
+
+    async def iter_completed(
+        self,
+        user: UserInDB,
+        inputs: Union[Iterable[AnalysisInput], AsyncIterable[AnalysisInput]],
+        options: PipelineOptions,
+        concurrency: int = 1,
+        insert_batch_size: int = 1,
+    ) -> AsyncIterator[AnalysisContext]:
+        """
+        Analyse several images with bounded concurrency, yielding each as it finishes
+
+        At most ``concurrency`` images are read and analysed at a time. With
+        ``insert_batch_size`` > 1 their records are written with
+        ``insert_many`` in chunks of that size (see ``RecordBatcher``).
+        Failures are isolated per image (recorded on ``ctx.error``). Inputs
+        with a ``batch_id`` are reported to the batch's progress subscribers
+        (src/services/batch_progress.py) as they finish.
+
+        ``inputs`` may be an async iterable (e.g. entries read from an
+        archive), which is only advanced when there is room for another
+        image. New images are only started while the caller keeps
+        consuming: no more than ``concurrency + insert_batch_size`` images
+        are in progress or finished but not yet taken, so a slow reader (e.g.
+        a streaming response) holds memory flat. Image bytes and data URLs
+        are dropped, and their share of the upload memory budget released,
+        once the record is stored. Closing the iterator early cancels the images
+        in progress.
+        """
+        gate = asyncio.Semaphore(max(1, concurrency))
+        records = RecordBatcher(insert_batch_size) if insert_batch_size > 1 else None
+        window = max(1, concurrency) + max(1, insert_batch_size)
+
+        async def run_one(ctx: AnalysisContext) -> AnalysisContext:
+            try:
+                # Only reading and analysing hold a slot; waiting for a chunk to be written does not
+                async with gate:
+                    await self._analyse(ctx)
+                await self._store(ctx, records)
+                await self._finish(ctx)
+            except HTTPException as e:
+                ctx.error = str(e.detail)
+                ctx.status_code = e.status_code
+            except Exception as e:
+                logger.error(f"Error processing image {ctx.input.index}: {str(e)}")
+                ctx.error = str(e)
+                ctx.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            finally:
+                self._drop_image(ctx)
+                if records is not None:
+                    records.discard(ctx)
+            if ctx.input.batch_id:
+                progress_hub.image_finished(
+                    ctx.input.batch_id,
+                    {
+                        "index": ctx.input.index,
+                        "filename": ctx.input.filename,
+                        "success": ctx.success,
+                        "analysis_id": ctx.analysis_id,
+                        "error": ctx.error,
+                    },
+                )
+            return ctx
+
+        source = _aiter(inputs)
+        exhausted = False
+        admitted = 0
+        batch_id: Optional[str] = None
+        running: set = set()
+
+        async def admit() -> None:
+            nonlocal exhausted, admitted, batch_id
+            while not exhausted and len(running) < window:
+                try:
+                    item = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    if records is not None:
+                        records.close()
+                    if batch_id is not None:
+                        progress_hub.set_total(batch_id, admitted)
+                    return
+                if records is not None:
+                    records.expect()
+                if admitted == 0 and item.batch_id:
+                    batch_id = item.batch_id
+                    total = len(inputs) if isinstance(inputs, Sized) else None
+                    progress_hub.begin(batch_id, str(user.id), item.batch_name, total)
+                admitted += 1
+                ctx = AnalysisContext(user=user, input=item, options=options)
+                running.add(asyncio.create_task(run_one(ctx)))
+
+        completed = False
+        try:
+            await admit()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    running.discard(task)
+                    yield task.result()
+                await admit()
+            completed = True
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            if batch_id is not None:
+                progress_hub.finish(batch_id, "completed" if completed else "cancelled")
+
+    async def _execute(self, ctx: AnalysisContext) -> None:
+        try:
+            await self._analyse(ctx)
+            await self._store(ctx)
+            await self._finish(ctx)
+        finally:
+            self._drop_image(ctx)
+
+    def _drop_image(self, ctx: AnalysisContext) -> None:
+        """Let go of the image's bytes and data URL and release their memory reservation"""
+        ctx.contents = None
+        ctx.image_url = None
+        if ctx.memory is not None:
+            ctx.memory.release()
+
+    async def _reserve_memory(self, ctx: AnalysisContext, size: int) -> None:
+        # The bytes, plus the data URL built from them unless the client sent base64
+        nbytes = size if ctx.input.base64_data is not None else size + base64_length(size)
+        if ctx.input.body_memory is not None:
+            ctx.memory = ctx.input.body_memory.split(nbytes)
+            if ctx.memory is not None:
+                return
+        ctx.memory = await get_memory_budget().reserve(nbytes)
+
+    async def _analyse(self, ctx: AnalysisContext) -> None:
+        """Everything up to the record: read, checks, save, model and enrichment"""
+        options = ctx.options
+
+        if options.check_quota:
+            async with self._stage("quota_check", ctx):
+                await self._check_quota(ctx)
+
+        async with self._stage("read", ctx):
+            await self._read(ctx)
+
+        for processor in self.pre_processors:
+            await processor(ctx)
+
+        if ctx.result is None:
+            async with self._stage("budget_check", ctx):
+                ctx.token_estimate = estimate_analysis_tokens(ctx.contents)
+                ctx.reservation = await CostBudgetService.reserve(
+                    str(ctx.user.id), ctx.token_estimate.estimated_cost_usd
+                )
+
+        features_task = None
+        try:
+            try:
+                if ctx.input.stored is not None:
+                    ctx.filename, ctx.file_path, ctx.sha256 = ctx.input.stored
+                else:
+                    async with self._stage("save", ctx):
+                        ctx.filename, ctx.file_path, ctx.sha256 = await save_image(
+                            ctx.contents, ctx.input.filename, ctx.user.username, sha256=ctx.sha256
+                        )
+
+                if options.cpu_offload and ctx.result is None:
+                    async with self._stage("preprocess", ctx):
+                        preprocessed = await get_cpu_pool().preprocess(
+                            ctx.contents,
+                            compute_features=options.compute_features,
+                            encode=ctx.input.base64_data is None,
+                        )
+                    ctx.image_url = ctx.input.base64_data or preprocessed.data_url
+                    ctx.sha256 = preprocessed.sha256
+                    ctx.feature_vector = preprocessed.feature_vector
+                elif options.compute_features:
+                    # Embedding for similar-case search runs alongside the model call
+                    features_task = asyncio.create_task(
+                        asyncio.to_thread(compute_feature_vector, ctx.contents)
+                    )
+
+                if ctx.result is None and ctx.image_url is None:
+                    async with self._stage("base64", ctx):
+                        ctx.image_url = ctx.input.base64_data or encode_data_url(ctx.contents)
+                if ctx.result is None:
+                    async with self._stage("model", ctx):
+                        ctx.model_called = True
+                        ctx.result = await asyncio.to_thread(test_with_base64_data, ctx.image_url)
+            except BaseException:
+                await CostBudgetService.release(ctx.reservation)
+                raise
+
+            if ctx.model_called:
+                await self._account_model_call(ctx)
+
+            result = ctx.result
+            if result is None or (isinstance(result, dict) and result.get("error")):
+                error_detail = (
+                    result.get("error", "Failed to process image")
+                    if isinstance(result, dict)
+                    else "Failed to process image"
+                )
+                logger.error(f"Disease detection failed: {error_detail}")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error_detail
+                )
+
+            if options.enrich:
+                async with self._stage("enrichment", ctx):
+                    await self._enrich(ctx)
+
+            for processor in self.post_processors:
+                await processor(ctx)
+
+            if features_task is not None:
+                async with self._stage("features", ctx):
+                    ctx.feature_vector = await features_task
+        finally:
+            # Not awaited when the model call or anything after it failed
+            if features_task is not None and not features_task.done():
+                features_task.cancel()
+
+    async def _store(self, ctx: AnalysisContext, records: Optional["RecordBatcher"] = None) -> None:
+        async with self._stage("insert", ctx):
+            self._build_record(ctx)
+            analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+            if records is None:
+                insert_result = await analysis_collection.insert_one(ctx.record.dict(by_alias=True))
+                ctx.analysis_id = str(insert_result.inserted_id)
+            else:
+                await records.insert(ctx)
+        logger.info(f"Analysis record saved with ID: {ctx.analysis_id}")
+
+        similarity_index = get_similarity_index()
+        if similarity_index is not None and ctx.feature_vector:
+            similarity_index.add(ctx.analysis_id, str(ctx.user.id), ctx.feature_vector)
+
+    async def _finish(self, ctx: AnalysisContext) -> None:
+        """Usage counting and prescription once the record is stored"""
+        options = ctx.options
+        if options.increment_usage:
+            from src.services.subscription_service import SubscriptionService
+
+            try:
+                async with self._stage("increment_usage", ctx):
+                    await SubscriptionService.increment_usage(str(ctx.user.id))
+            except Exception as e:
+                logger.error(f"Failed to increment usage count: {str(e)}")
+                # Continue - don't fail the analysis for usage tracking issues
+
+        if (
+            options.generate_prescription
+            and ctx.record.disease_detected
+            and ctx.record.disease_name
+        ):
+            try:
+                async with self._stage("prescription", ctx):
+                    await self._generate_prescription(ctx)
+            except Exception as e:
+                logger.error(f"Failed to generate prescription: {str(e)}")
+                # Continue without prescription - not critical
+
+        if options.webhooks:
+            from src.services.webhooks import emit_analysis_completed
+
+            async with self._stage("webhooks", ctx):
+                await emit_analysis_completed(ctx)
+
+    async def _check_quota(self, ctx: AnalysisContext) -> None:
+        from src.services.subscription_service import SubscriptionService
+
+        user_id = str(ctx.user.id)
+        if await SubscriptionService.check_usage_limit(user_id):
+            return
+
+        usage_quota = await SubscriptionService.get_user_usage_quota(user_id)
+        if usage_quota:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=(
+                    "Monthly analysis limit reached "
+                    f"({usage_quota.analyses_used}/{usage_quota.analyses_limit}). "
+                    "Please upgrade your plan."
+                ),
+            )
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Monthly analysis limit reached. Please upgrade your plan.",
+        )
+
+    async def _read(self, ctx: AnalysisContext) -> None:
+        """Load the image, enforcing the plan's size limit before reading it all"""
+        item = ctx.input
+        limit_mb = await get_upload_limit_mb(str(ctx.user.id))
+        if ctx.options.max_image_size_mb:
+            limit_mb = min(limit_mb, ctx.options.max_image_size_mb)
+        limit_bytes = limit_mb * 1024 * 1024
+
+        # Wait for room in the upload memory budget before reading, when the size is known
+        expected = _expected_size(item)
+        if expected is not None:
+            check_size(expected, limit_bytes)
+            await self._reserve_memory(ctx, expected)
+
+        if item.contents is not None:
+            check_size(len(item.contents), limit_bytes)
+            ctx.contents = item.contents
+            ctx.sha256 = item.sha256
+        elif item.upload is not None:
+            ctx.contents = await read_upload(item.upload, limit_bytes)
+        elif item.base64_data is not None:
+            check_size(len(item.base64_data) * 3 // 4, limit_bytes)
+            try:
+                ctx.contents = base64.b64decode(item.base64_data)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid base64 image data"
+                )
+        elif item.stored is not None:
+            location = await resolve_image(ctx.user.username, item.stored.filename)
+            if location is None:
+                raise HTTPException(
+                    status_code=status.HTTP_410_GONE, detail="Stored image no longer exists"
+                )
+            ctx.contents = await read_image(location)
+            ctx.sha256 = item.stored.sha256
+
+        if not ctx.contents:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file provided"
+            )
+        if ctx.memory is None:
+            await self._reserve_memory(ctx, len(ctx.contents))
+        logger.info(f"File size: {len(ctx.contents)} bytes")
+
+    async def _account_model_call(self, ctx: AnalysisContext) -> None:
+        """Settle the budget reservation and record token usage"""
+        token_usage = (ctx.result or {}).get("token_usage") or {}
+        estimate = ctx.token_estimate
+        await CostBudgetService.settle(ctx.reservation, usage_cost(token_usage, estimate))
+
+        if ctx.options.track_usage:
+            async with self._stage("usage_tracking", ctx):
+                await track_groq_usage(
+                    user_id=str(ctx.user.id),
+                    username=ctx.user.username,
+                    model=DEFAULT_MODEL,
+                    tokens_used=token_usage.get("total_tokens", estimate.total_tokens),
+                    input_tokens=token_usage.get("prompt_tokens", estimate.prompt_tokens),
+                    output_tokens=token_usage.get("completion_tokens", estimate.completion_tokens),
+                    success=ctx.result is not None and not ctx.result.get("error"),
+                    endpoint=ctx.options.endpoint,
+                )
+
+    async def _enrich(self, ctx: AnalysisContext) -> None:
+        """Fetch YouTube video recommendations (never fails the analysis)"""
+        from src.services.perplexity_service import get_perplexity_service
+
+        result = ctx.result
+        try:
+            perplexity = get_perplexity_service()
+
+            if result.get("disease_detected") and result.get("disease_name"):
+                logger.info(f"Fetching treatment videos for: {result.get('disease_name')}")
+                ctx.youtube_videos = perplexity.get_treatment_videos(
+                    disease_name=result.get("disease_name"),
+                    disease_type=result.get("disease_type", "unknown"),
+                    max_videos=3,
+                )
+                tokens_used = 1000  # Estimate
+            elif (
+                not result.get("disease_detected") and result.get("disease_type") != "invalid_image"
+            ):
+                logger.info("Plant is healthy - fetching plant care videos")
+                ctx.youtube_videos = perplexity.get_general_plant_care_videos(max_videos=3)
+                tokens_used = 800  # Estimate
+            else:
+                return
+
+            logger.info(f"Fetched {len(ctx.youtube_videos)} videos")
+            await track_perplexity_usage(
+                user_id=str(ctx.user.id),
+                username=ctx.user.username,
+                model="sonar",
+                tokens_used=tokens_used,
+                success=len(ctx.youtube_videos) > 0,
+            )
+        except Exception as e:
+            logger.error(f"Failed to fetch YouTube videos: {str(e)}", exc_info=True)
+            # Continue without videos - not critical
+
+    def _build_record(self, ctx: AnalysisContext) -> None:
+        result = ctx.result
+        ctx.record = AnalysisRecord(
+            user_id=str(ctx.user.id),
+            username=ctx.user.username,
+            image_filename=ctx.filename,
+            image_path=ctx.file_path,
+            image_sha256=ctx.sha256,
+            disease_detected=result.get("disease_detected", False),
+            disease_name=result.get("disease_name"),
+            original_disease_name=result.get("original_disease_name"),
+            disease_type=result.get("disease_type", "unknown"),
+            severity=result.get("severity", "unknown"),
+            confidence=result.get("confidence", 0.0),
+            symptoms=result.get("symptoms", []),
+            possible_causes=result.get("possible_causes", []),
+            treatment=result.get("treatment", []),
+            description=result.get("description", ""),
+            youtube_videos=ctx.youtube_videos,
+            batch_id=ctx.input.batch_id,
+            batch_name=ctx.input.batch_name,
+            api_access=ctx.options.api_access,
+            metadata=ctx.input.metadata,
+            feature_vector=ctx.feature_vector,
+        )
+
+    async def _generate_prescription(self, ctx: AnalysisContext) -> None:
+        from src.services.prescription_service import PrescriptionService
+
+        record = ctx.record
+        prescription = await PrescriptionService.generate_prescription(
+            user_id=str(ctx.user.id),
+            username=ctx.user.username,
+            analysis_id=ctx.analysis_id,
+            disease_name=record.disease_name,
+            disease_type=record.disease_type,
+            severity=record.severity,
+            confidence=record.confidence,
+        )
+        ctx.prescription_id = prescription.prescription_id
+        logger.info(f"Generated prescription: {ctx.prescription_id}")
+
+
+class RecordBatcher:
+    """
+    Writes the analysis records of one batch with ``insert_many``
+
+    A chunk is written once it holds ``size`` records, once the batch has
+    no more images to start and every image still outstanding is waiting
+    in it, or ``max_wait`` seconds after its first record arrived,
+    whichever comes first. Record ids are assigned client-side, so each
+    image learns its id (or its own write error) when its chunk is written.
+    """
+
+    def __init__(self, size: int, max_wait: Optional[float] = None):
+        self.size = size
+        self.max_wait = INSERT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        # Started images that may still add a record
+        self._outstanding = 0
+        self._closed = False
+        self._chunk: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: set = set()
+
+    def expect(self) -> None:
+        """Another image was started"""
+        self._outstanding += 1
+
+    def close(self) -> None:
+        """No more images will be started"""
+        self._closed = True
+        self._flush_if_complete()
+
+    def _flush_if_complete(self) -> None:
+        if self._chunk and (
+            len(self._chunk) >= self.size
+            or (self._closed and len(self._chunk) >= self._outstanding)
+        ):
+            self._flush()
+
+    async def insert(self, ctx: AnalysisContext) -> None:
+        """Queue ``ctx.record`` and wait until its chunk is written"""
+        future = asyncio.get_running_loop().create_future()
+        ctx.record_queued = True
+        self._chunk.append((ctx, future))
+        self._flush_if_complete()
+        if self._chunk and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        ctx.analysis_id = await future
+
+    def discard(self, ctx: AnalysisContext) -> None:
+        """An image is finished; if it never queued a record, stop waiting for one"""
+        if ctx.record_queued:
+            return
+        self._outstanding -= 1
+        self._flush_if_complete()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        self._outstanding -= len(chunk)
+        task = asyncio.create_task(self._write(chunk))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, chunk: List[tuple]) -> None:
+        from pymongo.errors import BulkWriteError
+
+        failed: Dict[int, Exception] = {}
+        try:
+            with stage("insert_many"):
+                await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_many(
+                    [ctx.record.dict(by_alias=True) for ctx, _ in chunk], ordered=False
+                )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = Exception(error.get("errmsg", "Failed to store analysis"))
+        except Exception as e:
+            failed = {i: e for i in range(len(chunk))}
+
+        for i, (ctx, future) in enumerate(chunk):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(str(ctx.record.id))
+
+
+def _expected_size(item: AnalysisInput) -> Optional[int]:
+    """Size of an input's bytes before reading them, if known"""
+    if item.contents is not None:
+        return len(item.contents)
+    if item.upload is not None:
+        return item.upload.size
+    if item.base64_data is not None:
+        return len(item.base64_data) * 3 // 4
+    return None
+
+
+async def _aiter(items: Union[Iterable[T], AsyncIterable[T]]) -> AsyncIterator[T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+_pipeline: Optional[AnalysisPipeline] = None
+
+
+def get_analysis_pipeline() -> AnalysisPipeline:
+    """Process-wide pipeline used by all detection routes"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = AnalysisPipeline()
+    return _pipeline
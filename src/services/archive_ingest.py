@@ -0,0 +1,399 @@
+"""
+Archive Ingestion
+=================
+
+Bulk analysis of a single ZIP or tar upload
+(``POST /api/enterprise/bulk-analysis/archive``), for batches too large to
+send as 100-file multipart requests or base64 JSON.
+
+- The upload is spooled to a temporary file by Starlette and read one entry
+  at a time, never extracted as a whole: ZIP through its central directory,
+  tar (plain, gzip, bzip2 or xz) as a stream.
+- Every entry is read in chunks, hashed as it arrives and checked: regular
+  file, within the plan's image size limit, and a JPEG, PNG or WebP
+  signature. Folders and metadata files (``__MACOSX/``, ``._*``,
+  ``.DS_Store``) are skipped silently; other rejected entries, and images
+  repeated within the archive, are reported with the results.
+- Images go into the analysis pipeline as they are read. The reader only
+  runs a few images ahead of the analysis, so memory stays flat.
+- Uncompressed bytes are counted as they are read, not taken from the
+  archive's own headers, and ingestion stops at ``ARCHIVE_MAX_TOTAL_MB``
+  (or ``ARCHIVE_MAX_ENTRIES`` images); the images read until then are still
+  analysed and the summary says the archive was truncated.
+
+Configuration (environment):
+    ARCHIVE_MAX_TOTAL_MB  uncompressed size cap per archive (default 2048)
+    ARCHIVE_MAX_ENTRIES   images per archive (default 10000)
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import IO, Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from src.database.models import UserInDB
+from src.services.analysis_pipeline import (
+    AnalysisContext,
+    AnalysisInput,
+    PipelineOptions,
+    get_analysis_pipeline,
+)
+from src.utils.metrics import metrics
+from src.utils.uploads import ARCHIVE_MAX_TOTAL_MB, get_upload_limit_mb
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MAX_TOTAL_BYTES = ARCHIVE_MAX_TOTAL_MB * 1024 * 1024
+ARCHIVE_MAX_ENTRIES = int(os.getenv("ARCHIVE_MAX_ENTRIES", "10000"))
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Leading bytes of JPEG and PNG; WebP is checked in is_image
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+
+SKIPPED_NAMES = (".DS_Store", "Thumbs.db", "desktop.ini")
+
+
+class ArchiveError(Exception):
+    """The archive cannot be read (any further)"""
+
+
+@dataclass
+class ArchiveEntry:
+    """One file read from an archive"""
+
+    index: int
+    name: str
+    size: int = 0
+    contents: Optional[bytes] = None
+    sha256: Optional[str] = None
+    error: Optional[str] = None
+    status_code: int = status.HTTP_200_OK
+
+
+@dataclass
+class ArchiveReport:
+    """Running totals of an ingestion, for the summary"""
+
+    entries: int = 0
+    uncompressed_bytes: int = 0
+    skipped: int = 0
+    truncated: bool = False
+    error: Optional[str] = None
+    # Entries that never reach the pipeline, reported with the results
+    rejected: Deque[Dict[str, Any]] = field(default_factory=deque)
+
+
+def is_image(head: bytes) -> bool:
+    """Whether the bytes start with a JPEG, PNG or WebP signature"""
+    return head.startswith(IMAGE_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+def _ignored(name: str) -> bool:
+    """Folders' metadata and OS clutter that is skipped without a report"""
+    base = posixpath.basename(name.rstrip("/"))
+    return (
+        name.startswith("__MACOSX/")
+        or "/__MACOSX/" in name
+        or base.startswith("._")
+        or base in SKIPPED_NAMES
+    )
+
+
+class ArchiveReader:
+    """
+    Reads a ZIP or tar archive one entry at a time
+
+    Blocking (file I/O and decompression); ``iter_archive`` runs each step
+    in a thread.
+    """
+
+    def __init__(
+        self,
+        fileobj: IO[bytes],
+        max_entry_bytes: int,
+        max_total_bytes: int = ARCHIVE_MAX_TOTAL_BYTES,
+    ):
+        self.fileobj = fileobj
+        self.max_entry_bytes = max_entry_bytes
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+        self._entries: Optional[Iterator[Optional[ArchiveEntry]]] = None
+        self._index = 0
+
+    def _open(self) -> Iterator[Optional[ArchiveEntry]]:
+        """Detect the format and start reading; raises ArchiveError up front"""
+        self.fileobj.seek(0)
+        head = self.fileobj.read(4)
+        self.fileobj.seek(0)
+        if head in (b"PK\x03\x04", b"PK\x05\x06"):
+            try:
+                archive = zipfile.ZipFile(self.fileobj)
+            except (zipfile.BadZipFile, OSError) as e:
+                raise ArchiveError(f"Archive is damaged: {e}")
+            declared = sum(info.file_size for info in archive.infolist() if not info.is_dir())
+            if declared > self.max_total_bytes:
+                archive.close()
+                raise ArchiveError(
+                    f"Archive exceeds {self.max_total_bytes // (1024 * 1024)}MB uncompressed"
+                )
+            return self._zip_entries(archive)
+        try:
+            archive = tarfile.open(fileobj=self.fileobj, mode="r|*")
+        except (tarfile.TarError, EOFError, OSError, zlib.error):
+            raise ArchiveError("Unsupported archive format (expected ZIP or tar)")
+        return self._tar_entries(archive)
+
+    def next_entry(self) -> Optional[ArchiveEntry]:
+        """The next file of the archive (None at the end)"""
+        if self._entries is None:
+            self._entries = self._open()
+        while True:
+            try:
+                entry = next(self._entries)
+            except StopIteration:
+                return None
+            except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+                raise ArchiveError(f"Archive is damaged: {e}")
+            if entry is not None:
+                return entry
+
+    def _entry(self, name: str, size: int) -> ArchiveEntry:
+        entry = ArchiveEntry(index=self._index, name=name, size=size)
+        self._index += 1
+        return entry
+
+    def _count(self, size: int) -> None:
+        self.total_bytes += size
+        if self.total_bytes > self.max_total_bytes:
+            raise ArchiveError(
+                f"Archive exceeds {self.max_total_bytes // (1024 * 1024)}MB uncompressed"
+            )
+
+    def _read(self, entry: ArchiveEntry, stream: IO[bytes], count_reads: bool) -> ArchiveEntry:
+        """Read an entry in chunks, hashing it and enforcing the size limits"""
+        digest = hashlib.sha256()
+        chunks: List[bytes] = []
+        size = 0
+        while True:
+            chunk = stream.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if count_reads:
+                self._count(len(chunk))
+            if size > self.max_entry_bytes:
+                return self._reject_size(entry)
+            digest.update(chunk)
+            chunks.append(chunk)
+        contents = b"".join(chunks)
+        entry.size = size
+        if not is_image(contents[:12]):
+            entry.error = "Not a JPEG, PNG or WebP image"
+            entry.status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            return entry
+        entry.contents = contents
+        entry.sha256 = digest.hexdigest()
+        return entry
+
+    def _reject_size(self, entry: ArchiveEntry) -> ArchiveEntry:
+        entry.error = f"File size exceeds {self.max_entry_bytes // (1024 * 1024)}MB limit"
+        entry.status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        return entry
+
+    def _zip_entries(self, archive: zipfile.ZipFile) -> Iterator[Optional[ArchiveEntry]]:
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir() or _ignored(info.filename):
+                    yield None
+                    continue
+                entry = self._entry(info.filename, info.file_size)
+                if info.file_size > self.max_entry_bytes:
+                    yield self._reject_size(entry)
+                    continue
+                try:
+                    with archive.open(info) as stream:
+                        # Decompressed bytes are counted: declared sizes can lie
+                        yield self._read(entry, stream, count_reads=True)
+                except ArchiveError:
+                    raise
+                except RuntimeError:
+                    entry.error = "Encrypted entries are not supported"
+                    entry.status_code = status.HTTP_400_BAD_REQUEST
+                    yield entry
+                except (
+                    zipfile.BadZipFile,
+                    zlib.error,
+                    EOFError,
+                    OSError,
+                    NotImplementedError,
+                ) as e:
+                    entry.error = f"Entry is damaged: {e}"
+                    entry.status_code = status.HTTP_400_BAD_REQUEST
+                    yield entry
+
+    def _tar_entries(self, archive: tarfile.TarFile) -> Iterator[Optional[ArchiveEntry]]:
+        with archive:
+            for member in archive:
+                if not member.isfile() or _ignored(member.name):
+                    yield None
+                    continue
+                # A stream has to pass over every byte of a member, read or not
+                self._count(member.size)
+                entry = self._entry(member.name, member.size)
+                if member.size > self.max_entry_bytes:
+                    yield self._reject_size(entry)
+                    continue
+                yield self._read(entry, archive.extractfile(member), count_reads=False)
+
+
+async def iter_archive(
+    fileobj: IO[bytes], max_entry_bytes: int, report: ArchiveReport
+) -> AsyncIterator[ArchiveEntry]:
+    """
+    Entries of an archive, read in a thread one at a time
+
+    Stops (recording why on ``report``) when the archive is damaged or
+    exceeds the total size or entry limits.
+    """
+    reader = ArchiveReader(fileobj, max_entry_bytes)
+    while True:
+        try:
+            with metrics.timer("archive.read_entry"):
+                entry = await asyncio.to_thread(reader.next_entry)
+        except ArchiveError as e:
+            report.truncated = report.entries > 0
+            report.error = str(e)
+            logger.warning(f"Archive ingestion stopped: {e}")
+            return
+        finally:
+            report.uncompressed_bytes = reader.total_bytes
+        if entry is None:
+            return
+        if report.entries >= ARCHIVE_MAX_ENTRIES:
+            report.truncated = True
+            report.error = f"Archive has more than {ARCHIVE_MAX_ENTRIES} files"
+            return
+        report.entries += 1
+        yield entry
+
+
+async def check_archive(fileobj: IO[bytes]) -> None:
+    """
+    Reject an upload that is not a readable archive before any work starts
+
+    Raises:
+        HTTPException: 400 for an unknown format, 413 for a ZIP whose
+            declared size is over the cap
+    """
+
+    def probe() -> None:
+        entries = ArchiveReader(fileobj, max_entry_bytes=0)._open()
+        if hasattr(entries, "close"):
+            entries.close()
+
+    try:
+        await asyncio.to_thread(probe)
+    except ArchiveError as e:
+        code = (
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            if "exceeds" in str(e)
+            else status.HTTP_400_BAD_REQUEST
+        )
+        raise HTTPException(status_code=code, detail=str(e))
+    finally:
+        fileobj.seek(0)
+
+
+def entry_result(entry: ArchiveEntry, **fields: Any) -> Dict[str, Any]:
+    """Per-entry result of an entry that was not analysed"""
+    result = {
+        "index": entry.index,
+        "entry": entry.name,
+        "filename": posixpath.basename(entry.name),
+        "size": entry.size,
+        "sha256": entry.sha256,
+        "success": False,
+        "analysis": None,
+        "error": entry.error,
+    }
+    result.update(fields)
+    return result
+
+
+async def analyse_archive(
+    user: UserInDB,
+    fileobj: IO[bytes],
+    options: PipelineOptions,
+    batch_id: str,
+    batch_name: Optional[str] = None,
+    metadata: Optional[dict] = None,
+    concurrency: int = 1,
+    insert_batch_size: int = 1,
+    report: Optional[ArchiveReport] = None,
+) -> AsyncIterator[Tuple[Optional[AnalysisContext], Dict[str, Any]]]:
+    """
+    Analyse the images of an archive, yielding per-entry results as they are known
+
+    Yields ``(ctx, result)``: ``ctx`` is the pipeline context of an
+    analysed image (None for entries that were rejected or duplicates) and
+    ``result`` the entry's ``index``, ``entry`` name, ``size``, ``sha256``,
+    ``success`` and ``error``; the caller adds the analysis. Totals are
+    kept on ``report``.
+    """
+    report = report if report is not None else ArchiveReport()
+    limit_mb = await get_upload_limit_mb(str(user.id))
+    if options.max_image_size_mb:
+        limit_mb = min(limit_mb, options.max_image_size_mb)
+    first_seen: Dict[str, ArchiveEntry] = {}
+    entries: Dict[int, ArchiveEntry] = {}
+
+    async def images() -> AsyncIterator[AnalysisInput]:
+        async for entry in iter_archive(fileobj, limit_mb * 1024 * 1024, report):
+            if entry.error:
+                report.rejected.append(entry_result(entry))
+                continue
+            original = first_seen.get(entry.sha256)
+            if original is not None:
+                # Same image twice in one archive: analysed (and paid for) once
+                report.skipped += 1
+                report.rejected.append(
+                    entry_result(
+                        entry,
+                        skipped=True,
+                        duplicate_of=original.index,
+                        error=f"Duplicate of {original.name}",
+                    )
+                )
+                continue
+            first_seen[entry.sha256] = entry
+            entries[entry.index] = entry
+            yield AnalysisInput(
+                filename=posixpath.basename(entry.name),
+                contents=entry.contents,
+                sha256=entry.sha256,
+                metadata={**(metadata or {}), "archive_entry": entry.name},
+                batch_id=batch_id,
+                batch_name=batch_name,
+                index=entry.index,
+            )
+            entry.contents = None
+
+    async for ctx in get_analysis_pipeline().iter_completed(
+        user, images(), options, concurrency=concurrency, insert_batch_size=insert_batch_size
+    ):
+        while report.rejected:
+            yield None, report.rejected.popleft()
+        entry = entries.pop(ctx.input.index)
+        yield ctx, entry_result(entry, success=ctx.success, error=ctx.error)
+    while report.rejected:
+        yield None, report.rejected.popleft()
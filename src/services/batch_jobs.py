@@ -0,0 +1,456 @@
+"""
+Batch Jobs
+==========
+
+Durable queue for bulk analyses submitted with ``?async=true`` (enterprise
+bulk analysis and ``/api/v1/batch-analyze``). Submitting stores every image
+and returns a batch id at once; workers analyse the images afterwards:
+
+- ``batch_jobs`` holds one document per batch with its counters and status
+  (queued -> running -> completed), ``batch_items`` one per image
+  (pending -> running -> done/failed).
+- A worker claims an image by setting a lease (owner and expiry) with a
+  conditional update, so workers in any number of app processes share the
+  queue without taking the same image twice. The lease is renewed while
+  the image is analysed.
+- Every image's outcome is checkpointed on its item as soon as it is known.
+  If a worker dies its lease expires and another worker takes the image
+  over; finished images are never analysed again, and an image whose
+  analysis was stored just before the crash is recognised by its record.
+- Every checkpoint is also announced to the batch's live progress
+  subscribers in this process (src/services/batch_progress.py).
+
+Configuration (environment):
+    BATCH_WORKERS        worker tasks per app process (default 4, 0 disables)
+    BATCH_LEASE_SECONDS  lease on a claimed image (default 300)
+    BATCH_MAX_ATTEMPTS   claims of one image before it is failed (default 3)
+    BATCH_POLL_SECONDS   how often idle workers look for work (default 2)
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+
+from src.database.connection import (
+    ANALYSIS_COLLECTION,
+    BATCH_ITEMS_COLLECTION,
+    BATCH_JOBS_COLLECTION,
+    MongoDB,
+)
+from src.database.models import UserInDB
+from src.services.analysis_pipeline import AnalysisInput, PipelineOptions, get_analysis_pipeline
+from src.services.batch_progress import progress_hub
+from src.services.model_scheduler import BATCH
+from src.services.webhooks import emit_batch_completed
+from src.storage.image_storage import StoredImage, save_image
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+LEASE_SECONDS = int(os.getenv("BATCH_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "2"))
+
+# Item states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Analysis fields reported per image
+SUMMARY_FIELDS = ("disease_detected", "disease_name", "disease_type", "severity", "confidence")
+
+# Set when a batch is submitted so idle workers in this process start at once
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _summary(analysis_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {"analysis_id": analysis_id}
+    summary.update({name: record.get(name) for name in SUMMARY_FIELDS})
+    return summary
+
+
+def _notify_workers() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def submit_batch(
+    user: UserInDB,
+    inputs: List[AnalysisInput],
+    options: PipelineOptions,
+    batch_id: str,
+    batch_name: Optional[str] = None,
+    metadata: Optional[dict] = None,
+) -> Dict[str, Any]:
+    """
+    Store a batch's images and queue them for analysis
+
+    Images that cannot be read (too large, empty, invalid base64) are
+    recorded as failed right away instead of rejecting the whole batch.
+
+    Returns:
+        The new job's progress (see ``get_batch_progress``)
+    """
+    pipeline = get_analysis_pipeline()
+    now = datetime.utcnow()
+    items = []
+    failed = 0
+    with metrics.timer("batch.submit"):
+        for item in inputs:
+            doc = {
+                "_id": f"{batch_id}:{item.index}",
+                "batch_id": batch_id,
+                "index": item.index,
+                "filename": item.filename,
+                "metadata": item.metadata,
+                "attempts": 0,
+                "queued_at": now,
+                "updated_at": now,
+            }
+            try:
+                contents = await pipeline.load(user, item, options)
+                stored = await save_image(contents, item.filename, user.username)
+                doc.update(status=PENDING, image=stored._asdict())
+            except HTTPException as e:
+                failed += 1
+                doc.update(status=FAILED, error=str(e.detail), status_code=e.status_code)
+            items.append(doc)
+
+    job = {
+        "_id": batch_id,
+        "user_id": str(user.id),
+        "username": user.username,
+        "batch_name": batch_name,
+        "metadata": metadata,
+        "options": asdict(options),
+        "status": "completed" if failed == len(items) else "queued",
+        "total_images": len(items),
+        "processed_images": 0,
+        "failed_images": failed,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": now if failed == len(items) else None,
+    }
+    # Job first: workers look it up for every image they claim
+    await MongoDB.get_collection(BATCH_JOBS_COLLECTION).insert_one(job)
+    if items:
+        await MongoDB.get_collection(BATCH_ITEMS_COLLECTION).insert_many(items)
+    _notify_workers()
+    if job["status"] == "completed":
+        await emit_batch_completed(str(user.id), batch_id, batch_name, len(items), 0, failed)
+
+    logger.info(f"Queued batch {batch_id}: {len(items) - failed} images, {failed} rejected")
+    return await get_batch_progress(batch_id, str(user.id))
+
+
+async def get_batch_progress(
+    batch_id: str, user_id: str, include_results: bool = True
+) -> Optional[Dict[str, Any]]:
+    """Status, counters and per-image results so far of a queued batch (None if unknown)"""
+    job = await MongoDB.get_collection(BATCH_JOBS_COLLECTION).find_one(
+        {"_id": batch_id, "user_id": user_id}
+    )
+    if job is None:
+        return None
+
+    finished = job["processed_images"] + job["failed_images"]
+    progress = {
+        "batch_id": batch_id,
+        "batch_name": job.get("batch_name"),
+        "status": job["status"],
+        "total_images": job["total_images"],
+        "processed_images": job["processed_images"],
+        "failed_images": job["failed_images"],
+        "pending_images": job["total_images"] - finished,
+        "progress": finished / job["total_images"] if job["total_images"] else 1.0,
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "metadata": job.get("metadata"),
+    }
+    if include_results:
+        cursor = (
+            MongoDB.get_collection(BATCH_ITEMS_COLLECTION)
+            .find({"batch_id": batch_id})
+            .sort("index", 1)
+        )
+        progress["results"] = [
+            {
+                "index": item["index"],
+                "filename": item["filename"],
+                "status": item["status"],
+                "success": item["status"] == DONE,
+                "analysis": item.get("result"),
+                "error": item.get("error"),
+                "attempts": item.get("attempts", 0),
+            }
+            async for item in cursor
+        ]
+    return progress
+
+
+class BatchWorker:
+    """Claims queued images one at a time and analyses them"""
+
+    def __init__(self, owner: Optional[str] = None):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Lease the oldest pending image, or one whose worker's lease expired"""
+        now = datetime.utcnow()
+        return await MongoDB.get_collection(BATCH_ITEMS_COLLECTION).find_one_and_update(
+            {
+                "$or": [
+                    {"status": PENDING},
+                    {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("queued_at", 1), ("index", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _keep_lease(self, item_id: str) -> None:
+        """Extend the lease while a slow analysis is in progress"""
+        items = MongoDB.get_collection(BATCH_ITEMS_COLLECTION)
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            await items.update_one(
+                {"_id": item_id, "lease_owner": self.owner},
+                {
+                    "$set": {
+                        "lease_expires_at": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+                    }
+                },
+            )
+
+    async def process(self, item: Dict[str, Any]) -> None:
+        """Analyse a claimed image and checkpoint its outcome"""
+        jobs = MongoDB.get_collection(BATCH_JOBS_COLLECTION)
+        job = await jobs.find_one({"_id": item["batch_id"]})
+        if job is None:
+            await self._checkpoint(item, FAILED, error="Batch no longer exists", status_code=404)
+            return
+        if job["status"] == "queued":
+            now = datetime.utcnow()
+            await jobs.update_one(
+                {"_id": job["_id"], "status": "queued"},
+                {"$set": {"status": "running", "started_at": now, "updated_at": now}},
+            )
+
+        if item["attempts"] > MAX_ATTEMPTS:
+            await self._checkpoint(
+                item,
+                FAILED,
+                job=job,
+                error=f"Gave up after {MAX_ATTEMPTS} attempts",
+                status_code=500,
+            )
+            return
+
+        # A worker that crashed after storing the analysis already did the work
+        existing = await MongoDB.get_collection(ANALYSIS_COLLECTION).find_one(
+            {
+                "image_filename": item["image"]["filename"],
+                "username": job["username"],
+                "batch_id": job["_id"],
+            }
+        )
+        if existing is not None:
+            await self._checkpoint(
+                item, DONE, job=job, result=_summary(str(existing["_id"]), existing)
+            )
+            return
+
+        renewal = asyncio.create_task(self._keep_lease(item["_id"]))
+        try:
+            await self._analyse(item, job)
+        except asyncio.CancelledError:
+            # Shutting down: hand the image back instead of letting the lease run out
+            await asyncio.shield(self._release(item))
+            raise
+        finally:
+            renewal.cancel()
+
+    async def _release(self, item: Dict[str, Any]) -> None:
+        await MongoDB.get_collection(BATCH_ITEMS_COLLECTION).update_one(
+            {"_id": item["_id"], "status": RUNNING, "lease_owner": self.owner},
+            {
+                "$set": {"status": PENDING},
+                "$inc": {"attempts": -1},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            },
+        )
+
+    async def _analyse(self, item: Dict[str, Any], job: Dict[str, Any]) -> None:
+        from src.auth.security import get_user_by_username
+
+        user = await get_user_by_username(job["username"])
+        if user is None:
+            await self._checkpoint(
+                item, FAILED, job=job, error="User no longer exists", status_code=404
+            )
+            return
+
+        analysis_input = AnalysisInput(
+            filename=item["filename"],
+            stored=StoredImage(**item["image"]),
+            metadata=item.get("metadata"),
+            batch_id=job["_id"],
+            batch_name=job.get("batch_name"),
+            index=item["index"],
+        )
+        try:
+            with metrics.timer("batch.image"):
+                # Queued images always take the batch lane (also for jobs queued before lanes existed)
+                options = PipelineOptions(**{**job["options"], "traffic_class": BATCH})
+                ctx = await get_analysis_pipeline().run(user, analysis_input, options)
+        except HTTPException as e:
+            await self._checkpoint(
+                item, FAILED, job=job, error=str(e.detail), status_code=e.status_code
+            )
+        except Exception as e:
+            logger.error(f"Error processing batch {job['_id']} image {item['index']}: {str(e)}")
+            await self._checkpoint(
+                item,
+                FAILED,
+                job=job,
+                error=str(e),
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        else:
+            await self._checkpoint(
+                item, DONE, job=job, result=_summary(ctx.analysis_id, ctx.record.dict())
+            )
+
+    async def _checkpoint(
+        self,
+        item: Dict[str, Any],
+        outcome: str,
+        job: Optional[Dict[str, Any]] = None,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        status_code: Optional[int] = None,
+    ) -> None:
+        """Record an image's outcome and count it on its batch (once, by the lease holder)"""
+        now = datetime.utcnow()
+        checkpoint = await MongoDB.get_collection(BATCH_ITEMS_COLLECTION).update_one(
+            {"_id": item["_id"], "status": RUNNING, "lease_owner": self.owner},
+            {
+                "$set": {
+                    "status": outcome,
+                    "result": result,
+                    "error": error,
+                    "status_code": status_code,
+                    "finished_at": now,
+                    "updated_at": now,
+                },
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            },
+        )
+        if checkpoint.modified_count == 0 or job is None:
+            # The lease expired and another worker took the image over
+            return
+
+        jobs = MongoDB.get_collection(BATCH_JOBS_COLLECTION)
+        counter = "processed_images" if outcome == DONE else "failed_images"
+        job = await jobs.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$inc": {counter: 1}, "$set": {"updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        progress_hub.job_image_finished(
+            job,
+            {
+                "index": item["index"],
+                "filename": item["filename"],
+                "success": outcome == DONE,
+                "analysis_id": result["analysis_id"] if result else None,
+                "error": error,
+            },
+        )
+        if job["processed_images"] + job["failed_images"] >= job["total_images"]:
+            completion = await jobs.update_one(
+                {"_id": job["_id"], "status": {"$ne": "completed"}},
+                {"$set": {"status": "completed", "finished_at": now}},
+            )
+            if completion.modified_count:
+                logger.info(
+                    f"Batch {job['_id']} completed: {job['processed_images']} processed, "
+                    f"{job['failed_images']} failed"
+                )
+                progress_hub.job_finished(job)
+                await emit_batch_completed(
+                    job["user_id"],
+                    job["_id"],
+                    job.get("batch_name"),
+                    job["total_images"],
+                    job["processed_images"],
+                    job["failed_images"],
+                )
+
+    async def run_until_idle(self) -> int:
+        """Process images until none can be claimed; returns how many were processed"""
+        processed = 0
+        while True:
+            item = await self.claim()
+            if item is None:
+                return processed
+            await self.process(item)
+            processed += 1
+
+    async def run(self) -> None:
+        """Work until cancelled, polling (or being woken by a submit) when idle"""
+        while True:
+            try:
+                await self.run_until_idle()
+            except Exception as e:
+                logger.error(f"Batch worker error: {e}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+                _wakeup.clear()
+            except asyncio.TimeoutError:
+                pass
+
+
+async def ensure_indexes() -> None:
+    """Create the indexes claiming and progress lookups rely on"""
+    items = MongoDB.get_collection(BATCH_ITEMS_COLLECTION)
+    await items.create_index([("status", 1), ("queued_at", 1), ("index", 1)])
+    await items.create_index([("batch_id", 1), ("index", 1)])
+    await MongoDB.get_collection(BATCH_JOBS_COLLECTION).create_index(
+        [("user_id", 1), ("created_at", -1)]
+    )
+
+
+def start_batch_workers(count: int = WORKERS) -> List[asyncio.Task]:
+    """Start ``count`` worker tasks in this process"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    return [asyncio.create_task(BatchWorker().run()) for _ in range(max(0, count))]
+
+
+async def stop_batch_workers(tasks: List[asyncio.Task]) -> None:
+    """Cancel the worker tasks; images they held are taken over once their leases expire"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
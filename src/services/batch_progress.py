@@ -0,0 +1,339 @@
+"""
+Batch Progress
+==============
+
+Live progress of bulk analyses, streamed by ``GET /api/enterprise/batch/{batch_id}/events``
+and ``GET /api/v1/batch/{batch_id}/events`` as Server-Sent Events, so clients
+do not have to poll the batch.
+
+- Synchronous batches (bulk analysis, archive uploads, ``/api/v1/batch-analyze``
+  without ``?async``) are reported by the pipeline while ``iter_completed``
+  runs them: the batch's start, every finished image and its end.
+- Queued batches are reported by the batch workers as they checkpoint each
+  image, with the counters from the batch document.
+- Events are fanned out in-process to every subscriber of the batch. On
+  attaching, a subscriber gets one snapshot (the in-memory state, or one read
+  of the queued batch), then an ``image`` event per finished image, and the
+  stream ends with ``completed`` (or ``cancelled`` when a synchronous batch's
+  request went away).
+- Every subscriber has a bounded queue. One that falls behind has its queued
+  events dropped and gets a fresh snapshot instead, so a slow client neither
+  holds memory nor slows the batch down.
+
+Events reach subscribers connected to the app process doing the work. For a
+queued batch whose images are analysed by other nodes' workers, the stream
+re-reads the batch whenever it has been quiet for ``KEEPALIVE_SECONDS`` and
+sends a ``progress`` event if the counters moved.
+
+Throughput in every progress payload: ``images_per_second`` since the batch
+started, and ``recent_images_per_second`` over the last
+``RECENT_WINDOW_SECONDS`` (images finished in this process).
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from src.database.connection import BATCH_JOBS_COLLECTION, MongoDB
+from src.utils.sse import KEEPALIVE, KEEPALIVE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Events queued per subscriber before it is resynchronised with a snapshot
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Batches whose state is kept in memory (least recently updated are dropped)
+MAX_TRACKED_BATCHES = 1000
+
+RECENT_WINDOW_SECONDS = 30
+
+FINAL_STATUSES = ("completed", "cancelled")
+
+_RESYNC = ("resync", None)
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+@dataclass
+class BatchState:
+    """Counters of one batch as seen by this process"""
+
+    batch_id: str
+    user_id: str
+    batch_name: Optional[str] = None
+    # None while a streamed source (archive) is still being read
+    total_images: Optional[int] = None
+    processed_images: int = 0
+    failed_images: int = 0
+    status: str = "running"
+    # Queued batch: counters come from its batch_jobs document
+    queued: bool = False
+    started_at: Optional[datetime] = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    _recent: Deque[float] = field(default_factory=deque, repr=False)
+
+    def record_finished(self) -> None:
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - RECENT_WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def update_from_job(self, job: Dict[str, Any]) -> None:
+        """Take counters and status from a batch_jobs document (or its progress)"""
+        self.batch_name = job.get("batch_name")
+        self.total_images = job["total_images"]
+        self.processed_images = job["processed_images"]
+        self.failed_images = job["failed_images"]
+        self.status = job["status"]
+        self.started_at = job.get("started_at")
+        self.finished_at = job.get("finished_at")
+
+    def progress(self) -> Dict[str, Any]:
+        finished = self.processed_images + self.failed_images
+        end = self.finished_at or datetime.utcnow()
+        elapsed = (end - self.started_at).total_seconds() if self.started_at else 0.0
+
+        now = time.monotonic()
+        recent = sum(1 for t in self._recent if t >= now - RECENT_WINDOW_SECONDS)
+        window = min(RECENT_WINDOW_SECONDS, elapsed) if elapsed > 0 else 0.0
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        recent_rate = recent / window if window > 0 else 0.0
+
+        pending = self.total_images - finished if self.total_images is not None else None
+        eta = None
+        if pending is not None and self.status not in FINAL_STATUSES:
+            current = recent_rate or rate
+            eta = pending / current if current > 0 else None
+
+        return {
+            "batch_id": self.batch_id,
+            "batch_name": self.batch_name,
+            "status": self.status,
+            "total_images": self.total_images,
+            "processed_images": self.processed_images,
+            "failed_images": self.failed_images,
+            "pending_images": pending,
+            "progress": finished / self.total_images if self.total_images else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(rate, 3),
+            "recent_images_per_second": round(recent_rate, 3),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
+
+
+class Subscription:
+    """One subscriber's bounded event queue"""
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize or SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, event: Event) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop the backlog, the subscriber re-reads a snapshot
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(_RESYNC)
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """The next event, or None if there was none for ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BatchProgressHub:
+    """Per-batch progress state and in-process fan-out to subscribers"""
+
+    def __init__(self):
+        self._batches: "OrderedDict[str, BatchState]" = OrderedDict()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def subscriber_count(self, batch_id: str) -> int:
+        return len(self._subscribers.get(batch_id, ()))
+
+    def _track(self, state: BatchState) -> BatchState:
+        self._batches[state.batch_id] = state
+        self._batches.move_to_end(state.batch_id)
+        while len(self._batches) > MAX_TRACKED_BATCHES:
+            self._batches.popitem(last=False)
+        return state
+
+    def _publish(self, batch_id: str, event: str, data: Dict[str, Any]) -> None:
+        for subscription in self._subscribers.get(batch_id, ()):
+            subscription.put((event, data))
+
+    # Synchronous batches (pipeline)
+
+    def begin(
+        self,
+        batch_id: str,
+        user_id: str,
+        batch_name: Optional[str] = None,
+        total_images: Optional[int] = None,
+    ) -> BatchState:
+        return self._track(BatchState(batch_id, user_id, batch_name, total_images))
+
+    def set_total(self, batch_id: str, total_images: int) -> None:
+        state = self._batches.get(batch_id)
+        if state is not None:
+            state.total_images = total_images
+
+    def image_finished(self, batch_id: str, image: Dict[str, Any]) -> None:
+        """Count an image of a synchronous batch and announce it"""
+        state = self._batches.get(batch_id)
+        if state is None:
+            return
+        if image["success"]:
+            state.processed_images += 1
+        else:
+            state.failed_images += 1
+        state.record_finished()
+        self._batches.move_to_end(batch_id)
+        if batch_id in self._subscribers:
+            self._publish(batch_id, "image", {"image": image, "progress": state.progress()})
+
+    def finish(self, batch_id: str, status: str = "completed") -> None:
+        state = self._batches.get(batch_id)
+        if state is None:
+            return
+        state.status = status
+        state.finished_at = datetime.utcnow()
+        self._publish(batch_id, status, state.progress())
+
+    # Queued batches (batch workers)
+
+    def _job_state(self, job: Dict[str, Any], batch_id: str, user_id: str) -> BatchState:
+        state = self._batches.get(batch_id)
+        if state is None or not state.queued:
+            state = self._track(BatchState(batch_id, user_id, queued=True))
+        state.update_from_job(job)
+        return state
+
+    def job_image_finished(self, job: Dict[str, Any], image: Dict[str, Any]) -> None:
+        """Announce a queued batch's image (``job`` is the batch document after counting it)"""
+        state = self._job_state(job, job["_id"], job["user_id"])
+        state.record_finished()
+        if job["_id"] in self._subscribers:
+            self._publish(job["_id"], "image", {"image": image, "progress": state.progress()})
+
+    def job_finished(self, job: Dict[str, Any]) -> None:
+        state = self._job_state(job, job["_id"], job["user_id"])
+        state.status = "completed"
+        state.finished_at = state.finished_at or datetime.utcnow()
+        self._publish(job["_id"], "completed", state.progress())
+
+    # Subscribers
+
+    async def snapshot(self, batch_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Current progress of one of the user's batches (None if unknown)"""
+        state = self._batches.get(batch_id)
+        if state is not None and not state.queued:
+            return state.progress() if state.user_id == user_id else None
+
+        from src.services.batch_jobs import get_batch_progress
+
+        job = await get_batch_progress(batch_id, user_id, include_results=False)
+        if job is None:
+            return None
+        return self._job_state(job, batch_id, user_id).progress()
+
+    async def active_batches(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """The user's unfinished batches: synchronous ones in this process, then queued ones"""
+        active = [
+            state.progress()
+            for state in reversed(self._batches.values())
+            if state.user_id == user_id and not state.queued and state.status not in FINAL_STATUSES
+        ]
+        cursor = (
+            MongoDB.get_collection(BATCH_JOBS_COLLECTION)
+            .find({"user_id": user_id, "status": {"$in": ["queued", "running"]}})
+            .sort("created_at", -1)
+            .limit(limit)
+        )
+        async for job in cursor:
+            active.append(self._job_state(job, job["_id"], user_id).progress())
+        return active[:limit]
+
+    def _unsubscribe(self, batch_id: str, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(batch_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[batch_id]
+
+    async def open_stream(
+        self, batch_id: str, user_id: str
+    ) -> Optional[AsyncIterator[Optional[Event]]]:
+        """
+        Subscribe to a batch's events
+
+        Returns an iterator of ``(event, data)`` pairs (``KEEPALIVE`` while
+        quiet) that starts with a snapshot, or None if the user has no such
+        batch.
+        """
+        subscription = Subscription()
+        # Subscribe before reading the snapshot so no event falls in between
+        self._subscribers.setdefault(batch_id, set()).add(subscription)
+        try:
+            snapshot = await self.snapshot(batch_id, user_id)
+        except BaseException:
+            self._unsubscribe(batch_id, subscription)
+            raise
+        if snapshot is None:
+            self._unsubscribe(batch_id, subscription)
+            return None
+        return self._stream(batch_id, user_id, subscription, snapshot)
+
+    async def _stream(
+        self, batch_id: str, user_id: str, subscription: Subscription, snapshot: Dict[str, Any]
+    ) -> AsyncIterator[Optional[Event]]:
+        try:
+            yield "snapshot", snapshot
+            if snapshot["status"] in FINAL_STATUSES:
+                return
+            while True:
+                event = await subscription.get(KEEPALIVE_SECONDS)
+                if event is None:
+                    state = self._batches.get(batch_id)
+                    if state is None or state.queued:
+                        # Workers on other nodes do not reach this process: re-read the batch
+                        latest = await self.snapshot(batch_id, user_id)
+                        if latest is None:
+                            return
+                        finished = (latest["processed_images"], latest["failed_images"])
+                        if latest["status"] in FINAL_STATUSES:
+                            yield latest["status"], latest
+                            return
+                        if finished != (snapshot["processed_images"], snapshot["failed_images"]):
+                            snapshot = latest
+                            yield "progress", latest
+                            continue
+                    yield KEEPALIVE
+                    continue
+                if event is _RESYNC:
+                    snapshot = await self.snapshot(batch_id, user_id)
+                    if snapshot is None:
+                        return
+                    yield "snapshot", snapshot
+                    if snapshot["status"] in FINAL_STATUSES:
+                        return
+                    continue
+                name, data = event
+                snapshot = data.get("progress", data)
+                yield name, data
+                if name in FINAL_STATUSES:
+                    return
+        finally:
+            self._unsubscribe(batch_id, subscription)
+
+
+progress_hub = BatchProgressHub()
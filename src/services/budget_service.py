@@ -0,0 +1,262 @@
+"""
+Cost Budget Service
+===================
+
+Per-user daily and monthly model cost budgets. Plans define the default
+budgets, a subscription can override them per user. Each analysis reserves
+its pre-flight cost estimate before the model is called and settles to the
+actual cost afterwards, so concurrent requests cannot overshoot a budget.
+
+Counters live in one document per user and period and are only ever changed
+with conditional ``$inc`` updates, which keeps them correct across workers.
+Exhausted counters are remembered in-process for a short while so repeated
+requests from an over-budget tenant are rejected without a database trip.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from src.database.connection import MongoDB
+
+logger = logging.getLogger(__name__)
+
+COST_BUDGETS_COLLECTION = "cost_budgets"
+
+PERIODS = ("daily", "monthly")
+
+# How long plan/subscription budget limits are cached per user
+LIMITS_CACHE_TTL_SECONDS = 60
+
+# How long a rejected counter is answered from memory before re-checking
+EXHAUSTED_RECHECK_SECONDS = 30
+
+
+@dataclass
+class BudgetReservation:
+    """Cost reserved against a user's budget counters"""
+
+    user_id: str
+    amount_usd: float
+    counter_ids: List[str] = field(default_factory=list)
+    settled: bool = False
+
+
+def _period_bounds(period: str, now: datetime) -> Tuple[datetime, datetime]:
+    """Start and end of the budget period containing ``now`` (UTC)"""
+    if period == "daily":
+        start = datetime(now.year, now.month, now.day)
+        return start, start + timedelta(days=1)
+    start = datetime(now.year, now.month, 1)
+    if now.month == 12:
+        return start, datetime(now.year + 1, 1, 1)
+    return start, datetime(now.year, now.month + 1, 1)
+
+
+def _counter_id(user_id: str, period: str, start: datetime) -> str:
+    if period == "daily":
+        return f"{user_id}:d:{start:%Y-%m-%d}"
+    return f"{user_id}:m:{start:%Y-%m}"
+
+
+class CostBudgetService:
+    """Service for enforcing per-user model cost budgets"""
+
+    _limits_cache: Dict[str, Tuple[float, Dict[str, float]]] = {}
+    # counter id -> (monotonic deadline, remaining USD at last rejection)
+    _exhausted: Dict[str, Tuple[float, float]] = {}
+
+    @staticmethod
+    def clear_cache() -> None:
+        """Forget cached limits and exhausted counters"""
+        CostBudgetService._limits_cache.clear()
+        CostBudgetService._exhausted.clear()
+
+    @staticmethod
+    async def get_limits(user_id: str) -> Dict[str, float]:
+        """Daily and monthly budget in USD for a user (0 = unlimited)"""
+        cached = CostBudgetService._limits_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        from src.services.subscription_service import SubscriptionService
+
+        limits = {"daily": 0.0, "monthly": 0.0}
+        subscription = await SubscriptionService.get_user_subscription(user_id)
+        if subscription:
+            plan = await SubscriptionService.get_plan_by_id(subscription.plan_id)
+            if plan:
+                limits["daily"] = plan.daily_cost_budget_usd
+                limits["monthly"] = plan.monthly_cost_budget_usd
+            if subscription.daily_cost_budget_usd is not None:
+                limits["daily"] = subscription.daily_cost_budget_usd
+            if subscription.monthly_cost_budget_usd is not None:
+                limits["monthly"] = subscription.monthly_cost_budget_usd
+
+        CostBudgetService._limits_cache[user_id] = (
+            time.monotonic() + LIMITS_CACHE_TTL_SECONDS,
+            limits,
+        )
+        return limits
+
+    @staticmethod
+    async def _try_increment(counter_id: str, limit: float, amount: float) -> bool:
+        """Atomically add ``amount`` to a counter if it stays within ``limit``"""
+        collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+        result = await collection.update_one(
+            {"_id": counter_id, "spent_usd": {"$lte": limit - amount}},
+            {
+                "$inc": {"spent_usd": amount, "requests": 1},
+                "$set": {"updated_at": datetime.utcnow()},
+            },
+        )
+        return result.matched_count > 0
+
+    @staticmethod
+    async def _ensure_counter(
+        counter_id: str, user_id: str, period: str, start: datetime, end: datetime
+    ):
+        collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+        await collection.update_one(
+            {"_id": counter_id},
+            {
+                "$setOnInsert": {
+                    "user_id": user_id,
+                    "period": period,
+                    "period_start": start,
+                    "period_end": end,
+                    "spent_usd": 0.0,
+                    "requests": 0,
+                }
+            },
+            upsert=True,
+        )
+
+    @staticmethod
+    async def _remaining(counter_id: str, limit: float) -> float:
+        collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+        doc = await collection.find_one({"_id": counter_id}, {"spent_usd": 1})
+        return max(0.0, limit - (doc or {}).get("spent_usd", 0.0))
+
+    @staticmethod
+    async def reserve(user_id: str, amount_usd: float) -> BudgetReservation:
+        """
+        Reserve estimated cost against the user's budgets
+
+        Raises:
+            HTTPException: 429 if the daily or monthly budget would be exceeded
+        """
+        reservation = BudgetReservation(user_id=user_id, amount_usd=amount_usd)
+        limits = await CostBudgetService.get_limits(user_id)
+        now = datetime.utcnow()
+
+        for period in PERIODS:
+            limit = limits.get(period, 0.0)
+            if not limit:
+                continue
+            start, end = _period_bounds(period, now)
+            counter_id = _counter_id(user_id, period, start)
+
+            exhausted = CostBudgetService._exhausted.get(counter_id)
+            if exhausted and exhausted[0] > time.monotonic() and amount_usd > exhausted[1]:
+                await CostBudgetService.release(reservation)
+                CostBudgetService._raise_exceeded(period, limit)
+
+            ok = await CostBudgetService._try_increment(counter_id, limit, amount_usd)
+            if not ok:
+                await CostBudgetService._ensure_counter(counter_id, user_id, period, start, end)
+                ok = await CostBudgetService._try_increment(counter_id, limit, amount_usd)
+            if not ok:
+                remaining = await CostBudgetService._remaining(counter_id, limit)
+                deadline = time.monotonic() + min(
+                    EXHAUSTED_RECHECK_SECONDS, (end - now).total_seconds()
+                )
+                CostBudgetService._exhausted[counter_id] = (deadline, remaining)
+                await CostBudgetService.release(reservation)
+                CostBudgetService._raise_exceeded(period, limit)
+
+            reservation.counter_ids.append(counter_id)
+
+        return reservation
+
+    @staticmethod
+    def _raise_exceeded(period: str, limit: float) -> None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{period.capitalize()} cost budget of ${limit:.2f} reached. "
+            "Please try again later or upgrade your plan.",
+        )
+
+    @staticmethod
+    async def settle(reservation: Optional[BudgetReservation], actual_usd: float) -> None:
+        """Replace the reserved estimate with the actual cost"""
+        if reservation is None or reservation.settled:
+            return
+        reservation.settled = True
+        delta = actual_usd - reservation.amount_usd
+        if not reservation.counter_ids or delta == 0:
+            return
+
+        collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+        for counter_id in reservation.counter_ids:
+            try:
+                await collection.update_one({"_id": counter_id}, {"$inc": {"spent_usd": delta}})
+            except Exception as e:
+                logger.error(f"Failed to settle cost budget {counter_id}: {str(e)}")
+            if delta < 0:
+                CostBudgetService._exhausted.pop(counter_id, None)
+
+    @staticmethod
+    async def release(reservation: Optional[BudgetReservation]) -> None:
+        """Give back a reservation whose model call never happened"""
+        if reservation is None or reservation.settled:
+            return
+        if reservation.counter_ids:
+            collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+            for counter_id in reservation.counter_ids:
+                await collection.update_one(
+                    {"_id": counter_id},
+                    {"$inc": {"spent_usd": -reservation.amount_usd, "requests": -1}},
+                )
+                CostBudgetService._exhausted.pop(counter_id, None)
+        reservation.settled = True
+
+    @staticmethod
+    async def get_budget_status(user_id: str) -> Dict[str, Any]:
+        """Budget burn-down for the current day and month"""
+        limits = await CostBudgetService.get_limits(user_id)
+        collection = MongoDB.get_collection(COST_BUDGETS_COLLECTION)
+        now = datetime.utcnow()
+
+        budget = {}
+        for period in PERIODS:
+            start, end = _period_bounds(period, now)
+            doc = await collection.find_one({"_id": _counter_id(user_id, period, start)}) or {}
+            limit = limits.get(period, 0.0)
+            spent = max(0.0, doc.get("spent_usd", 0.0))
+
+            elapsed = max((now - start).total_seconds(), 1.0)
+            length = (end - start).total_seconds()
+            projected = spent * length / elapsed
+
+            entry = {
+                "limit_usd": limit,
+                "unlimited": not limit,
+                "spent_usd": round(spent, 6),
+                "remaining_usd": round(max(0.0, limit - spent), 6) if limit else None,
+                "usage_percentage": round(spent / limit * 100, 2) if limit else 0,
+                "requests": doc.get("requests", 0),
+                "projected_spend_usd": round(projected, 6),
+                "projected_exhaustion_at": None,
+                "resets_at": end,
+            }
+            if limit and spent > 0 and projected > limit:
+                seconds_left = (limit - spent) / (spent / elapsed)
+                entry["projected_exhaustion_at"] = now + timedelta(seconds=max(0.0, seconds_left))
+            budget[period] = entry
+
+        return budget
@@ -0,0 +1,586 @@
+"""
+Image Export
+============
+
+Streams a tenant's analysed images as one ZIP or tar archive.
+
+The archive is planned up front from the analysis records (entry names,
+sizes and order), so its total size is known before the first byte is sent
+and the same export always produces the same bytes. That makes byte ranges
+(and so resumed downloads) possible; the plan's ETag changes whenever the
+exported images do, for ``If-Range``. Images are stored uncompressed (they
+already are compressed) and read from storage in chunks, so memory use does
+not grow with the export. The first entry, ``manifest.json``, maps every
+file to its analysis.
+
+ZIP headers carry each image's CRC-32, computed by reading the image once
+and cached on its blob record (``crc32``), so later exports and resumed
+downloads do not read images twice.
+
+A tenant may run ``EXPORT_MAX_CONCURRENT`` exports at a time. Slots are
+leases in MongoDB, shared by all app nodes and renewed while an export
+streams, so an abandoned download frees its slot.
+"""
+
+import calendar
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import struct
+import tarfile
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path, PurePosixPath
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from src.database.connection import (
+    ANALYSIS_COLLECTION,
+    EXPORT_SESSIONS_COLLECTION,
+    IMAGE_BLOBS_COLLECTION,
+    IMAGE_REFS_COLLECTION,
+    MongoDB,
+)
+from src.storage import image_storage
+from src.storage.image_storage import ImageLocation
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("zip", "tar")
+EXPORT_MAX_IMAGES = int(os.getenv("EXPORT_MAX_IMAGES", "10000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+# A slot is freed this long after its export stops streaming
+EXPORT_LEASE_SECONDS = 120
+
+READ_CHUNK_BYTES = 256 * 1024
+# Records looked up per query while planning
+PLAN_BATCH_SIZE = 500
+
+MANIFEST_NAME = "manifest.json"
+
+# ZIP structures (all sizes known up front; images are STORED)
+ZIP_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+ZIP_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_OFFSET_EXTRA = struct.Struct("<HHQ")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+ZIP_END = struct.Struct("<IHHHHIIH")
+ZIP_UTF8_FLAG = 0x800
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP16_LIMIT = 0xFFFF
+
+
+class ExportEntry:
+    """One file in the archive"""
+
+    def __init__(
+        self,
+        name: str,
+        size: int,
+        mtime: datetime,
+        location: Optional[ImageLocation] = None,
+        sha256: Optional[str] = None,
+        data: Optional[bytes] = None,
+        crc: Optional[int] = None,
+    ):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        # Image bytes come from storage; the manifest is held in memory
+        self.location = location
+        self.sha256 = sha256
+        self.data = data
+        self.crc = zlib.crc32(data) if data is not None else crc
+        self.header_offset = 0
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        if self.data is not None:
+            yield self.data
+            return
+        produced = 0
+        async for chunk in image_storage.stream_image(self.location, READ_CHUNK_BYTES):
+            produced += len(chunk)
+            yield chunk
+        if produced != self.size:
+            # Sizes are promised in headers and Content-Length; never emit a corrupt archive
+            raise RuntimeError(
+                f"{self.name} changed during export ({produced} bytes, expected {self.size})"
+            )
+
+    async def checksum(self) -> int:
+        """CRC-32 of the entry (read once, then cached on the blob record)"""
+        if self.crc is None:
+            crc = 0
+            async for chunk in self.chunks():
+                crc = zlib.crc32(chunk, crc)
+            self.crc = crc
+            if self.sha256:
+                await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_one(
+                    {"_id": self.sha256}, {"$set": {"crc32": crc}}
+                )
+        return self.crc
+
+
+class _Part:
+    """A contiguous run of archive bytes"""
+
+    def __init__(self, length: int, produce: Callable[[], AsyncIterator[bytes]]):
+        self.length = length
+        self.produce = produce
+
+
+def _static(data: bytes) -> _Part:
+    async def produce():
+        yield data
+
+    return _Part(len(data), produce)
+
+
+def _lazy(length: int, build: Callable[[], Awaitable[bytes]]) -> _Part:
+    async def produce():
+        data = await build()
+        if len(data) != length:
+            raise RuntimeError(f"Planned {length} bytes, built {len(data)}")
+        yield data
+
+    return _Part(length, produce)
+
+
+def _dos_datetime(moment: datetime) -> Tuple[int, int]:
+    moment = max(moment, datetime(1980, 1, 1))
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    dos_date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    return dos_time, dos_date
+
+
+class ExportPlan:
+    """The byte layout of one export archive"""
+
+    def __init__(self, archive_format: str, entries: List[ExportEntry]):
+        self.format = archive_format
+        self.entries = entries
+        self.parts = self._zip_parts() if archive_format == "zip" else self._tar_parts()
+        self.size = sum(part.length for part in self.parts)
+
+        identity = hashlib.sha256(archive_format.encode("utf-8"))
+        for entry in entries:
+            identity.update(f"{entry.name}|{entry.size}|{entry.sha256 or ''}\n".encode("utf-8"))
+            if entry.data is not None:
+                identity.update(entry.data)
+        self.etag = f'"{identity.hexdigest()[:32]}"'
+
+    def _tar_parts(self) -> List[_Part]:
+        parts = []
+        for entry in self.entries:
+            info = tarfile.TarInfo(entry.name)
+            info.size = entry.size
+            # Record times are naive UTC; independent of the node's timezone
+            info.mtime = calendar.timegm(entry.mtime.utctimetuple())
+            info.mode = 0o644
+            parts.append(_static(info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")))
+            parts.append(_Part(entry.size, entry.chunks))
+            parts.append(_static(b"\0" * (-entry.size % tarfile.BLOCKSIZE)))
+        parts.append(_static(b"\0" * (2 * tarfile.BLOCKSIZE)))
+        return parts
+
+    @staticmethod
+    def _local_header(entry: ExportEntry, crc: int) -> bytes:
+        name = entry.name.encode("utf-8")
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        return (
+            ZIP_LOCAL_HEADER.pack(
+                0x04034B50,
+                20,
+                ZIP_UTF8_FLAG,
+                0,
+                dos_time,
+                dos_date,
+                crc,
+                entry.size,
+                entry.size,
+                len(name),
+                0,
+            )
+            + name
+        )
+
+    @staticmethod
+    def _central_header(entry: ExportEntry) -> bytes:
+        name = entry.name.encode("utf-8")
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        zip64 = entry.header_offset >= ZIP32_LIMIT
+        extra = ZIP64_OFFSET_EXTRA.pack(0x0001, 8, entry.header_offset) if zip64 else b""
+        return (
+            ZIP_CENTRAL_HEADER.pack(
+                0x02014B50,
+                (3 << 8) | 45,
+                45 if zip64 else 20,
+                ZIP_UTF8_FLAG,
+                0,
+                dos_time,
+                dos_date,
+                entry.crc,
+                entry.size,
+                entry.size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                0o100644 << 16,
+                min(entry.header_offset, ZIP32_LIMIT),
+            )
+            + name
+            + extra
+        )
+
+    @staticmethod
+    def _central_header_size(entry: ExportEntry) -> int:
+        zip64 = entry.header_offset >= ZIP32_LIMIT
+        return (
+            ZIP_CENTRAL_HEADER.size
+            + len(entry.name.encode("utf-8"))
+            + (ZIP64_OFFSET_EXTRA.size if zip64 else 0)
+        )
+
+    def _zip_parts(self) -> List[_Part]:
+        if any(entry.size >= ZIP32_LIMIT for entry in self.entries):
+            raise ValueError("Images of 4 GB or more cannot be exported")
+
+        parts = []
+        offset = 0
+        for entry in self.entries:
+            entry.header_offset = offset
+            header_size = ZIP_LOCAL_HEADER.size + len(entry.name.encode("utf-8"))
+
+            async def header(entry=entry):
+                return self._local_header(entry, await entry.checksum())
+
+            parts.append(_lazy(header_size, header))
+            parts.append(_Part(entry.size, entry.chunks))
+            offset += header_size + entry.size
+
+        directory_offset = offset
+        directory_size = sum(self._central_header_size(entry) for entry in self.entries)
+
+        async def directory():
+            # Entries skipped by a range request still need their checksum here
+            for entry in self.entries:
+                await entry.checksum()
+            return b"".join(self._central_header(entry) for entry in self.entries)
+
+        parts.append(_lazy(directory_size, directory))
+
+        count = len(self.entries)
+        if count >= ZIP16_LIMIT or directory_offset >= ZIP32_LIMIT or directory_size >= ZIP32_LIMIT:
+            zip64_end_offset = directory_offset + directory_size
+            parts.append(
+                _static(
+                    ZIP64_END.pack(
+                        0x06064B50,
+                        ZIP64_END.size - 12,
+                        45,
+                        45,
+                        0,
+                        0,
+                        count,
+                        count,
+                        directory_size,
+                        directory_offset,
+                    )
+                    + ZIP64_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1)
+                )
+            )
+        parts.append(
+            _static(
+                ZIP_END.pack(
+                    0x06054B50,
+                    0,
+                    0,
+                    min(count, ZIP16_LIMIT),
+                    min(count, ZIP16_LIMIT),
+                    min(directory_size, ZIP32_LIMIT),
+                    min(directory_offset, ZIP32_LIMIT),
+                    0,
+                )
+            )
+        )
+        return parts
+
+    async def stream(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Archive bytes ``start`` to ``end`` (inclusive), produced in chunks"""
+        end = self.size - 1 if end is None else end
+        position = 0
+        for part in self.parts:
+            part_start, part_end = position, position + part.length
+            position = part_end
+            if part_end <= start or part.length == 0:
+                continue
+            if part_start > end:
+                return
+            cursor = part_start
+            chunks = part.produce()
+            try:
+                async for chunk in chunks:
+                    chunk_start, chunk_end = cursor, cursor + len(chunk)
+                    cursor = chunk_end
+                    if chunk_end <= start:
+                        # Storage reads are sequential; skip up to the range start
+                        continue
+                    if chunk_start > end:
+                        break
+                    yield chunk[max(start - chunk_start, 0) : min(end + 1, chunk_end) - chunk_start]
+            finally:
+                await chunks.aclose()
+
+
+def _entry_name(record: Dict[str, Any], content_type: Optional[str]) -> str:
+    filename = PurePosixPath(record["image_filename"]).name
+    if content_type:
+        # Re-encoded by storage maintenance: name the file after its real type
+        extension = mimetypes.guess_extension(content_type)
+        if extension:
+            filename = str(PurePosixPath(filename).with_suffix(extension))
+    return f"images/{record['_id']}_{filename}"
+
+
+def _legacy_size(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+def _manifest_row(
+    record: Dict[str, Any], name: Optional[str], sha256: Optional[str]
+) -> Dict[str, Any]:
+    timestamp = record.get("analysis_timestamp")
+    return {
+        "file": name,
+        "analysis_id": str(record["_id"]),
+        "image_filename": record.get("image_filename"),
+        "image_sha256": sha256,
+        "analysis_timestamp": timestamp.isoformat()
+        if isinstance(timestamp, datetime)
+        else timestamp,
+        "batch_id": record.get("batch_id"),
+        "batch_name": record.get("batch_name"),
+        "disease_detected": record.get("disease_detected"),
+        "disease_name": record.get("disease_name"),
+        "disease_type": record.get("disease_type"),
+        "severity": record.get("severity"),
+        "confidence": record.get("confidence"),
+    }
+
+
+async def _plan_batch(
+    records: List[Dict[str, Any]], entries: List[ExportEntry], manifest: List[Dict[str, Any]]
+) -> None:
+    """Resolve where each record's image is stored and how large it is"""
+    backend = image_storage._backend()
+    ref_ids = [f"{record['username']}/{record['image_filename']}" for record in records]
+    refs = {
+        ref["_id"]: ref
+        async for ref in MongoDB.get_collection(IMAGE_REFS_COLLECTION).find(
+            {"_id": {"$in": ref_ids}}
+        )
+    }
+    blobs = {
+        blob["_id"]: blob
+        async for blob in MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).find(
+            {"_id": {"$in": sorted({ref["sha256"] for ref in refs.values()})}}
+        )
+    }
+
+    for record, ref_id in zip(records, ref_ids):
+        mtime = record.get("analysis_timestamp") or datetime(1980, 1, 1)
+        ref = refs.get(ref_id)
+        blob = blobs.get(ref["sha256"]) if ref else None
+        if blob is not None and not blob.get("deleting"):
+            key = image_storage.blob_key(blob["_id"])
+            name = _entry_name(record, blob.get("content_type"))
+            entries.append(
+                ExportEntry(
+                    name,
+                    blob.get("stored_size", blob.get("size", 0)),
+                    mtime,
+                    location=ImageLocation(
+                        key, None, backend.location(key), blob.get("content_type")
+                    ),
+                    sha256=blob["_id"],
+                    crc=blob.get("crc32"),
+                )
+            )
+            manifest.append(_manifest_row(record, name, blob["_id"]))
+            continue
+
+        path = image_storage.UPLOAD_DIR / record["username"] / record["image_filename"]
+        size = None if ref else await image_storage._run_io("stat", _legacy_size, path)
+        if size is None:
+            # Deleted image: listed in the manifest without a file
+            manifest.append(_manifest_row(record, None, None))
+            continue
+        name = _entry_name(record, None)
+        entries.append(
+            ExportEntry(name, size, mtime, location=ImageLocation(None, path, str(path)))
+        )
+        manifest.append(_manifest_row(record, name, None))
+
+
+async def plan_export(
+    user_id: str,
+    username: str,
+    archive_format: str = "zip",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    batch_id: Optional[str] = None,
+) -> ExportPlan:
+    """
+    Plan the archive of a tenant's analysed images
+
+    Raises:
+        ValueError: Unknown format, or more than ``EXPORT_MAX_IMAGES`` images
+    """
+    if archive_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{archive_format}'")
+
+    query: Dict[str, Any] = {"user_id": user_id}
+    if start_date or end_date:
+        query["analysis_timestamp"] = {}
+        if start_date:
+            query["analysis_timestamp"]["$gte"] = start_date
+        if end_date:
+            query["analysis_timestamp"]["$lte"] = end_date
+    if batch_id:
+        query["batch_id"] = batch_id
+
+    analyses = MongoDB.get_collection(ANALYSIS_COLLECTION)
+    total = await analyses.count_documents(query)
+    if total > EXPORT_MAX_IMAGES:
+        raise ValueError(
+            f"Export is limited to {EXPORT_MAX_IMAGES} images ({total} match); narrow the date range"
+        )
+
+    projection = {
+        field: 1
+        for field in (
+            "username",
+            "image_filename",
+            "analysis_timestamp",
+            "batch_id",
+            "batch_name",
+            "disease_detected",
+            "disease_name",
+            "disease_type",
+            "severity",
+            "confidence",
+        )
+    }
+    cursor = analyses.find(query, projection).sort([("analysis_timestamp", 1), ("_id", 1)])
+    entries: List[ExportEntry] = []
+    manifest: List[Dict[str, Any]] = []
+    batch: List[Dict[str, Any]] = []
+    async for record in cursor:
+        batch.append(record)
+        if len(batch) >= PLAN_BATCH_SIZE:
+            await _plan_batch(batch, entries, manifest)
+            batch = []
+    if batch:
+        await _plan_batch(batch, entries, manifest)
+
+    manifest_data = json.dumps(
+        {
+            "username": username,
+            "format": archive_format,
+            "filters": {
+                "start_date": start_date.isoformat() if start_date else None,
+                "end_date": end_date.isoformat() if end_date else None,
+                "batch_id": batch_id,
+            },
+            "images": manifest,
+        },
+        indent=2,
+    ).encode("utf-8")
+    newest = max((entry.mtime for entry in entries), default=datetime(1980, 1, 1))
+    entries.insert(0, ExportEntry(MANIFEST_NAME, len(manifest_data), newest, data=manifest_data))
+    return ExportPlan(archive_format, entries)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single ``Range: bytes=...`` header
+
+    Returns:
+        (start, end) inclusive, or None to send the whole archive (no header,
+        or several ranges)
+
+    Raises:
+        ValueError: The range cannot be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(f"Range not satisfiable for {size} bytes")
+    return start, end
+
+
+async def acquire_export_slot(user_id: str) -> Optional[str]:
+    """Take one of the tenant's export slots (None if all are busy)"""
+    sessions = MongoDB.get_collection(EXPORT_SESSIONS_COLLECTION)
+    now = datetime.utcnow()
+    for slot in range(EXPORT_MAX_CONCURRENT):
+        slot_id = f"{user_id}:{slot}"
+        try:
+            await sessions.update_one(
+                {"_id": slot_id, "expires_at": {"$lt": now}},
+                {
+                    "$set": {
+                        "user_id": user_id,
+                        "started_at": now,
+                        "expires_at": now + timedelta(seconds=EXPORT_LEASE_SECONDS),
+                    }
+                },
+                upsert=True,
+            )
+            return slot_id
+        except DuplicateKeyError:
+            continue
+    return None
+
+
+async def renew_export_slot(slot_id: str) -> None:
+    await MongoDB.get_collection(EXPORT_SESSIONS_COLLECTION).update_one(
+        {"_id": slot_id},
+        {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=EXPORT_LEASE_SECONDS)}},
+    )
+
+
+async def release_export_slot(slot_id: str) -> None:
+    await MongoDB.get_collection(EXPORT_SESSIONS_COLLECTION).delete_one({"_id": slot_id})
+
+
+async def stream_with_slot(body: AsyncIterator[bytes], slot_id: str) -> AsyncIterator[bytes]:
+    """Stream an export, keeping its slot leased until the stream ends"""
+    renewed = time.monotonic()
+    try:
+        async for chunk in body:
+            if time.monotonic() - renewed > EXPORT_LEASE_SECONDS / 3:
+                await renew_export_slot(slot_id)
+                renewed = time.monotonic()
+            yield chunk
+    finally:
+        await release_export_slot(slot_id)
@@ -0,0 +1,225 @@
+"""
+Model Scheduler
+===============
+
+Shares the model stage's capacity (``PIPELINE_MODEL_CONCURRENCY`` calls in
+flight per process) between tenants and traffic classes, so that one
+tenant's 100-image batch cannot starve live single-image requests or other
+tenants.
+
+- Two lanes: ``interactive`` (single-image requests) and ``batch`` (bulk,
+  archive, ``/api/v1/batch-analyze`` and queued batches). Interactive
+  requests are always dispatched first, and ``SCHEDULER_INTERACTIVE_RESERVED``
+  slots (default 2) are never given to batch work, so an interactive request
+  does not wait for a batch image's model call to finish.
+- Within a lane every tenant (user) has its own FIFO queue, and the queues
+  are served by deficit round robin: each round a tenant earns credit equal
+  to its plan's weight (``SCHEDULING_WEIGHTS`` in subscription_models) and
+  spends one per model call. A tenant with a long queue gets its weighted
+  share and no more; an idle tenant keeps no credit.
+- The time each call spends queued is recorded in the
+  ``scheduler.wait.<class>`` metric.
+
+State lives in one event loop and one process; every app process schedules
+its own capacity.
+
+Configuration (environment):
+    SCHEDULER_INTERACTIVE_RESERVED  model slots batch work may not use (default 2)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from src.database.subscription_models import SCHEDULING_WEIGHTS, PlanType
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+TRAFFIC_CLASSES = (INTERACTIVE, BATCH)
+
+INTERACTIVE_RESERVED = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVED", "2"))
+
+WEIGHT_CACHE_TTL_SECONDS = 60
+
+_weight_cache: Dict[str, Tuple[float, int]] = {}
+
+
+async def tenant_weight(user_id: str) -> int:
+    """Scheduling weight of the user's plan (cached; free plan when unknown)"""
+    cached = _weight_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    from src.services.subscription_service import SubscriptionService
+
+    weight = SCHEDULING_WEIGHTS[PlanType.FREE]
+    try:
+        subscription = await SubscriptionService.get_user_subscription(user_id)
+        if subscription:
+            plan = await SubscriptionService.get_plan_by_id(subscription.plan_id)
+            if plan:
+                weight = SCHEDULING_WEIGHTS.get(plan.plan_type, weight)
+    except Exception as e:
+        logger.error(f"Could not load scheduling weight for {user_id}: {str(e)}")
+
+    _weight_cache[user_id] = (time.monotonic() + WEIGHT_CACHE_TTL_SECONDS, weight)
+    return weight
+
+
+def clear_weight_cache() -> None:
+    _weight_cache.clear()
+
+
+@dataclass
+class _Waiter:
+    tenant: str
+    cost: float
+    future: asyncio.Future = field(repr=False)
+
+
+class DeficitRoundRobin:
+    """Per-tenant FIFO queues served by deficit round robin"""
+
+    def __init__(self):
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._weights: Dict[str, float] = {}
+        self._deficits: Dict[str, float] = {}
+        # Tenants with queued work, in round order; the head has the turn
+        self._active: Deque[str] = deque()
+        self._turn: Optional[str] = None
+
+    def waiting(self) -> Dict[str, int]:
+        """Queued requests per tenant (including ones about to be dropped as cancelled)"""
+        return {tenant: len(queue) for tenant, queue in self._queues.items()}
+
+    def push(self, waiter: _Waiter, weight: float) -> None:
+        queue = self._queues.get(waiter.tenant)
+        if queue is None:
+            queue = self._queues[waiter.tenant] = deque()
+            self._deficits[waiter.tenant] = 0.0
+            self._active.append(waiter.tenant)
+        self._weights[waiter.tenant] = weight
+        queue.append(waiter)
+
+    def pop(self) -> Optional[_Waiter]:
+        """The next request to serve, or None when nothing is queued"""
+        while self._active:
+            tenant = self._active[0]
+            queue = self._queues[tenant]
+            while queue and queue[0].future.done():
+                # The caller gave up waiting
+                queue.popleft()
+            if not queue:
+                self._remove_head()
+                continue
+            if self._turn != tenant:
+                # A new turn: earn this round's credit
+                self._turn = tenant
+                self._deficits[tenant] += self._weights[tenant]
+            waiter = queue[0]
+            if self._deficits[tenant] >= waiter.cost:
+                self._deficits[tenant] -= waiter.cost
+                queue.popleft()
+                if not queue:
+                    self._remove_head()
+                return waiter
+            # Credit spent: next tenant's turn
+            self._active.rotate(-1)
+            self._turn = None
+        return None
+
+    def _remove_head(self) -> None:
+        # An idle tenant keeps no credit
+        tenant = self._active.popleft()
+        del self._queues[tenant], self._weights[tenant], self._deficits[tenant]
+        self._turn = None
+
+
+class ModelScheduler:
+    """Fair admission to a fixed number of model call slots"""
+
+    def __init__(self, capacity: int, interactive_reserved: Optional[int] = None):
+        if interactive_reserved is None:
+            interactive_reserved = INTERACTIVE_RESERVED
+        self.capacity = max(1, capacity)
+        self.batch_capacity = max(1, self.capacity - max(0, interactive_reserved))
+        self._lanes = {traffic_class: DeficitRoundRobin() for traffic_class in TRAFFIC_CLASSES}
+        self._in_use = {traffic_class: 0 for traffic_class in TRAFFIC_CLASSES}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Slots in use and requests queued per traffic class"""
+        return {
+            traffic_class: {
+                "in_use": self._in_use[traffic_class],
+                "queued": sum(self._lanes[traffic_class].waiting().values()),
+            }
+            for traffic_class in TRAFFIC_CLASSES
+        }
+
+    def _has_slot(self, traffic_class: str) -> bool:
+        if sum(self._in_use.values()) >= self.capacity:
+            return False
+        return traffic_class == INTERACTIVE or self._in_use[BATCH] < self.batch_capacity
+
+    def _dispatch(self) -> None:
+        """Hand free slots to queued requests, interactive lane first"""
+        while True:
+            for traffic_class in TRAFFIC_CLASSES:
+                if not self._has_slot(traffic_class):
+                    continue
+                waiter = self._lanes[traffic_class].pop()
+                if waiter is not None:
+                    self._in_use[traffic_class] += 1
+                    waiter.future.set_result(None)
+                    break
+            else:
+                return
+
+    def _release(self, traffic_class: str) -> None:
+        self._in_use[traffic_class] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        tenant: str,
+        traffic_class: str = INTERACTIVE,
+        weight: Optional[float] = None,
+        cost: float = 1.0,
+    ) -> AsyncIterator[float]:
+        """
+        Hold one model slot for the duration of the block
+
+        Yields the seconds spent waiting for it. ``weight`` defaults to the
+        tenant's plan weight.
+        """
+        if traffic_class not in self._lanes:
+            raise ValueError(f"Unknown traffic class: {traffic_class}")
+        if weight is None:
+            weight = await tenant_weight(tenant)
+
+        start = time.perf_counter()
+        waiter = _Waiter(tenant, cost, asyncio.get_running_loop().create_future())
+        self._lanes[traffic_class].push(waiter, weight)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up
+                self._release(traffic_class)
+            raise
+        waited = time.perf_counter() - start
+        metrics.observe(f"scheduler.wait.{traffic_class}", waited)
+        try:
+            yield waited
+        finally:
+            self._release(traffic_class)
@@ -0,0 +1,320 @@
+"""
+Replay Service
+==============
+
+Offline replay of stored images against candidate prompt/model configurations.
+Used by ``scripts/replay_harness.py`` to compare agreement with stored
+analyses, token usage, latency percentiles and parse failure rate before a
+prompt or model change is deployed.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import math
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.core.inference_backend import BACKEND_FAKE, create_inference_client
+from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+from src.image_utils import LeafDiseaseDetector
+from src.storage.image_storage import ImageLocation, read_image, resolve_image
+
+logger = logging.getLogger(__name__)
+
+# Suffix the detector appends to disease names ("Brown Spot #1A2B3C4D")
+_UNIQUE_SUFFIX = re.compile(r"\s+#[0-9A-F]{8}$")
+
+
+@dataclass
+class ReplayCandidate:
+    """Prompt/model configuration to replay stored images against"""
+
+    name: str
+    model: Optional[str] = None
+    prompt: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], base_dir: Optional[Path] = None) -> "ReplayCandidate":
+        """Build a candidate from JSON config, resolving ``prompt_file`` if set"""
+        prompt = data.get("prompt")
+        if data.get("prompt_file"):
+            prompt_path = Path(data["prompt_file"])
+            if base_dir and not prompt_path.is_absolute():
+                prompt_path = base_dir / prompt_path
+            prompt = prompt_path.read_text(encoding="utf-8")
+        return cls(
+            name=data["name"],
+            model=data.get("model"),
+            prompt=prompt,
+            temperature=data.get("temperature"),
+            max_tokens=data.get("max_tokens"),
+        )
+
+
+@dataclass
+class ReplaySample:
+    """Stored image plus the analysis result it was recorded with"""
+
+    analysis_id: str
+    # Local file (manifests), or the stored image's location for display
+    image_path: str
+    disease_detected: bool
+    disease_type: str
+    disease_name: Optional[str] = None
+    # Stored image (samples from the database), read through image storage
+    location: Optional[ImageLocation] = field(default=None, repr=False)
+
+
+@dataclass
+class ReplayOutcome:
+    """Result of replaying one sample against one candidate"""
+
+    analysis_id: str
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    parse_failed: bool = False
+    error: Optional[str] = None
+    detected_match: bool = False
+    type_match: bool = False
+    name_match: bool = False
+
+
+@dataclass
+class CandidateReport:
+    """Aggregated replay metrics for one candidate"""
+
+    candidate: str
+    model: str
+    samples: int
+    completed: int
+    errors: int
+    parse_failure_rate: float
+    detected_agreement: float
+    type_agreement: float
+    name_agreement: float
+    prompt_tokens_total: int
+    completion_tokens_total: int
+    prompt_tokens_avg: float
+    completion_tokens_avg: float
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert report to a JSON serializable dict"""
+        return asdict(self)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values (0 when empty)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def normalize_disease_name(name: Optional[str]) -> str:
+    """Strip the per-analysis unique suffix and normalise case for comparison"""
+    if not name:
+        return ""
+    return _UNIQUE_SUFFIX.sub("", name).strip().lower()
+
+
+async def load_samples_from_db(
+    limit: int, user_id: Optional[str] = None, include_invalid: bool = False
+) -> List[ReplaySample]:
+    """Randomly sample stored analysis records whose image is still in storage"""
+    analysis_collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+
+    match: Dict[str, Any] = {"image_filename": {"$exists": True, "$ne": ""}}
+    if user_id:
+        match["user_id"] = user_id
+    if not include_invalid:
+        match["disease_type"] = {"$ne": "invalid_image"}
+
+    pipeline = [
+        {"$match": match},
+        {"$sample": {"size": limit}},
+        {
+            "$project": {
+                "username": 1,
+                "image_filename": 1,
+                "disease_detected": 1,
+                "disease_type": 1,
+                "disease_name": 1,
+                "original_disease_name": 1,
+            }
+        },
+    ]
+
+    samples = []
+    async for record in analysis_collection.aggregate(pipeline):
+        # Wherever the bytes are now: S3, a packed segment or a local file
+        location = await resolve_image(record["username"], record["image_filename"])
+        if location is None:
+            continue
+        samples.append(
+            ReplaySample(
+                analysis_id=str(record["_id"]),
+                image_path=location.location,
+                location=location,
+                disease_detected=bool(record.get("disease_detected", False)),
+                disease_type=record.get("disease_type", "unknown"),
+                disease_name=record.get("original_disease_name") or record.get("disease_name"),
+            )
+        )
+    return samples
+
+
+def load_samples_from_manifest(manifest_path: Path) -> List[ReplaySample]:
+    """Load samples from a JSON manifest (list of sample dicts) for offline/CI runs"""
+    entries = json.loads(manifest_path.read_text(encoding="utf-8"))
+    samples = []
+    for entry in entries:
+        image_path = Path(entry["image_path"])
+        if not image_path.is_absolute():
+            image_path = manifest_path.parent / image_path
+        samples.append(
+            ReplaySample(
+                analysis_id=str(entry.get("analysis_id", image_path.name)),
+                image_path=str(image_path),
+                disease_detected=bool(entry.get("disease_detected", False)),
+                disease_type=entry.get("disease_type", "unknown"),
+                disease_name=entry.get("disease_name"),
+            )
+        )
+    return samples
+
+
+def build_detector(candidate: ReplayCandidate, backend: str) -> LeafDiseaseDetector:
+    """Create a detector configured with the candidate's model and prompt"""
+    detector = LeafDiseaseDetector(client=create_inference_client(backend))
+    if candidate.model:
+        detector.MODEL_NAME = candidate.model
+    if candidate.prompt:
+        prompt = candidate.prompt
+        detector.create_analysis_prompt = lambda: prompt
+    return detector
+
+
+async def _read_sample(sample: ReplaySample) -> bytes:
+    if sample.location is not None:
+        return await read_image(sample.location)
+    return await asyncio.to_thread(Path(sample.image_path).read_bytes)
+
+
+def _replay_one(
+    detector: LeafDiseaseDetector,
+    candidate: ReplayCandidate,
+    sample: ReplaySample,
+    image_bytes: bytes,
+) -> ReplayOutcome:
+    """Replay a single sample synchronously (runs in a worker thread)"""
+    base64_string = base64.b64encode(image_bytes).decode("utf-8")
+
+    start = time.perf_counter()
+    try:
+        result = detector.analyze_leaf_image_base64(
+            base64_string, temperature=candidate.temperature, max_tokens=candidate.max_tokens
+        )
+    except ValueError as e:
+        latency_ms = (time.perf_counter() - start) * 1000
+        return ReplayOutcome(
+            analysis_id=sample.analysis_id,
+            latency_ms=latency_ms,
+            parse_failed="parse" in str(e).lower(),
+            error=str(e),
+        )
+    except Exception as e:
+        latency_ms = (time.perf_counter() - start) * 1000
+        return ReplayOutcome(analysis_id=sample.analysis_id, latency_ms=latency_ms, error=str(e))
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    token_usage = result.get("token_usage") or {}
+    return ReplayOutcome(
+        analysis_id=sample.analysis_id,
+        latency_ms=latency_ms,
+        prompt_tokens=token_usage.get("prompt_tokens") or 0,
+        completion_tokens=token_usage.get("completion_tokens") or 0,
+        detected_match=bool(result.get("disease_detected")) == sample.disease_detected,
+        type_match=(result.get("disease_type") or "").lower() == sample.disease_type.lower(),
+        name_match=normalize_disease_name(result.get("disease_name"))
+        == normalize_disease_name(sample.disease_name),
+    )
+
+
+def summarize(
+    candidate: ReplayCandidate, model: str, outcomes: List[ReplayOutcome]
+) -> CandidateReport:
+    """Aggregate per-sample outcomes into a candidate report"""
+    completed = [o for o in outcomes if o.error is None]
+    total = len(outcomes)
+    done = len(completed)
+    latencies = [o.latency_ms for o in completed]
+    prompt_total = sum(o.prompt_tokens for o in completed)
+    completion_total = sum(o.completion_tokens for o in completed)
+
+    return CandidateReport(
+        candidate=candidate.name,
+        model=model,
+        samples=total,
+        completed=done,
+        errors=total - done,
+        parse_failure_rate=round(sum(o.parse_failed for o in outcomes) / total, 4) if total else 0,
+        detected_agreement=round(sum(o.detected_match for o in completed) / done, 4) if done else 0,
+        type_agreement=round(sum(o.type_match for o in completed) / done, 4) if done else 0,
+        name_agreement=round(sum(o.name_match for o in completed) / done, 4) if done else 0,
+        prompt_tokens_total=prompt_total,
+        completion_tokens_total=completion_total,
+        prompt_tokens_avg=round(prompt_total / done, 1) if done else 0,
+        completion_tokens_avg=round(completion_total / done, 1) if done else 0,
+        latency_ms={
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+        },
+    )
+
+
+async def replay_candidate(
+    candidate: ReplayCandidate,
+    samples: List[ReplaySample],
+    backend: str = BACKEND_FAKE,
+    concurrency: int = 4,
+) -> CandidateReport:
+    """Replay all samples against one candidate with bounded concurrency"""
+    detector = build_detector(candidate, backend)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(sample: ReplaySample) -> ReplayOutcome:
+        async with semaphore:
+            image_bytes = await _read_sample(sample)
+            return await asyncio.to_thread(_replay_one, detector, candidate, sample, image_bytes)
+
+    outcomes = await asyncio.gather(*(run(sample) for sample in samples))
+    report = summarize(candidate, detector.MODEL_NAME, list(outcomes))
+    logger.info(
+        f"Replay '{candidate.name}': {report.completed}/{report.samples} completed, "
+        f"type agreement {report.type_agreement:.2%}, p95 {report.latency_ms['p95']}ms"
+    )
+    return report
+
+
+async def run_replay(
+    candidates: List[ReplayCandidate],
+    samples: List[ReplaySample],
+    backend: str = BACKEND_FAKE,
+    concurrency: int = 4,
+) -> List[CandidateReport]:
+    """Replay the same sample set against every candidate in turn"""
+    reports = []
+    for candidate in candidates:
+        reports.append(await replay_candidate(candidate, samples, backend, concurrency))
+    return reports
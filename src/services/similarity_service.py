@@ -0,0 +1,309 @@
+"""
+Similar-Case Retrieval
+======================
+
+Compact colour/texture feature vectors for analysed images and an in-memory
+approximate nearest-neighbour index over past analyses.
+
+The index uses random-hyperplane LSH (cosine similarity) with exact re-ranking
+of the candidates. It is filled from ``analysis_records`` on first use and then
+topped up incrementally: new records are added as they are inserted, and a
+periodic refresh picks up records written by other workers.
+"""
+
+import asyncio
+import io
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+
+try:
+    import numpy as np
+    from PIL import Image
+
+    SIMILARITY_AVAILABLE = True
+except ImportError:
+    SIMILARITY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Feature layout: HSV colour histogram, gradient histograms, 4x4 layout
+HUE_BINS, SAT_BINS, VAL_BINS = 12, 3, 3
+GRADIENT_BINS = 8
+LAYOUT_GRID = 4
+THUMBNAIL_SIZE = 64
+FEATURE_DIM = HUE_BINS * SAT_BINS * VAL_BINS + 2 * GRADIENT_BINS + LAYOUT_GRID * LAYOUT_GRID
+
+# LSH parameters
+LSH_TABLES = 8
+LSH_BITS = 10
+
+# Re-read new records from MongoDB at most this often
+REFRESH_INTERVAL_SECONDS = 30
+
+# Records are timestamped when the analysis finishes but inserted later (the
+# pipeline batches inserts) and by workers whose clocks may differ, so each
+# refresh re-reads this far behind the newest timestamp it has seen
+REFRESH_OVERLAP_SECONDS = 300
+
+# Matches this close to a confident past analysis are offered as provisional answers
+PROVISIONAL_MIN_SIMILARITY = 0.98
+PROVISIONAL_MIN_CONFIDENCE = 85.0
+
+
+def compute_feature_vector(image_bytes: bytes) -> Optional[List[float]]:
+    """
+    Compute a unit-length colour/texture embedding for an image
+
+    Returns None if NumPy/Pillow are not installed or the image cannot be decoded.
+    """
+    if not SIMILARITY_AVAILABLE:
+        return None
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # JPEG can decode straight at reduced scale
+        image.draft("RGB", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        image = image.convert("RGB").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    except Exception as e:
+        logger.debug(f"Could not decode image for features: {str(e)}")
+        return None
+
+    rgb = np.asarray(image, dtype=np.float32) / 255.0
+    hsv = np.asarray(image.convert("HSV"), dtype=np.float32) / 255.0
+
+    # Colour: joint HSV histogram
+    colour, _ = np.histogramdd(
+        hsv.reshape(-1, 3),
+        bins=(HUE_BINS, SAT_BINS, VAL_BINS),
+        range=((0, 1), (0, 1), (0, 1)),
+    )
+    colour = colour.ravel()
+
+    # Texture: gradient magnitude and orientation histograms on luminance
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy)
+    orientation = np.arctan2(gy, gx)
+    magnitude_hist, _ = np.histogram(magnitude, bins=GRADIENT_BINS, range=(0, 0.5))
+    orientation_hist, _ = np.histogram(
+        orientation, bins=GRADIENT_BINS, range=(-np.pi, np.pi), weights=magnitude
+    )
+
+    # Layout: coarse luminance grid, mean-centred
+    cell = THUMBNAIL_SIZE // LAYOUT_GRID
+    layout = gray.reshape(LAYOUT_GRID, cell, LAYOUT_GRID, cell).mean(axis=(1, 3)).ravel()
+    layout = layout - layout.mean()
+
+    parts = []
+    for block in (colour, magnitude_hist, orientation_hist, layout):
+        block = np.asarray(block, dtype=np.float32)
+        norm = np.linalg.norm(block)
+        parts.append(block / norm if norm > 0 else block)
+    vector = np.concatenate(parts)
+    vector /= np.linalg.norm(vector) or 1.0
+    return [round(float(v), 5) for v in vector]
+
+
+class SimilarityIndex:
+    """Approximate nearest-neighbour index over analysis feature vectors"""
+
+    def __init__(
+        self, dim: int = FEATURE_DIM, tables: int = LSH_TABLES, bits: int = LSH_BITS, seed: int = 0
+    ):
+        self.dim = dim
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self._powers = (1 << np.arange(bits)).astype(np.int64)
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(tables)]
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._owners: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._user_positions: Dict[str, List[int]] = {}
+        self._removed: set = set()
+        self._last_timestamp: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _hash(self, vector: "np.ndarray") -> "np.ndarray":
+        bits = (self._planes @ vector) > 0
+        return bits.astype(np.int64) @ self._powers
+
+    def add(self, analysis_id: str, user_id: str, vector: List[float]) -> bool:
+        """Add an analysis; returns False if it is already indexed"""
+        if analysis_id in self._positions or len(vector) != self.dim:
+            return False
+        vec = np.asarray(vector, dtype=np.float32)
+
+        # Grow storage geometrically
+        if self._size == len(self._vectors):
+            grown = np.zeros((max(64, self._size * 2), self.dim), dtype=np.float32)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+        position = self._size
+        self._vectors[position] = vec
+        self._size += 1
+        self._ids.append(analysis_id)
+        self._owners.append(user_id)
+        self._positions[analysis_id] = position
+        self._user_positions.setdefault(user_id, []).append(position)
+
+        for table, key in enumerate(self._hash(vec)):
+            self._buckets[table].setdefault(int(key), []).append(position)
+        return True
+
+    def remove(self, analysis_id: str) -> None:
+        """Drop an analysis from query results"""
+        position = self._positions.pop(analysis_id, None)
+        if position is not None:
+            self._removed.add(position)
+
+    def query(
+        self,
+        vector: List[float],
+        k: int = 5,
+        user_id: Optional[str] = None,
+        exclude_id: Optional[str] = None,
+    ) -> List[Tuple[str, float]]:
+        """Top-k (analysis_id, cosine similarity) pairs, optionally within one user"""
+        if not self._size or len(vector) != self.dim:
+            return []
+        vec = np.asarray(vector, dtype=np.float32)
+
+        candidates = set()
+        for table, key in enumerate(self._hash(vec)):
+            candidates.update(self._buckets[table].get(int(key), ()))
+
+        def allowed(position: int) -> bool:
+            return (
+                position not in self._removed
+                and (user_id is None or self._owners[position] == user_id)
+                and self._ids[position] != exclude_id
+            )
+
+        positions = [p for p in candidates if allowed(p)]
+        if len(positions) < k:
+            # Sparse buckets: fall back to an exact scan
+            scan = self._user_positions.get(user_id, []) if user_id else range(self._size)
+            positions = [p for p in scan if allowed(p)]
+        if not positions:
+            return []
+
+        positions_arr = np.fromiter(positions, dtype=np.int64)
+        scores = self._vectors[positions_arr] @ vec
+        top = np.argsort(-scores)[:k]
+        return [(self._ids[positions_arr[i]], float(scores[i])) for i in top]
+
+    async def refresh(self, force: bool = False) -> int:
+        """Load analyses written since the last refresh; returns how many were added"""
+        if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL_SECONDS:
+            return 0
+        async with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL_SECONDS:
+                return 0
+            query: Dict[str, Any] = {"feature_vector": {"$ne": None}}
+            if self._last_timestamp is not None:
+                # Ids and timestamps are assigned before the insert, so neither is a
+                # strict cursor; records seen again are skipped by add()
+                since = self._last_timestamp - timedelta(seconds=REFRESH_OVERLAP_SECONDS)
+                query["analysis_timestamp"] = {"$gte": since}
+
+            collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+            projection = {"user_id": 1, "feature_vector": 1, "analysis_timestamp": 1}
+            cursor = collection.find(query, projection)
+            added = 0
+            async for record in cursor:
+                if self.add(str(record["_id"]), record["user_id"], record["feature_vector"]):
+                    added += 1
+                timestamp = record.get("analysis_timestamp")
+                if isinstance(timestamp, datetime) and (
+                    self._last_timestamp is None or timestamp > self._last_timestamp
+                ):
+                    self._last_timestamp = timestamp
+            self._last_refresh = time.monotonic()
+            if added:
+                logger.info(f"Similarity index refreshed: +{added} analyses ({len(self)} total)")
+            return added
+
+
+_index: Optional[SimilarityIndex] = None
+
+
+async def ensure_indexes() -> None:
+    """Create the index incremental refreshes query by"""
+    await MongoDB.get_collection(ANALYSIS_COLLECTION).create_index("analysis_timestamp")
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """Process-wide index, or None if NumPy/Pillow are not installed"""
+    global _index
+    if not SIMILARITY_AVAILABLE:
+        return None
+    if _index is None:
+        _index = SimilarityIndex()
+    return _index
+
+
+def _summarize(record: Dict[str, Any], similarity: float) -> Dict[str, Any]:
+    return {
+        "analysis_id": str(record["_id"]),
+        "similarity": round(similarity, 4),
+        "image_filename": record.get("image_filename"),
+        "disease_detected": record.get("disease_detected", False),
+        "disease_name": record.get("disease_name"),
+        "disease_type": record.get("disease_type", "unknown"),
+        "severity": record.get("severity", "unknown"),
+        "confidence": record.get("confidence", 0.0),
+        "analysis_timestamp": record.get("analysis_timestamp"),
+    }
+
+
+async def find_similar_cases(
+    vector: List[float], k: int = 5, user_id: Optional[str] = None, exclude_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Top-k similar past analyses with their current diagnosis"""
+    index = get_similarity_index()
+    if index is None or not vector:
+        return []
+    await index.refresh()
+
+    matches = index.query(vector, k=k, user_id=user_id, exclude_id=exclude_id)
+    if not matches:
+        return []
+
+    collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+    ids = [ObjectId(analysis_id) for analysis_id, _ in matches]
+    records = {
+        str(record["_id"]): record
+        async for record in collection.find({"_id": {"$in": ids}}, {"feature_vector": 0})
+    }
+
+    results = []
+    for analysis_id, similarity in matches:
+        record = records.get(analysis_id)
+        if record is None:
+            # Deleted since it was indexed
+            index.remove(analysis_id)
+            continue
+        results.append(_summarize(record, similarity))
+    return results
+
+
+def provisional_answer(similar_cases: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Best near-identical, high-confidence match, if any"""
+    for case in similar_cases:
+        if (
+            case["similarity"] >= PROVISIONAL_MIN_SIMILARITY
+            and case["confidence"] >= PROVISIONAL_MIN_CONFIDENCE
+        ):
+            return case
+    return None
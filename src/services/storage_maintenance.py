@@ -0,0 +1,557 @@
+"""
+Storage Maintenance
+===================
+
+Background housekeeping for the image store (``src.storage.image_storage``):
+
+- Compaction: blobs older than ``STORAGE_COMPACT_AFTER_DAYS`` are re-encoded
+  to WebP (or AVIF) at the lowest quality level that stays above a PSNR
+  floor, and only if that saves at least ``MIN_SAVINGS_RATIO``. A blob keeps
+  its key, the hash of the uploaded bytes, so re-uploads of the same image
+  still deduplicate; its record and references get the new content type.
+- Orphan collection: image references older than a grace period that no
+  ``analysis_records`` document points at and no queued batch image
+  (``src.services.batch_jobs``) is waiting on (images are saved before the
+  model runs, so failed analyses leave them behind, as do deletes that
+  failed half way), blobs whose deletion was interrupted, and legacy
+  per-user files without an analysis record are deleted.
+- Packing: cold blobs are packed into segment files and segments with
+  deleted images are rewritten (``src.storage.segments``).
+
+The job paces itself (images and bytes per second), encodes one image at a
+time and holds a lease in MongoDB so only one app node runs it. Every run
+reports the bytes reclaimed by each part and is recorded in
+``storage_maintenance``.
+
+Configuration (environment):
+    STORAGE_MAINTENANCE_INTERVAL_HOURS     run inside the app this often
+                                           (default 24, 0 disables)
+    STORAGE_COMPACT_AFTER_DAYS             age before re-encoding (default 30)
+    STORAGE_COMPACT_FORMAT                 webp (default) or avif
+    STORAGE_COMPACT_MIN_PSNR               quality floor in dB (default 38)
+    STORAGE_ORPHAN_GRACE_HOURS             age before an unreferenced image
+                                           is collected (default 24)
+    STORAGE_MAINTENANCE_IMAGES_PER_SECOND  pace limit (default 5)
+    STORAGE_MAINTENANCE_MB_PER_SECOND      pace limit on bytes read (default 10)
+"""
+
+import asyncio
+import io
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from src.database.connection import (
+    ANALYSIS_COLLECTION,
+    BATCH_ITEMS_COLLECTION,
+    IMAGE_BLOBS_COLLECTION,
+    IMAGE_REFS_COLLECTION,
+    STORAGE_MAINTENANCE_COLLECTION,
+    MongoDB,
+)
+from src.storage import image_storage
+from src.storage.segments import compact_segments, pack_cold_blobs
+from src.utils.metrics import metrics
+
+try:
+    from PIL import Image, ImageChops, ImageOps, ImageStat, features
+
+    COMPACTION_AVAILABLE = True
+except ImportError:
+    COMPACTION_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_HOURS = float(os.getenv("STORAGE_MAINTENANCE_INTERVAL_HOURS", "24"))
+COMPACT_AFTER_DAYS = float(os.getenv("STORAGE_COMPACT_AFTER_DAYS", "30"))
+COMPACT_FORMAT = os.getenv("STORAGE_COMPACT_FORMAT", "webp").lower()
+MIN_PSNR_DB = float(os.getenv("STORAGE_COMPACT_MIN_PSNR", "38"))
+ORPHAN_GRACE_HOURS = float(os.getenv("STORAGE_ORPHAN_GRACE_HOURS", "24"))
+IMAGES_PER_SECOND = float(os.getenv("STORAGE_MAINTENANCE_IMAGES_PER_SECOND", "5"))
+BYTES_PER_SECOND = float(os.getenv("STORAGE_MAINTENANCE_MB_PER_SECOND", "10")) * 1024 * 1024
+
+# Quality levels tried in order; the first one above the PSNR floor is kept
+QUALITY_LEVELS = (75, 85, 92)
+# Re-encode only when it saves at least this fraction of the original
+MIN_SAVINGS_RATIO = 0.10
+# Quality is measured on downscaled copies (bounded memory and CPU)
+COMPARE_MAX_SIDE = 1024
+
+# Blobs examined per run; the rest wait for the next run
+COMPACT_MAX_PER_RUN = 10000
+# References checked against analysis records per query
+ORPHAN_BATCH_SIZE = 500
+
+LEASE_ID = "lease"
+LEASE_SECONDS = 3600
+
+# Format name -> (Pillow encoder, content type)
+COMPACT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+
+
+class Throttle:
+    """Paces work to at most ``items_per_second`` items and ``bytes_per_second`` bytes"""
+
+    def __init__(
+        self,
+        items_per_second: float = IMAGES_PER_SECOND,
+        bytes_per_second: float = BYTES_PER_SECOND,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.items_per_second = items_per_second
+        self.bytes_per_second = bytes_per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._start: Optional[float] = None
+        self._items = 0
+        self._bytes = 0
+
+    async def wait(self, nbytes: int = 0) -> None:
+        """Wait until one more item of ``nbytes`` fits in the budget (0 disables a limit)"""
+        if self._start is None:
+            self._start = self._clock()
+        self._items += 1
+        self._bytes += nbytes
+        due = max(
+            self._items / self.items_per_second if self.items_per_second > 0 else 0.0,
+            self._bytes / self.bytes_per_second if self.bytes_per_second > 0 else 0.0,
+        )
+        delay = self._start + due - self._clock()
+        if delay > 0:
+            await self._sleep(delay)
+
+
+def _compact_format() -> Tuple[str, str]:
+    encoder, content_type = COMPACT_FORMATS.get(COMPACT_FORMAT, COMPACT_FORMATS["webp"])
+    if encoder == "AVIF" and not features.check("avif"):
+        logger.warning("Pillow has no AVIF support, compacting to WebP")
+        return COMPACT_FORMATS["webp"]
+    return encoder, content_type
+
+
+def _comparison_copy(image: "Image.Image") -> "Image.Image":
+    copy = image.convert("RGB")
+    copy.thumbnail((COMPARE_MAX_SIDE, COMPARE_MAX_SIDE))
+    return copy
+
+
+def psnr(reference: "Image.Image", candidate: "Image.Image") -> float:
+    """Peak signal-to-noise ratio of two same-sized RGB images, in dB"""
+    rms = ImageStat.Stat(ImageChops.difference(reference, candidate)).rms
+    mse = sum(value * value for value in rms) / len(rms)
+    if mse == 0:
+        return math.inf
+    return 20 * math.log10(255 / math.sqrt(mse))
+
+
+def recompress(data: bytes, min_psnr: float = MIN_PSNR_DB) -> Optional[Tuple[bytes, str, int]]:
+    """
+    Re-encode an image into the compact format
+
+    Returns:
+        (encoded bytes, content type, quality), or None when the image is
+        already compact, animated, or no quality level meets both the PSNR
+        floor and the minimum saving
+    """
+    encoder, content_type = _compact_format()
+    budget = len(data) * (1 - MIN_SAVINGS_RATIO)
+
+    with Image.open(io.BytesIO(data)) as source:
+        if source.format in ("WEBP", "AVIF") or getattr(source, "n_frames", 1) > 1:
+            return None
+        # Keep the colour profile; EXIF orientation is applied to the pixels
+        options = (
+            {"icc_profile": source.info["icc_profile"]} if source.info.get("icc_profile") else {}
+        )
+        image = ImageOps.exif_transpose(source)
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    reference = _comparison_copy(image)
+
+    for quality in QUALITY_LEVELS:
+        buffer = io.BytesIO()
+        image.save(buffer, format=encoder, quality=quality, **options)
+        encoded = buffer.getvalue()
+        if len(encoded) > budget:
+            # Higher quality levels only get larger
+            return None
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            if psnr(reference, _comparison_copy(decoded)) >= min_psnr:
+                return encoded, content_type, quality
+    return None
+
+
+def _new_report(dry_run: bool) -> Dict[str, Any]:
+    return {
+        "started_at": datetime.utcnow(),
+        "dry_run": dry_run,
+        "compaction": {
+            "examined": 0,
+            "compacted": 0,
+            "kept": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "bytes_reclaimed": 0,
+        },
+        "orphans": {"references": 0, "blobs": 0, "legacy_files": 0, "bytes_reclaimed": 0},
+        "segments": {
+            "packed": 0,
+            "segments_written": 0,
+            "bytes_packed": 0,
+            "segments_rewritten": 0,
+            "bytes_reclaimed": 0,
+        },
+        "errors": 0,
+    }
+
+
+async def compact_blobs(report: Dict[str, Any], throttle: Throttle, dry_run: bool = False) -> None:
+    """Re-encode blobs older than ``COMPACT_AFTER_DAYS`` (see module docstring)"""
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    refs = MongoDB.get_collection(IMAGE_REFS_COLLECTION)
+    backend = image_storage._backend()
+    stats = report["compaction"]
+
+    cutoff = datetime.utcnow() - timedelta(days=COMPACT_AFTER_DAYS)
+    cursor = (
+        blobs.find(
+            {
+                "created_at": {"$lt": cutoff},
+                "compacted_at": {"$exists": False},
+                "ref_count": {"$gt": 0},
+                "deleting": {"$ne": True},
+            },
+            {"size": 1},
+        )
+        .sort("created_at", 1)
+        .limit(COMPACT_MAX_PER_RUN)
+    )
+    candidates = [blob async for blob in cursor]
+
+    compacted: List[Tuple[str, str]] = []
+    for blob in candidates:
+        sha256, key = blob["_id"], image_storage.blob_key(blob["_id"])
+        await throttle.wait(blob.get("size", 0))
+        stats["examined"] += 1
+
+        if not dry_run:
+            # Deletion waits for the claim to be released (see purge_unreferenced_blob)
+            claimed = await blobs.find_one_and_update(
+                {"_id": sha256, "deleting": {"$ne": True}, "compacting": {"$ne": True}},
+                {"$set": {"compacting": True, "compacting_at": datetime.utcnow()}},
+            )
+            if claimed is None:
+                continue
+        try:
+            data = await backend.read(key)
+            with metrics.timer("maintenance.recompress"):
+                result = await asyncio.to_thread(recompress, data)
+            if result is None:
+                stats["kept"] += 1
+                if not dry_run:
+                    await blobs.update_one(
+                        {"_id": sha256}, {"$set": {"compacted_at": datetime.utcnow()}}
+                    )
+                continue
+
+            encoded, content_type, quality = result
+            if not dry_run:
+                await backend.replace(key, encoded)
+                await blobs.update_one(
+                    {"_id": sha256},
+                    {
+                        "$set": {
+                            "content_type": content_type,
+                            "stored_size": len(encoded),
+                            "compact_quality": quality,
+                            "compacted_at": datetime.utcnow(),
+                        },
+                        # Rewritten loose; a packed copy and the export checksum are now stale
+                        "$unset": {"segment": "", "packed_at": "", "crc32": ""},
+                    },
+                )
+                await refs.update_many({"sha256": sha256}, {"$set": {"content_type": content_type}})
+                compacted.append((sha256, content_type))
+            stats["compacted"] += 1
+            stats["bytes_before"] += len(data)
+            stats["bytes_after"] += len(encoded)
+            stats["bytes_reclaimed"] += len(data) - len(encoded)
+        except Exception as e:
+            logger.warning(f"Could not compact blob {sha256}: {e}")
+            report["errors"] += 1
+        finally:
+            if not dry_run:
+                await blobs.update_one(
+                    {"_id": sha256}, {"$unset": {"compacting": "", "compacting_at": ""}}
+                )
+                # The last reference may have gone while the blob was claimed
+                report["orphans"]["bytes_reclaimed"] += await image_storage.purge_unreferenced_blob(
+                    sha256
+                )
+
+    # References saved while their blob was being re-encoded missed the update
+    for sha256, content_type in compacted:
+        await refs.update_many(
+            {"sha256": sha256, "content_type": {"$exists": False}},
+            {"$set": {"content_type": content_type}},
+        )
+
+
+async def _analysed_images(pairs: List[Tuple[str, str]]) -> set:
+    """The (username, filename) pairs an analysis record points at or a queued batch will"""
+    filenames = sorted({filename for _, filename in pairs})
+    analyses = MongoDB.get_collection(ANALYSIS_COLLECTION)
+    cursor = analyses.find(
+        {"image_filename": {"$in": filenames}},
+        {"username": 1, "image_filename": 1},
+    )
+    kept = {(record.get("username"), record.get("image_filename")) async for record in cursor}
+    # Filenames are unique per upload, so a queued image is matched by name alone
+    queued = MongoDB.get_collection(BATCH_ITEMS_COLLECTION).find(
+        {"image.filename": {"$in": filenames}, "status": {"$in": ["pending", "running"]}},
+        {"image.filename": 1},
+    )
+    queued_names = {item["image"]["filename"] async for item in queued}
+    kept.update(pair for pair in pairs if pair[1] in queued_names)
+    return kept
+
+
+async def _collect_orphan_references(
+    report: Dict[str, Any], throttle: Throttle, dry_run: bool, cutoff: datetime
+) -> None:
+    refs = MongoDB.get_collection(IMAGE_REFS_COLLECTION)
+    stats = report["orphans"]
+    last_id = ""
+    while True:
+        batch = [
+            ref
+            async for ref in refs.find(
+                {"_id": {"$gt": last_id}, "created_at": {"$lt": cutoff}},
+                {"username": 1, "filename": 1, "size": 1},
+            )
+            .sort("_id", 1)
+            .limit(ORPHAN_BATCH_SIZE)
+        ]
+        if not batch:
+            return
+        last_id = batch[-1]["_id"]
+        analysed = await _analysed_images([(ref["username"], ref["filename"]) for ref in batch])
+        for ref in batch:
+            if (ref["username"], ref["filename"]) in analysed:
+                continue
+            await throttle.wait()
+            if dry_run:
+                # Upper bound: shared blobs are only freed with their last reference
+                stats["references"] += 1
+                stats["bytes_reclaimed"] += ref.get("size", 0)
+                continue
+            freed = await image_storage.delete_reference(ref["username"], ref["filename"])
+            if freed is not None:
+                stats["references"] += 1
+                stats["bytes_reclaimed"] += freed
+                stats["blobs"] += 1 if freed else 0
+
+
+async def _collect_stale_blobs(report: Dict[str, Any], dry_run: bool, cutoff: datetime) -> None:
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    backend = image_storage._backend()
+    stats = report["orphans"]
+
+    # A crashed compaction must not keep its blob from being deleted forever
+    if not dry_run:
+        await blobs.update_many(
+            {"compacting": True, "compacting_at": {"$lt": cutoff}},
+            {"$unset": {"compacting": "", "compacting_at": ""}},
+        )
+
+    async for blob in blobs.find({"ref_count": {"$lte": 0}}):
+        size = blob.get("stored_size", blob.get("size", 0))
+        if blob.get("deleting"):
+            if blob.get("deleting_at", cutoff) > cutoff:
+                continue  # Still being deleted
+            if not dry_run:
+                # Interrupted deletion: finish it
+                await backend.delete(image_storage.blob_key(blob["_id"]))
+                await blobs.delete_one({"_id": blob["_id"], "deleting": True})
+        elif not dry_run:
+            size = await image_storage.purge_unreferenced_blob(blob["_id"])
+            if not size:
+                continue
+        stats["blobs"] += 1
+        stats["bytes_reclaimed"] += size
+
+
+def _old_legacy_files(cutoff: datetime) -> List[Tuple[str, str, int]]:
+    threshold = cutoff.timestamp()
+    files = []
+    for path in image_storage._list_legacy_files():
+        stat = path.stat()
+        if stat.st_mtime < threshold:
+            files.append((path.parent.name, path.name, stat.st_size))
+    return files
+
+
+async def _collect_legacy_files(
+    report: Dict[str, Any], throttle: Throttle, dry_run: bool, cutoff: datetime
+) -> None:
+    # Local-time mtimes against a UTC cutoff: off by at most the UTC offset, well inside the grace
+    files = await image_storage._run_io("list", _old_legacy_files, cutoff)
+    stats = report["orphans"]
+    for start in range(0, len(files), ORPHAN_BATCH_SIZE):
+        batch = files[start : start + ORPHAN_BATCH_SIZE]
+        analysed = await _analysed_images([(username, filename) for username, filename, _ in batch])
+        for username, filename, size in batch:
+            if (username, filename) in analysed:
+                continue
+            await throttle.wait(size)
+            path = image_storage.UPLOAD_DIR / username / filename
+            if dry_run or await image_storage._run_io("delete", image_storage._unlink, path):
+                stats["legacy_files"] += 1
+                stats["bytes_reclaimed"] += size
+
+
+async def collect_orphans(
+    report: Dict[str, Any], throttle: Throttle, dry_run: bool = False
+) -> None:
+    """Delete stored images no analysis record points at (see module docstring)"""
+    cutoff = datetime.utcnow() - timedelta(hours=ORPHAN_GRACE_HOURS)
+    await _collect_orphan_references(report, throttle, dry_run, cutoff)
+    await _collect_stale_blobs(report, dry_run, cutoff)
+    await _collect_legacy_files(report, throttle, dry_run, cutoff)
+
+
+async def _acquire_lease(owner: str) -> bool:
+    collection = MongoDB.get_collection(STORAGE_MAINTENANCE_COLLECTION)
+    now = datetime.utcnow()
+    try:
+        await collection.update_one(
+            {"_id": LEASE_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _keep_lease(owner: str) -> None:
+    """Extend the lease while a long run is in progress"""
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        await _acquire_lease(owner)
+
+
+async def _release_lease(owner: str) -> None:
+    await MongoDB.get_collection(STORAGE_MAINTENANCE_COLLECTION).delete_one(
+        {"_id": LEASE_ID, "owner": owner}
+    )
+
+
+async def run_maintenance(
+    dry_run: bool = False,
+    compact: bool = True,
+    orphans: bool = True,
+    pack: bool = True,
+    throttle: Optional[Throttle] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Run one maintenance pass
+
+    Args:
+        dry_run: Only report what would be reclaimed
+        compact: Re-encode old blobs
+        orphans: Delete unreferenced images
+        pack: Pack cold blobs into segments and rewrite segments with
+            deleted images (``src.storage.segments``)
+        throttle: Pace limit (default from the environment)
+
+    Returns:
+        The run report, or None if another node holds the maintenance lease
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not await _acquire_lease(owner):
+        logger.info("Storage maintenance is already running on another node")
+        return None
+
+    throttle = throttle or Throttle()
+    report = _new_report(dry_run)
+    renewal = asyncio.create_task(_keep_lease(owner))
+    try:
+        with metrics.timer("maintenance.run"):
+            if compact and COMPACTION_AVAILABLE:
+                await compact_blobs(report, throttle, dry_run)
+            if orphans:
+                await collect_orphans(report, throttle, dry_run)
+            if pack:
+                report["segments"].update(
+                    await pack_cold_blobs(pace=throttle.wait, dry_run=dry_run)
+                )
+                report["segments"].update(
+                    await compact_segments(pace=throttle.wait, dry_run=dry_run)
+                )
+    finally:
+        renewal.cancel()
+        await _release_lease(owner)
+
+    report["finished_at"] = datetime.utcnow()
+    report["bytes_reclaimed"] = sum(
+        report[part]["bytes_reclaimed"] for part in ("compaction", "orphans", "segments")
+    )
+    await MongoDB.get_collection(STORAGE_MAINTENANCE_COLLECTION).insert_one(
+        {"kind": "report", **report}
+    )
+    report.pop("_id", None)
+    logger.info(
+        f"Storage maintenance{' (dry run)' if dry_run else ''}: compacted {report['compaction']['compacted']} images, "
+        f"collected {report['orphans']['references']} orphaned images, reclaimed {report['bytes_reclaimed']} bytes"
+    )
+    return report
+
+
+async def get_recent_reports(limit: int = 10) -> List[Dict[str, Any]]:
+    """Most recent maintenance reports, newest first"""
+    cursor = (
+        MongoDB.get_collection(STORAGE_MAINTENANCE_COLLECTION)
+        .find({"kind": "report"}, {"_id": 0, "kind": 0})
+        .sort("started_at", -1)
+        .limit(limit)
+    )
+    return [report async for report in cursor]
+
+
+async def _maintenance_loop(interval_seconds: float) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_maintenance()
+        except Exception as e:
+            logger.error(f"Storage maintenance failed: {e}")
+
+
+def start_background_maintenance() -> Optional[asyncio.Task]:
+    """Run maintenance every ``STORAGE_MAINTENANCE_INTERVAL_HOURS`` (None if disabled)"""
+    if INTERVAL_HOURS <= 0:
+        return None
+    return asyncio.create_task(_maintenance_loop(INTERVAL_HOURS * 3600))
+
+
+async def stop_background_maintenance(task: Optional[asyncio.Task]) -> None:
+    """Cancel the periodic maintenance task"""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
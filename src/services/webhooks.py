@@ -0,0 +1,646 @@
+"""
+Webhooks
+========
+
+Pushes ``analysis.completed`` and ``batch.completed`` events to URLs that
+integrators register per API key, so they do not have to poll
+``/api/enterprise/batch/{batch_id}`` or ``/api/v1/analyses``.
+
+- A webhook belongs to the API key it was registered with and stops
+  receiving events when that key is revoked or expires. It receives the
+  events it subscribed to for all of the account's analyses and batches.
+- Every event is queued durably in ``webhook_deliveries``, one document per
+  webhook and event. The document id is derived from the event id, so an
+  event raised twice (a retried batch image, a resumed batch) is delivered
+  once.
+- Workers claim deliveries with a lease (as in ``batch_jobs``) and POST the
+  event as JSON. A 2xx response delivers it; a network error, timeout, 408,
+  429 or 5xx is retried with exponential backoff and jitter up to
+  ``WEBHOOK_MAX_ATTEMPTS``; other 4xx responses fail it at once.
+- Each attempt's time, status code, latency and error are kept on the
+  delivery and shown by ``GET /api/v1/webhooks/{id}/deliveries``; latencies
+  are also recorded in the ``webhook.delivery`` metric.
+
+Webhooks may only reach public addresses. The host is resolved when a
+webhook is registered and again before every attempt; loopback, private,
+link-local and reserved addresses are refused, and the request is sent to
+the address that was checked (so the name cannot be re-pointed in between).
+
+Requests are signed with the webhook's secret:
+``X-Webhook-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">``.
+``X-Webhook-Id`` is the event id, the same on every retry, for receivers
+that want to deduplicate themselves.
+
+Configuration (environment):
+    WEBHOOK_WORKERS               delivery tasks per app process (default 2, 0 disables)
+    WEBHOOK_TIMEOUT_SECONDS       per request (default 10)
+    WEBHOOK_MAX_ATTEMPTS          before a delivery is failed (default 8)
+    WEBHOOK_RETRY_BASE_SECONDS    first retry delay, doubled per attempt (default 30)
+    WEBHOOK_RETRY_MAX_SECONDS     longest retry delay (default 3600)
+    WEBHOOK_ALLOW_HTTP            accept plain http URLs other than localhost (default false)
+    WEBHOOK_ALLOW_PRIVATE         accept hosts on loopback and private networks (default false)
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import secrets
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src.database.connection import WEBHOOK_DELIVERIES_COLLECTION, WEBHOOKS_COLLECTION, MongoDB
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+ALLOW_HTTP = os.getenv("WEBHOOK_ALLOW_HTTP", "false").lower() == "true"
+ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"
+POLL_SECONDS = 2.0
+LEASE_SECONDS = TIMEOUT_SECONDS * 3
+
+MAX_WEBHOOKS_PER_KEY = 5
+# Attempts kept on a delivery document
+ATTEMPT_LOG_SIZE = 10
+# How long the webhooks of an account are cached when raising events
+TARGET_CACHE_SECONDS = 30
+
+EVENT_TYPES = ("analysis.completed", "batch.completed")
+PING = "ping"
+
+# Delivery states
+PENDING = "pending"
+DELIVERING = "delivering"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+RETRYABLE_STATUS = {408, 429}
+
+_wakeup: Optional[asyncio.Event] = None
+_target_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+
+def _notify_workers() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def clear_target_cache() -> None:
+    _target_cache.clear()
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """Signature header value of a webhook request"""
+    digest = hmac.new(
+        secret.encode("utf-8"), str(timestamp).encode("ascii") + b"." + body, hashlib.sha256
+    )
+    return f"t={timestamp},v1={digest.hexdigest()}"
+
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance_seconds: int = 300) -> bool:
+    """Check a signature header (for receivers, and the local test receiver)"""
+    try:
+        fields = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(fields["t"])
+    except (KeyError, ValueError):
+        return False
+    if tolerance_seconds and abs(time.time() - timestamp) > tolerance_seconds:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), header)
+
+
+def encode_body(event: Dict[str, Any]) -> bytes:
+    return json.dumps(event, separators=(",", ":"), sort_keys=True, default=str).encode("utf-8")
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before attempt ``attempts + 1``: doubling from the base, capped, with jitter"""
+    delay = min(RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class BlockedTarget(Exception):
+    """A webhook host that resolves to an address webhooks may not reach"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_target(url: str) -> List[str]:
+    """
+    Addresses a webhook URL's host resolves to, all of them public
+
+    Raises:
+        BlockedTarget: if any address is loopback, private, link-local or reserved
+        OSError: if the host does not resolve
+    """
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        parsed.hostname, port, type=socket.SOCK_STREAM
+    )
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    blocked = [address for address in addresses if not _is_public(address)]
+    if blocked:
+        raise BlockedTarget(f"{parsed.hostname} resolves to a non-public address ({blocked[0]})")
+    return addresses
+
+
+def _pinned_request(url: str, address: str) -> Tuple[Any, Dict[str, str], Dict[str, Any]]:
+    """URL, headers and extensions that send a request for ``url`` to ``address``"""
+    import httpx
+
+    original = httpx.URL(url)
+    extensions = {"sni_hostname": original.host} if original.scheme == "https" else {}
+    return (
+        original.copy_with(host=address),
+        {"Host": original.netloc.decode("ascii")},
+        extensions,
+    )
+
+
+async def _check_url(url: str) -> None:
+    try:
+        parsed = urlparse(url)
+        parsed.port
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid webhook URL")
+    local = parsed.hostname in ("localhost", "127.0.0.1", "::1")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Webhook URL must be http(s)"
+        )
+    if parsed.scheme == "http" and not (local or ALLOW_HTTP):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Webhook URL must use https"
+        )
+    if ALLOW_PRIVATE:
+        return
+    try:
+        await resolve_target(url)
+    except BlockedTarget as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Webhook URL not allowed: {e}"
+        )
+    except OSError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Webhook host {parsed.hostname} does not resolve",
+        )
+
+
+def _public(webhook: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "webhook_id": webhook["_id"],
+        "api_key_id": webhook["api_key_id"],
+        "url": webhook["url"],
+        "events": webhook["events"],
+        "description": webhook.get("description"),
+        "is_active": webhook["is_active"],
+        "created_at": webhook["created_at"],
+    }
+
+
+async def register_webhook(
+    user_id: str, api_key_id: str, url: str, events: List[str], description: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Register a webhook on an API key
+
+    Returns:
+        The webhook, including its signing ``secret`` (only returned here)
+    """
+    await _check_url(url)
+    unknown = sorted(set(events) - set(EVENT_TYPES))
+    if unknown or not events:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Events must be among {', '.join(EVENT_TYPES)}",
+        )
+    webhooks = MongoDB.get_collection(WEBHOOKS_COLLECTION)
+    if (
+        await webhooks.count_documents({"api_key_id": api_key_id, "is_active": True})
+        >= MAX_WEBHOOKS_PER_KEY
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_WEBHOOKS_PER_KEY} webhooks per API key",
+        )
+    webhook = {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "api_key_id": api_key_id,
+        "url": url,
+        "events": sorted(set(events)),
+        "description": description,
+        # Kept in clear: it is needed to sign every request
+        "secret": f"whsec_{secrets.token_urlsafe(32)}",
+        "is_active": True,
+        "created_at": datetime.utcnow(),
+    }
+    await webhooks.insert_one(webhook)
+    clear_target_cache()
+    return {**_public(webhook), "secret": webhook["secret"]}
+
+
+async def list_webhooks(api_key_id: str) -> List[Dict[str, Any]]:
+    cursor = (
+        MongoDB.get_collection(WEBHOOKS_COLLECTION)
+        .find({"api_key_id": api_key_id, "is_active": True})
+        .sort("created_at", 1)
+    )
+    return [_public(webhook) async for webhook in cursor]
+
+
+async def get_webhook(api_key_id: str, webhook_id: str) -> Dict[str, Any]:
+    webhook = await MongoDB.get_collection(WEBHOOKS_COLLECTION).find_one(
+        {"_id": webhook_id, "api_key_id": api_key_id, "is_active": True}
+    )
+    if webhook is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Webhook not found")
+    return webhook
+
+
+async def delete_webhook(api_key_id: str, webhook_id: str) -> None:
+    """Deactivate a webhook; its queued deliveries are failed when claimed"""
+    result = await MongoDB.get_collection(WEBHOOKS_COLLECTION).update_one(
+        {"_id": webhook_id, "api_key_id": api_key_id, "is_active": True},
+        {"$set": {"is_active": False, "deleted_at": datetime.utcnow()}},
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Webhook not found")
+    clear_target_cache()
+
+
+async def list_deliveries(
+    webhook_id: str, delivery_status: Optional[str] = None, limit: int = 50
+) -> List[Dict[str, Any]]:
+    """Recent deliveries of a webhook with their attempts, newest first"""
+    query: Dict[str, Any] = {"webhook_id": webhook_id}
+    if delivery_status:
+        query["status"] = delivery_status
+    cursor = (
+        MongoDB.get_collection(WEBHOOK_DELIVERIES_COLLECTION)
+        .find(query, {"payload": 0, "lease_owner": 0, "lease_expires_at": 0})
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+    deliveries = []
+    async for delivery in cursor:
+        delivery["delivery_id"] = delivery.pop("_id")
+        deliveries.append(delivery)
+    return deliveries
+
+
+async def _targets(user_id: str, event_type: str) -> List[Dict[str, Any]]:
+    """Active webhooks of an account subscribed to an event type"""
+    now = time.monotonic()
+    cached = _target_cache.get(user_id)
+    if cached is None or cached[0] < now:
+        cursor = MongoDB.get_collection(WEBHOOKS_COLLECTION).find(
+            {"user_id": user_id, "is_active": True}
+        )
+        cached = (now + TARGET_CACHE_SECONDS, [webhook async for webhook in cursor])
+        _target_cache[user_id] = cached
+    return [webhook for webhook in cached[1] if event_type in webhook["events"]]
+
+
+async def _enqueue(webhook: Dict[str, Any], event: Dict[str, Any]) -> bool:
+    """Queue one event for one webhook; False if it was queued before"""
+    now = datetime.utcnow()
+    try:
+        await MongoDB.get_collection(WEBHOOK_DELIVERIES_COLLECTION).insert_one(
+            {
+                "_id": f"{webhook['_id']}:{event['id']}",
+                "webhook_id": webhook["_id"],
+                "user_id": webhook["user_id"],
+                "event_id": event["id"],
+                "event_type": event["type"],
+                "payload": event,
+                "status": PENDING,
+                "attempts": 0,
+                "attempt_log": [],
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def emit(user_id: str, event_type: str, event_id: str, data: Dict[str, Any]) -> int:
+    """
+    Raise an event for an account's webhooks
+
+    Never raises: webhooks must not fail the work that produced the event.
+
+    Returns:
+        Number of deliveries queued
+    """
+    try:
+        targets = await _targets(user_id, event_type)
+        if not targets:
+            return 0
+        event = {
+            "id": f"{event_type}:{event_id}",
+            "type": event_type,
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "data": data,
+        }
+        queued = 0
+        for webhook in targets:
+            queued += await _enqueue(webhook, event)
+        if queued:
+            _notify_workers()
+        return queued
+    except Exception as e:
+        logger.error(f"Failed to queue {event_type} webhook event {event_id}: {str(e)}")
+        return 0
+
+
+async def emit_analysis_completed(ctx) -> int:
+    """``analysis.completed`` for a stored analysis (pipeline context)"""
+    record = ctx.record
+    return await emit(
+        str(ctx.user.id),
+        "analysis.completed",
+        ctx.analysis_id,
+        {
+            "analysis_id": ctx.analysis_id,
+            "batch_id": ctx.input.batch_id,
+            "index": ctx.input.index if ctx.input.batch_id else None,
+            "filename": ctx.input.filename,
+            "disease_detected": record.disease_detected,
+            "disease_name": record.disease_name,
+            "disease_type": record.disease_type,
+            "severity": record.severity,
+            "confidence": record.confidence,
+        },
+    )
+
+
+async def emit_batch_completed(
+    user_id: str,
+    batch_id: str,
+    batch_name: Optional[str],
+    total_images: int,
+    processed_images: int,
+    failed_images: int,
+) -> int:
+    """``batch.completed`` with a batch's counters"""
+    return await emit(
+        user_id,
+        "batch.completed",
+        batch_id,
+        {
+            "batch_id": batch_id,
+            "batch_name": batch_name,
+            "status": "completed",
+            "total_images": total_images,
+            "processed_images": processed_images,
+            "failed_images": failed_images,
+        },
+    )
+
+
+async def send_ping(webhook: Dict[str, Any]) -> str:
+    """Queue a ``ping`` event for one webhook (to test a receiver)"""
+    event = {
+        "id": f"{PING}:{uuid.uuid4()}",
+        "type": PING,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "data": {"webhook_id": webhook["_id"]},
+    }
+    await _enqueue(webhook, event)
+    _notify_workers()
+    return f"{webhook['_id']}:{event['id']}"
+
+
+class DeliveryWorker:
+    """Claims due deliveries one at a time and POSTs them"""
+
+    def __init__(self, owner: Optional[str] = None, client=None):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._client = client
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(timeout=TIMEOUT_SECONDS, follow_redirects=False)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Lease the delivery that is due first, or one whose worker's lease expired"""
+        now = datetime.utcnow()
+        return await MongoDB.get_collection(WEBHOOK_DELIVERIES_COLLECTION).find_one_and_update(
+            {
+                "$or": [
+                    {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                    {"status": DELIVERING, "lease_expires_at": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": DELIVERING,
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _target(
+        self, delivery: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """The delivery's webhook if it may still receive events, else why not"""
+        webhook = await MongoDB.get_collection(WEBHOOKS_COLLECTION).find_one(
+            {"_id": delivery["webhook_id"], "is_active": True}
+        )
+        if webhook is None:
+            return None, "Webhook was deleted"
+        api_key = await MongoDB.get_collection("enterprise_api_keys").find_one(
+            {
+                "_id": webhook["api_key_id"],
+                "is_active": True,
+                "expires_at": {"$gt": datetime.utcnow()},
+            }
+        )
+        if api_key is None:
+            return None, "API key was revoked or expired"
+        return webhook, None
+
+    async def process(self, delivery: Dict[str, Any]) -> str:
+        """Attempt a claimed delivery and record the outcome; returns its new status"""
+        webhook, reason = await self._target(delivery)
+        if webhook is None:
+            return await self._record(delivery, FAILED, error=reason)
+
+        body = encode_body(delivery["payload"])
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "LeafDiseaseDetection-Webhooks/1.0",
+            "X-Webhook-Id": delivery["event_id"],
+            "X-Webhook-Event": delivery["event_type"],
+            "X-Webhook-Delivery": delivery["_id"],
+            "X-Webhook-Attempt": str(delivery["attempts"]),
+            "X-Webhook-Signature": sign(webhook["secret"], int(time.time()), body),
+        }
+        start = time.perf_counter()
+        try:
+            url, extensions = webhook["url"], {}
+            if not ALLOW_PRIVATE:
+                # Checked again now: the name may point elsewhere since registration
+                addresses = await resolve_target(url)
+                url, host, extensions = _pinned_request(url, addresses[0])
+                headers.update(host)
+            response = await self._http().post(
+                url, content=body, headers=headers, extensions=extensions
+            )
+        except BlockedTarget as e:
+            return await self._record(delivery, FAILED, error=str(e))
+        except Exception as e:
+            latency = time.perf_counter() - start
+            metrics.observe("webhook.delivery", latency)
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            return await self._retry_or_fail(delivery, latency, error=error)
+
+        latency = time.perf_counter() - start
+        metrics.observe("webhook.delivery", latency)
+        code = response.status_code
+        if 200 <= code < 300:
+            return await self._record(delivery, DELIVERED, latency, code)
+        if code >= 500 or code in RETRYABLE_STATUS:
+            return await self._retry_or_fail(delivery, latency, code, f"HTTP {code}")
+        return await self._record(delivery, FAILED, latency, code, f"HTTP {code}")
+
+    async def _retry_or_fail(
+        self,
+        delivery: Dict[str, Any],
+        latency: float,
+        code: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> str:
+        if delivery["attempts"] >= MAX_ATTEMPTS:
+            return await self._record(delivery, FAILED, latency, code, error)
+        return await self._record(delivery, PENDING, latency, code, error)
+
+    async def _record(
+        self,
+        delivery: Dict[str, Any],
+        outcome: str,
+        latency: Optional[float] = None,
+        code: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> str:
+        now = datetime.utcnow()
+        latency_ms = round(latency * 1000, 1) if latency is not None else None
+        fields: Dict[str, Any] = {
+            "status": outcome,
+            "last_status_code": code,
+            "last_latency_ms": latency_ms,
+            "last_error": error,
+            "last_attempt_at": now,
+        }
+        if outcome == PENDING:
+            fields["next_attempt_at"] = now + timedelta(seconds=retry_delay(delivery["attempts"]))
+        elif outcome == DELIVERED:
+            fields["delivered_at"] = now
+        attempt = {
+            "attempt": delivery["attempts"],
+            "at": now,
+            "status_code": code,
+            "latency_ms": latency_ms,
+            "error": error,
+        }
+        await MongoDB.get_collection(WEBHOOK_DELIVERIES_COLLECTION).update_one(
+            {"_id": delivery["_id"], "lease_owner": self.owner},
+            {
+                "$set": fields,
+                "$push": {"attempt_log": {"$each": [attempt], "$slice": -ATTEMPT_LOG_SIZE}},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            },
+        )
+        if outcome != DELIVERED:
+            logger.warning(
+                f"Webhook delivery {delivery['_id']} attempt {delivery['attempts']}: {error} -> {outcome}"
+            )
+        return outcome
+
+    async def run_until_idle(self) -> int:
+        """Deliver until nothing is due; returns how many attempts were made"""
+        attempts = 0
+        while True:
+            delivery = await self.claim()
+            if delivery is None:
+                return attempts
+            await self.process(delivery)
+            attempts += 1
+
+    async def run(self) -> None:
+        """Work until cancelled, polling (or being woken by an event) when idle"""
+        try:
+            while True:
+                try:
+                    await self.run_until_idle()
+                except Exception as e:
+                    logger.error(f"Webhook worker error: {e}")
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+                    _wakeup.clear()
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.aclose()
+
+
+async def ensure_indexes() -> None:
+    """Create the indexes claiming and lookups rely on"""
+    deliveries = MongoDB.get_collection(WEBHOOK_DELIVERIES_COLLECTION)
+    await deliveries.create_index([("status", 1), ("next_attempt_at", 1)])
+    await deliveries.create_index([("webhook_id", 1), ("created_at", -1)])
+    webhooks = MongoDB.get_collection(WEBHOOKS_COLLECTION)
+    await webhooks.create_index([("user_id", 1), ("is_active", 1)])
+    await webhooks.create_index([("api_key_id", 1), ("is_active", 1)])
+
+
+def start_webhook_workers(count: int = WORKERS) -> List[asyncio.Task]:
+    """Start ``count`` delivery tasks in this process"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    return [asyncio.create_task(DeliveryWorker().run()) for _ in range(max(0, count))]
+
+
+async def stop_webhook_workers(tasks: List[asyncio.Task]) -> None:
+    """Cancel the delivery tasks; deliveries they held are retried once their leases expire"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
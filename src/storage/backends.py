@@ -0,0 +1,396 @@
+"""
+Image Storage Backends
+======================
+
+Where image blobs physically live. ``image_storage`` keeps the references
+and reference counts in MongoDB and hands the bytes to a backend by key
+(``ab/cd/<sha256>``):
+
+- ``LocalBackend``: files under ``storage/blobs`` (default); cold blobs may
+  be packed into segment files under ``storage/segments``.
+- ``S3Backend``: any S3-compatible object store (AWS S3, MinIO, R2, ...),
+  so several app nodes can share one image store. Uses a pooled boto3
+  client, multipart uploads for large images, streaming reads and presigned
+  GET URLs, which ``serve_image`` redirects to so image bytes do not pass
+  through the app.
+
+Configuration (environment):
+    STORAGE_BACKEND      local (default) or s3
+    S3_BUCKET            bucket name (required for s3)
+    S3_PREFIX            key prefix inside the bucket (default "blobs/")
+    S3_ENDPOINT_URL      e.g. http://localhost:9000 for MinIO
+    S3_REGION            region name (default us-east-1)
+    AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+                         credentials (or any other boto3 credential source)
+"""
+
+import io
+import logging
+import os
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from src.storage import image_storage
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+
+    S3_AVAILABLE = True
+except ImportError:
+    S3_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_BYTES = 256 * 1024
+
+# Images above this are uploaded in parts
+MULTIPART_THRESHOLD_BYTES = 8 * 1024 * 1024
+MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Presigned GET URLs stay valid this long
+PRESIGNED_URL_TTL_SECONDS = int(os.getenv("S3_PRESIGNED_URL_TTL_SECONDS", "3600"))
+
+
+class StorageBackend:
+    """Blob storage interface (keys are ``ab/cd/<sha256>``)"""
+
+    name = "base"
+
+    async def put(self, key: str, data: bytes) -> None:
+        """Store ``data`` under ``key`` (a no-op if the key already exists)"""
+        raise NotImplementedError
+
+    async def replace(self, key: str, data: bytes) -> None:
+        """Overwrite the blob under ``key`` (used when re-encoding old images)"""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        """Remove a blob; returns False if it did not exist"""
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> Optional[int]:
+        """Length of a blob in bytes (None if it does not exist)"""
+        raise NotImplementedError
+
+    async def stream(
+        self,
+        key: str,
+        chunk_size: int = STREAM_CHUNK_BYTES,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        """Yield a blob, or bytes ``start`` to ``end`` (inclusive) of it, in chunks"""
+        raise NotImplementedError
+        yield b""  # pragma: no cover
+
+    def location(self, key: str) -> str:
+        """Human-readable location stored on analysis records"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path of the blob, if the backend is local"""
+        return None
+
+    def presigned_url(
+        self,
+        key: str,
+        content_type: Optional[str] = None,
+        expires_in: int = PRESIGNED_URL_TTL_SECONDS,
+    ) -> Optional[str]:
+        """Direct download URL clients can be redirected to, if supported"""
+        return None
+
+
+class LocalBackend(StorageBackend):
+    """Blobs as files under a local directory, or packed into segments (``src.storage.segments``)"""
+
+    name = "local"
+
+    def __init__(self, root: Optional[Path] = None, segment_dir: Optional[Path] = None):
+        self._root = root
+        self._segment_dir = segment_dir
+
+    @property
+    def root(self) -> Path:
+        # Follows image_storage.BLOB_DIR unless given explicitly
+        return self._root or image_storage.BLOB_DIR
+
+    @property
+    def segment_dir(self) -> Path:
+        return self._segment_dir or image_storage.SEGMENT_DIR
+
+    @property
+    def segments(self):
+        from src.storage.segments import get_segment_store
+
+        return get_segment_store(self.segment_dir)
+
+    def local_path(self, key: str) -> Path:
+        return self.root / key
+
+    def location(self, key: str) -> str:
+        return str(self.local_path(key))
+
+    @staticmethod
+    def _sha256(key: str) -> str:
+        return key.rsplit("/", 1)[-1]
+
+    def _exists(self, key: str) -> bool:
+        return self.local_path(key).exists() or self.segments.find(self._sha256(key)) is not None
+
+    def _put(self, key: str, data: bytes) -> None:
+        if not self._exists(key):
+            path = self.local_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            image_storage.write_atomic(path, data)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await image_storage._run_io("save", self._put, key, data)
+
+    def _replace(self, path: Path, data: bytes) -> None:
+        # A loose file takes precedence over a packed copy
+        path.parent.mkdir(parents=True, exist_ok=True)
+        image_storage.write_atomic(path, data)
+
+    async def replace(self, key: str, data: bytes) -> None:
+        await image_storage._run_io("save", self._replace, self.local_path(key), data)
+
+    async def exists(self, key: str) -> bool:
+        return await image_storage._run_io("stat", self._exists, key)
+
+    def _delete(self, key: str) -> bool:
+        # A packed copy becomes dead space, reclaimed by segment compaction
+        removed = image_storage._unlink(self.local_path(key))
+        return removed or self.segments.find(self._sha256(key)) is not None
+
+    async def delete(self, key: str) -> bool:
+        return await image_storage._run_io("delete", self._delete, key)
+
+    def _read(self, key: str) -> bytes:
+        try:
+            return self.local_path(key).read_bytes()
+        except FileNotFoundError:
+            view = self.segments.view(self._sha256(key))
+            if view is None:
+                raise
+            return bytes(view)
+
+    async def read(self, key: str) -> bytes:
+        return await image_storage._run_io("read", self._read, key)
+
+    def _size(self, key: str) -> Optional[int]:
+        try:
+            return self.local_path(key).stat().st_size
+        except FileNotFoundError:
+            found = self.segments.find(self._sha256(key))
+            return found[2] if found is not None else None
+
+    async def size(self, key: str) -> Optional[int]:
+        return await image_storage._run_io("stat", self._size, key)
+
+    async def stream(
+        self,
+        key: str,
+        chunk_size: int = STREAM_CHUNK_BYTES,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        stop = None if end is None else end + 1
+        try:
+            f = await image_storage._run_io("open", open, self.local_path(key), "rb")
+        except FileNotFoundError:
+            view = await image_storage._run_io("open", self.segments.view, self._sha256(key))
+            if view is None:
+                raise
+            # Slices of the segment mapping, sent without copying
+            view = view[start:stop]
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset : offset + chunk_size]
+            return
+        try:
+            if start:
+                await image_storage._run_io("read", f.seek, start)
+            remaining = None if stop is None else stop - start
+            while remaining is None or remaining > 0:
+                wanted = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await image_storage._run_io("read", f.read, wanted)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+
+class S3Backend(StorageBackend):
+    """Blobs as objects in an S3-compatible bucket"""
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "blobs/",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        client=None,
+    ):
+        if client is None and not S3_AVAILABLE:
+            raise RuntimeError("S3 storage backend requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region or "us-east-1",
+            config=Config(
+                # One pooled connection per I/O thread, plus multipart part uploads
+                max_pool_connections=image_storage.IO_WORKERS * 2,
+                retries={"max_attempts": 5, "mode": "standard"},
+                signature_version="s3v4",
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD_BYTES,
+            multipart_chunksize=MULTIPART_CHUNK_BYTES,
+            max_concurrency=4,
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+    def _exists(self, key: str) -> bool:
+        return self._size(key) is not None
+
+    def _put(self, key: str, data: bytes) -> None:
+        # Content-addressed: an existing object already holds these bytes
+        if self._exists(key):
+            return
+        self.client.upload_fileobj(
+            io.BytesIO(data), self.bucket, self._key(key), Config=self.transfer_config
+        )
+
+    async def put(self, key: str, data: bytes) -> None:
+        await image_storage._run_io("save", self._put, key, data)
+
+    def _replace(self, key: str, data: bytes) -> None:
+        self.client.upload_fileobj(
+            io.BytesIO(data), self.bucket, self._key(key), Config=self.transfer_config
+        )
+
+    async def replace(self, key: str, data: bytes) -> None:
+        await image_storage._run_io("save", self._replace, key, data)
+
+    async def exists(self, key: str) -> bool:
+        return await image_storage._run_io("stat", self._exists, key)
+
+    def _delete(self, key: str) -> bool:
+        existed = self._exists(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return existed
+
+    async def delete(self, key: str) -> bool:
+        return await image_storage._run_io("delete", self._delete, key)
+
+    def _read(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    async def read(self, key: str) -> bytes:
+        return await image_storage._run_io("read", self._read, key)
+
+    def _size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    async def size(self, key: str) -> Optional[int]:
+        return await image_storage._run_io("stat", self._size, key)
+
+    async def stream(
+        self,
+        key: str,
+        chunk_size: int = STREAM_CHUNK_BYTES,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        request = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            request["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = await image_storage._run_io("open", lambda: self.client.get_object(**request))
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await image_storage._run_io("read", body.read, chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            body.close()
+
+    def presigned_url(
+        self,
+        key: str,
+        content_type: Optional[str] = None,
+        expires_in: int = PRESIGNED_URL_TTL_SECONDS,
+    ) -> Optional[str]:
+        params = {
+            "Bucket": self.bucket,
+            "Key": self._key(key),
+            "ResponseCacheControl": f"private, max-age={expires_in}, immutable",
+        }
+        if content_type:
+            params["ResponseContentType"] = content_type
+        # Signed locally, no request to the store
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+
+def create_backend_from_env() -> StorageBackend:
+    """Backend selected by ``STORAGE_BACKEND``"""
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalBackend()
+    if backend == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3Backend(
+            bucket,
+            prefix=os.getenv("S3_PREFIX", "blobs/"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region=os.getenv("S3_REGION") or None,
+        )
+    raise RuntimeError(f"Unknown STORAGE_BACKEND '{backend}' (use local or s3)")
+
+
+_backend: Optional[StorageBackend] = None
+
+
+def get_storage_backend() -> StorageBackend:
+    """Process-wide storage backend"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend_from_env()
+        logger.info(f"Image storage backend: {_backend.name}")
+    return _backend
+
+
+def set_storage_backend(backend: Optional[StorageBackend]) -> None:
+    """Replace the backend (None: re-read the environment on next use)"""
+    global _backend
+    _backend = backend
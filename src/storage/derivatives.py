@@ -0,0 +1,205 @@
+"""
+Image Derivatives
+=================
+
+Downscaled variants of stored images for thumbnails and previews.
+
+A derivative is generated the first time it is requested, in a worker
+thread, and cached as a JPEG in ``storage/derivatives``. Concurrent requests
+for the same derivative share one generation. The cache is capped at
+``DERIVATIVE_CACHE_MAX_MB`` (default 512) and evicts least recently served
+files first; access order survives restarts through file modification times.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from src.storage.image_storage import write_atomic
+from src.utils.metrics import metrics
+
+try:
+    from PIL import Image, ImageOps
+
+    DERIVATIVES_AVAILABLE = True
+except ImportError:
+    DERIVATIVES_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Preset name -> longest side in pixels
+SIZE_PRESETS: Dict[str, int] = {
+    "thumb": 256,
+    "medium": 1024,
+}
+JPEG_QUALITY = 82
+
+DERIVATIVE_DIR = Path("storage/derivatives")
+CACHE_MAX_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Resizes running at once (each holds a decoded image in memory)
+GENERATION_CONCURRENCY = 2
+
+
+def _render(source: Union[Path, bytes], max_side: int) -> Optional[bytes]:
+    """Downscale an image to a JPEG; None if it is already small enough"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        if max(image.size) <= max_side:
+            return None
+        # JPEG can decode straight at reduced scale
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buffer.getvalue()
+
+
+class DerivativeCache:
+    """On-disk LRU cache of generated derivatives"""
+
+    def __init__(self, directory: Optional[Path] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or DERIVATIVE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        # Guards the index; generation runs in worker threads
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.jpg"
+
+    def _load(self) -> None:
+        """Index files left by a previous run, oldest access first"""
+        files = []
+        if self.directory.exists():
+            for path in self.directory.glob("*/*.jpg"):
+                stat = path.stat()
+                files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+        self._loaded = True
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self._path(key).unlink(missing_ok=True)
+
+    def _touch(self, key: str) -> Path:
+        self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._total -= self._entries.pop(key)
+            raise
+        return path
+
+    def _store(self, key: str, data: bytes) -> Path:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, data)
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+        return path
+
+    def _lookup(self, key: str) -> Optional[Path]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if key in self._entries:
+                try:
+                    return self._touch(key)
+                except FileNotFoundError:
+                    pass
+        return None
+
+    def _create(self, key: str, source: Union[Path, bytes], max_side: int) -> Optional[Path]:
+        data = _render(source, max_side)
+        if data is None:
+            return None
+        return self._store(key, data)
+
+    async def _generate(
+        self,
+        key: str,
+        source: Union[Path, str],
+        max_side: int,
+        loader: Optional[Callable[[], Awaitable[bytes]]],
+    ) -> Optional[Path]:
+        cached = await asyncio.to_thread(self._lookup, key)
+        if cached is not None:
+            return cached
+        original = await loader() if loader is not None else source
+        return await asyncio.to_thread(self._create, key, original, max_side)
+
+    async def get(
+        self,
+        source: Union[Path, str],
+        size: str,
+        loader: Optional[Callable[[], Awaitable[bytes]]] = None,
+    ) -> Union[Path, str]:
+        """
+        Path of the ``size`` derivative of ``source``
+
+        ``source`` is a local file, or the location of a remote image together
+        with a ``loader`` that downloads it (only called on a cache miss).
+        Returns ``source`` itself when it is already no larger than the preset
+        or derivatives are unavailable (Pillow not installed).
+        """
+        if not DERIVATIVES_AVAILABLE:
+            return source
+        max_side = SIZE_PRESETS[size]
+        # Stored images never change under a given location, so it identifies the content
+        key = hashlib.sha256(f"{source}|{max_side}".encode("utf-8")).hexdigest()[:40]
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                if self._semaphore is None:
+                    self._semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+                async with self._semaphore:
+                    with metrics.timer(f"derivative.{size}"):
+                        path = await self._generate(key, source, max_side, loader)
+                future.set_result(path)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Mark retrieved so an unobserved failure is not logged again
+                future.exception()
+                raise
+            finally:
+                del self._inflight[key]
+        else:
+            path = await asyncio.shield(future)
+        return path or source
+
+
+_cache: Optional[DerivativeCache] = None
+
+
+def get_derivative_cache() -> DerivativeCache:
+    """Process-wide derivative cache"""
+    global _cache
+    if _cache is None:
+        _cache = DerivativeCache()
+    return _cache
@@ -3,18 +3,98 @@ Local Image Storage Manager
 ===========================
 
 Handles saving and retrieving leaf images locally.
+
+Images are stored once per content: the file lives in ``storage/blobs``
+under its SHA-256, sharded by hash prefix (``ab/cd/<sha256>``) so no
+directory grows past a few thousand entries. Every saved upload gets its own
+reference (the ``<username>/<filename>`` the rest of the app uses) in
+``image_refs``, which doubles as the per-user index: listing, usage and
+cleanup read it instead of scanning directories. ``image_blobs`` keeps a
+reference count per blob, and the blob is removed when its last reference
+is deleted. Files from before content addressing
+(``storage/uploads/<username>/<filename>``) are still served and deleted;
+``fold_legacy_images`` moves them into the blob store and
+``reshard_blobs`` moves blobs saved before sharding.
+
+Cold blobs may be packed into large segment files (``src.storage.segments``);
+the local backend reads them from there transparently.
+
+Old blobs may be re-encoded in place by ``src.services.storage_maintenance``
+(compaction); their blob record and references then carry the new
+``content_type``, which is served instead of the type implied by the name.
+
+The blob bytes go to the configured ``src.storage.backends`` backend: local
+files under ``storage/blobs`` by default, or an S3-compatible bucket shared
+by all app nodes.
+
+The public functions are coroutines: the blocking filesystem work runs on a
+bounded I/O thread pool (``STORAGE_IO_WORKERS``, default 8) so a slow or
+network-backed disk does not stall the event loop. Writes go to a temporary
+file in the target directory and are renamed into place, so readers never
+see a partial image; with ``STORAGE_FSYNC=true`` the file and directory are
+fsynced before the call returns. Every operation is timed as
+``storage.<operation>`` in ``src.utils.metrics`` (including time spent
+waiting for a pool thread).
 """
 
+import asyncio
+import hashlib
+import logging
 import os
 import shutil
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, TypeVar
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src.database.connection import IMAGE_BLOBS_COLLECTION, IMAGE_REFS_COLLECTION, MongoDB
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 # Storage configuration
 UPLOAD_DIR = Path("storage/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+BLOB_DIR = Path("storage/blobs")
+# Cold blobs packed by src.storage.segments
+SEGMENT_DIR = Path("storage/segments")
+
+# A blob being deleted cannot gain references; saves of the same content wait
+BLOB_ACQUIRE_ATTEMPTS = 50
+BLOB_ACQUIRE_RETRY_SECONDS = 0.02
+
+IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "8"))
+FSYNC_WRITES = os.getenv("STORAGE_FSYNC", "false").lower() == "true"
+
+T = TypeVar("T")
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="storage-io")
+    return _io_executor
+
+
+async def _run_io(operation: str, func: Callable[..., T], *args) -> T:
+    """Run blocking filesystem work on the I/O pool, timed as ``storage.<operation>``"""
+    loop = asyncio.get_running_loop()
+    with metrics.timer(f"storage.{operation}"):
+        return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+def shutdown_io_pool() -> None:
+    """Stop the I/O threads (called on application shutdown)"""
+    global _io_executor
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=True)
+        _io_executor = None
 
 
 def generate_unique_filename(original_filename: str) -> str:
@@ -25,62 +105,484 @@ def generate_unique_filename(original_filename: str) -> str:
     return f"{timestamp}_{unique_id}{extension}"
 
 
-def save_image(file_content: bytes, original_filename: str, username: str) -> tuple[str, str]:
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(file_path: Path, file_content: bytes, fsync: bool = FSYNC_WRITES) -> None:
+    """Write via a temporary file in the same directory and rename it into place"""
+    temp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(file_content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    if fsync:
+        _fsync_directory(file_path.parent)
+
+
+class StoredImage(NamedTuple):
+    """A saved upload"""
+
+    filename: str
+    path: str
+    sha256: str
+
+
+class ImageLocation(NamedTuple):
+    """Where a referenced image's bytes are"""
+
+    # Blob key in the storage backend (None for legacy per-user files)
+    key: Optional[str]
+    # Local file, if the image is on this node's disk
+    path: Optional[Path]
+    # Stable identifier of the stored bytes (file path or backend location)
+    location: str
+    # Set once the blob was re-encoded (otherwise implied by the filename)
+    content_type: Optional[str] = None
+
+
+def blob_key(sha256: str) -> str:
+    """Backend key of the blob with this content hash (``ab/cd/<sha256>``)"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_path(sha256: str) -> Path:
+    """Location of the blob in the local layout"""
+    return BLOB_DIR / blob_key(sha256)
+
+
+def _backend():
+    from src.storage.backends import get_storage_backend
+
+    return get_storage_backend()
+
+
+def _ref_id(username: str, filename: str) -> str:
+    return f"{username}/{filename}"
+
+
+def _hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _unlink(path: Path) -> bool:
+    try:
+        path.unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def _acquire_blob(sha256: str, size: int) -> Dict[str, Any]:
+    """Add a reference to a blob, creating its record if needed; returns the record"""
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    for _ in range(BLOB_ACQUIRE_ATTEMPTS):
+        try:
+            return await blobs.find_one_and_update(
+                {"_id": sha256, "deleting": {"$ne": True}},
+                {
+                    "$inc": {"ref_count": 1},
+                    "$setOnInsert": {"size": size, "created_at": datetime.utcnow()},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The last reference is being deleted; the record goes away shortly
+            await asyncio.sleep(BLOB_ACQUIRE_RETRY_SECONDS)
+    raise RuntimeError(f"Blob {sha256} is stuck in deletion")
+
+
+async def _release_blob(sha256: str) -> int:
+    """Drop a reference; removes the blob when it was the last one (returns bytes freed)"""
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    blob = await blobs.find_one_and_update(
+        {"_id": sha256}, {"$inc": {"ref_count": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob["ref_count"] > 0:
+        return 0
+    return await purge_unreferenced_blob(sha256)
+
+
+async def purge_unreferenced_blob(sha256: str) -> int:
+    """
+    Remove a blob whose reference count dropped to zero
+
+    Skipped while the blob is being re-encoded; the compaction job purges it
+    afterwards. Returns the bytes freed (0 if the blob is referenced again,
+    already being deleted or busy).
+    """
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    # Claim the deletion so a concurrent save cannot re-reference the blob meanwhile
+    blob = await blobs.find_one_and_update(
+        {
+            "_id": sha256,
+            "ref_count": {"$lte": 0},
+            "deleting": {"$ne": True},
+            "compacting": {"$ne": True},
+        },
+        {"$set": {"deleting": True, "deleting_at": datetime.utcnow()}},
+    )
+    if blob is None:
+        return 0
+    try:
+        await _backend().delete(blob_key(sha256))
+    except BaseException:
+        # Give the claim back: the blob can be saved again meanwhile, and the
+        # maintenance job (which needs the record to find the bytes) retries
+        await blobs.update_one(
+            {"_id": sha256, "deleting": True}, {"$unset": {"deleting": "", "deleting_at": ""}}
+        )
+        raise
+    await blobs.delete_one({"_id": sha256})
+    return blob.get("stored_size", blob.get("size", 0))
+
+
+async def save_image(
+    file_content: bytes, original_filename: str, username: str, sha256: Optional[str] = None
+) -> StoredImage:
     """
-    Save image to local storage
+    Save image to storage
 
     Args:
         file_content: Image file content in bytes
         original_filename: Original filename
         username: Username of uploader
+        sha256: Content hash, if the caller already computed it
 
     Returns:
-        tuple: (filename, full_path)
+        StoredImage: (filename, full_path, sha256); the filename is unique
+        per upload, the path is the shared blob
     """
-    # Create user directory
-    user_dir = UPLOAD_DIR / username
-    user_dir.mkdir(parents=True, exist_ok=True)
-
-    # Generate unique filename
+    if sha256 is None:
+        sha256 = await _run_io("hash", _hash, file_content)
     filename = generate_unique_filename(original_filename)
-    file_path = user_dir / filename
 
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(file_content)
+    backend = _backend()
+    blob = await _acquire_blob(sha256, len(file_content))
+    try:
+        # A no-op for known content, including blobs that were since re-encoded
+        await backend.put(blob_key(sha256), file_content)
+        path = backend.location(blob_key(sha256))
+        ref = {
+            "_id": _ref_id(username, filename),
+            "username": username,
+            "filename": filename,
+            "sha256": sha256,
+            "size": len(file_content),
+            "created_at": datetime.utcnow(),
+        }
+        if blob.get("content_type"):
+            ref["content_type"] = blob["content_type"]
+        await MongoDB.get_collection(IMAGE_REFS_COLLECTION).insert_one(ref)
+    except BaseException:
+        await _release_blob(sha256)
+        raise
+    return StoredImage(filename, path, sha256)
 
-    return filename, str(file_path)
 
-
-def get_image_path(username: str, filename: str) -> Optional[Path]:
-    """Get full path to image file"""
+def _legacy_path(username: str, filename: str) -> Optional[Path]:
     file_path = UPLOAD_DIR / username / filename
     if file_path.exists():
         return file_path
     return None
 
 
-def delete_image(username: str, filename: str) -> bool:
-    """Delete image from storage"""
-    file_path = get_image_path(username, filename)
-    if file_path and file_path.exists():
-        file_path.unlink()
+async def resolve_image(username: str, filename: str) -> Optional[ImageLocation]:
+    """Find where an image is stored (None if it does not exist)"""
+    ref = await MongoDB.get_collection(IMAGE_REFS_COLLECTION).find_one(
+        {"_id": _ref_id(username, filename)}
+    )
+    if ref is not None:
+        backend = _backend()
+        key = blob_key(ref["sha256"])
+        path = backend.local_path(key)
+        if path is not None and not await _run_io("stat", path.exists):
+            if not await backend.exists(key):
+                return None
+            # Packed into a segment: read through the backend
+            path = None
+        # Remote blobs are trusted to exist while referenced (no HEAD per request)
+        return ImageLocation(key, path, backend.location(key), ref.get("content_type"))
+    path = await _run_io("stat", _legacy_path, username, filename)
+    return ImageLocation(None, path, str(path)) if path else None
+
+
+async def get_image_path(username: str, filename: str) -> Optional[Path]:
+    """Get full path to image file (None if missing or not on local disk)"""
+    location = await resolve_image(username, filename)
+    return location.path if location else None
+
+
+async def read_image(location: ImageLocation) -> bytes:
+    """Read a resolved image's bytes"""
+    if location.path is not None:
+        return await _run_io("read", location.path.read_bytes)
+    return await _backend().read(location.key)
+
+
+async def stream_image(
+    location: ImageLocation, chunk_size: int = 256 * 1024
+) -> AsyncIterator[bytes]:
+    """Read a resolved image in chunks"""
+    if location.key is not None:
+        async for chunk in _backend().stream(location.key, chunk_size):
+            yield chunk
+        return
+    f = await _run_io("open", open, location.path, "rb")
+    try:
+        while True:
+            chunk = await _run_io("read", f.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        f.close()
+
+
+async def delete_reference(username: str, filename: str) -> Optional[int]:
+    """
+    Delete an image reference, and the blob if nothing else references it
+
+    Returns:
+        Bytes freed (0 if the blob is still referenced), None if there was
+        no such reference
+    """
+    ref = await MongoDB.get_collection(IMAGE_REFS_COLLECTION).find_one_and_delete(
+        {"_id": _ref_id(username, filename)}
+    )
+    if ref is None:
+        return None
+    return await _release_blob(ref["sha256"])
+
+
+async def delete_image(username: str, filename: str) -> bool:
+    """Delete an image reference, and the blob if nothing else references it"""
+    if await delete_reference(username, filename) is not None:
         return True
-    return False
+    return await _run_io("delete", _unlink, UPLOAD_DIR / username / filename)
 
 
-def get_user_images(username: str) -> list[str]:
+async def get_user_images(username: str) -> list[str]:
     """Get list of all images for a user"""
-    user_dir = UPLOAD_DIR / username
-    if not user_dir.exists():
-        return []
-    return [f.name for f in user_dir.iterdir() if f.is_file()]
+    refs = (
+        MongoDB.get_collection(IMAGE_REFS_COLLECTION)
+        .find({"username": username}, {"filename": 1})
+        .sort("created_at", 1)
+    )
+    return [ref["filename"] async for ref in refs]
 
 
-def cleanup_user_storage(username: str) -> bool:
-    """Delete all images for a user"""
+async def get_user_storage_usage(username: str) -> Dict[str, int]:
+    """Number of images and bytes referenced by a user (from the index)"""
+    pipeline = [
+        {"$match": {"username": username}},
+        {"$group": {"_id": None, "images": {"$sum": 1}, "bytes": {"$sum": "$size"}}},
+    ]
+    async for row in MongoDB.get_collection(IMAGE_REFS_COLLECTION).aggregate(pipeline):
+        return {"images": row["images"], "bytes": row["bytes"]}
+    return {"images": 0, "bytes": 0}
+
+
+async def ensure_indexes() -> None:
+    """Create the indexes the per-user image index and storage maintenance rely on"""
+    from src.database.connection import ANALYSIS_COLLECTION
+
+    refs = MongoDB.get_collection(IMAGE_REFS_COLLECTION)
+    await refs.create_index([("username", 1), ("created_at", 1)])
+    await refs.create_index("sha256")
+    await refs.create_index("created_at")
+    await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).create_index("created_at")
+    # Orphan collection looks up the analysis of every stored image
+    await MongoDB.get_collection(ANALYSIS_COLLECTION).create_index(
+        [("image_filename", 1), ("username", 1)]
+    )
+
+
+def _cleanup_legacy_storage(username: str) -> bool:
     user_dir = UPLOAD_DIR / username
     if user_dir.exists():
         shutil.rmtree(user_dir)
         return True
     return False
+
+
+async def cleanup_user_storage(username: str) -> bool:
+    """Delete all images for a user"""
+    refs = MongoDB.get_collection(IMAGE_REFS_COLLECTION).find(
+        {"username": username}, {"filename": 1}
+    )
+    deleted = False
+    for filename in [ref["filename"] async for ref in refs]:
+        deleted = await delete_image(username, filename) or deleted
+    return await _run_io("cleanup", _cleanup_legacy_storage, username) or deleted
+
+
+def _fold_legacy_file(path: Path, root: Path) -> tuple[str, int, bool]:
+    """Hash a legacy file and move it into a local blob store (or drop it as a duplicate)"""
+    size = path.stat().st_size
+    sha256 = hashlib.sha256(path.read_bytes()).hexdigest()
+    target = root / blob_key(sha256)
+    if target.exists():
+        path.unlink()
+        return sha256, size, True
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(path, target)
+    except OSError:
+        # Different filesystem
+        shutil.move(str(path), str(target))
+    return sha256, size, False
+
+
+async def _fold_legacy(path: Path) -> tuple[str, int, bool]:
+    """Move a legacy file into the configured backend"""
+    from src.storage.backends import LocalBackend
+
+    backend = _backend()
+    if isinstance(backend, LocalBackend):
+        return await _run_io("fold", _fold_legacy_file, path, backend.root)
+
+    data = await _run_io("read", path.read_bytes)
+    sha256 = _hash(data)
+    duplicate = await backend.exists(blob_key(sha256))
+    if not duplicate:
+        await backend.put(blob_key(sha256), data)
+    await _run_io("delete", _unlink, path)
+    return sha256, len(data), duplicate
+
+
+def _list_legacy_files() -> List[Path]:
+    if not UPLOAD_DIR.exists():
+        return []
+    return sorted(
+        f
+        for user_dir in UPLOAD_DIR.iterdir()
+        if user_dir.is_dir()
+        for f in user_dir.iterdir()
+        if f.is_file() and not f.name.startswith(".")
+    )
+
+
+async def fold_legacy_images(
+    dry_run: bool = False, progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
+    """
+    Move ``storage/uploads/<username>/<filename>`` files into the blob store
+
+    Every file becomes a reference under its old name, so image URLs keep
+    working, and analysis records are pointed at the blob. Duplicate files
+    are removed. With ``dry_run`` only the savings are computed.
+
+    Returns:
+        Counts of files, unique blobs and duplicates, and bytes reclaimed
+    """
+    from src.database.connection import ANALYSIS_COLLECTION
+
+    files = await _run_io("list", _list_legacy_files)
+    refs = MongoDB.get_collection(IMAGE_REFS_COLLECTION)
+    analyses = MongoDB.get_collection(ANALYSIS_COLLECTION)
+
+    stats = {"files": len(files), "blobs": 0, "duplicates": 0, "bytes_reclaimed": 0}
+    seen: set = set()
+    for done, path in enumerate(files, start=1):
+        username, filename = path.parent.name, path.name
+        if dry_run:
+            size = path.stat().st_size
+            sha256 = await _run_io(
+                "hash", lambda p=path: hashlib.sha256(p.read_bytes()).hexdigest()
+            )
+            duplicate = sha256 in seen or await _backend().exists(blob_key(sha256))
+        else:
+            sha256, size, duplicate = await _fold_legacy(path)
+            await _acquire_blob(sha256, size)
+            ref = await refs.update_one(
+                {"_id": _ref_id(username, filename)},
+                {
+                    "$setOnInsert": {
+                        "username": username,
+                        "filename": filename,
+                        "sha256": sha256,
+                        "size": size,
+                        "created_at": datetime.utcnow(),
+                    }
+                },
+                upsert=True,
+            )
+            if ref.upserted_id is None:
+                # Already folded by an interrupted earlier run
+                await _release_blob(sha256)
+            await analyses.update_many(
+                {"username": username, "image_filename": filename},
+                {
+                    "$set": {
+                        "image_path": _backend().location(blob_key(sha256)),
+                        "image_sha256": sha256,
+                    }
+                },
+            )
+        seen.add(sha256)
+        if duplicate:
+            stats["duplicates"] += 1
+            stats["bytes_reclaimed"] += size
+        else:
+            stats["blobs"] += 1
+        if progress:
+            progress(done, len(files))
+
+    logger.info(
+        f"Folded {stats['files']} legacy images into {stats['blobs']} blobs, "
+        f"reclaimed {stats['bytes_reclaimed']} bytes"
+    )
+    return stats
+
+
+def _list_flat_blobs() -> List[Path]:
+    if not BLOB_DIR.exists():
+        return []
+    return sorted(
+        f
+        for f in BLOB_DIR.iterdir()
+        if f.is_file() and len(f.name) == 64 and not f.name.startswith(".")
+    )
+
+
+def _move_blob(path: Path) -> str:
+    target = blob_path(path.name)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, target)
+    return str(target)
+
+
+async def reshard_blobs(progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """
+    Move blobs saved flat as ``storage/blobs/<sha256>`` into ``ab/cd/<sha256>``
+
+    Files are renamed in place (same filesystem) and analysis records are
+    repointed. Safe to re-run.
+    """
+    from src.database.connection import ANALYSIS_COLLECTION
+
+    files = await _run_io("list", _list_flat_blobs)
+    analyses = MongoDB.get_collection(ANALYSIS_COLLECTION)
+    moved_bytes = 0
+    for done, path in enumerate(files, start=1):
+        size = path.stat().st_size
+        target = await _run_io("move", _move_blob, path)
+        await analyses.update_many({"image_sha256": path.name}, {"$set": {"image_path": target}})
+        moved_bytes += size
+        if progress:
+            progress(done, len(files))
+
+    logger.info(f"Resharded {len(files)} blobs ({moved_bytes} bytes)")
+    return {"blobs": len(files), "bytes": moved_bytes}
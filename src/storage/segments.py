@@ -0,0 +1,395 @@
+"""
+Packed Image Segments
+=====================
+
+Archival tier for cold images. Millions of small blob files strain inodes
+and make backups and directory walks slow, so blobs older than
+``SEGMENT_PACK_AFTER_DAYS`` are packed into large append-only segment files
+(``storage/segments/<name>.dat``, up to ``SEGMENT_MAX_MB`` each). Each
+segment has a sorted offset index (``<name>.idx``: SHA-256 digest, offset
+and length per image). The index is written after the data is on disk, so
+readers only see complete segments. Both files are memory-mapped: a lookup
+is a binary search over the index and a read is a slice of the data
+mapping, streamed to the client without copying.
+
+``LocalBackend`` falls back to the segments when a blob's loose file is
+gone, so ``serve_image``, derivatives and the rest of the app read packed
+images transparently. A loose file always wins over a packed copy (blobs
+re-encoded by maintenance are written loose again). Deleting a packed blob
+only drops its record; ``compact_segments`` rewrites segments in which at
+least ``COMPACT_DEAD_RATIO`` of the bytes belong to deleted images.
+
+The blob record's ``segment`` field names the segment holding its live
+copy. Packing and compaction run as part of storage maintenance
+(``src.services.storage_maintenance``) and only apply to the local backend.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from src.database.connection import IMAGE_BLOBS_COLLECTION, MongoDB
+from src.storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_MB", "256")) * 1024 * 1024
+# 0 disables packing
+PACK_AFTER_DAYS = float(os.getenv("SEGMENT_PACK_AFTER_DAYS", "90"))
+# Segments with at least this fraction of deleted bytes are rewritten
+COMPACT_DEAD_RATIO = 0.3
+# Blobs packed per run; the rest wait for the next run
+PACK_MAX_PER_RUN = 100000
+
+# Data file: per image, a header followed by the bytes
+ENTRY_MAGIC = b"LSEG"
+ENTRY_HEADER = struct.Struct("<4s32sQ")  # magic, SHA-256 digest, length
+# Index file: records sorted by digest
+INDEX_RECORD = struct.Struct("<32sQQ")  # SHA-256 digest, data offset, length
+DIGEST_BYTES = 32
+
+Pace = Callable[[int], Awaitable[None]]
+
+
+class SegmentEntry(NamedTuple):
+    """One image in a segment"""
+
+    sha256: str
+    offset: int
+    length: int
+
+
+class Segment:
+    """A sealed segment: memory-mapped data and offset index"""
+
+    def __init__(self, data_path: Path):
+        self.name = data_path.stem
+        self.data_path = data_path
+        self.index_path = data_path.with_suffix(".idx")
+        # The mappings stay open for the life of the object: streamed
+        # responses may still hold views into them after a compaction
+        with open(self.index_path, "rb") as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.data_path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = len(self._index) // INDEX_RECORD.size
+        self.size = len(self._data)
+
+    def find(self, digest: bytes) -> Optional[Tuple[int, int]]:
+        """(offset, length) of an image, by binary search over the index"""
+        record = INDEX_RECORD.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._index[mid * record : mid * record + DIGEST_BYTES] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            found, offset, length = INDEX_RECORD.unpack_from(self._index, lo * record)
+            if found == digest:
+                return offset, length
+        return None
+
+    def view(self, offset: int, length: int) -> memoryview:
+        """Zero-copy view of an image's bytes"""
+        return memoryview(self._data)[offset : offset + length]
+
+    def entries(self) -> Iterator[SegmentEntry]:
+        for i in range(self.count):
+            digest, offset, length = INDEX_RECORD.unpack_from(self._index, i * INDEX_RECORD.size)
+            yield SegmentEntry(digest.hex(), offset, length)
+
+
+class SegmentWriter:
+    """Appends images to a new segment; ``seal`` makes it visible to readers"""
+
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        # Names sort by creation time, so newer copies of an image win
+        self.name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:6]}"
+        self._temp_path = directory / f".{self.name}.dat.tmp"
+        self._file = open(self._temp_path, "wb")
+        self._records: Dict[bytes, Tuple[int, int]] = {}
+        self.size = 0
+
+    def append(self, sha256: str, data) -> None:
+        digest = bytes.fromhex(sha256)
+        if digest in self._records:
+            return
+        self._file.write(ENTRY_HEADER.pack(ENTRY_MAGIC, digest, len(data)))
+        self._records[digest] = (self._file.tell(), len(data))
+        self._file.write(data)
+        self.size = self._file.tell()
+
+    def seal(self) -> str:
+        """Flush the data, then write the index; returns the segment name"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._temp_path, self.directory / f"{self.name}.dat")
+        index = b"".join(
+            INDEX_RECORD.pack(digest, offset, length)
+            for digest, (offset, length) in sorted(self._records.items())
+        )
+        image_storage.write_atomic(self.directory / f"{self.name}.idx", index, fsync=True)
+        return self.name
+
+    def abort(self) -> None:
+        self._file.close()
+        self._temp_path.unlink(missing_ok=True)
+
+
+class SegmentStore:
+    """The sealed segments in a directory, newest first"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._segments: List[Segment] = []
+        self._mtime: Optional[int] = None
+
+    def _refresh(self) -> None:
+        # One stat per lookup picks up segments written or removed by other processes
+        try:
+            mtime = self.directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            current = {segment.name: segment for segment in self._segments}
+            names = (
+                sorted((p.stem for p in self.directory.glob("*.idx")), reverse=True)
+                if mtime
+                else []
+            )
+            segments = []
+            for name in names:
+                segment = current.get(name)
+                if segment is None:
+                    try:
+                        segment = Segment(self.directory / f"{name}.dat")
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"Skipping unreadable segment {name}: {e}")
+                        continue
+                segments.append(segment)
+            self._segments = segments
+            self._mtime = mtime
+
+    def segments(self) -> List[Segment]:
+        self._refresh()
+        return list(self._segments)
+
+    def find(self, sha256: str) -> Optional[Tuple[Segment, int, int]]:
+        """Newest segment holding an image, with its offset and length"""
+        digest = bytes.fromhex(sha256)
+        for segment in self.segments():
+            found = segment.find(digest)
+            if found:
+                return (segment, *found)
+        return None
+
+    def view(self, sha256: str) -> Optional[memoryview]:
+        found = self.find(sha256)
+        if found is None:
+            return None
+        segment, offset, length = found
+        return segment.view(offset, length)
+
+    def remove(self, segment: Segment) -> bool:
+        """Delete a segment's files (mappings already handed out stay valid)"""
+        try:
+            segment.index_path.unlink(missing_ok=True)
+            segment.data_path.unlink(missing_ok=True)
+        except OSError as e:
+            # Windows cannot delete mapped files; the next compaction retries
+            logger.warning(f"Could not remove segment {segment.name}: {e}")
+            return False
+        self._refresh()
+        return True
+
+
+_stores: Dict[Path, SegmentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_segment_store(directory: Optional[Path] = None) -> SegmentStore:
+    """Process-wide store for a segment directory (default ``image_storage.SEGMENT_DIR``)"""
+    directory = Path(directory or image_storage.SEGMENT_DIR).resolve()
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = SegmentStore(directory)
+        return _stores[directory]
+
+
+def _local_backend():
+    from src.storage.backends import LocalBackend
+
+    backend = image_storage._backend()
+    return backend if isinstance(backend, LocalBackend) else None
+
+
+def _read_if_exists(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+async def _seal(backend, writer: SegmentWriter, packed: List[str], stats: Dict[str, int]) -> None:
+    """Publish a segment, point its blobs at it and drop their loose files"""
+    name = await image_storage._run_io("pack", writer.seal)
+    await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_many(
+        {"_id": {"$in": packed}}, {"$set": {"segment": name, "packed_at": datetime.utcnow()}}
+    )
+    for sha256 in packed:
+        await image_storage._run_io(
+            "delete", image_storage._unlink, backend.local_path(image_storage.blob_key(sha256))
+        )
+    stats["segments_written"] += 1
+
+
+async def pack_cold_blobs(
+    older_than_days: float = PACK_AFTER_DAYS, pace: Optional[Pace] = None, dry_run: bool = False
+) -> Dict[str, int]:
+    """
+    Move loose blobs older than ``older_than_days`` into new segments
+
+    Returns:
+        Counts of packed images, segments written and bytes packed
+    """
+    stats = {"packed": 0, "segments_written": 0, "bytes_packed": 0}
+    backend = _local_backend()
+    if backend is None or older_than_days <= 0:
+        return stats
+
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    cursor = (
+        blobs.find(
+            {
+                "created_at": {"$lt": cutoff},
+                "segment": {"$exists": False},
+                "ref_count": {"$gt": 0},
+                "deleting": {"$ne": True},
+            },
+            {"_id": 1},
+        )
+        .sort("created_at", 1)
+        .limit(PACK_MAX_PER_RUN)
+    )
+    candidates = [blob["_id"] async for blob in cursor]
+
+    writer: Optional[SegmentWriter] = None
+    packed: List[str] = []
+    try:
+        for sha256 in candidates:
+            data = await image_storage._run_io(
+                "read", _read_if_exists, backend.local_path(image_storage.blob_key(sha256))
+            )
+            if data is None:
+                continue
+            if pace:
+                await pace(len(data))
+            stats["packed"] += 1
+            stats["bytes_packed"] += len(data)
+            if dry_run:
+                continue
+            if writer is None:
+                writer = SegmentWriter(backend.segment_dir)
+            await image_storage._run_io("pack", writer.append, sha256, data)
+            packed.append(sha256)
+            if writer.size >= SEGMENT_MAX_BYTES:
+                await _seal(backend, writer, packed, stats)
+                writer, packed = None, []
+        if writer is not None:
+            await _seal(backend, writer, packed, stats)
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    logger.info(f"Packed {stats['packed']} cold images into {stats['segments_written']} segments")
+    return stats
+
+
+async def compact_segments(
+    dead_ratio: float = COMPACT_DEAD_RATIO, pace: Optional[Pace] = None, dry_run: bool = False
+) -> Dict[str, int]:
+    """
+    Rewrite segments in which deleted images take ``dead_ratio`` of the bytes or more
+
+    Live images are copied into a new segment and the old one is removed.
+
+    Returns:
+        Counts of segments rewritten and bytes reclaimed
+    """
+    stats = {"segments_rewritten": 0, "bytes_reclaimed": 0}
+    backend = _local_backend()
+    if backend is None:
+        return stats
+
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    store = backend.segments
+    for segment in reversed(store.segments()):
+        entries = list(segment.entries())
+        # A blob deleted and then uploaded again while packed has a new record
+        # without a segment: the packed copy is still its only one
+        live_ids = {
+            blob["_id"]
+            async for blob in blobs.find(
+                {
+                    "_id": {"$in": [entry.sha256 for entry in entries]},
+                    "$or": [
+                        {"segment": segment.name},
+                        {"segment": {"$exists": False}, "ref_count": {"$gt": 0}},
+                    ],
+                },
+                {"_id": 1},
+            )
+        }
+        live = [entry for entry in entries if entry.sha256 in live_ids]
+        live_bytes = sum(ENTRY_HEADER.size + entry.length for entry in live)
+        if live and (segment.size - live_bytes) < segment.size * dead_ratio:
+            continue
+
+        if not dry_run:
+            if live:
+                writer = SegmentWriter(store.directory)
+                try:
+                    for entry in live:
+                        if pace:
+                            await pace(entry.length)
+                        view = segment.view(entry.offset, entry.length)
+                        await image_storage._run_io("pack", writer.append, entry.sha256, view)
+                    name = await image_storage._run_io("pack", writer.seal)
+                except BaseException:
+                    writer.abort()
+                    raise
+                await blobs.update_many(
+                    {
+                        "_id": {"$in": [entry.sha256 for entry in live]},
+                        "$or": [{"segment": segment.name}, {"segment": {"$exists": False}}],
+                    },
+                    {"$set": {"segment": name}},
+                )
+            if not await image_storage._run_io("delete", store.remove, segment):
+                continue
+        stats["segments_rewritten"] += 1
+        stats["bytes_reclaimed"] += segment.size - live_bytes
+
+    logger.info(
+        f"Rewrote {stats['segments_rewritten']} segments, reclaimed {stats['bytes_reclaimed']} bytes"
+    )
+    return stats
@@ -0,0 +1,202 @@
+"""
+CPU Preprocessing Pool
+======================
+
+Runs the CPU-bound part of an analysis (decode/resize for the similarity
+embedding, SHA-256 and base64 encoding) in a process pool so it scales across
+cores instead of serialising on the GIL. I/O stages stay on the event loop.
+
+Image bytes go to the worker, and the base64 payload comes back, through
+``multiprocessing.shared_memory`` blocks; only their names and small results
+are pickled. The pool is sized to the CPUs available to the process
+(``CPU_POOL_WORKERS`` overrides; 0 disables the pool and runs the same work
+in a thread).
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from src.utils.uploads import DATA_URL_PREFIX, base64_length, encode_data_url, encode_into
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreprocessResult:
+    """Output of the CPU stages for one image"""
+
+    # data:image/jpeg;base64,... (None when encoding was not requested)
+    data_url: Optional[str]
+    sha256: str
+    feature_vector: Optional[List[float]] = None
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_size() -> int:
+    """Number of worker processes (0 = pool disabled)"""
+    configured = os.getenv("CPU_POOL_WORKERS")
+    if configured is not None:
+        return max(0, int(configured))
+    return _available_cpus()
+
+
+def _preprocess(
+    data: memoryview, compute_features: bool, encode: bool
+) -> Tuple[Optional[str], str, Optional[List[float]]]:
+    """In-process variant of the worker (used when the pool is disabled)"""
+    from src.services.similarity_service import compute_feature_vector
+
+    digest = hashlib.sha256(data).hexdigest()
+    features = compute_feature_vector(data) if compute_features else None
+    encoded = encode_data_url(data) if encode else None
+    return encoded, digest, features
+
+
+def _preprocess_worker(
+    input_name: str, size: int, compute_features: bool, encode: bool
+) -> Tuple[Optional[str], int, str, Optional[List[float]]]:
+    """
+    Worker entry point: read the image from shared memory, write the data URL back
+
+    Returns the output block name and length (None/0 if not encoding), the
+    SHA-256 and the embedding.
+    """
+    from src.services.similarity_service import compute_feature_vector
+
+    source = shared_memory.SharedMemory(name=input_name)
+    try:
+        with source.buf[:size] as data:
+            digest = hashlib.sha256(data).hexdigest()
+            features = compute_feature_vector(data) if compute_features else None
+
+            if not encode:
+                return None, 0, digest, features
+
+            prefix = DATA_URL_PREFIX
+            encoded_size = len(prefix) + base64_length(size)
+            output = shared_memory.SharedMemory(create=True, size=encoded_size)
+            try:
+                output.buf[: len(prefix)] = prefix
+                encode_into(data, output.buf[len(prefix) : encoded_size])
+            except BaseException:
+                output.close()
+                output.unlink()
+                raise
+            output.close()
+    finally:
+        source.close()
+    return output.name, encoded_size, digest, features
+
+
+def _unlink_block(name: str) -> None:
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def _discard_output(future: Future) -> None:
+    """Free the output block of a worker call nobody is waiting for any more"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    output_name = future.result()[0]
+    if output_name is not None:
+        _unlink_block(output_name)
+
+
+class CPUPool:
+    """Lazily started process pool for CPU-bound image preprocessing"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = pool_size() if workers is None else workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: never fork a process that has an event loop and driver threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Started CPU preprocessing pool with {self.workers} workers")
+        return self._executor
+
+    async def preprocess(
+        self, contents: bytes, compute_features: bool = True, encode: bool = True
+    ) -> PreprocessResult:
+        """Hash, embed and (optionally) encode an image as a data URL off the event loop"""
+        if not self.enabled:
+            encoded, digest, features = await asyncio.to_thread(
+                _preprocess, memoryview(contents), compute_features, encode
+            )
+            return PreprocessResult(encoded, digest, features)
+
+        source = shared_memory.SharedMemory(create=True, size=max(1, len(contents)))
+        try:
+            source.buf[: len(contents)] = contents
+            future = self._get_executor().submit(
+                _preprocess_worker, source.name, len(contents), compute_features, encode
+            )
+            try:
+                output_name, encoded_size, digest, features = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # The worker may already be running: free its output once it is done
+                future.add_done_callback(_discard_output)
+                raise
+        finally:
+            source.close()
+            source.unlink()
+
+        if output_name is None:
+            return PreprocessResult(None, digest, features)
+
+        output = shared_memory.SharedMemory(name=output_name)
+        try:
+            with output.buf[:encoded_size] as encoded:
+                data_url = str(encoded, "ascii")
+        finally:
+            output.close()
+            output.unlink()
+        return PreprocessResult(data_url, digest, features)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+_cpu_pool: Optional[CPUPool] = None
+
+
+def get_cpu_pool() -> CPUPool:
+    """Process-wide CPU preprocessing pool"""
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = CPUPool()
+    return _cpu_pool
+
+
+def shutdown_cpu_pool() -> None:
+    """Stop worker processes (called on application shutdown)"""
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown()
+        _cpu_pool = None
@@ -0,0 +1,219 @@
+"""
+Upload Memory Budget
+====================
+
+One budget per process for the bytes that upload handling holds in memory,
+shared by every upload route, so that concurrent batches wait for each other
+or are turned away with 503 instead of running the process out of memory.
+
+- The pipeline reserves an image's size plus its base64 encoding just before
+  reading it and releases the reservation once its record is stored. Images
+  of an admitted batch that do not fit wait for room, first come first
+  served; one that waits longer than ``UPLOAD_MEMORY_WAIT_SECONDS`` fails
+  with 503 (the rest of the batch carries on).
+- JSON upload bodies (base64 images) are held in memory while the request
+  runs, so ``UploadSizeLimitMiddleware`` reserves twice their size (the raw
+  body and the strings parsed from it) for the whole request. It is kept in
+  ``request.state.upload_memory``; the images of that body take their share
+  out of it (``split``) rather than reserving the same bytes again.
+- While the budget is tight (``UPLOAD_MEMORY_HIGH_WATER`` of it or more in
+  use, or images waiting) new upload requests get 503 with ``Retry-After``
+  before their body is read.
+- A reservation larger than the whole budget is capped at the budget, so a
+  very large image is admitted on its own rather than never.
+
+Multipart file parts are spooled to disk by Starlette and only count once
+they are read.
+
+Configuration (environment):
+    UPLOAD_MEMORY_BUDGET_MB     bytes held for uploads per process (default 1024, 0 disables)
+    UPLOAD_MEMORY_HIGH_WATER    share in use from which new uploads get 503 (default 0.9)
+    UPLOAD_MEMORY_WAIT_SECONDS  longest an image waits for room (default 30)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BUDGET_MB = int(os.getenv("UPLOAD_MEMORY_BUDGET_MB", "1024"))
+HIGH_WATER = float(os.getenv("UPLOAD_MEMORY_HIGH_WATER", "0.9"))
+WAIT_SECONDS = float(os.getenv("UPLOAD_MEMORY_WAIT_SECONDS", "30"))
+
+# Suggested to clients that are turned away
+RETRY_AFTER_SECONDS = 5
+
+
+def busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy processing other uploads, please retry shortly",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+class MemoryReservation:
+    """Bytes held against the budget until released"""
+
+    def __init__(
+        self, budget: "MemoryBudget", nbytes: int, parent: Optional["MemoryReservation"] = None
+    ):
+        self._budget = budget
+        self.nbytes = nbytes
+        self.released = False
+        self._parent = parent
+
+    def grow(self, nbytes: int) -> None:
+        """Count more bytes that are already in memory (never waits)"""
+        if not self.released and self._budget.limit_bytes:
+            self._budget._in_use += nbytes
+            self.nbytes += nbytes
+
+    def split(self, nbytes: int) -> Optional["MemoryReservation"]:
+        """
+        Move ``nbytes`` of this reservation into a new one (None if it holds fewer)
+
+        The bytes return here when the new reservation is released, or to
+        the budget if this one was released first.
+        """
+        if self.released or nbytes > self.nbytes:
+            return None
+        self.nbytes -= nbytes
+        return MemoryReservation(self._budget, nbytes, parent=self)
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self._parent is not None and not self._parent.released:
+            self._parent.nbytes += self.nbytes
+        else:
+            self._budget._release(self.nbytes)
+
+    def __enter__(self) -> "MemoryReservation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class MemoryBudget:
+    """Byte budget with FIFO waiting and high-water admission"""
+
+    def __init__(
+        self,
+        limit_bytes: int,
+        high_water: Optional[float] = None,
+        wait_seconds: Optional[float] = None,
+    ):
+        self.limit_bytes = max(0, limit_bytes)
+        self.high_water = HIGH_WATER if high_water is None else high_water
+        self.wait_seconds = WAIT_SECONDS if wait_seconds is None else wait_seconds
+        self._in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit_bytes": self.limit_bytes,
+            "in_use_bytes": self._in_use,
+            "waiting": sum(1 for _, future in self._waiters if not future.done()),
+        }
+
+    def is_tight(self) -> bool:
+        """Whether new upload requests should be turned away"""
+        if not self.limit_bytes:
+            return False
+        waiting = any(not future.done() for _, future in self._waiters)
+        return waiting or self._in_use >= self.high_water * self.limit_bytes
+
+    def _cap(self, nbytes: int) -> int:
+        return min(max(0, nbytes), self.limit_bytes)
+
+    def try_reserve(self, nbytes: int) -> Optional[MemoryReservation]:
+        """Reserve at once, or None if the bytes do not fit (or others are waiting)"""
+        if not self.limit_bytes:
+            return MemoryReservation(self, 0)
+        nbytes = self._cap(nbytes)
+        if self._waiters or self._in_use + nbytes > self.limit_bytes:
+            return None
+        self._in_use += nbytes
+        return MemoryReservation(self, nbytes)
+
+    async def reserve(self, nbytes: int, timeout: Optional[float] = None) -> MemoryReservation:
+        """
+        Reserve, waiting for room if needed
+
+        Raises:
+            HTTPException: 503 if there is no room within ``timeout`` seconds
+        """
+        reservation = self.try_reserve(nbytes)
+        if reservation is not None:
+            return reservation
+
+        nbytes = self._cap(nbytes)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.wait_seconds if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted just as the wait ended
+                future.result().release()
+            else:
+                future.cancel()
+            self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.observe("memory_budget.rejected", time.perf_counter() - start)
+                logger.warning(
+                    f"No room in the upload memory budget for {nbytes} bytes: {self.stats()}"
+                )
+                raise busy_error()
+            raise
+        metrics.observe("memory_budget.wait", time.perf_counter() - start)
+        return future.result()
+
+    def _release(self, nbytes: int) -> None:
+        self._in_use -= nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        """Grant waiting reservations in order while they fit"""
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self._in_use + nbytes > self.limit_bytes:
+                return
+            self._waiters.popleft()
+            self._in_use += nbytes
+            future.set_result(MemoryReservation(self, nbytes))
+
+
+def request_reservation(request) -> Optional[MemoryReservation]:
+    """The body reservation ``UploadSizeLimitMiddleware`` holds for a request, if any"""
+    return getattr(request.state, "upload_memory", None)
+
+
+_budget: Optional[MemoryBudget] = None
+
+
+def get_memory_budget() -> MemoryBudget:
+    """The process-wide upload memory budget"""
+    global _budget
+    if _budget is None:
+        _budget = MemoryBudget(BUDGET_MB * 1024 * 1024)
+    return _budget
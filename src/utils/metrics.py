@@ -0,0 +1,117 @@
+"""
+In-Process Metrics
+==================
+
+Lightweight latency and allocation tracking for request stages.
+
+Routes wrap each unit of server-side work in ``stage("name")``. Every stage
+records its wall-clock time; when ``tracemalloc`` is tracing (benchmarks),
+the net bytes allocated are recorded as well. ``metrics.snapshot()`` returns
+counts, totals and p50/p95/p99 per metric.
+"""
+
+import math
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+
+# Number of most recent samples kept per metric for percentile estimates
+SAMPLE_WINDOW = 2048
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class _Series:
+    """Rolling window of observations for one metric"""
+
+    __slots__ = ("count", "total", "max", "samples", "alloc_bytes")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_WINDOW)
+        self.alloc_bytes = 0
+
+    def observe(self, value: float, alloc_bytes: int = 0) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+        self.alloc_bytes += alloc_bytes
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        summary = {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 3),
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+        if self.alloc_bytes:
+            summary["alloc_bytes"] = self.alloc_bytes
+            summary["alloc_bytes_avg"] = self.alloc_bytes // self.count
+        return summary
+
+
+class MetricsRegistry:
+    """Thread-safe registry of named latency series"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[str, _Series] = {}
+
+    def observe(self, name: str, seconds: float, alloc_bytes: int = 0) -> None:
+        """Record one observation (in seconds) for a metric"""
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = _Series()
+            series.observe(seconds, alloc_bytes)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Time the wrapped block and record it under ``name``"""
+        tracing = tracemalloc.is_tracing()
+        alloc_start = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            alloc = max(0, tracemalloc.get_traced_memory()[0] - alloc_start) if tracing else 0
+            self.observe(name, elapsed, alloc)
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Dict[str, float]]:
+        """Get summaries for all metrics, optionally filtered by name prefix"""
+        with self._lock:
+            return {
+                name: series.summary()
+                for name, series in sorted(self._series.items())
+                if name.startswith(prefix)
+            }
+
+    def reset(self) -> None:
+        """Drop all recorded observations"""
+        with self._lock:
+            self._series.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def stage(name: str):
+    """Time one stage of request processing (recorded as ``stage.<name>``)"""
+    return metrics.timer(f"stage.{name}")
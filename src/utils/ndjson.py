@@ -0,0 +1,46 @@
+"""
+NDJSON Streaming
+================
+
+Newline-delimited JSON responses for the batch endpoints. A client that sends
+``Accept: application/x-ndjson`` gets one JSON object per line as soon as it
+is produced instead of one document at the end.
+
+The response pulls lines from an async iterator only when the previous line
+has been handed to the server, so a slow client slows the producer down
+instead of results piling up in memory.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from src.utils.streaming import encode_stream, streaming_response
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    """Whether the Accept header asks for NDJSON"""
+    if not accept:
+        return False
+    return any(part.split(";")[0].strip() == NDJSON_MEDIA_TYPE for part in accept.split(","))
+
+
+def encode_line(obj: Any) -> bytes:
+    return json.dumps(jsonable_encoder(obj), separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _encode_error(detail: str) -> bytes:
+    return encode_line({"type": "error", "detail": detail})
+
+
+def ndjson_response(
+    lines: AsyncIterator[Dict[str, Any]], headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """Stream ``lines`` as NDJSON, one object per line"""
+    return streaming_response(
+        encode_stream(lines, encode_line, _encode_error, "NDJSON"), NDJSON_MEDIA_TYPE, headers
+    )
@@ -0,0 +1,52 @@
+"""
+Server-Sent Events
+==================
+
+``text/event-stream`` responses for live progress. Every event is one
+``event:`` line naming its type and one ``data:`` line of JSON. While
+nothing happens a comment line is sent every ``KEEPALIVE_SECONDS`` so
+proxies do not close the idle connection.
+
+Browsers can read the stream with ``EventSource``, or with ``fetch`` when
+they need to send an ``Authorization`` header (the dashboard does).
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from src.utils.streaming import encode_stream, streaming_response
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+KEEPALIVE_SECONDS = 15
+
+# Yielded by an event source to have a keep-alive comment sent
+KEEPALIVE = None
+
+
+def encode_event(event: str, data: Any) -> bytes:
+    payload = json.dumps(jsonable_encoder(data), separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+def _encode_item(item: Optional[Tuple[str, Dict[str, Any]]]) -> bytes:
+    if item is KEEPALIVE:
+        return b": keep-alive\n\n"
+    return encode_event(*item)
+
+
+def _encode_error(detail: str) -> bytes:
+    return encode_event("error", {"detail": detail})
+
+
+def sse_response(
+    events: AsyncIterator[Optional[Tuple[str, Dict[str, Any]]]],
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """Stream ``(event, data)`` pairs as Server-Sent Events"""
+    return streaming_response(
+        encode_stream(events, _encode_item, _encode_error, "Event"), SSE_MEDIA_TYPE, headers
+    )
@@ -0,0 +1,44 @@
+"""
+Streaming Responses
+===================
+
+Shared plumbing for the NDJSON and Server-Sent Events responses: the
+encoding loop that turns a producer's failure into a final in-band error
+record, and the headers that keep proxies from caching or buffering.
+"""
+
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional, TypeVar
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def encode_stream(
+    items: AsyncIterator[T],
+    encode: Callable[[T], bytes],
+    encode_error: Callable[[str], bytes],
+    name: str,
+) -> AsyncIterator[bytes]:
+    """Encode ``items``; if the producer raises, end with ``encode_error(detail)``"""
+    try:
+        async for item in items:
+            yield encode(item)
+    except Exception as e:
+        # Headers are already sent: report the failure in-band and end the stream
+        logger.error(f"{name} stream failed: {str(e)}")
+        yield encode_error(str(e))
+
+
+def streaming_response(
+    body: AsyncIterator[bytes], media_type: str, headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """Stream ``body`` uncached and unbuffered by proxies"""
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no", **(headers or {})},
+    )
@@ -0,0 +1,173 @@
+"""
+Pre-flight Token Estimation
+===========================
+
+Estimates the prompt/completion tokens and cost of a vision analysis before
+the model is called, from the image dimensions read out of the file header
+(no decode). The provider resizes images into fixed-size tiles, so token
+cost follows the normalised dimensions rather than the encoded byte size.
+"""
+
+import math
+import struct
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from src.database.admin_models import GROQ_PRICING
+
+DEFAULT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+# Vision preprocessing of the Llama 4 models: images are scaled to fit at most
+# MAX_TILES tiles of TILE_SIZE px; multi-tile images also get one global tile.
+TILE_SIZE = 336
+MAX_TILES = 16
+TOKENS_PER_TILE = 144
+
+# Text part of the analysis prompt plus chat template overhead
+PROMPT_TEXT_TOKENS = 700
+
+# Typical completion length of the JSON answer (the hard cap is max_tokens)
+EXPECTED_COMPLETION_TOKENS = 260
+
+DEFAULT_PRICING = {"input": 0.05, "output": 0.08}
+
+
+@dataclass
+class TokenEstimate:
+    """Pre-flight estimate for one image analysis"""
+
+    width: Optional[int]
+    height: Optional[int]
+    tiles: int
+    prompt_tokens: int
+    completion_tokens: int
+    estimated_cost_usd: float
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def get_image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from a JPEG, PNG, GIF, WebP or BMP header"""
+    if len(data) < 26:
+        return None
+
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height
+
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", data[6:10])
+        return width, height
+
+    if data[:2] == b"BM":
+        width, height = struct.unpack("<ii", data[18:26])
+        return width, abs(height)
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        chunk = data[12:16]
+        if chunk == b"VP8 " and len(data) >= 30:
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and len(data) >= 25:
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X" and len(data) >= 30:
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return width, height
+        return None
+
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_dimensions(data)
+
+    return None
+
+
+def _jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Walk JPEG segments until a start-of-frame marker"""
+    offset = 2
+    length = len(data)
+    while offset + 9 < length:
+        if data[offset] != 0xFF:
+            offset += 1
+            continue
+        marker = data[offset + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker == 0xFF:
+            offset += 1
+            continue
+        segment_length = struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+        # SOF0-SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def normalize_dimensions(width: int, height: int) -> Tuple[int, int, int]:
+    """Scale dimensions down to the provider's tile budget; returns (w, h, tiles)"""
+    width, height = max(1, width), max(1, height)
+    scale = 1.0
+    while True:
+        w = max(1, int(width * scale))
+        h = max(1, int(height * scale))
+        tiles = math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE)
+        if tiles <= MAX_TILES:
+            return w, h, tiles
+        scale *= 0.9
+
+
+def calculate_cost(prompt_tokens: int, completion_tokens: int, model: str = DEFAULT_MODEL) -> float:
+    """Cost in USD for the given token counts"""
+    pricing = GROQ_PRICING.get(model, DEFAULT_PRICING)
+    return (prompt_tokens / 1_000_000) * pricing["input"] + (
+        completion_tokens / 1_000_000
+    ) * pricing["output"]
+
+
+def estimate_analysis_tokens(
+    image_bytes: bytes,
+    model: str = DEFAULT_MODEL,
+    completion_tokens: int = EXPECTED_COMPLETION_TOKENS,
+) -> TokenEstimate:
+    """
+    Estimate tokens and cost of analysing an image before calling the model
+
+    Unreadable headers are charged as a full tile budget (worst case).
+    """
+    dimensions = get_image_dimensions(image_bytes)
+    if dimensions:
+        width, height = dimensions
+        _, _, tiles = normalize_dimensions(width, height)
+    else:
+        width = height = None
+        tiles = MAX_TILES
+
+    # Multi-tile images get an extra downscaled global view
+    image_tiles = tiles + 1 if tiles > 1 else tiles
+    prompt_tokens = PROMPT_TEXT_TOKENS + image_tiles * TOKENS_PER_TILE
+
+    return TokenEstimate(
+        width=width,
+        height=height,
+        tiles=tiles,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        estimated_cost_usd=calculate_cost(prompt_tokens, completion_tokens, model),
+    )
+
+
+def usage_cost(
+    token_usage: Optional[dict], estimate: TokenEstimate, model: str = DEFAULT_MODEL
+) -> float:
+    """Actual cost from provider token usage, falling back to the estimate"""
+    if token_usage and token_usage.get("prompt_tokens") is not None:
+        return calculate_cost(
+            token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0), model
+        )
+    return estimate.estimated_cost_usd
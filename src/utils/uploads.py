@@ -0,0 +1,136 @@
+"""
+Upload Handling Utilities
+=========================
+
+Size-limited reading of uploaded images and copy-free data URL encoding.
+
+Starlette already spools multipart file parts to a temporary file (in memory
+up to 1MB, on disk beyond). ``read_upload`` checks the part size against the
+user's plan before reading anything and then reads it in chunks straight
+into one preallocated buffer, so an upload is held in memory once. Oversized
+request bodies are cut off while they arrive by
+``src.middleware.upload_limit.UploadSizeLimitMiddleware``.
+"""
+
+import binascii
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+# Read uploads in chunks of this size
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Input bytes per base64 chunk (multiple of 3 so chunks concatenate cleanly)
+ENCODE_CHUNK_BYTES = 3 * 1024 * 1024
+
+# Used when the user has no subscription (matches the plan model default)
+DEFAULT_MAX_IMAGE_SIZE_MB = 10
+
+# Uncompressed size cap of one archive upload (bulk-analysis/archive)
+ARCHIVE_MAX_TOTAL_MB = int(os.getenv("ARCHIVE_MAX_TOTAL_MB", "2048"))
+
+PLAN_LIMIT_CACHE_TTL_SECONDS = 60
+
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+_plan_limit_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def base64_length(size: int) -> int:
+    """Length of the base64 encoding of ``size`` bytes"""
+    return 4 * ((size + 2) // 3)
+
+
+def encode_into(data: memoryview, out: memoryview) -> None:
+    """Base64-encode ``data`` into ``out`` chunk by chunk, without a full temporary copy"""
+    position = 0
+    for offset in range(0, len(data), ENCODE_CHUNK_BYTES):
+        encoded = binascii.b2a_base64(data[offset : offset + ENCODE_CHUNK_BYTES], newline=False)
+        out[position : position + len(encoded)] = encoded
+        position += len(encoded)
+
+
+def encode_data_url(contents: bytes, prefix: bytes = DATA_URL_PREFIX) -> str:
+    """
+    Build ``data:image/jpeg;base64,...`` for an image
+
+    The encoding is written into one buffer that already holds the prefix, so
+    the only full-size copies are that buffer and the final string (instead
+    of base64 bytes, their str, and an f-string around it).
+    """
+    buffer = bytearray(len(prefix) + base64_length(len(contents)))
+    buffer[: len(prefix)] = prefix
+    with memoryview(buffer) as view, memoryview(contents) as data:
+        encode_into(data, view[len(prefix) :])
+    return buffer.decode("ascii")
+
+
+async def get_upload_limit_mb(user_id: str) -> int:
+    """Maximum image size of the user's plan in MB (cached)"""
+    cached = _plan_limit_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    from src.services.subscription_service import SubscriptionService
+
+    limit = DEFAULT_MAX_IMAGE_SIZE_MB
+    subscription = await SubscriptionService.get_user_subscription(user_id)
+    if subscription:
+        plan = await SubscriptionService.get_plan_by_id(subscription.plan_id)
+        if plan:
+            limit = plan.max_image_size_mb
+
+    _plan_limit_cache[user_id] = (time.monotonic() + PLAN_LIMIT_CACHE_TTL_SECONDS, limit)
+    return limit
+
+
+def clear_upload_limit_cache() -> None:
+    _plan_limit_cache.clear()
+
+
+def _too_large(limit_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File size exceeds {limit_bytes // (1024 * 1024)}MB limit",
+    )
+
+
+def check_size(size: int, limit_bytes: Optional[int]) -> None:
+    """Raise 413 if ``size`` is over the limit"""
+    if limit_bytes and size > limit_bytes:
+        raise _too_large(limit_bytes)
+
+
+async def read_upload(upload: UploadFile, limit_bytes: Optional[int] = None) -> bytearray:
+    """
+    Read an uploaded file in chunks, enforcing ``limit_bytes`` as it goes
+
+    Returns a bytearray (bytes-like; hashlib, base64, Pillow and file writes
+    accept it) so the data is not copied once more into an immutable bytes.
+    """
+    if upload.size is not None:
+        check_size(upload.size, limit_bytes)
+        buffer = bytearray(upload.size)
+        with memoryview(buffer) as view:
+            filled = 0
+            while filled < len(buffer):
+                read = await run_in_threadpool(
+                    upload.file.readinto, view[filled : filled + READ_CHUNK_BYTES]
+                )
+                if not read:
+                    break
+                filled += read
+        del buffer[filled:]
+        return buffer
+
+    # Size unknown: grow while reading
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return buffer
+        buffer += chunk
+        check_size(len(buffer), limit_bytes)
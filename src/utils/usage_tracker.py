@@ -7,8 +7,9 @@ import logging
 from datetime import datetime
 from typing import Optional
 
-from src.database.admin_models import GROQ_PRICING, PERPLEXITY_PRICING
+from src.database.admin_models import PERPLEXITY_PRICING
 from src.database.connection import MongoDB
+from src.utils.token_estimator import calculate_cost
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,7 @@ async def track_groq_usage(
     error_message: Optional[str] = None,
     input_tokens: Optional[int] = None,
     output_tokens: Optional[int] = None,
+    endpoint: str = "disease-detection",
 ):
     """
     Track Groq API usage with cost calculation
@@ -37,33 +39,25 @@ async def track_groq_usage(
         error_message: Error message if failed
         input_tokens: Number of input tokens (prompt)
         output_tokens: Number of output tokens (completion)
+        endpoint: Entry point that made the call
     """
     try:
-        # Get pricing for the model
-        pricing = GROQ_PRICING.get(
-            model, {"input": 0.05, "output": 0.08}
-        )  # Default to llama-4-scout pricing
-
         # Calculate cost based on input/output tokens if available
         if input_tokens is not None and output_tokens is not None:
-            input_cost = (input_tokens / 1_000_000) * pricing["input"]
-            output_cost = (output_tokens / 1_000_000) * pricing["output"]
-            estimated_cost = input_cost + output_cost
+            estimated_cost = calculate_cost(input_tokens, output_tokens, model)
             total_tokens = input_tokens + output_tokens
         else:
             # Fallback: estimate 70% input, 30% output split
             input_tokens_est = int(tokens_used * 0.7)
             output_tokens_est = int(tokens_used * 0.3)
-            input_cost = (input_tokens_est / 1_000_000) * pricing["input"]
-            output_cost = (output_tokens_est / 1_000_000) * pricing["output"]
-            estimated_cost = input_cost + output_cost
+            estimated_cost = calculate_cost(input_tokens_est, output_tokens_est, model)
             total_tokens = tokens_used
 
         usage_record = {
             "user_id": user_id,
             "username": username,
             "api_type": "groq",
-            "endpoint": "disease-detection",
+            "endpoint": endpoint,
             "model_used": model,
             "tokens_used": total_tokens,
             "input_tokens": input_tokens or input_tokens_est,
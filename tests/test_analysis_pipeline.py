@@ -0,0 +1,178 @@
+"""
+Tests for the shared analysis pipeline
+"""
+
+import asyncio
+import base64
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+from src.services import analysis_pipeline
+from src.services.analysis_pipeline import AnalysisInput, AnalysisPipeline, PipelineOptions
+from src.utils.metrics import metrics
+
+
+@pytest.mark.integration
+async def test_pre_processor_can_short_circuit_model():
+    """Test that a pre-processor result skips budget, base64 and model stages"""
+    seen = []
+
+    async def cached_answer(ctx):
+        ctx.result = {"disease_detected": False, "disease_type": "healthy", "confidence": 90}
+
+    async def tag_result(ctx):
+        ctx.result["description"] = "from cache"
+
+    pipeline = AnalysisPipeline(
+        pre_processors=[cached_answer],
+        post_processors=[tag_result],
+        stage_hooks=[lambda name, ctx, seconds: seen.append(name)],
+    )
+    image = make_test_images(1, width=64, height=48)[0]
+
+    async with benchmark_environment() as (_client, user):
+        ctx = await pipeline.run(
+            user, AnalysisInput(filename="leaf.jpg", contents=image), PipelineOptions()
+        )
+
+    assert ctx.success
+    assert ctx.record.description == "from cache"
+    assert "model" not in seen and "budget_check" not in seen
+    assert {"read", "save", "insert"} <= set(seen)
+
+
+@pytest.mark.integration
+async def test_failed_analysis_cancels_feature_extraction(monkeypatch):
+    """Test that the embedding task is not left running when the analysis fails after the model"""
+    started, release = threading.Event(), threading.Event()
+
+    def slow_features(contents):
+        started.set()
+        release.wait(5)
+        return [0.0]
+
+    async def fails(ctx):
+        raise HTTPException(status_code=502, detail="post-processor failed")
+
+    monkeypatch.setattr(analysis_pipeline, "compute_feature_vector", slow_features)
+    pipeline = AnalysisPipeline(post_processors=[fails])
+    image = make_test_images(1, width=64, height=48)[0]
+
+    try:
+        async with benchmark_environment() as (_client, user):
+            with pytest.raises(HTTPException):
+                await pipeline.run(
+                    user, AnalysisInput(filename="leaf.jpg", contents=image), PipelineOptions()
+                )
+            await asyncio.sleep(0)
+            pending = [
+                task
+                for task in asyncio.all_tasks()
+                if task.get_coro().__qualname__ == "to_thread" and not task.done()
+            ]
+    finally:
+        release.set()
+
+    assert started.is_set() and pending == []
+
+
+@pytest.mark.integration
+async def test_run_many_isolates_failures_and_keeps_order():
+    """Test that one bad image does not fail the batch and order is preserved"""
+    images = make_test_images(3, width=64, height=48)
+    inputs = [
+        AnalysisInput(filename="a.jpg", base64_data=base64.b64encode(images[0]).decode(), index=0),
+        AnalysisInput(filename="b.jpg", base64_data="", index=1),
+        AnalysisInput(filename="c.jpg", contents=images[2], index=2),
+    ]
+
+    async with benchmark_environment() as (_client, user):
+        contexts = await AnalysisPipeline().run_many(user, inputs, PipelineOptions(), concurrency=3)
+
+    assert [ctx.input.index for ctx in contexts] == [0, 1, 2]
+    assert [ctx.success for ctx in contexts] == [True, False, True]
+    assert contexts[1].status_code == 400
+
+
+@pytest.mark.integration
+async def test_bulk_endpoint_runs_on_pipeline():
+    """Test that enterprise bulk analysis goes through the shared stages"""
+    images = make_test_images(3, width=64, height=48)
+    files = [("files", (f"leaf{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images)]
+
+    async with benchmark_environment() as (client, _user):
+        response = await client.post("/api/enterprise/bulk-analysis", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["processed_images"] == 3
+    assert [r["index"] for r in body["results"]] == [0, 1, 2]
+    assert all(r["analysis"]["batch_id"] == body["batch_id"] for r in body["results"])
+
+
+@pytest.mark.integration
+async def test_iter_completed_yields_in_completion_order_and_batches_inserts(monkeypatch):
+    """Test that a slow image does not hold back the others and records go in chunks"""
+    monkeypatch.setattr(analysis_pipeline, "INSERT_MAX_WAIT_SECONDS", 5.0)
+    images = make_test_images(7, width=64, height=48)
+    inputs = [
+        AnalysisInput(filename=f"{i}.jpg", contents=image, index=i)
+        for i, image in enumerate(images)
+    ]
+    inputs.append(AnalysisInput(filename="empty.jpg", contents=b"", index=7))
+
+    async def slow_first(ctx):
+        if ctx.input.index == 0:
+            await asyncio.sleep(0.2)
+
+    pipeline = AnalysisPipeline(pre_processors=[slow_first])
+    async with benchmark_environment() as (_client, user):
+        metrics.reset()
+        order = [
+            ctx.input.index
+            async for ctx in pipeline.iter_completed(
+                user, inputs, PipelineOptions(), concurrency=4, insert_batch_size=3
+            )
+        ]
+        writes = metrics.snapshot("stage.insert_many")["stage.insert_many"]["count"]
+        stored = await MongoDB.get_collection(ANALYSIS_COLLECTION).count_documents({})
+
+    assert order[-1] == 0 and sorted(order) == list(range(8))
+    assert stored == 7
+    assert writes == 3
+
+
+@pytest.mark.integration
+async def test_api_batch_runs_at_plan_concurrency_with_ordered_results():
+    """Test that /api/v1/batch-analyze isolates failures and keeps request order"""
+    from src.routes.programmatic_api import batch_concurrency
+
+    images = make_test_images(5, width=64, height=48)
+    request = {
+        "images": [
+            {
+                "image_base64": base64.b64encode(image).decode(),
+                "filename": f"{i}.jpg",
+                "metadata": {"i": i},
+            }
+            for i, image in enumerate(images)
+        ]
+    }
+    request["images"][2]["image_base64"] = "not base64!"
+
+    async with benchmark_environment() as (client, user):
+        concurrency = await batch_concurrency(str(user.id))
+        response = await client.post("/api/v1/batch-analyze", json=request)
+
+    body = response.json()
+    assert concurrency == 10  # enterprise: 300 requests/minute
+    assert response.status_code == 200
+    assert body["successful_analyses"] == 4 and body["failed_analyses"] == 1
+    assert [result["metadata"]["i"] for result in body["results"]] == [0, 1, 3, 4]
+    assert body["errors"][0]["index"] == 2 and body["errors"][0]["filename"] == "2.jpg"
@@ -0,0 +1,135 @@
+"""
+Tests for archive (ZIP/tar) bulk analysis
+"""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from src.services.archive_ingest import ArchiveError, ArchiveReader
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def _zip(entries) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _tar(entries, mode: str = "w:gz") -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _read_all(reader: ArchiveReader) -> list:
+    entries = []
+    while (entry := reader.next_entry()) is not None:
+        entries.append(entry)
+    return entries
+
+
+def test_reader_validates_and_hashes_each_entry():
+    """Test that entries are checked one by one and clutter is skipped silently"""
+    data = _zip(
+        [
+            ("leaves/a.png", PNG),
+            ("leaves/notes.txt", b"not an image"),
+            ("leaves/big.png", PNG + b"\x00" * 200),
+            ("__MACOSX/leaves/._a.png", b"resource fork"),
+            ("leaves/.DS_Store", b"finder"),
+        ]
+    )
+    entries = _read_all(ArchiveReader(io.BytesIO(data), max_entry_bytes=128))
+
+    assert [entry.name for entry in entries] == [
+        "leaves/a.png",
+        "leaves/notes.txt",
+        "leaves/big.png",
+    ]
+    image, text, big = entries
+    assert image.error is None and image.contents == PNG and len(image.sha256) == 64
+    assert text.status_code == 415 and text.contents is None
+    assert big.status_code == 413 and "exceeds" in big.error
+
+
+def test_reader_stops_at_total_uncompressed_cap():
+    """Test that a tar stream is cut off once its uncompressed bytes pass the cap"""
+    data = _tar([(f"{i}.png", PNG + bytes([i]) * 100) for i in range(5)])
+    reader = ArchiveReader(io.BytesIO(data), max_entry_bytes=1024, max_total_bytes=400)
+
+    assert reader.next_entry().error is None
+    assert reader.next_entry().error is None
+    with pytest.raises(ArchiveError):
+        reader.next_entry()
+
+
+@pytest.mark.integration
+async def test_archive_analysis_reports_every_entry():
+    """Test that a ZIP upload is analysed entry by entry with per-entry results"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+
+    images = make_test_images(2, width=64, height=48)
+    data = _zip(
+        [
+            ("a.jpg", images[0]),
+            ("b.jpg", images[1]),
+            ("copy/a.jpg", images[0]),
+            ("readme.txt", b"hi"),
+        ]
+    )
+
+    async with benchmark_environment() as (client, _user):
+        response = await client.post(
+            "/api/enterprise/bulk-analysis/archive",
+            files={"file": ("leaves.zip", data, "application/zip")},
+        )
+        garbage = await client.post(
+            "/api/enterprise/bulk-analysis/archive",
+            files={"file": ("leaves.zip", b"definitely not an archive" * 40, "application/zip")},
+        )
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["total_entries"] == 4 and body["processed_images"] == 2
+    assert body["failed_images"] == 1 and body["skipped_entries"] == 1
+    results = {result["entry"]: result for result in body["results"]}
+    assert results["a.jpg"]["success"] and results["a.jpg"]["analysis"]["id"]
+    assert results["copy/a.jpg"]["duplicate_of"] == results["a.jpg"]["index"]
+    assert results["readme.txt"]["error"] == "Not a JPEG, PNG or WebP image"
+    assert garbage.status_code == 400
+
+
+@pytest.mark.integration
+async def test_archive_analysis_streams_tar_results():
+    """Test that a tar.gz upload streams NDJSON results and a summary"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+
+    images = make_test_images(3, width=64, height=48)
+    data = _tar([(f"field/{i}.jpg", image) for i, image in enumerate(images)])
+
+    async with benchmark_environment() as (client, _user):
+        response = await client.post(
+            "/api/enterprise/bulk-analysis/archive",
+            files={"file": ("field.tar.gz", data, "application/gzip")},
+            headers=NDJSON,
+        )
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["type"] for line in lines] == ["result"] * 3 + ["summary"]
+    assert all(line["success"] for line in lines[:3])
+    assert lines[-1]["processed_images"] == 3 and not lines[-1]["truncated"]
+    assert lines[-1]["batch_id"] == response.headers["x-batch-id"]
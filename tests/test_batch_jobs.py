@@ -0,0 +1,113 @@
+"""
+Tests for the durable batch job queue
+"""
+
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.database.connection import ANALYSIS_COLLECTION, BATCH_ITEMS_COLLECTION, MongoDB
+from src.services.batch_jobs import BatchWorker
+
+
+async def _crash(*args, **kwargs) -> None:
+    """Stand-in checkpoint of a worker that dies right after the analysis"""
+
+
+def _files(images):
+    return [("files", (f"leaf_{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+
+
+@pytest.mark.integration
+async def test_queued_bulk_analysis_reports_progress_until_complete():
+    """Test that ?async=true returns a batch id at once and workers fill in the results"""
+    images = make_test_images(3)
+
+    async with benchmark_environment() as (client, user):
+        submitted = await client.post(
+            "/api/enterprise/bulk-analysis?async=true&batch_name=field-7", files=_files(images)
+        )
+        batch_id = submitted.json()["batch_id"]
+        queued = (await client.get(f"/api/enterprise/batch/{batch_id}")).json()
+        analyses_before = await MongoDB.get_collection(ANALYSIS_COLLECTION).count_documents({})
+
+        worker = BatchWorker()
+        first = await worker.claim()
+        await worker.process(first)
+        partial = (await client.get(f"/api/enterprise/batch/{batch_id}")).json()
+
+        processed = await worker.run_until_idle()
+        done = (await client.get(f"/api/enterprise/batch/{batch_id}")).json()
+
+    assert submitted.status_code == 202
+    assert submitted.json()["status_url"] == f"/api/enterprise/batch/{batch_id}"
+    assert queued["status"] == "queued" and queued["pending_images"] == 3
+    assert analyses_before == 0
+    assert partial["status"] == "running" and partial["processed_images"] == 1
+    assert [result["status"] for result in partial["results"]] == ["done", "pending", "pending"]
+    assert processed == 2
+    assert done["status"] == "completed" and done["progress"] == 1.0
+    assert done["processed_images"] == 3 and done["failed_images"] == 0
+    assert all(result["analysis"]["analysis_id"] for result in done["results"])
+    assert done["batch_name"] == "field-7"
+
+
+@pytest.mark.integration
+async def test_crashed_batch_resumes_where_it_stopped():
+    """Test that expired leases are taken over without analysing finished images twice"""
+    images = make_test_images(3)
+    request = {"images": [{"image_base64": base64.b64encode(data).decode()} for data in images]}
+
+    async with benchmark_environment() as (client, user):
+        submitted = await client.post("/api/v1/batch-analyze?async=true", json=request)
+        batch_id = submitted.json()["batch_id"]
+        items = MongoDB.get_collection(BATCH_ITEMS_COLLECTION)
+
+        crashed = BatchWorker(owner="crashed")
+        crashed._checkpoint = _crash
+        # Image 0: analysed and stored, but the worker died before its checkpoint
+        await crashed.process(await crashed.claim())
+        # Image 1: claimed, then the worker died mid-analysis
+        await crashed.claim()
+        await items.update_many(
+            {"lease_owner": "crashed"},
+            {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}},
+        )
+
+        await BatchWorker().run_until_idle()
+        progress = (await client.get(f"/api/v1/batch/{batch_id}")).json()
+        analyses = await MongoDB.get_collection(ANALYSIS_COLLECTION).count_documents(
+            {"batch_id": batch_id}
+        )
+
+    assert submitted.status_code == 202
+    assert progress["status"] == "completed" and progress["processed_images"] == 3
+    assert [result["attempts"] for result in progress["results"]] == [2, 2, 1]
+    assert analyses == 3
+
+
+@pytest.mark.integration
+async def test_unreadable_images_fail_at_submit_without_failing_the_batch():
+    """Test that an invalid image is recorded as failed while the rest are queued"""
+    request = {
+        "images": [
+            {"image_base64": base64.b64encode(make_test_images(1)[0]).decode()},
+            {"image_base64": ""},
+        ]
+    }
+
+    async with benchmark_environment() as (client, user):
+        submitted = (await client.post("/api/v1/batch-analyze?async=true", json=request)).json()
+        await BatchWorker().run_until_idle()
+        progress = (await client.get(f"/api/v1/batch/{submitted['batch_id']}")).json()
+        missing = await client.get("/api/v1/batch/unknown")
+
+    assert submitted["failed_images"] == 1 and submitted["pending_images"] == 1
+    assert progress["status"] == "completed"
+    assert [result["success"] for result in progress["results"]] == [True, False]
+    assert progress["results"][1]["error"] == "Empty file provided"
+    assert missing.status_code == 404
@@ -0,0 +1,144 @@
+"""
+Tests for live batch progress events
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from src.services import batch_progress
+from src.services.batch_progress import BatchProgressHub
+
+
+def _image(index: int, success: bool = True) -> dict:
+    return {
+        "index": index,
+        "filename": f"leaf_{index}.jpg",
+        "success": success,
+        "analysis_id": None,
+        "error": None,
+    }
+
+
+async def _collect(events) -> list:
+    return [event async for event in events if event is not None]
+
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+async def test_every_subscriber_gets_a_snapshot_then_each_image():
+    """Test that events fan out to all subscribers, each starting from the state when it attached"""
+    hub = BatchProgressHub()
+    hub.begin("b1", "user-1", "field-7", total_images=3)
+    hub.image_finished("b1", _image(0))
+
+    early = await hub.open_stream("b1", "user-1")
+    hub.image_finished("b1", _image(1, success=False))
+    late = await hub.open_stream("b1", "user-1")
+    hub.image_finished("b1", _image(2))
+    hub.finish("b1")
+
+    early_events, late_events = await asyncio.gather(_collect(early), _collect(late))
+
+    assert [name for name, _ in early_events] == ["snapshot", "image", "image", "completed"]
+    assert [name for name, _ in late_events] == ["snapshot", "image", "completed"]
+    assert early_events[0][1]["processed_images"] == 1
+    assert late_events[0][1]["failed_images"] == 1 and late_events[0][1]["pending_images"] == 1
+    assert late_events[1][1]["image"]["index"] == 2
+    assert late_events[1][1]["progress"]["images_per_second"] > 0
+    assert early_events[-1][1]["status"] == "completed" and early_events[-1][1]["progress"] == 1.0
+    assert hub.subscriber_count("b1") == 0
+    # Another user's batch id is not found
+    assert await hub.open_stream("b1", "user-2") is None
+
+
+async def test_slow_subscriber_is_resynchronised_with_a_snapshot(monkeypatch):
+    """Test that a subscriber that falls behind gets a fresh snapshot instead of a backlog"""
+    monkeypatch.setattr(batch_progress, "SUBSCRIBER_QUEUE_SIZE", 2)
+    hub = BatchProgressHub()
+    hub.begin("b1", "user-1", total_images=10)
+    events = await hub.open_stream("b1", "user-1")
+
+    for index in range(5):
+        hub.image_finished("b1", _image(index))
+    hub.finish("b1")
+    received = await _collect(events)
+
+    # The backlog was dropped twice; the last snapshot already shows the batch finished
+    assert [name for name, _ in received] == ["snapshot", "snapshot"]
+    assert received[1][1]["processed_images"] == 5 and received[1][1]["status"] == "completed"
+
+
+@pytest.mark.integration
+async def test_queued_batch_events_stream_to_several_clients():
+    """Test that two clients watching a queued batch over SSE see every image and the completion"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+    from src.services.batch_jobs import BatchWorker
+    from src.services.batch_progress import progress_hub
+
+    images = make_test_images(3, width=64, height=48)
+    files = [("files", (f"leaf_{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+
+    async with benchmark_environment() as (client, _user):
+        submitted = await client.post("/api/enterprise/bulk-analysis?async=true", files=files)
+        batch_id = submitted.json()["batch_id"]
+        url = f"/api/enterprise/batch/{batch_id}/events"
+        watchers = [asyncio.create_task(client.get(url)) for _ in range(2)]
+        while progress_hub.subscriber_count(batch_id) < 2:
+            await asyncio.sleep(0.01)
+
+        await BatchWorker().run_until_idle()
+        responses = await asyncio.gather(*watchers)
+        missing = await client.get("/api/enterprise/batch/no-such-batch/events")
+
+    assert missing.status_code == 404
+    for response in responses:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(response.text)
+        assert [name for name, _ in events] == ["snapshot", "image", "image", "image", "completed"]
+        assert events[0][1]["status"] == "queued" and events[0][1]["pending_images"] == 3
+        assert sorted(data["image"]["index"] for name, data in events if name == "image") == [
+            0,
+            1,
+            2,
+        ]
+        assert all(data["image"]["analysis_id"] for name, data in events if name == "image")
+        assert events[-1][1]["processed_images"] == 3 and events[-1][1]["eta_seconds"] is None
+
+
+async def test_failing_event_source_ends_with_an_error_event():
+    """Test that SSE and NDJSON streams report a producer failure in-band"""
+    from src.utils.ndjson import ndjson_response
+    from src.utils.sse import KEEPALIVE, sse_response
+
+    async def events():
+        yield KEEPALIVE
+        yield "progress", {"completed": 1}
+        raise RuntimeError("store unavailable")
+
+    async def lines():
+        yield {"type": "result", "index": 0}
+        raise RuntimeError("store unavailable")
+
+    sse = b"".join([chunk async for chunk in sse_response(events()).body_iterator])
+    ndjson = b"".join([chunk async for chunk in ndjson_response(lines()).body_iterator])
+
+    assert sse.startswith(b": keep-alive\n\n")
+    assert _parse_sse(sse.decode()) == [
+        ("progress", {"completed": 1}),
+        ("error", {"detail": "store unavailable"}),
+    ]
+    assert [json.loads(line) for line in ndjson.splitlines()] == [
+        {"type": "result", "index": 0},
+        {"type": "error", "detail": "store unavailable"},
+    ]
@@ -0,0 +1,97 @@
+"""
+Tests for NDJSON streaming of batch results
+"""
+
+import asyncio
+import base64
+import json
+
+import pytest
+
+from src.utils.ndjson import wants_ndjson
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def _lines(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_wants_ndjson_matches_media_type_only():
+    """Test that only an explicit NDJSON Accept header selects streaming"""
+    assert wants_ndjson("application/x-ndjson")
+    assert wants_ndjson("application/json;q=0.5, application/x-ndjson")
+    assert not wants_ndjson("application/json")
+    assert not wants_ndjson("*/*")
+    assert not wants_ndjson(None)
+
+
+@pytest.mark.integration
+async def test_bulk_analysis_streams_one_line_per_image_and_a_summary():
+    """Test that bulk analysis writes each image's result, then a summary line"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+
+    images = make_test_images(3, width=64, height=48) + [b""]
+    files = [("files", (f"leaf{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images)]
+
+    async with benchmark_environment() as (client, _user):
+        response = await client.post("/api/enterprise/bulk-analysis", files=files, headers=NDJSON)
+
+    lines = _lines(response)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [line["type"] for line in lines] == ["result"] * 4 + ["summary"]
+    assert sorted(line["index"] for line in lines[:4]) == [0, 1, 2, 3]
+    assert lines[-1]["batch_id"] == response.headers["x-batch-id"]
+    assert lines[-1]["processed_images"] == 3 and lines[-1]["failed_images"] == 1
+    failed = next(line for line in lines if line["type"] == "result" and not line["success"])
+    assert failed["filename"] == "leaf3.jpg" and failed["error"] == "Empty file provided"
+
+
+@pytest.mark.integration
+async def test_api_batch_streams_results():
+    """Test that /api/v1/batch-analyze streams analyses as NDJSON"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+
+    images = make_test_images(2, width=64, height=48)
+    request = {"images": [{"image_base64": base64.b64encode(image).decode()} for image in images]}
+
+    async with benchmark_environment() as (client, _user):
+        response = await client.post("/api/v1/batch-analyze", json=request, headers=NDJSON)
+
+    lines = _lines(response)
+    assert [line["type"] for line in lines] == ["result", "result", "summary"]
+    assert all(line["analysis"]["analysis_id"] for line in lines[:2])
+    assert lines[-1]["successful_analyses"] == 2
+
+
+@pytest.mark.integration
+async def test_slow_reader_stops_new_images_from_starting():
+    """Test that iter_completed only admits new images as results are consumed"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+    from src.services.analysis_pipeline import AnalysisInput, AnalysisPipeline, PipelineOptions
+
+    started = []
+
+    async def record_start(ctx):
+        started.append(ctx.input.index)
+
+    images = make_test_images(10, width=64, height=48)
+    inputs = [
+        AnalysisInput(filename=f"{i}.jpg", contents=image, index=i)
+        for i, image in enumerate(images)
+    ]
+    pipeline = AnalysisPipeline(pre_processors=[record_start])
+
+    async with benchmark_environment() as (_client, user):
+        results = pipeline.iter_completed(user, inputs, PipelineOptions(), concurrency=2)
+        await results.__anext__()
+        # The reader stalls: images in the window finish, no new ones start
+        await asyncio.sleep(0.5)
+        stalled = len(started)
+        rest = [ctx async for ctx in results]
+
+    assert stalled <= 3  # window: concurrency 2 + 1
+    assert len(rest) == 9 and len(started) == 10
@@ -0,0 +1,63 @@
+"""
+Tests for per-user cost budgets
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.memory_mongo import install_memory_mongo
+from src.database.connection import MongoDB
+from src.services.budget_service import CostBudgetService
+
+
+@pytest.fixture
+def budget_env():
+    """In-memory MongoDB and fixed budget limits for user 'u1'"""
+    original_client = MongoDB.client
+    install_memory_mongo()
+    CostBudgetService.clear_cache()
+
+    async def fixed_limits(user_id):
+        return {"daily": 0.01, "monthly": 0.05}
+
+    original_get_limits = CostBudgetService.get_limits
+    CostBudgetService.get_limits = staticmethod(fixed_limits)
+    yield
+    CostBudgetService.get_limits = original_get_limits
+    CostBudgetService.clear_cache()
+    MongoDB.client = original_client
+
+
+async def test_concurrent_reservations_never_overshoot(budget_env):
+    """Test that the conditional increment admits exactly what fits"""
+    results = await asyncio.gather(
+        *[CostBudgetService.reserve("u1", 0.003) for _ in range(10)], return_exceptions=True
+    )
+
+    admitted = [r for r in results if not isinstance(r, Exception)]
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(admitted) == 3
+    assert all(r.status_code == 429 for r in rejected)
+
+    status = await CostBudgetService.get_budget_status("u1")
+    assert status["daily"]["spent_usd"] == pytest.approx(0.009)
+    assert status["monthly"]["spent_usd"] == pytest.approx(0.009)
+
+
+async def test_settle_and_release_adjust_spend(budget_env):
+    """Test that settling to a lower cost frees budget for new requests"""
+    first = await CostBudgetService.reserve("u1", 0.008)
+    with pytest.raises(HTTPException):
+        await CostBudgetService.reserve("u1", 0.005)
+
+    await CostBudgetService.settle(first, 0.002)
+    second = await CostBudgetService.reserve("u1", 0.005)
+    await CostBudgetService.release(second)
+
+    status = await CostBudgetService.get_budget_status("u1")
+    assert status["daily"]["spent_usd"] == pytest.approx(0.002)
+    assert status["daily"]["remaining_usd"] == pytest.approx(0.008)
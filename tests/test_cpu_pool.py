@@ -0,0 +1,62 @@
+"""
+Tests for the CPU preprocessing pool
+"""
+
+import asyncio
+import base64
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from benchmarks.harness import make_test_images
+from src.utils.cpu_pool import CPUPool
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("workers", [0, 1])
+async def test_preprocess_round_trips_through_shared_memory(workers):
+    """Test that pool and in-thread preprocessing give identical results"""
+    images = make_test_images(3, width=96, height=64)
+    pool = CPUPool(workers=workers)
+    try:
+        results = [await pool.preprocess(image) for image in images]
+        hashed_only = await pool.preprocess(images[0], compute_features=False, encode=False)
+    finally:
+        pool.shutdown()
+
+    for image, result in zip(images, results):
+        assert result.data_url == "data:image/jpeg;base64," + base64.b64encode(image).decode(
+            "ascii"
+        )
+        assert result.sha256 == hashlib.sha256(image).hexdigest()
+    assert hashed_only.data_url is None and hashed_only.feature_vector is None
+    assert hashed_only.sha256 == results[0].sha256
+
+
+def _shared_blocks() -> set:
+    return {path.name for path in Path("/dev/shm").glob("psm_*")}
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not Path("/dev/shm").is_dir(), reason="needs /dev/shm")
+async def test_cancelled_preprocess_frees_the_worker_output():
+    """Test that cancelling a running call does not leak its shared memory output"""
+    pool = CPUPool(workers=1)
+    try:
+        await pool.preprocess(b"warm up", compute_features=False)
+        before = _shared_blocks()
+        task = asyncio.create_task(
+            pool.preprocess(b"\0" * (64 * 1024 * 1024), compute_features=False)
+        )
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The single worker finishes the cancelled call before this one
+        await pool.preprocess(b"after", compute_features=False)
+        leaked = _shared_blocks() - before
+    finally:
+        pool.shutdown()
+
+    assert leaked == set()
@@ -0,0 +1,68 @@
+"""
+Tests for image derivatives (thumbnails and previews)
+"""
+
+import asyncio
+import io
+
+import pytest
+
+from src.storage import derivatives
+from src.storage.derivatives import DERIVATIVES_AVAILABLE, DerivativeCache
+
+pytestmark = pytest.mark.skipif(not DERIVATIVES_AVAILABLE, reason="Pillow not installed")
+
+
+def _write_image(path, size):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 160, 60)).save(buffer, format="JPEG")
+    path.write_bytes(buffer.getvalue())
+    return path
+
+
+async def test_concurrent_requests_generate_once(tmp_path, monkeypatch):
+    """Test that simultaneous requests for one derivative share a single resize"""
+    source = _write_image(tmp_path / "leaf.jpg", (2000, 1500))
+    cache = DerivativeCache(directory=tmp_path / "derivatives")
+    renders = []
+    real_render = derivatives._render
+    monkeypatch.setattr(derivatives, "_render", lambda *a: renders.append(a) or real_render(*a))
+
+    paths = await asyncio.gather(*(cache.get(source, "thumb") for _ in range(5)))
+
+    assert len(renders) == 1
+    assert len(set(paths)) == 1 and paths[0] != source
+    from PIL import Image
+
+    with Image.open(paths[0]) as thumb:
+        assert max(thumb.size) == derivatives.SIZE_PRESETS["thumb"]
+
+    # Served from the cache afterwards
+    assert await cache.get(source, "thumb") == paths[0]
+    assert len(renders) == 1
+
+
+async def test_small_originals_are_served_as_is(tmp_path):
+    """Test that an image already within the preset is not re-encoded"""
+    source = _write_image(tmp_path / "small.jpg", (200, 100))
+    cache = DerivativeCache(directory=tmp_path / "derivatives")
+
+    assert await cache.get(source, "thumb") == source
+
+
+async def test_cache_evicts_least_recently_used(tmp_path):
+    """Test that the size cap evicts the least recently served derivative"""
+    sources = [_write_image(tmp_path / f"{i}.jpg", (1200, 900)) for i in range(3)]
+    probe = DerivativeCache(directory=tmp_path / "probe")
+    one_size = (await probe.get(sources[0], "thumb")).stat().st_size
+    cache = DerivativeCache(directory=tmp_path / "derivatives", max_bytes=one_size * 2 + 100)
+
+    first = await cache.get(sources[0], "thumb")
+    second = await cache.get(sources[1], "thumb")
+    await cache.get(sources[0], "thumb")  # first is now most recent
+    await cache.get(sources[2], "thumb")
+
+    assert first.exists()
+    assert not second.exists()
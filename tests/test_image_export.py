@@ -0,0 +1,129 @@
+"""
+Tests for the streaming image export
+"""
+
+import io
+import json
+import tarfile
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+from src.services import image_export
+from src.services.image_export import acquire_export_slot, parse_range
+from src.storage.image_storage import delete_image, save_image
+
+
+async def _seed_analyses(user, images, batch_id="batch-1"):
+    """Store images with analysis records, one minute apart"""
+    records = []
+    for i, data in enumerate(images):
+        stored = await save_image(data, f"leaf{i}.jpg", user.username)
+        record = {
+            "user_id": str(user.id),
+            "username": user.username,
+            "image_filename": stored.filename,
+            "image_path": stored.path,
+            "disease_detected": True,
+            "disease_name": "Leaf Spot",
+            "disease_type": "fungal",
+            "severity": "moderate",
+            "confidence": 0.9,
+            "analysis_timestamp": datetime(2026, 1, 1) + timedelta(minutes=i),
+            "batch_id": batch_id,
+        }
+        result = await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_one(record)
+        records.append((str(result.inserted_id), stored))
+    return records
+
+
+def test_parse_range():
+    """Test single, open and suffix ranges, and unsatisfiable ones"""
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=10-19", 100) == (10, 19)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-5", 100) == (95, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+@pytest.mark.integration
+async def test_zip_export_with_manifest_and_resume():
+    """Test that the ZIP is valid, maps files to analyses and resumes byte-identically"""
+    images = make_test_images(3, width=160, height=120)
+
+    async with benchmark_environment() as (client, user):
+        records = await _seed_analyses(user, images)
+        await delete_image(user.username, records[2][1].filename)
+
+        full = await client.get("/api/enterprise/export/images?format=zip&batch_id=batch-1")
+        resumed = await client.get(
+            "/api/enterprise/export/images?format=zip&batch_id=batch-1",
+            headers={"Range": "bytes=1000-", "If-Range": full.headers["etag"]},
+        )
+        stale = await client.get(
+            "/api/enterprise/export/images?format=zip&batch_id=batch-1",
+            headers={"Range": "bytes=1000-", "If-Range": '"outdated"'},
+        )
+
+    assert full.status_code == 200
+    assert int(full.headers["content-length"]) == len(full.content)
+    archive = zipfile.ZipFile(io.BytesIO(full.content))
+    assert archive.testzip() is None
+    manifest = json.loads(archive.read("manifest.json"))
+    files = {row["analysis_id"]: row["file"] for row in manifest["images"]}
+    assert [archive.read(files[analysis_id]) for analysis_id, _ in records[:2]] == images[:2]
+    # The deleted image is listed without a file
+    assert files[records[2][0]] is None
+
+    assert resumed.status_code == 206
+    assert (
+        resumed.headers["content-range"]
+        == f"bytes 1000-{len(full.content) - 1}/{len(full.content)}"
+    )
+    assert resumed.content == full.content[1000:]
+    assert stale.status_code == 200 and stale.content == full.content
+
+
+@pytest.mark.integration
+async def test_tar_export_by_date_range():
+    """Test that a tar export honours the date range"""
+    images = make_test_images(3, width=160, height=120)
+
+    async with benchmark_environment() as (client, user):
+        records = await _seed_analyses(user, images)
+        response = await client.get(
+            "/api/enterprise/export/images",
+            params={
+                "format": "tar",
+                "start_date": "2026-01-01T00:01:00",
+                "end_date": "2026-01-01T00:02:00",
+            },
+        )
+
+    assert response.status_code == 200
+    archive = tarfile.open(fileobj=io.BytesIO(response.content))
+    manifest = json.loads(archive.extractfile("manifest.json").read())
+    assert [row["analysis_id"] for row in manifest["images"]] == [records[1][0], records[2][0]]
+    assert [archive.extractfile(row["file"]).read() for row in manifest["images"]] == images[1:]
+
+
+@pytest.mark.integration
+async def test_concurrent_exports_are_limited_per_tenant(monkeypatch):
+    """Test that a tenant gets 429 while all its export slots are busy"""
+    monkeypatch.setattr(image_export, "EXPORT_MAX_CONCURRENT", 1)
+
+    async with benchmark_environment() as (client, user):
+        slot = await acquire_export_slot(str(user.id))
+        busy = await client.get("/api/enterprise/export/images")
+        await image_export.release_export_slot(slot)
+        free = await client.get("/api/enterprise/export/images")
+
+    assert busy.status_code == 429
+    assert free.status_code == 200
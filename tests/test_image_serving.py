@@ -0,0 +1,60 @@
+"""
+Tests for image serving: caching headers, conditional and range requests, signed URLs
+"""
+
+import time
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.storage.image_storage import save_image
+from src.utils.image_urls import signed_image_url, verify_image_signature
+
+
+def test_signed_url_round_trip_and_expiry():
+    """Test that signatures verify, bind the size preset and expire"""
+    now = 1_700_000_000
+    url = signed_image_url("alice", "leaf.jpg", size="thumb", now=now)
+    params = dict(part.split("=") for part in url.split("?")[1].split("&"))
+    expires, sig = int(params["expires"]), params["sig"]
+
+    assert verify_image_signature("alice", "leaf.jpg", "thumb", expires, sig, now=now)
+    assert not verify_image_signature("alice", "leaf.jpg", None, expires, sig, now=now)
+    assert not verify_image_signature("bob", "leaf.jpg", "thumb", expires, sig, now=now)
+    assert not verify_image_signature("alice", "leaf.jpg", "thumb", expires, sig, now=expires + 1)
+    # Stable within the expiry bucket, so caches see one URL
+    assert signed_image_url("alice", "leaf.jpg", size="thumb", now=now + 60) == url
+
+
+@pytest.mark.integration
+async def test_conditional_range_and_signed_requests():
+    """Test ETag/304, Range and signed URL handling on /images"""
+    image = make_test_images(1, width=64, height=48)[0]
+
+    async with benchmark_environment() as (client, user):
+        filename, _, _ = await save_image(image, "leaf.jpg", user.username)
+        url = f"/images/{user.username}/{filename}"
+
+        full = await client.get(url)
+        assert full.status_code == 200
+        assert full.content == image
+        assert "immutable" in full.headers["cache-control"]
+        etag = full.headers["etag"]
+        assert not etag.startswith("W/")
+
+        not_modified = await client.get(url, headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        partial = await client.get(url, headers={"Range": "bytes=0-9"})
+        assert partial.status_code == 206
+        assert partial.content == image[:10]
+
+        signed = await client.get(signed_image_url(user.username, filename))
+        assert signed.status_code == 200
+        assert signed.headers["cache-control"].startswith("public")
+
+        expired = await client.get(f"{url}?expires={int(time.time()) - 1}&sig=0")
+        assert expired.status_code == 403
@@ -0,0 +1,175 @@
+"""
+Tests for the async image storage API
+"""
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.memory_mongo import install_memory_mongo
+from src.database.connection import ANALYSIS_COLLECTION, IMAGE_BLOBS_COLLECTION, MongoDB
+from src.storage import image_storage
+from src.utils.metrics import metrics
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    original_client = MongoDB.client
+    install_memory_mongo()
+    monkeypatch.setattr(image_storage, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(image_storage, "BLOB_DIR", tmp_path / "blobs")
+    metrics.reset()
+    yield tmp_path / "uploads"
+    MongoDB.client = original_client
+
+
+async def test_save_list_delete_round_trip(upload_dir):
+    """Test that saved images can be listed and deleted, and operations are timed"""
+    filename, path, _ = await image_storage.save_image(b"leaf", "leaf.jpg", "alice")
+
+    assert open(path, "rb").read() == b"leaf"
+    assert await image_storage.get_user_images("alice") == [filename]
+    assert await image_storage.get_image_path("alice", filename) is not None
+    assert await image_storage.delete_image("alice", filename) is True
+    assert await image_storage.delete_image("alice", filename) is False
+
+    timings = metrics.snapshot(prefix="storage.")
+    assert timings["storage.save"]["count"] == 1
+    assert timings["storage.delete"]["count"] == 2
+
+
+async def test_duplicates_share_one_blob_until_last_reference(upload_dir):
+    """Test that identical uploads are stored once and removed with the last reference"""
+    first = await image_storage.save_image(b"same leaf", "a.jpg", "alice")
+    second = await image_storage.save_image(b"same leaf", "b.jpg", "bob")
+
+    assert first.path == second.path
+    assert first.filename != second.filename
+    blob = await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).find_one({"_id": first.sha256})
+    assert blob["ref_count"] == 2
+
+    await image_storage.delete_image("alice", first.filename)
+    assert await image_storage.get_image_path("bob", second.filename) is not None
+
+    await image_storage.delete_image("bob", second.filename)
+    assert not image_storage.blob_path(first.sha256).exists()
+    assert (
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).find_one({"_id": first.sha256}) is None
+    )
+
+
+async def test_failed_blob_delete_keeps_the_record_for_maintenance(upload_dir, monkeypatch):
+    """Test that a blob whose bytes could not be deleted keeps its record and can be saved again"""
+    from src.storage import backends
+
+    stored = await image_storage.save_image(b"stubborn leaf", "a.jpg", "alice")
+    real_delete = backends.LocalBackend._delete
+
+    def fail(self, key):
+        raise OSError("storage unavailable")
+
+    monkeypatch.setattr(backends.LocalBackend, "_delete", fail)
+    with pytest.raises(OSError):
+        await image_storage.delete_image("alice", stored.filename)
+
+    blobs = MongoDB.get_collection(IMAGE_BLOBS_COLLECTION)
+    blob = await blobs.find_one({"_id": stored.sha256})
+    assert blob["ref_count"] == 0 and "deleting" not in blob
+    assert image_storage.blob_path(stored.sha256).exists()
+
+    # The same bytes can be uploaded again at once
+    again = await image_storage.save_image(b"stubborn leaf", "b.jpg", "alice")
+    assert again.sha256 == stored.sha256
+    assert (await blobs.find_one({"_id": stored.sha256}))["ref_count"] == 1
+
+    # Once storage recovers, deleting the last reference removes the blob
+    monkeypatch.setattr(backends.LocalBackend, "_delete", real_delete)
+    await image_storage.delete_image("alice", again.filename)
+    assert await blobs.find_one({"_id": stored.sha256}) is None
+    assert not image_storage.blob_path(stored.sha256).exists()
+
+
+async def test_fold_legacy_images_reclaims_duplicates(upload_dir):
+    """Test that the migration folds duplicate legacy files and keeps their names working"""
+    for user, name, content in [
+        ("alice", "1.jpg", b"x" * 100),
+        ("alice", "2.jpg", b"x" * 100),
+        ("bob", "3.jpg", b"x" * 100),
+        ("bob", "4.jpg", b"y" * 50),
+    ]:
+        (upload_dir / user).mkdir(parents=True, exist_ok=True)
+        (upload_dir / user / name).write_bytes(content)
+    await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_one(
+        {"username": "bob", "image_filename": "3.jpg", "image_path": "old"}
+    )
+
+    dry_run = await image_storage.fold_legacy_images(dry_run=True)
+    stats = await image_storage.fold_legacy_images()
+
+    assert dry_run == stats == {"files": 4, "blobs": 2, "duplicates": 2, "bytes_reclaimed": 200}
+    assert not list(upload_dir.glob("*/*"))
+    assert await image_storage.get_image_path("alice", "2.jpg") is not None
+    record = await MongoDB.get_collection(ANALYSIS_COLLECTION).find_one({"image_filename": "3.jpg"})
+    assert record["image_path"] == str(image_storage.blob_path(record["image_sha256"]))
+
+    await image_storage.delete_image("alice", "1.jpg")
+    await image_storage.delete_image("alice", "2.jpg")
+    assert image_storage.blob_path(record["image_sha256"]).exists()
+
+
+async def test_save_is_atomic_and_fsyncs(upload_dir, monkeypatch):
+    """Test that writes go through a renamed temp file and fsync when enabled"""
+    synced = []
+    real_fsync = image_storage.os.fsync
+    monkeypatch.setattr(image_storage.os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd))
+    upload_dir.mkdir(parents=True)
+    target = upload_dir / "leaf.jpg"
+
+    image_storage.write_atomic(target, b"x" * 1024, fsync=True)
+
+    assert target.read_bytes() == b"x" * 1024
+    assert [p.name for p in upload_dir.iterdir()] == ["leaf.jpg"]
+    assert len(synced) == 2  # file and directory
+
+
+async def test_failed_write_leaves_no_partial_file(upload_dir, monkeypatch):
+    """Test that a failed write removes its temp file and never creates the target"""
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(image_storage.os, "replace", fail)
+
+    with pytest.raises(OSError):
+        await image_storage.save_image(b"leaf", "leaf.jpg", "alice")
+
+    assert [p for p in image_storage.BLOB_DIR.rglob("*") if p.is_file()] == []
+    assert await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).count_documents({}) == 0
+
+
+async def test_blobs_are_sharded_and_usage_comes_from_the_index(upload_dir):
+    """Test the ab/cd/<sha256> layout, indexed listing/usage and resharding of flat blobs"""
+    stored = await image_storage.save_image(b"leaf" * 10, "a.jpg", "alice")
+    await image_storage.save_image(b"other", "b.jpg", "alice")
+
+    sha = stored.sha256
+    assert stored.path == str(image_storage.BLOB_DIR / sha[:2] / sha[2:4] / sha)
+    assert await image_storage.get_user_storage_usage("alice") == {"images": 2, "bytes": 45}
+
+    # A blob left flat by an earlier version
+    flat = image_storage.BLOB_DIR / ("f" * 64)
+    flat.write_bytes(b"old")
+    await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_one(
+        {"image_sha256": "f" * 64, "image_path": str(flat)}
+    )
+    seen = []
+
+    stats = await image_storage.reshard_blobs(
+        progress=lambda done, total: seen.append((done, total))
+    )
+
+    assert stats == {"blobs": 1, "bytes": 3}
+    assert seen == [(1, 1)]
+    assert image_storage.blob_path("f" * 64).read_bytes() == b"old"
+    record = await MongoDB.get_collection(ANALYSIS_COLLECTION).find_one({"image_sha256": "f" * 64})
+    assert record["image_path"] == str(image_storage.blob_path("f" * 64))
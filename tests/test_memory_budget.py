@@ -0,0 +1,134 @@
+"""
+Tests for the process-wide upload memory budget
+"""
+
+import asyncio
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from src.utils import memory_budget
+from src.utils.memory_budget import MemoryBudget
+
+
+async def test_waiters_are_served_in_order_and_time_out_with_503():
+    """Test that reservations wait first come first served and give up with 503"""
+    budget = MemoryBudget(100, wait_seconds=5)
+    held = budget.try_reserve(80)
+    order = []
+
+    async def wants(name: str, nbytes: int):
+        with await budget.reserve(nbytes):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(wants("big", 60)), asyncio.create_task(wants("small", 10))]
+    await asyncio.sleep(0.01)
+    # "small" would fit, but waits behind "big" so large images are not starved
+    assert order == [] and budget.stats()["waiting"] == 2 and budget.is_tight()
+    held.release()
+    await asyncio.gather(*tasks)
+    assert order == ["big", "small"] and budget.in_use == 0
+
+    blocker = budget.try_reserve(100)
+    with pytest.raises(HTTPException) as exc_info:
+        await budget.reserve(1, timeout=0.01)
+    assert exc_info.value.status_code == 503 and exc_info.value.headers["Retry-After"]
+    blocker.release()
+    assert budget.in_use == 0 and not budget.is_tight()
+
+
+async def test_oversized_reservation_is_capped_at_the_budget():
+    """Test that a reservation larger than the budget is admitted on its own"""
+    budget = MemoryBudget(100)
+
+    with await budget.reserve(500) as reservation:
+        assert reservation.nbytes == 100 and budget.try_reserve(1) is None
+    assert budget.in_use == 0
+
+
+def test_split_reservation_returns_to_its_parent():
+    """Test that bytes split off a reservation go back to it, or to the budget once it is gone"""
+    budget = MemoryBudget(100)
+    body = budget.try_reserve(60)
+
+    image = body.split(40)
+    assert body.nbytes == 20 and budget.in_use == 60
+    assert body.split(30) is None
+    image.release()
+    assert body.nbytes == 60 and budget.in_use == 60
+
+    image = body.split(40)
+    body.release()
+    assert budget.in_use == 40
+    image.release()
+    assert budget.in_use == 0
+
+
+@pytest.mark.integration
+async def test_json_batch_close_to_the_budget_is_not_refused_by_itself(monkeypatch):
+    """Test that the images of a JSON batch are counted within its body reservation"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+    from src.app import app
+    from src.auth.api_key_auth import get_enterprise_api_user
+
+    images = make_test_images(4, width=320, height=240)
+    request = {"images": [{"image_base64": base64.b64encode(image).decode()} for image in images]}
+    body = json.dumps(request).encode()
+    # Room for the body reservation, but not for the images on top of it
+    budget = MemoryBudget(int(2.2 * len(body)), high_water=1.0, wait_seconds=1)
+    monkeypatch.setattr(memory_budget, "_budget", budget)
+
+    async with benchmark_environment() as (client, user):
+        app.dependency_overrides[get_enterprise_api_user] = lambda: user
+        try:
+            response = await client.post(
+                "/api/v1/batch-analyze", content=body, headers={"Content-Type": "application/json"}
+            )
+        finally:
+            app.dependency_overrides.pop(get_enterprise_api_user, None)
+
+    assert response.status_code == 200
+    assert response.json()["successful_analyses"] == 4
+    assert budget.in_use == 0
+
+
+@pytest.mark.integration
+async def test_bulk_analysis_stays_within_budget_and_new_uploads_get_503(monkeypatch):
+    """Test that bulk images wait for room within the budget and a tight budget turns uploads away"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+
+    images = make_test_images(6, width=320, height=240)
+    largest = max(len(image) for image in images)
+    # Room for two images (and their data URLs) at a time
+    budget = MemoryBudget(5 * largest, high_water=1.0)
+    monkeypatch.setattr(memory_budget, "_budget", budget)
+    files = [("files", (f"leaf_{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+
+    peak = 0
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, budget.in_use)
+            await asyncio.sleep(0.001)
+
+    async with benchmark_environment() as (client, _user):
+        watcher = asyncio.create_task(watch())
+        bulk = await client.post("/api/enterprise/bulk-analysis", files=files)
+        watcher.cancel()
+
+        held = budget.try_reserve(budget.limit_bytes)
+        refused = await client.post("/api/enterprise/bulk-analysis", files=files[:1])
+        held.release()
+        accepted = await client.post("/api/enterprise/bulk-analysis", files=files[:1])
+
+    assert bulk.status_code == 200 and bulk.json()["processed_images"] == 6
+    assert 0 < peak <= budget.limit_bytes
+    assert refused.status_code == 503 and refused.headers["retry-after"] == "5"
+    assert accepted.status_code == 200
+    assert budget.in_use == 0
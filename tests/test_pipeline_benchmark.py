@@ -0,0 +1,40 @@
+"""
+Tests for the recorded-response pipeline benchmark
+"""
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from benchmarks.pipeline_benchmark import SCENARIOS, compare, run_scenario
+
+
+@pytest.mark.integration
+async def test_scenarios_run_end_to_end():
+    """Test that both endpoints complete with replayed providers and report stages"""
+    images = make_test_images(2, width=64, height=48)
+
+    async with benchmark_environment() as (client, _user):
+        results = {
+            name: await run_scenario(client, path, images, iterations=2, warmup=0, trace_alloc=True)
+            for name, path in SCENARIOS.items()
+        }
+
+    assert results["detect_disease"]["failures"] == 0
+    assert results["api_v1_analyze"]["failures"] == 0
+    assert {"read", "save", "base64", "model", "insert"} <= set(results["api_v1_analyze"]["stages"])
+    assert "enrichment" in results["detect_disease"]["stages"]
+
+
+def test_compare_flags_regressions_above_threshold():
+    """Test that only slowdowns beyond threshold and noise floor are reported"""
+    baseline = {
+        "scenarios": {"s": {"stages": {"save": {"avg_ms": 2.0}, "insert": {"avg_ms": 1.0}}}}
+    }
+    current = {"scenarios": {"s": {"stages": {"save": {"avg_ms": 4.0}, "insert": {"avg_ms": 1.4}}}}}
+
+    regressions = compare(current, baseline, threshold=0.25)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("s.save")
@@ -0,0 +1,146 @@
+"""
+Tests for the Replay Service
+"""
+
+import json
+
+import pytest
+
+from src.core.inference_backend import FakeGroqClient, create_inference_client
+from src.services.replay_service import (
+    ReplayCandidate,
+    ReplaySample,
+    load_samples_from_manifest,
+    normalize_disease_name,
+    percentile,
+    run_replay,
+)
+
+
+@pytest.fixture
+def samples(tmp_path):
+    """Write a few fake images and return samples pointing at them"""
+    result = []
+    for i in range(6):
+        image_path = tmp_path / f"leaf_{i}.jpg"
+        image_path.write_bytes(f"fake-image-{i}".encode() * 50)
+        result.append(
+            ReplaySample(
+                analysis_id=f"id-{i}",
+                image_path=str(image_path),
+                disease_detected=True,
+                disease_type="fungal",
+                disease_name="Brown Spot",
+            )
+        )
+    return result
+
+
+def test_percentile_nearest_rank():
+    """Test nearest-rank percentiles"""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_normalize_disease_name_strips_unique_suffix():
+    """Test that the detector's unique suffix is ignored when comparing"""
+    assert normalize_disease_name("Brown Spot #1A2B3C4D") == "brown spot"
+    assert normalize_disease_name(None) == ""
+
+
+def test_fake_backend_is_deterministic():
+    """Test that the fake backend returns the same answer for the same image"""
+    client = create_inference_client("fake")
+    assert isinstance(client, FakeGroqClient)
+    messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "x"}}]}]
+    first = client.chat.completions.create(model="m", messages=messages)
+    second = client.chat.completions.create(model="m", messages=messages)
+    assert first.choices[0].message.content == second.choices[0].message.content
+    assert first.usage.total_tokens == first.usage.prompt_tokens + first.usage.completion_tokens
+
+
+async def test_replay_reports_metrics(samples):
+    """Test replaying samples against two candidates on the fake backend"""
+    candidates = [
+        ReplayCandidate(name="baseline"),
+        ReplayCandidate(name="short-prompt", model="test-model", prompt="Return JSON."),
+    ]
+
+    reports = await run_replay(candidates, samples, backend="fake", concurrency=3)
+
+    assert [r.candidate for r in reports] == ["baseline", "short-prompt"]
+    for report in reports:
+        assert report.samples == len(samples)
+        assert report.completed == len(samples)
+        assert report.parse_failure_rate == 0
+        assert 0 <= report.type_agreement <= 1
+        assert report.prompt_tokens_total > 0
+        assert set(report.latency_ms) == {"p50", "p95", "p99"}
+    assert reports[1].model == "test-model"
+    # A shorter prompt must cost fewer prompt tokens
+    assert reports[1].prompt_tokens_avg < reports[0].prompt_tokens_avg
+
+
+def test_load_samples_from_manifest(tmp_path):
+    """Test that manifest image paths resolve relative to the manifest"""
+    (tmp_path / "a.jpg").write_bytes(b"data")
+    manifest = tmp_path / "samples.json"
+    manifest.write_text(
+        json.dumps([{"image_path": "a.jpg", "disease_detected": False, "disease_type": "healthy"}])
+    )
+
+    samples = load_samples_from_manifest(manifest)
+
+    assert len(samples) == 1
+    assert samples[0].image_path == str(tmp_path / "a.jpg")
+    assert samples[0].disease_type == "healthy"
+
+
+@pytest.mark.integration
+async def test_database_samples_are_read_through_image_storage():
+    """Test that sampled images are found wherever storage keeps them, not by their stored path"""
+    pytest.importorskip("mongomock_motor")
+    from datetime import datetime, timedelta
+
+    from benchmarks.harness import benchmark_environment, make_test_images
+    from src.database.connection import ANALYSIS_COLLECTION, IMAGE_BLOBS_COLLECTION, MongoDB
+    from src.services.replay_service import load_samples_from_db
+    from src.storage.image_storage import blob_path, delete_image, save_image
+    from src.storage.segments import pack_cold_blobs
+
+    images = make_test_images(3, width=64, height=48)
+
+    async with benchmark_environment() as (_client, user):
+        stored = [await save_image(image, "leaf.jpg", user.username) for image in images]
+        await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_many(
+            [
+                {
+                    "user_id": str(user.id),
+                    "username": user.username,
+                    "image_filename": image.filename,
+                    # Not a local file (an S3 location, say)
+                    "image_path": f"s3://leaf-images/{image.sha256}",
+                    "disease_detected": True,
+                    "disease_type": "fungal",
+                    "disease_name": "Brown Spot",
+                }
+                for image in stored
+            ]
+        )
+        # One image packed into a segment, one deleted
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_one(
+            {"_id": stored[0].sha256},
+            {"$set": {"created_at": datetime.utcnow() - timedelta(days=365)}},
+        )
+        await pack_cold_blobs()
+        await delete_image(user.username, stored[2].filename)
+
+        samples = await load_samples_from_db(10)
+        reports = await run_replay([ReplayCandidate(name="baseline")], samples, backend="fake")
+
+    assert not blob_path(stored[0].sha256).exists()
+    assert len(samples) == 2 and reports[0].completed == 2
+    assert not any(sample.image_path.startswith("s3://") for sample in samples)
@@ -0,0 +1,148 @@
+"""
+Tests for packed image segments
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment, make_test_images
+from src.database.connection import IMAGE_BLOBS_COLLECTION, MongoDB
+from src.storage import image_storage
+from src.storage.image_storage import blob_path, delete_image, save_image
+from src.storage.segments import SegmentStore, SegmentWriter, compact_segments, pack_cold_blobs
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_segment_index_lookup_and_newest_copy_wins(tmp_path):
+    """Test that sealed segments are found by binary search, newest first"""
+    images = [f"leaf {i}".encode() * (i + 1) for i in range(200)]
+    writer = SegmentWriter(tmp_path)
+    for data in images:
+        writer.append(_sha(data), data)
+    writer.seal()
+    store = SegmentStore(tmp_path)
+
+    assert all(bytes(store.view(_sha(data))) == data for data in images)
+    assert store.find("00" * 32) is None
+
+    # An unsealed segment is invisible; a newer sealed one shadows older copies
+    pending = SegmentWriter(tmp_path)
+    pending.append(_sha(images[0]), b"not yet")
+    assert len(store.segments()) == 1
+    newer = SegmentWriter(tmp_path)
+    newer.append(_sha(images[0]), b"re-encoded")
+    newer.seal()
+    pending.abort()
+
+    assert bytes(store.view(_sha(images[0]))) == b"re-encoded"
+    assert len(store.segments()) == 2
+
+
+@pytest.mark.integration
+async def test_packed_images_are_served_and_compacted():
+    """Test that cold blobs are packed, read transparently and reclaimed after deletes"""
+    images = make_test_images(4, width=320, height=240)
+
+    async with benchmark_environment() as (client, user):
+        stored = [await save_image(data, "leaf.jpg", user.username) for data in images]
+        served = (await client.get(f"/images/{user.username}/{stored[0].filename}")).content
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_many(
+            {}, {"$set": {"created_at": datetime.utcnow() - timedelta(days=365)}}
+        )
+
+        packed = await pack_cold_blobs()
+        assert packed["packed"] == 4 and packed["segments_written"] == 1
+        assert not any(blob_path(image.sha256).exists() for image in stored)
+
+        original = await client.get(f"/images/{user.username}/{stored[0].filename}")
+        thumb = await client.get(f"/images/{user.username}/{stored[0].filename}?size=thumb")
+        location = await image_storage.resolve_image(user.username, stored[1].filename)
+        # Re-uploading packed content does not write a loose copy
+        again = await save_image(images[1], "again.jpg", user.username)
+        assert not blob_path(again.sha256).exists()
+
+        for image in stored[:2] + [again]:
+            await delete_image(user.username, image.filename)
+        compacted = await compact_segments()
+        survivors = [
+            (await client.get(f"/images/{user.username}/{image.filename}")).content
+            for image in stored[2:]
+        ]
+        store = image_storage._backend().segments
+        deleted = store.find(stored[0].sha256)
+
+    assert original.status_code == 200 and original.content == served == images[0]
+    assert original.headers["content-type"] == "image/jpeg"
+    assert thumb.status_code == 200 and len(thumb.content) < len(images[0])
+    assert location.path is None and location.key is not None
+    assert compacted["segments_rewritten"] == 1
+    assert compacted["bytes_reclaimed"] >= len(images[0])
+    assert survivors == images[2:]
+    assert deleted is None
+
+
+@pytest.mark.integration
+async def test_packed_images_are_served_with_length_and_ranges():
+    """Test that packed images advertise their length and answer Range requests"""
+    images = make_test_images(2, width=320, height=240)
+
+    async with benchmark_environment() as (client, user):
+        stored = [await save_image(data, "leaf.jpg", user.username) for data in images]
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_many(
+            {}, {"$set": {"created_at": datetime.utcnow() - timedelta(days=365)}}
+        )
+        await pack_cold_blobs()
+
+        url = f"/images/{user.username}/{stored[1].filename}"
+        whole = await client.get(url)
+        head = await client.get(url, headers={"Range": "bytes=0-99"})
+        tail = await client.get(url, headers={"Range": "bytes=-50"})
+        stale = await client.get(url, headers={"Range": "bytes=0-99", "If-Range": '"other"'})
+        beyond = await client.get(url, headers={"Range": f"bytes={len(images[1])}-"})
+
+    size = len(images[1])
+    assert whole.status_code == 200 and whole.content == images[1]
+    assert whole.headers["content-length"] == str(size)
+    assert whole.headers["accept-ranges"] == "bytes"
+    assert head.status_code == 206 and head.content == images[1][:100]
+    assert head.headers["content-range"] == f"bytes 0-99/{size}"
+    assert tail.status_code == 206 and tail.content == images[1][-50:]
+    assert stale.status_code == 200 and stale.content == images[1]
+    assert beyond.status_code == 416
+    assert beyond.headers["content-range"] == f"bytes */{size}"
+
+
+@pytest.mark.integration
+async def test_compaction_keeps_packed_copy_of_reuploaded_image():
+    """Test that an image deleted and uploaded again while packed survives compaction"""
+    images = make_test_images(4, width=320, height=240)
+
+    async with benchmark_environment() as (client, user):
+        stored = [await save_image(data, "leaf.jpg", user.username) for data in images]
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_many(
+            {}, {"$set": {"created_at": datetime.utcnow() - timedelta(days=365)}}
+        )
+        await pack_cold_blobs()
+
+        await delete_image(user.username, stored[0].filename)
+        again = await save_image(images[0], "again.jpg", user.username)
+        for image in stored[1:3]:
+            await delete_image(user.username, image.filename)
+        compacted = await compact_segments()
+        served = await client.get(f"/images/{user.username}/{again.filename}")
+        record = await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).find_one(
+            {"_id": again.sha256}
+        )
+        packed_in = image_storage._backend().segments.find(again.sha256)
+
+    assert compacted["segments_rewritten"] == 1
+    assert served.status_code == 200 and served.content == images[0]
+    # The record now points at the rewritten segment
+    assert record["ref_count"] == 1 and record["segment"] == packed_in[0].name
@@ -0,0 +1,138 @@
+"""
+Tests for similar-case retrieval
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from benchmarks.harness import make_test_images
+from src.services import similarity_service
+from src.services.similarity_service import (
+    FEATURE_DIM,
+    SimilarityIndex,
+    compute_feature_vector,
+    provisional_answer,
+)
+
+
+def test_feature_vector_is_unit_length_and_stable():
+    """Test that the same image always maps to the same normalised vector"""
+    image = make_test_images(1, width=128, height=96)[0]
+
+    first = compute_feature_vector(image)
+    second = compute_feature_vector(image)
+
+    assert len(first) == FEATURE_DIM
+    assert first == second
+    assert sum(v * v for v in first) == pytest.approx(1.0, abs=1e-3)
+    assert compute_feature_vector(b"not an image") is None
+
+
+def test_index_returns_nearest_first_and_respects_owner():
+    """Test top-k ordering, per-user filtering and removal"""
+    images = make_test_images(6, width=96, height=96, seed=3)
+    vectors = [compute_feature_vector(image) for image in images]
+
+    index = SimilarityIndex()
+    for i, vector in enumerate(vectors):
+        index.add(f"a{i}", "alice" if i % 2 == 0 else "bob", vector)
+
+    top = index.query(vectors[2], k=3)
+    assert top[0][0] == "a2"
+    assert top[0][1] == pytest.approx(1.0, abs=1e-4)
+    assert all(
+        index.query(vectors[2], k=5, user_id="bob")[i][0] in {"a1", "a3", "a5"} for i in range(3)
+    )
+
+    index.remove("a2")
+    assert "a2" not in [analysis_id for analysis_id, _ in index.query(vectors[2], k=3)]
+
+
+def test_provisional_answer_needs_similarity_and_confidence():
+    """Test that only near-identical confident matches are offered"""
+    confident = {"similarity": 0.99, "confidence": 90.0}
+    unsure = {"similarity": 0.99, "confidence": 60.0}
+    distant = {"similarity": 0.8, "confidence": 95.0}
+
+    assert provisional_answer([unsure, distant, confident]) is confident
+    assert provisional_answer([unsure, distant]) is None
+
+
+async def test_refresh_picks_up_records_inserted_out_of_order():
+    """Test that a record inserted late, with an older id and timestamp, is still indexed"""
+    pytest.importorskip("mongomock_motor")
+    from bson import ObjectId
+
+    from benchmarks.memory_mongo import install_memory_mongo
+    from src.database.connection import ANALYSIS_COLLECTION, MongoDB
+
+    original_client = MongoDB.client
+    install_memory_mongo()
+    try:
+        vectors = [compute_feature_vector(image) for image in make_test_images(2, seed=5)]
+        collection = MongoDB.get_collection(ANALYSIS_COLLECTION)
+        now = datetime.utcnow()
+        # Created first but still waiting in another worker's insert batch
+        delayed = {
+            "_id": ObjectId(),
+            "user_id": "u1",
+            "feature_vector": vectors[0],
+            "analysis_timestamp": now - timedelta(seconds=5),
+        }
+        await collection.insert_one(
+            {
+                "_id": ObjectId(),
+                "user_id": "u1",
+                "feature_vector": vectors[1],
+                "analysis_timestamp": now,
+            }
+        )
+
+        index = SimilarityIndex()
+        first = await index.refresh(force=True)
+        await collection.insert_one(delayed)
+        second = await index.refresh(force=True)
+        third = await index.refresh(force=True)
+    finally:
+        MongoDB.client = original_client
+
+    assert (first, second, third) == (1, 1, 0)
+    assert len(index) == 2
+    assert index.query(vectors[0], k=1)[0][0] == str(delayed["_id"])
+
+
+@pytest.mark.integration
+async def test_similar_cases_endpoint_finds_previous_upload():
+    """Test that an analysed image is found again by the similar-cases endpoint"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment
+
+    similarity_service._index = None
+    images = make_test_images(3, width=96, height=96, seed=11)
+
+    async with benchmark_environment() as (client, _user):
+        ids = []
+        for image in images:
+            response = await client.post(
+                "/api/disease-detection", files={"file": ("leaf.jpg", image, "image/jpeg")}
+            )
+            assert response.status_code == 200
+            ids.append(response.json()["id"])
+
+        response = await client.post(
+            "/api/similar-cases?k=2", files={"file": ("leaf.jpg", images[1], "image/jpeg")}
+        )
+        assert response.status_code == 200
+        body = response.json()
+        assert body["similar_cases"][0]["analysis_id"] == ids[1]
+        assert body["similar_cases"][0]["similarity"] == pytest.approx(1.0, abs=1e-3)
+
+        response = await client.get(f"/api/analyses/{ids[1]}/similar?k=5")
+        assert response.status_code == 200
+        assert ids[1] not in [case["analysis_id"] for case in response.json()["similar_cases"]]
+
+    similarity_service._index = None
@@ -0,0 +1,139 @@
+"""
+Tests for image storage maintenance (compaction and orphan collection)
+"""
+
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from benchmarks.harness import benchmark_environment
+from src.database.connection import (
+    ANALYSIS_COLLECTION,
+    IMAGE_BLOBS_COLLECTION,
+    IMAGE_REFS_COLLECTION,
+    MongoDB,
+)
+from src.services.storage_maintenance import COMPACTION_AVAILABLE, Throttle, run_maintenance
+from src.storage import image_storage
+from src.storage.image_storage import blob_path, save_image
+
+UNTHROTTLED = Throttle(0, 0)
+
+
+def _smooth_jpeg(shade: int = 60) -> bytes:
+    """A photo-like JPEG (smooth gradients compress well, unlike noise)"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    image = Image.radial_gradient("L").resize((640, 480)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        draw.ellipse((i * 40, i * 30, i * 40 + 140, i * 30 + 90), fill=(40 + i * 5, 160, shade))
+    buffer = io.BytesIO()
+    image.filter(ImageFilter.GaussianBlur(2)).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+async def _age(collection: str, query: dict, **delta) -> None:
+    await MongoDB.get_collection(collection).update_many(
+        query, {"$set": {"created_at": datetime.utcnow() - timedelta(**delta)}}
+    )
+
+
+async def _analyse(username: str, filename: str) -> None:
+    await MongoDB.get_collection(ANALYSIS_COLLECTION).insert_one(
+        {"username": username, "image_filename": filename}
+    )
+
+
+async def test_throttle_paces_items_and_bytes():
+    """Test that the throttle sleeps to the slower of its item and byte budgets"""
+    now = [0.0]
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    throttle = Throttle(
+        items_per_second=10, bytes_per_second=1000, clock=lambda: now[0], sleep=sleep
+    )
+    await throttle.wait(0)  # item budget: due at 0.1s
+    await throttle.wait(500)  # byte budget: due at 0.5s
+    await throttle.wait(0)  # item budget: 0.3s already passed
+
+    assert sleeps == pytest.approx([0.1, 0.4])
+
+
+@pytest.mark.integration
+@pytest.mark.skipif(not COMPACTION_AVAILABLE, reason="Pillow not installed")
+async def test_old_images_are_compacted_and_served_with_new_type():
+    """Test that old blobs are re-encoded in place and still deduplicate re-uploads"""
+    original = _smooth_jpeg()
+
+    async with benchmark_environment() as (client, user):
+        stored = await save_image(original, "leaf.jpg", user.username)
+        await _analyse(user.username, stored.filename)
+        before = await client.get(f"/images/{user.username}/{stored.filename}")
+        await _age(IMAGE_BLOBS_COLLECTION, {"_id": stored.sha256}, days=60)
+
+        report = await run_maintenance(throttle=UNTHROTTLED)
+
+        compacted = blob_path(stored.sha256).read_bytes()
+        after = await client.get(f"/images/{user.username}/{stored.filename}")
+        again = await save_image(original, "leaf.jpg", user.username)
+        ref = await MongoDB.get_collection(IMAGE_REFS_COLLECTION).find_one(
+            {"_id": f"{user.username}/{again.filename}"}
+        )
+        second_run = await run_maintenance(throttle=UNTHROTTLED)
+
+    assert report["compaction"]["compacted"] == 1
+    assert report["bytes_reclaimed"] == len(original) - len(compacted) > 0
+    assert compacted[:4] == b"RIFF" and compacted[8:12] == b"WEBP"
+    assert after.headers["content-type"] == "image/webp"
+    assert after.headers["etag"] != before.headers["etag"]
+    assert after.content == compacted
+    # Same content hash: the re-upload shares the compacted blob
+    assert again.sha256 == stored.sha256 and ref["content_type"] == "image/webp"
+    assert second_run["compaction"]["examined"] == 0
+
+
+@pytest.mark.integration
+async def test_unreferenced_images_are_collected_after_grace_period():
+    """Test that images without an analysis record are deleted and reported"""
+    async with benchmark_environment() as (client, user):
+        analysed = await save_image(b"analysed leaf", "a.jpg", user.username)
+        orphan = await save_image(b"failed analysis", "b.jpg", user.username)
+        recent = await save_image(b"analysis in progress", "c.jpg", user.username)
+        await _analyse(user.username, analysed.filename)
+        await _age(IMAGE_REFS_COLLECTION, {"filename": {"$ne": recent.filename}}, hours=48)
+
+        # A blob whose deletion was interrupted long ago
+        stuck = await save_image(b"half deleted", "d.jpg", user.username)
+        await MongoDB.get_collection(IMAGE_REFS_COLLECTION).delete_one({"filename": stuck.filename})
+        await MongoDB.get_collection(IMAGE_BLOBS_COLLECTION).update_one(
+            {"_id": stuck.sha256},
+            {
+                "$set": {
+                    "ref_count": 0,
+                    "deleting": True,
+                    "deleting_at": datetime.utcnow() - timedelta(days=2),
+                }
+            },
+        )
+
+        dry_run = await run_maintenance(dry_run=True, compact=False, throttle=UNTHROTTLED)
+        assert blob_path(orphan.sha256).exists()
+
+        report = await run_maintenance(compact=False, throttle=UNTHROTTLED)
+        images = await image_storage.get_user_images(user.username)
+
+    assert dry_run["orphans"]["references"] == 1
+    assert report["orphans"]["references"] == 1
+    assert report["orphans"]["blobs"] == 2
+    assert report["orphans"]["bytes_reclaimed"] == len(b"failed analysis") + len(b"half deleted")
+    assert not blob_path(orphan.sha256).exists()
+    assert not blob_path(stuck.sha256).exists()
+    assert sorted(images) == sorted([analysed.filename, recent.filename])
@@ -0,0 +1,64 @@
+"""
+Tests for pre-flight token estimation
+"""
+
+import struct
+
+from src.utils.token_estimator import (
+    MAX_TILES,
+    estimate_analysis_tokens,
+    get_image_dimensions,
+    normalize_dimensions,
+    usage_cost,
+)
+
+
+def _png_header(width, height):
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + b"\x00\x00\x00\rIHDR"
+        + struct.pack(">II", width, height)
+        + b"\x00" * 8
+    )
+
+
+def _jpeg_header(width, height):
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+    sof0 = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, height, width) + b"\x03" + b"\x00" * 9
+    return b"\xff\xd8" + app0 + sof0 + b"\xff\xd9"
+
+
+def test_reads_png_and_jpeg_dimensions():
+    """Test that dimensions come from the header without decoding"""
+    assert get_image_dimensions(_png_header(640, 480)) == (640, 480)
+    assert get_image_dimensions(_jpeg_header(4000, 3000)) == (4000, 3000)
+    assert get_image_dimensions(b"not an image at all, just text") is None
+
+
+def test_estimate_follows_dimensions_not_bytes():
+    """Test that a small and a padded image of equal size cost the same"""
+    small = estimate_analysis_tokens(_png_header(300, 300))
+    padded = estimate_analysis_tokens(_png_header(300, 300) + b"\x00" * 5_000_000)
+    large = estimate_analysis_tokens(_jpeg_header(4000, 3000))
+
+    assert small.tiles == 1
+    assert small.prompt_tokens == padded.prompt_tokens
+    assert large.tiles <= MAX_TILES
+    assert large.prompt_tokens > small.prompt_tokens
+    assert large.estimated_cost_usd > small.estimated_cost_usd
+
+
+def test_normalize_caps_tiles():
+    """Test that huge images are scaled down to the tile budget"""
+    width, height, tiles = normalize_dimensions(12000, 9000)
+
+    assert tiles <= MAX_TILES
+    assert width < 12000 and height < 9000
+
+
+def test_usage_cost_prefers_provider_usage():
+    """Test that reported usage overrides the estimate"""
+    estimate = estimate_analysis_tokens(_png_header(300, 300))
+
+    assert usage_cost(None, estimate) == estimate.estimated_cost_usd
+    assert usage_cost({"prompt_tokens": 1_000_000, "completion_tokens": 0}, estimate) == 0.05
@@ -0,0 +1,96 @@
+"""
+Tests for upload reading and data URL encoding
+"""
+
+import base64
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from src.utils.uploads import encode_data_url, read_upload
+
+
+def test_data_url_matches_one_shot_encoding(monkeypatch):
+    """Test that chunked encoding into the prefixed buffer equals b64encode"""
+    monkeypatch.setattr("src.utils.uploads.ENCODE_CHUNK_BYTES", 3 * 7)
+    data = bytes(range(256)) * 3 + b"xy"
+
+    assert encode_data_url(data) == "data:image/jpeg;base64," + base64.b64encode(data).decode()
+
+
+async def test_read_upload_returns_whole_file_within_limit():
+    """Test that chunked reading returns the complete upload"""
+    data = b"x" * 2_500_000
+    upload = UploadFile(io.BytesIO(data), size=len(data), filename="leaf.jpg")
+
+    assert await read_upload(upload, limit_bytes=3_000_000) == data
+
+
+async def test_read_upload_rejects_before_reading():
+    """Test that a declared oversized part is refused without being read"""
+    source = io.BytesIO(b"x" * 2048)
+    upload = UploadFile(source, size=2048, filename="leaf.jpg")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await read_upload(upload, limit_bytes=1024)
+
+    assert exc_info.value.status_code == 413
+    assert source.tell() == 0
+
+
+async def test_read_upload_enforces_limit_when_size_unknown():
+    """Test that the limit is checked incrementally when no size is declared"""
+    upload = UploadFile(io.BytesIO(b"x" * (3 * 1024 * 1024)), filename="leaf.jpg")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await read_upload(upload, limit_bytes=1024 * 1024)
+
+    assert exc_info.value.status_code == 413
+
+
+def _limited_app(limit_mb):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    from src.middleware.upload_limit import UploadSizeLimitMiddleware
+
+    async def analyze(request):
+        body = await request.body()
+        return JSONResponse({"received": len(body)})
+
+    app = Starlette(routes=[Route("/api/v1/analyze", analyze, methods=["POST"])])
+    return UploadSizeLimitMiddleware(app)
+
+
+@pytest.fixture
+def plan_limit(monkeypatch):
+    async def user_id(request):
+        return "user-1"
+
+    async def limit_mb(user_id):
+        return 1
+
+    monkeypatch.setattr("src.middleware.upload_limit.get_request_user_id", user_id)
+    monkeypatch.setattr("src.middleware.upload_limit.get_upload_limit_mb", limit_mb)
+
+
+async def test_upload_limit_middleware_cuts_off_streamed_body(plan_limit):
+    """Test that a body without Content-Length is stopped once it crosses the plan limit"""
+    import httpx
+
+    async def body():
+        for _ in range(8):
+            yield b"x" * (512 * 1024)
+
+    transport = httpx.ASGITransport(app=_limited_app(1))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        small = await client.post("/api/v1/analyze", content=b"x" * 1024)
+        large = await client.post("/api/v1/analyze", content=body())
+        declared = await client.post("/api/v1/analyze", content=b"x" * (2 * 1024 * 1024))
+
+    assert small.status_code == 200
+    assert large.status_code == 413
+    assert large.json() == {"detail": "File size exceeds 1MB limit"}
+    assert declared.status_code == 413
@@ -0,0 +1,181 @@
+"""
+Tests for webhook registration, signing and delivery
+"""
+
+import base64
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.services import webhooks
+
+
+def test_signature_round_trip_and_tampering():
+    """Test that a signed body verifies and any change to it does not"""
+    body = webhooks.encode_body({"id": "batch.completed:1", "type": "batch.completed", "data": {}})
+    header = webhooks.sign("whsec_test", 1700000000, body)
+
+    assert header.startswith("t=1700000000,v1=")
+    assert webhooks.verify_signature("whsec_test", header, body, tolerance_seconds=0)
+    assert not webhooks.verify_signature("whsec_test", header, body + b" ", tolerance_seconds=0)
+    assert not webhooks.verify_signature("whsec_other", header, body, tolerance_seconds=0)
+    assert not webhooks.verify_signature("whsec_test", header, body)  # too old
+
+
+def test_requests_are_pinned_to_the_checked_address():
+    """Test that a delivery goes to the resolved address with the original host name"""
+    url, headers, extensions = webhooks._pinned_request(
+        "https://hooks.example.com:8443/in?a=1", "203.0.113.7"
+    )
+
+    assert str(url) == "https://203.0.113.7:8443/in?a=1"
+    assert headers == {"Host": "hooks.example.com:8443"}
+    assert extensions == {"sni_hostname": "hooks.example.com"}
+
+
+def test_retry_delay_doubles_up_to_the_cap(monkeypatch):
+    """Test that retries back off exponentially, with jitter, up to the maximum"""
+    monkeypatch.setattr(webhooks, "RETRY_BASE_SECONDS", 10)
+    monkeypatch.setattr(webhooks, "RETRY_MAX_SECONDS", 100)
+
+    assert 8 <= webhooks.retry_delay(1) <= 12
+    assert 16 <= webhooks.retry_delay(2) <= 24
+    assert 80 <= webhooks.retry_delay(10) <= 120
+
+
+async def _api_key(user) -> str:
+    from src.database.connection import MongoDB
+
+    key_id = "key-1"
+    await MongoDB.get_collection("enterprise_api_keys").insert_one(
+        {
+            "_id": key_id,
+            "user_id": str(user.id),
+            "api_key_hash": hashlib.sha256(b"ent_test").hexdigest(),
+            "is_active": True,
+            "expires_at": datetime.utcnow() + timedelta(days=1),
+        }
+    )
+    return key_id
+
+
+@pytest.mark.integration
+async def test_batch_events_reach_a_local_receiver(monkeypatch):
+    """Test that events are signed, retried after a 500, deduplicated and reported"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment, make_test_images
+    from scripts.webhook_receiver import WebhookReceiver
+    from src.app import app
+    from src.auth.api_key_auth import get_api_key_id
+
+    monkeypatch.setattr(webhooks, "RETRY_BASE_SECONDS", 0)
+    # The receiver listens on localhost
+    monkeypatch.setattr(webhooks, "ALLOW_PRIVATE", True)
+    webhooks.clear_target_cache()
+    receiver = WebhookReceiver(fail_first=1).start()
+    images = make_test_images(2, width=64, height=48)
+    request = {"images": [{"image_base64": base64.b64encode(image).decode()} for image in images]}
+
+    try:
+        async with benchmark_environment() as (client, user):
+            key_id = await _api_key(user)
+            app.dependency_overrides[get_api_key_id] = lambda: key_id
+            created = await client.post("/api/v1/webhooks", json={"url": receiver.url})
+            receiver.secret = created.json()["secret"]
+            webhook_id = created.json()["webhook_id"]
+
+            batch = (await client.post("/api/v1/batch-analyze", json=request)).json()
+            attempts = await webhooks.DeliveryWorker().run_until_idle()
+            # Raising the same event again does not deliver it twice
+            again = await webhooks.emit_batch_completed(
+                str(user.id), batch["batch_id"], None, 2, 2, 0
+            )
+            deliveries = (await client.get(f"/api/v1/webhooks/{webhook_id}/deliveries")).json()[
+                "deliveries"
+            ]
+    finally:
+        receiver.stop()
+        webhooks.clear_target_cache()
+
+    assert attempts == 4 and again == 0
+    assert all(request["signature_valid"] for request in receiver.received)
+    types = sorted(request["event_type"] for request in receiver.received[1:])
+    assert types == ["analysis.completed", "analysis.completed", "batch.completed"]
+    retried = receiver.received[0]["event_id"]
+    assert [r["attempt"] for r in receiver.received if r["event_id"] == retried] == [1, 2]
+    assert all(delivery["status"] == "delivered" for delivery in deliveries)
+    retried_delivery = next(d for d in deliveries if d["event_id"] == retried)
+    assert [a["status_code"] for a in retried_delivery["attempt_log"]] == [500, 204]
+    assert retried_delivery["last_latency_ms"] is not None
+
+
+@pytest.mark.integration
+async def test_revoked_key_stops_deliveries(monkeypatch):
+    """Test that deliveries for a webhook whose API key was revoked are failed"""
+    pytest.importorskip("mongomock_motor")
+    from benchmarks.harness import benchmark_environment
+    from src.database.connection import MongoDB
+
+    monkeypatch.setattr(webhooks, "ALLOW_PRIVATE", True)
+    webhooks.clear_target_cache()
+    try:
+        async with benchmark_environment() as (_client, user):
+            key_id = await _api_key(user)
+            await webhooks.register_webhook(
+                str(user.id), key_id, "http://localhost:9/", ["batch.completed"]
+            )
+            await MongoDB.get_collection("enterprise_api_keys").update_one(
+                {"_id": key_id}, {"$set": {"is_active": False}}
+            )
+            assert await webhooks.emit_batch_completed(str(user.id), "b1", None, 1, 1, 0) == 1
+            await webhooks.DeliveryWorker().run_until_idle()
+            delivery = await MongoDB.get_collection("webhook_deliveries").find_one({})
+    finally:
+        webhooks.clear_target_cache()
+
+    assert delivery["status"] == "failed"
+    assert delivery["last_error"] == "API key was revoked or expired"
+
+
+@pytest.mark.integration
+async def test_internal_addresses_are_refused(monkeypatch):
+    """Test that webhooks cannot target loopback, private or metadata addresses"""
+    pytest.importorskip("mongomock_motor")
+    from fastapi import HTTPException
+
+    from benchmarks.harness import benchmark_environment
+    from src.database.connection import MongoDB
+
+    webhooks.clear_target_cache()
+    urls = [
+        "https://169.254.169.254/latest/",
+        "https://10.0.0.5/",
+        "http://localhost:9/",
+        "https://[::1]/",
+    ]
+    try:
+        async with benchmark_environment() as (_client, user):
+            key_id = await _api_key(user)
+            refused = []
+            for url in urls:
+                with pytest.raises(HTTPException) as exc_info:
+                    await webhooks.register_webhook(str(user.id), key_id, url, ["batch.completed"])
+                refused.append(exc_info.value.status_code)
+
+            # Registered while allowed; checked again when delivering
+            monkeypatch.setattr(webhooks, "ALLOW_PRIVATE", True)
+            webhook = await webhooks.register_webhook(
+                str(user.id), key_id, "http://127.0.0.1:9/", ["batch.completed"]
+            )
+            monkeypatch.setattr(webhooks, "ALLOW_PRIVATE", False)
+            await webhooks.send_ping(await webhooks.get_webhook(key_id, webhook["webhook_id"]))
+            await webhooks.DeliveryWorker().run_until_idle()
+            delivery = await MongoDB.get_collection("webhook_deliveries").find_one({})
+    finally:
+        webhooks.clear_target_cache()
+
+    assert refused == [400, 400, 400, 400]
+    assert delivery["status"] == "failed" and delivery["attempts"] == 1
+    assert "non-public address (127.0.0.1)" in delivery["last_error"]
+    assert delivery["last_status_code"] is None